@@ -82,11 +82,8 @@ def run_strategy(project_settings):
     # Extract the timeframe to be traded
     timeframe = project_settings["mt5"]["timeframe"]
     # Strategy Risk Management
-    # Get a list of open orders
-    orders = mt5_lib.get_all_open_orders()
-    # Iterate through the open orders and cancel
-    for order in orders:
-        mt5_lib.cancel_order(order)
+    # Cancel all open orders
+    mt5_lib.cancel_orders_by_filter()
     # Run through the strategy of the specified symbols
     for symbol in symbols:
         # Strategy Risk Management
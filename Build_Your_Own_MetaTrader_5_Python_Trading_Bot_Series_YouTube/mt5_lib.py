@@ -364,3 +364,29 @@ def cancel_filtered_orders(symbol, comment):
     else:
         return True
 
+
+# Function to cancel every open order matching a filter
+def cancel_orders_by_filter(symbols=None, comment=None):
+    """
+    Function to cancel every open order matching a filter, across any number of symbols. All open orders are
+    retrieved with a single query rather than one query per symbol
+    :param symbols: list of symbols to cancel orders for. None matches every symbol
+    :param comment: string of the comment to match. None matches every comment
+    :return: Boolean. True = orders cancelled, False = issue with cancellation
+    """
+    # Retrieve every open order
+    open_orders = MetaTrader5.orders_get()
+    # Check if any orders were retrieved (there may be none)
+    if open_orders is None or len(open_orders) == 0:
+        return True
+    # Iterate through and cancel the orders matching the filter
+    for order in open_orders:
+        if symbols is not None and order.symbol not in symbols:
+            continue
+        if comment is not None and order.comment != comment:
+            continue
+        cancel_outcome = cancel_order(order.ticket)
+        if cancel_outcome is not True:
+            return False
+    # At conclusion of iteration, return true
+    return True
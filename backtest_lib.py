@@ -1,26 +1,60 @@
+import heapq
 import itertools
-import multiprocessing
+import math
 from datetime import timedelta
 
+import pickle
+import time
+
 import numpy
 import numpy as np
 from backtesting import Backtest
 
+import cache_lib
+import cluster_lib
 import display_lib
 import mt5_lib
 import pandas
 import os
+import report_lib
 import helper_functions
-from backtesting_py_strategies import ema_cross
-from strategies import macd_crossover_strategy
+import instrumentation_lib
+import strategy_lib
+import worker_pool_lib
 from tqdm import tqdm
 
+# Version of the backtest engine. Bump this whenever a change to the engine would change backtest results, so that
+# stale cached results are not reused
+backtest_engine_version = "1.1.0"
+# Number of M1 bars in each block of the price pyramid used to skip bars, from smallest to largest
+pyramid_block_sizes = [16, 256, 4096]
+# Number of M1 bars converted to dictionaries at a time when the bars of a trade are needed
+historic_chunk_size = 1024
+# Approximate fixed cost of each multi_optimize task (loading the candles and setting up the backtest), in backtest
+# runs. Used to decide how finely to split each optimization across the workers
+optimize_task_overhead_runs = 2
+# Strategy dataframe most recently generated in a worker process, so backtests of the same strategy settings which
+# follow each other (i.e. a trailing stop sweep) only generate it once
+worker_strategy_candles = {
+    "key": None,
+    "candles": None
+}
+# Indicator dataframe most recently calculated in a worker process, so strategy settings which share indicators (see
+# strategy_lib.register_strategy) only calculate them once
+worker_indicator_candles = {
+    "key": None,
+    "candles": None
+}
+
 
 # Function to multi-optimize a strategy
 def multi_optimize(strategy, cash, commission, symbols, timeframes, exchange, time_to_test, params, forex=False,
-                   risk_percent=None):
+                   risk_percent=None, use_cache=True, cache_location=cache_lib.default_cache_location,
+                   profile_save_location=None, plot_top_k=3, processes=None):
     """
-    Function to run a backtest optimizing across symbols, timeframes
+    Function to run a backtest optimizing across symbols, timeframes. Every parameter combination of every symbol and
+    timeframe is run on one pool of workers, split as create_optimize_schedule decides. The best combination of each
+    symbol and timeframe is then run once more to save its results, and only the best results are plotted
     :param strategy: string of the strategy to be tested
     :param cash: integer of the cash to start with
     :param commission: decimal value of the percentage commission fees
@@ -32,56 +66,202 @@ def multi_optimize(strategy, cash, commission, symbols, timeframes, exchange, ti
     :param params: dictionary of parameters to be optimized
     :param forex: boolean to identify if the strategy is a forex strategy
     :param risk_percent: decimal value of the percentage of the account to risk per trade
+    :param use_cache: boolean to identify if previously computed backtests should be reused
+    :param cache_location: string of the folder to store cached backtest results in
+    :param profile_save_location: string of the location to save the sweep profile. Defaults to the profiles folder
+    :param plot_top_k: integer of the number of best results (by final equity) to plot
+    :param processes: integer of the number of worker processes. None uses the number of cores
     :return:
     """
     # Todo: Add in support for using custom indicators
     # Check the time_to_test variable for approved values
     if time_to_test not in ["1Month", "3Months", "6Months", "1Year", "2Years", "3Years", "5Years", "All"]:
         raise ValueError("Chosen time_to_test range not supported")
-    # Instantiate an empty list to store results
-    results_list = []
-    # Create a list of arguments to pass to the run_backtest function
-    args_list = []
-    # Iterate through the symbols
-    for symbol in symbols:
-        # Iterate through the timeframes
-        for timeframe in timeframes:
-            # Get data from exchange. Keep this single threaded
-            if exchange == "mt5":
-                data = mt5_lib.query_historic_data_by_time(
-                    symbol=symbol,
-                    timeframe=timeframe,
-                    time_range=time_to_test
-                )
-                # Get current working directory
-                save_location = os.path.abspath(os.getcwd())
-                # Create the save path
-                plot_save_path = f"{save_location}" + "/plots/" + f"{strategy}" + "_" + f"{exchange}" + "_" + \
-                                 f"{symbol}" + "_" + f"{timeframe}" + "_" + f"{cash}" + "_" + f"{commission}" + "_" + \
-                                 ".html"
-                result_save_path = f"{save_location}" + "/results/" + f"{strategy}" + "_" + f"{exchange}" + "_" + \
-                                   f"{symbol}" + "_" + f"{timeframe}" + "_" + f"{cash}" + "_" + f"{commission}" + "_" \
-                                   + ".json"
-                # Create tuple
-                args_tuple = (data, strategy, cash, commission, symbol, timeframe, exchange, True, True,
-                              plot_save_path, result_save_path, params, forex, risk_percent)
-                # Append to args_list
-                args_list.append(args_tuple)
-            else:
-                raise ValueError("Exchange not supported")
-
-    # Set up Async results
-    async_results = []
-    # Iterate through the data_list and use multiprocessing to run the backtest
-    with multiprocessing.Pool(9) as process_pool:
-        result = process_pool.starmap(run_backtest, args_list)
+    if exchange != "mt5":
+        raise ValueError("Exchange not supported")
+    # Forex strategies aren't run by the stock testing framework (see run_backtest), so there is nothing to optimize
+    if forex:
+        print(f"Forex testing framework in use")
+        return True
+    # Every parameter combination to be tested
+    strategy_settings = strategy_lib.get_strategy(strategy, engine="backtesting")
+    combinations = strategy_lib.create_parameter_combinations(strategy_settings, params)
+    # Start the sweep profile
+    instrumentation_lib.reset_profile()
+    sweep_start_time = time.perf_counter()
+    # Get the data for every symbol and timeframe up front. The queries are sent at once rather than one after another
+    symbol_timeframes = [(symbol, timeframe) for symbol in symbols for timeframe in timeframes]
+    with instrumentation_lib.stage_timer("data_fetch"):
+        data = mt5_lib.query_historic_data_for_symbols(symbol_timeframes, time_to_test)
+    # Get current working directory
+    save_location = os.path.abspath(os.getcwd())
+    # Track cache hits and misses across the sweep
+    cache_stats = cache_lib.create_cache_stats()
+    # Results of each symbol and timeframe, and the optimizations which still need to be run
+    optimizations = []
+    pending = []
+    for symbol, timeframe in symbol_timeframes:
+        optimization = {
+            "symbol": symbol,
+            "timeframe": timeframe,
+            "stats": None,
+            "parameters": None,
+            "equity": None,
+            "cache_key": None,
+            # Create the save paths
+            "plot_save_path": f"{save_location}" + "/plots/" + f"{strategy}" + "_" + f"{exchange}" + "_" +
+                              f"{symbol}" + "_" + f"{timeframe}" + "_" + f"{cash}" + "_" + f"{commission}" + "_" +
+                              ".html",
+            "result_save_path": f"{save_location}" + "/results/" + f"{strategy}" + "_" + f"{exchange}" + "_" +
+                                f"{symbol}" + "_" + f"{timeframe}" + "_" + f"{cash}" + "_" + f"{commission}" + "_" +
+                                ".json"
+        }
+        # Create the cache key for the optimization
+        if use_cache:
+            optimization["cache_key"] = cache_lib.create_cache_key(
+                data_hash=cache_lib.hash_dataframe(data[(symbol, timeframe)]),
+                strategy=strategy,
+                parameters=(cash, commission, symbol, timeframe, exchange, repr(sorted(params.items())), forex,
+                            risk_percent, "best_of_grid"),
+                engine_version=backtest_engine_version,
+                source_hash=strategy_lib.get_source_hash(strategy_settings)
+            )
+            cached_entry = cache_lib.get_cached_result(optimization["cache_key"], cache_location)
+            if cached_entry is not None:
+                cache_lib.record_cache_hit(cache_stats, cached_entry)
+                optimization["stats"] = cached_entry["result"]
+                optimization["parameters"] = cached_entry["result"]["Params"]
+                optimization["equity"] = cached_entry["result"]["Equity Final [$]"]
+        if optimization["stats"] is None:
+            pending.append(optimization)
+        optimizations.append(optimization)
+    print(f"{len(optimizations) - len(pending)} optimizations retrieved from cache, {len(pending)} to run")
+    worker_pool = worker_pool_lib.create_worker_pool(processes=processes, preload=False)
+    schedule = create_optimize_schedule(len(pending), len(combinations), worker_pool["processes"])
+    try:
+        if len(pending) > 0:
+            print(f"Running {len(combinations)} parameter combinations for each of {len(pending)} symbols and "
+                  f"timeframes, split into {schedule['splits']} tasks each")
+            # Split the combinations of each optimization into tasks
+            task_list = []
+            for optimization in pending:
+                dataset_key = f"{len(worker_pool['dataset_keys'])}_{optimization['symbol']}_" \
+                              f"{optimization['timeframe']}"
+                worker_pool_lib.save_dataset(worker_pool, dataset_key,
+                                             {"data": data[(optimization["symbol"], optimization["timeframe"])]})
+                for batch in numpy.array_split(numpy.arange(len(combinations)), schedule["splits"]):
+                    task_list.append((run_optimization_task, (dataset_key, strategy, cash, commission,
+                                                              [combinations[index] for index in batch])))
+            # Run the tasks, collecting the final equity of every combination of each optimization in order
+            outcomes = worker_pool_lib.run_tasks(worker_pool, task_list, run_optimization_task.__name__)
+            equity_values = []
+            for equity_batch, worker_profile in tqdm(outcomes, total=len(task_list)):
+                instrumentation_lib.merge_profile(worker_profile)
+                instrumentation_lib.increment_counter("backtests_run", len(equity_batch))
+                equity_values.extend(equity_batch)
+            # Pick the best combination of each optimization. The first is kept if several are equally good, as
+            # Backtest.optimize does
+            for number, optimization in enumerate(pending):
+                optimization_equity = numpy.array(equity_values[number * len(combinations):
+                                                                (number + 1) * len(combinations)], dtype=float)
+                best_index = 0 if numpy.isnan(optimization_equity).all() else int(numpy.nanargmax(optimization_equity))
+                optimization["parameters"] = combinations[best_index]
+                optimization["equity"] = optimization_equity[best_index]
+    finally:
+        worker_pool_lib.close_worker_pool(worker_pool)
+    # Run the best combination of each optimization to save its results. Only the best results are plotted
+    ranked = sorted(optimizations, key=lambda item: item["equity"], reverse=True)
+    for rank, optimization in enumerate(ranked):
+        plot = rank < plot_top_k
+        # Cached results are only run again if they need plotting
+        if optimization["stats"] is not None and not plot:
+            continue
+        start_time = time.perf_counter()
+        optimization["stats"] = run_backtest(
+            data=data[(optimization["symbol"], optimization["timeframe"])].copy(),
+            strategy=strategy,
+            cash=cash,
+            commission=commission,
+            symbol=optimization["symbol"],
+            timeframe=optimization["timeframe"],
+            exchange=exchange,
+            optimize=False,
+            save=True,
+            plot_save_location=optimization["plot_save_path"],
+            result_save_location=optimization["result_save_path"],
+            params=optimization["parameters"],
+            forex=forex,
+            risk_percent=risk_percent,
+            plot=plot
+        )
+        if optimization["cache_key"] is not None:
+            cache_lib.save_cached_result(optimization["cache_key"], optimization["stats"],
+                                         time.perf_counter() - start_time, cache_location)
+    # Report the cache performance
+    cache_lib.report_cache_stats(cache_stats)
+    # Report and save the sweep profile
+    sweep_wall_time = time.perf_counter() - sweep_start_time
+    sweep_profile = instrumentation_lib.get_profile()
+    instrumentation_lib.print_profile_summary(sweep_profile, sweep_wall_time, len(pending) * len(combinations),
+                                              worker_pool["processes"])
+    if profile_save_location is None:
+        profile_save_location = os.path.join(
+            os.path.abspath(os.getcwd()), "profiles",
+            f"multi_optimize_{strategy}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    instrumentation_lib.write_profile(
+        sweep_profile=sweep_profile,
+        file_path=profile_save_location,
+        wall_time=sweep_wall_time,
+        tasks=len(pending) * len(combinations),
+        processes=worker_pool["processes"],
+        metadata={
+            "strategy": strategy,
+            "symbols": symbols,
+            "timeframes": timeframes,
+            "time_to_test": time_to_test,
+            "cache_hits": cache_stats["hits"],
+            "cache_misses": cache_stats["misses"],
+            "schedule": schedule
+        }
+    )
 
     # Return the results dataframe
     return True
 
 
+# Function to decide how to split the optimizations of a sweep across the workers
+def create_optimize_schedule(optimization_count, grid_size, processes):
+    """
+    Function to decide whether to run each optimization in one task (parallelizing across symbols and timeframes) or
+    to split each optimization into several tasks (parallelizing within each optimization). Splitting keeps every
+    worker busy when there are fewer optimizations than workers, but each task has a fixed cost (loading the candles
+    and setting up the backtest). The number of splits with the lowest estimated run time is chosen
+    :param optimization_count: integer of the number of optimizations (symbols and timeframes)
+    :param grid_size: integer of the number of parameter combinations in each optimization
+    :param processes: integer of the number of worker processes
+    :return: dictionary of the mode ("across" or "within"), the number of tasks each optimization is split into and
+    the estimated run time in backtest runs
+    """
+    best_splits = 1
+    best_runs = None
+    for splits in range(1, max(1, min(grid_size, processes)) + 1):
+        tasks = optimization_count * splits
+        # Each worker runs the tasks in rounds. Every task in a round takes as long as its share of the grid
+        runs = math.ceil(tasks / processes) * (math.ceil(grid_size / splits) + optimize_task_overhead_runs)
+        if best_runs is None or runs < best_runs:
+            best_splits = splits
+            best_runs = runs
+    return {
+        "mode": "across" if best_splits == 1 else "within",
+        "splits": best_splits,
+        "estimated_runs": best_runs
+    }
+
+
 def run_backtest(data, strategy, cash, commission, symbol, timeframe, exchange, optimize=False, save=False,
-                 plot_save_location=None, result_save_location=None, params={}, forex=False, risk_percent=None):
+                 plot_save_location=None, result_save_location=None, params={}, forex=False, risk_percent=None,
+                 plot=None):
     """
     Function to run a backtest
     :param data: raw dataframe to use for backtesting
@@ -98,49 +278,41 @@ def run_backtest(data, strategy, cash, commission, symbol, timeframe, exchange,
     :param forex: boolean to identify if the strategy is a forex strategy
     :param risk_percent: decimal value of the percentage of the account to risk per trade
     :param commission: Commission fees (percentage expressed as decimal)
+    :param plot: boolean to identify if the backtest should be plotted when saved. None plots whenever it is saved
     :return: backtest outcomes
     """
+    if plot is None:
+        plot = save
     print("Processing")
     if forex:
         print(f"Forex testing framework in use")
     else:
         print(f"Stock testing framework in use")
-        ### Reformat dataframe to match backtesting.py requirements
-        # Create a new column with name Open using open
-        data['Open'] = data['open']
-        # Create a new column with name Close using close
-        data['Close'] = data['close']
-        # Create a new column with name High using high
-        data['High'] = data['high']
-        # Create a new column with name Low using low
-        data['Low'] = data['low']
-        # Set index to human_time
-        data.set_index('human_time', inplace=True)
+        # Reformat dataframe to match backtesting.py requirements
+        format_backtesting_data(data)
         # Get the strategy class
-        if strategy == "EMACross":
-            strategy = ema_cross.EMACross
-            # Initialize the backtest
-            backtest = Backtest(data, strategy, cash=cash, commission=commission)
+        strategy_settings = strategy_lib.get_strategy(strategy, engine="backtesting")
+        strategy = strategy_settings["strategy_class"]
+        # Initialize the backtest
+        backtest = Backtest(data, strategy, cash=cash, commission=commission)
+        # The parameters of the strategy which are being set
+        strategy_params = {name: params[name] for name in strategy_settings["parameter_names"] if name in params}
+        with instrumentation_lib.stage_timer("simulation"):
             # If optimize is true, optimize the strategy
             if optimize:
                 # Optimize the strategy
                 stats = backtest.optimize(
-                    n1=params['n1'],
-                    n2=params['n2'],
+                    **strategy_params,
                     maximize='Equity Final [$]',
-                    constraint=lambda p: p.n1 < p.n2
+                    constraint=strategy_settings["constraint"]
                 )
             else:
                 # Run the backtest
-                stats = backtest.run(
-                    n1=params['n1'],
-                    n2=params['n2']
-                )
-        else:
-            raise ValueError("Strategy not supported")
+                stats = backtest.run(**strategy_params)
         # If save is true, save the backtest
-        if save:
-            backtest.plot(filename=plot_save_location, open_browser=False)
+        if save and plot:
+            with instrumentation_lib.stage_timer("plotting"):
+                backtest.plot(filename=plot_save_location, open_browser=False)
         # Update with information about the backtest
         stats['Strategy'] = strategy
         stats['Cash'] = cash
@@ -150,12 +322,35 @@ def run_backtest(data, strategy, cash, commission, symbol, timeframe, exchange,
         stats['Exchange'] = exchange
         stats['Forex'] = forex
         stats['Risk_Percent'] = risk_percent
+        # Record the parameters of a single run, so a cached result can be run again
+        if not optimize:
+            stats['Params'] = dict(params)
         if save:
             stats.to_json(result_save_location)
 
         return stats
 
 
+# Function to reformat a dataframe to match backtesting.py requirements
+def format_backtesting_data(data):
+    """
+    Function to reformat a dataframe of candlesticks in place to match backtesting.py requirements
+    :param data: dataframe of candlesticks
+    :return: dataframe of candlesticks
+    """
+    # Create a new column with name Open using open
+    data['Open'] = data['open']
+    # Create a new column with name Close using close
+    data['Close'] = data['close']
+    # Create a new column with name High using high
+    data['High'] = data['high']
+    # Create a new column with name Low using low
+    data['Low'] = data['low']
+    # Set index to human_time
+    data.set_index('human_time', inplace=True)
+    return data
+
+
 # Define an overarching forex backtest function, including the ability optimize parameters, symbols, timeframes, and use
 # multiprocessing
 def forex_backtest(strategy, cash, commission, symbols, timeframes, time_to_test, risk_percent, strategy_params=[],
@@ -163,133 +358,254 @@ def forex_backtest(strategy, cash, commission, symbols, timeframes, time_to_test
                    optimize_order_cancel_time=False, display_results=False, save_results=False,
                    trailing_stop_column=None, trailing_stop_pips=None, trailing_stop_percent=None,
                    trailing_take_profit_column=None, trailing_take_profit_pips=None, trailing_take_profit_percent=None,
-                   optimize_trailing_stop_pips=False, optimize_trailing_stop_percent=False):
-    # Retrieve strategy dataframe
-    if strategy == "MACD_Crossover":
-        pass
-    else:
-        raise ValueError("Strategy not supported")
+                   optimize_trailing_stop_pips=False, optimize_trailing_stop_percent=False, use_cache=True,
+                   cache_location=cache_lib.default_cache_location, profile_save_location=None, export_report=False,
+                   report_top_k=10, report_location=None, results_save_location=None,
+                   trailing_update_summary=False, batch_multipliers=True, cluster_address=None, cluster_authkey=None,
+                   cluster_local_workers=0, resample_strategy_candles=True):
+    # Start the sweep profile
+    instrumentation_lib.reset_profile()
+    sweep_start_time = time.perf_counter()
+    # Get the settings of the strategy
+    strategy_settings = strategy_lib.get_strategy(strategy, engine="forex")
+    # Default to the parameter space of the strategy
+    if len(strategy_params) == 0:
+        strategy_params = [list(strategy_settings["parameter_space"][name])
+                           for name in strategy_settings["parameter_names"]]
     # Results
     results = []
-    # Arguments List
-    args_list = []
-    # Iterate through the symbols
-    for symbol in symbols:
-        symbol_check = symbol.split(".")
-        if symbol_check[0] == "ETHUSD":
-            pip_size = 0.01
-        else:
-            # Get the pip_size
-            pip_size = mt5_lib.get_pip_size(symbol)
-        # Get the contract size for a symbol
-        contract_size = mt5_lib.get_contract_size(symbol=symbol)
-        # Iterate through the timeframes
-        for timeframe in timeframes:
+    # Track cache hits and misses across the sweep
+    cache_stats = cache_lib.create_cache_stats()
+    # Load the metadata of every symbol in one query. It doesn't need refreshing during a sweep
+    symbol_registry = mt5_lib.create_symbol_registry(symbols=symbols, ttl_seconds=None)
+    # Create one pool of workers for the whole sweep. The candles of each symbol and timeframe are saved once and loaded
+    # once by each worker, so each backtest only carries its parameters
+    if cluster_address is not None:
+        # Hand the backtests to workers on any number of hosts (started with cluster_lib.py)
+        worker_pool = cluster_lib.create_cluster_pool(
+            address=cluster_address,
+            authkey=cluster_authkey,
+            local_workers=cluster_local_workers
+        )
+    else:
+        worker_pool = worker_pool_lib.create_worker_pool()
+    try:
+        # Iterate through the symbols
+        for symbol in symbols:
+            symbol_check = symbol.split(".")
+            if symbol_check[0] == "ETHUSD":
+                pip_size = 0.01
+            else:
+                # Get the pip_size
+                pip_size = mt5_lib.get_pip_size(symbol, registry=symbol_registry)
+            # Get the contract size for a symbol
+            contract_size = mt5_lib.get_contract_size(symbol=symbol, registry=symbol_registry)
             if exchange == "mt5":
-                # Get historic data from exchange. Keep this single threaded
-                historic_data = mt5_lib.query_historic_data_by_time(
-                    symbol=symbol,
-                    timeframe="M1",
-                    time_range=time_to_test
-                )
-                # Get raw candlestick data for strategy
-                raw_strategy_candles = mt5_lib.query_historic_data_by_time(
-                    symbol=symbol,
-                    timeframe=timeframe,
-                    time_range=time_to_test
-                )
+                with instrumentation_lib.stage_timer("data_fetch"):
+                    # Get historic data from exchange once for every timeframe. Keep this single threaded
+                    historic_data = mt5_lib.query_historic_data_by_time(
+                        symbol=symbol,
+                        timeframe="M1",
+                        time_range=time_to_test
+                    )
             else:
                 raise ValueError("Exchange not supported")
-            # Create a grid search based on the parameters
-            grid_search = create_grid_search(
-                params=strategy_params,
-                optimize_params=optimize_params,
-                optimize_take_profit=optimize_take_profit,
-                optimize_stop_loss=optimize_stop_loss
-            )
-
-            print("Generating backtests")
-            print(f"Total number of backtests: {len(grid_search)}")
-            with tqdm(total=len(grid_search)) as pbar:
-                for parameters in grid_search:
-                    pbar.update(1)
-                    # Pass the grid search to the strategy
-                    if strategy == "MACD_Crossover":
-                        strategy_candles = macd_crossover_strategy.macd_crossover_strategy(
-                            time_to_test=time_to_test,
-                            time_to_cancel=parameters[5],
-                            macd_fast=parameters[2],
-                            macd_slow=parameters[3],
-                            macd_signal=parameters[4],
-                            dataframe=raw_strategy_candles,
-                            stop_loss_multiplier=parameters[1],
-                            take_profit_multiplier=parameters[0]
+            # Hash the M1 candles once for every timeframe
+            historic_data_hash = None
+            if use_cache:
+                with instrumentation_lib.stage_timer("data_hash"):
+                    historic_data_hash = cache_lib.hash_dataframe(historic_data)
+            # Iterate through the timeframes
+            for timeframe in timeframes:
+                if resample_strategy_candles:
+                    # Build the raw candlestick data for strategy from the M1 candles, so the two always agree
+                    raw_strategy_candles = mt5_lib.resample_candles(historic_data, timeframe)
+                else:
+                    with instrumentation_lib.stage_timer("data_fetch"):
+                        # Get raw candlestick data for strategy
+                        raw_strategy_candles = mt5_lib.query_historic_data_by_time(
+                            symbol=symbol,
+                            timeframe=timeframe,
+                            time_range=time_to_test
                         )
+                # Arguments List
+                args_list = []
+                # Cache keys, one for each set of arguments
+                cache_keys = []
+                # Values swept outside of the strategy parameters (i.e. the trailing stop pips), one dictionary for
+                # each set of arguments. They are added to the results so each row of the results table is distinct
+                variants = []
+                # Hash the candle data once, so that every backtest against it shares the same data hash
+                data_hash = None
+                if use_cache:
+                    with instrumentation_lib.stage_timer("data_hash"):
+                        data_hash = historic_data_hash + cache_lib.hash_dataframe(raw_strategy_candles)
+                # Save the candles for the workers
+                dataset_key = f"{len(worker_pool['dataset_keys'])}_{symbol}_{timeframe}"
+                with instrumentation_lib.stage_timer("dataset_save"):
+                    worker_pool_lib.save_dataset(worker_pool, dataset_key, {
+                        "historic_data": historic_data,
+                        "raw_strategy_candles": raw_strategy_candles
+                    })
+                # Create a grid search based on the parameters
+                grid_search = create_grid_search(
+                    params=strategy_params,
+                    optimize_params=optimize_params,
+                    optimize_take_profit=optimize_take_profit,
+                    optimize_stop_loss=optimize_stop_loss,
+                    parameter_count=len(strategy_settings["parameter_names"])
+                )
+                # Leave out the parameters the strategy can't run
+                grid_search = [parameters for parameters in grid_search
+                               if strategy_lib.check_constraint(strategy_settings, parameters)]
 
-                    else:
-                        raise ValueError("Strategy not supported")
-                    # If the strategy dataframe is empty, skip this iteration
-                    if strategy_candles is False:
-                        print(f"Params: {parameters}, Strategy dataframe: False")
-                        profit = 0
-                    elif len(strategy_candles) == 0:
-                        print(f"Params: {parameters}, Strategy dataframe: Empty")
-                        profit = 0
-                    else:
-                        # Get the last candle
-                        last_candle = strategy_candles.iloc[-1]
-                        # If optimize_order_cancel_timme is True, add another for loop to iterate through the strategy
-                        # dataframe
+                # The take profit and stop loss multipliers of each strategy setting can be run as one batch, as long
+                # as nothing else is being optimized and no trailing stops or take profits are used
+                run_batches = batch_multipliers and strategy_settings["batchable"] and \
+                    (optimize_take_profit or optimize_stop_loss) and not \
+                    (optimize_order_cancel_time or optimize_trailing_stop_pips or optimize_trailing_stop_percent) and \
+                    not (trailing_stop_column or trailing_stop_pips or trailing_stop_percent or
+                         trailing_take_profit_column or trailing_take_profit_pips or trailing_take_profit_percent)
+                # Batches of parameters, keyed by the parameters other than the exit parameters
+                batches = {}
+                print("Generating backtests")
+                print(f"Total number of backtests: {len(grid_search)}")
+                with tqdm(total=len(grid_search)) as pbar:
+                    for parameters in grid_search:
+                        pbar.update(1)
+                        if run_batches:
+                            batches.setdefault(strategy_lib.get_batch_key(strategy_settings, parameters),
+                                               []).append(parameters)
+                            continue
+                        # The strategy dataframe is generated by the worker running each backtest, so the dataframes
+                        # are left out of the arguments and filled in from the dataset
+                        # If optimize_order_cancel_timme is True, add another for loop to iterate through the cancel
+                        # times
                         if optimize_order_cancel_time:
                             for i in range(5, 1440):
-                                # Replace the column 'cancel_time' with the new cancel time of i added to 'human_time'
-                                strategy_candles['cancel_time'] = strategy_candles['human_time'] + timedelta(minutes=i)
                                 # Create a tuple of the arguments
-                                args_tuple = (strategy_candles, raw_strategy_candles, cash, commission, symbol,
-                                              historic_data, pip_size, contract_size, risk_percent)
-                                # Append to args_list
-                                args_list.append(args_tuple)
+                                args_tuple = (None, None, cash, commission, symbol, None, pip_size, contract_size,
+                                              risk_percent, None, None, None, None, None, None, False, parameters, True,
+                                              trailing_update_summary)
+                                # Append to args_list. The worker replaces the cancel time of each trade with i
+                                # minutes after the trade
+                                args_list.append((dataset_key, strategy, time_to_test, args_tuple, i))
+                                cache_keys.append(create_forex_cache_key(strategy, data_hash, args_tuple,
+                                                                         ("order_cancel_minutes", i), use_cache))
+                                variants.append({"order_cancel_minutes": i})
                         elif optimize_trailing_stop_pips:
                             for i in range(1, 2000):
                                 # Replace the column 'trailing_stop_pips' with the new value of i
-                                args_tuple = (strategy_candles, raw_strategy_candles, cash, commission, symbol,
-                                              historic_data, pip_size, contract_size, risk_percent,
-                                              trailing_stop_column, i, trailing_stop_percent,
+                                args_tuple = (None, None, cash, commission, symbol, None, pip_size, contract_size,
+                                              risk_percent, trailing_stop_column, i, trailing_stop_percent,
                                               trailing_take_profit_column, trailing_take_profit_pips,
-                                              trailing_take_profit_percent)
+                                              trailing_take_profit_percent, False, parameters, True,
+                                              trailing_update_summary)
                                 # Append to args_list
-                                args_list.append(args_tuple)
+                                args_list.append((dataset_key, strategy, time_to_test, args_tuple))
+                                cache_keys.append(create_forex_cache_key(strategy, data_hash, args_tuple,
+                                                                         use_cache=use_cache))
+                                variants.append({"trailing_stop_pips": i})
                         elif optimize_trailing_stop_percent:
                             for i in range(1, 50):
                                 # Replace the column 'trailing_stop_percent' with the new value of i
-                                args_tuple = (strategy_candles, raw_strategy_candles, cash, commission, symbol,
-                                              historic_data, pip_size, contract_size, risk_percent,
-                                              trailing_stop_column, trailing_stop_pips, i,
+                                args_tuple = (None, None, cash, commission, symbol, None, pip_size, contract_size,
+                                              risk_percent, trailing_stop_column, trailing_stop_pips, i,
                                               trailing_take_profit_column, trailing_take_profit_pips,
-                                              trailing_take_profit_percent)
+                                              trailing_take_profit_percent, False, parameters, True,
+                                              trailing_update_summary)
                                 # Append to args_list
-                                args_list.append(args_tuple)
+                                args_list.append((dataset_key, strategy, time_to_test, args_tuple))
+                                cache_keys.append(create_forex_cache_key(strategy, data_hash, args_tuple,
+                                                                         use_cache=use_cache))
+                                variants.append({"trailing_stop_percent": i})
                         else:
                             # Create an args_tuple
-                            args_tuple = (strategy_candles, raw_strategy_candles, cash, commission, symbol,
-                                          historic_data, pip_size, contract_size, risk_percent, trailing_stop_column,
-                                          trailing_stop_pips, trailing_stop_percent, trailing_take_profit_column,
-                                          trailing_take_profit_pips, trailing_take_profit_percent)
+                            args_tuple = (None, None, cash, commission, symbol, None, pip_size, contract_size,
+                                          risk_percent, trailing_stop_column, trailing_stop_pips,
+                                          trailing_stop_percent, trailing_take_profit_column,
+                                          trailing_take_profit_pips, trailing_take_profit_percent, False, parameters,
+                                          True, trailing_update_summary)
                             # Append to args_list
-                            args_list.append(args_tuple)
+                            args_list.append((dataset_key, strategy, time_to_test, args_tuple))
+                            cache_keys.append(create_forex_cache_key(strategy, data_hash, args_tuple,
+                                                                     use_cache=use_cache))
+                            variants.append({})
 
-            if len(args_list) > 0:
-                print("Assigning processing cores and processing backtests")
-                # Create a pool of workers
-                with multiprocessing.Pool(10) as pool:
-                    backtest_results = pool.starmap(forex_backtest_run, tqdm(args_list, total=len(args_list)))
-                    # Extract the profit from backtest_results
+                # Each batch generates its strategy dataframe once, in the worker running it
+                batch_list = []
+                for batch_parameters in batches.values():
+                    # Create the cache key of each backtest in the same way as a single backtest, so the cache is
+                    # shared
+                    cache_key_list = []
+                    for parameters in batch_parameters:
+                        args_tuple = (None, None, cash, commission, symbol, None, pip_size, contract_size,
+                                      risk_percent, None, None, None, None, None, None, False, parameters, True,
+                                      trailing_update_summary)
+                        cache_key_list.append(create_forex_cache_key(strategy, data_hash, args_tuple,
+                                                                     use_cache=use_cache))
+                    batch_list.append({
+                        "dataset_key": dataset_key,
+                        "strategy": strategy,
+                        "time_to_test": time_to_test,
+                        "args": (None, None, cash, commission, symbol, None, pip_size, contract_size, risk_percent),
+                        "parameters_list": batch_parameters,
+                        "cache_keys": cache_key_list
+                    })
+                if len(batch_list) > 0:
+                    print("Assigning processing cores and processing backtest batches")
+                    backtest_results = run_cached_backtest_batches(
+                        batch_list=batch_list,
+                        cache_stats=cache_stats,
+                        cache_location=cache_location,
+                        worker_pool=worker_pool,
+                        trailing_update_summary=trailing_update_summary
+                    )
                     for result in backtest_results:
+                        # Strategy settings without any trades have no result
+                        if result is None:
+                            continue
+                        # Update the result
+                        result['symbol'] = symbol
+                        result['timeframe'] = timeframe
+                        # The workers leave out the raw strategy candles, which are the same for every backtest
+                        result['raw_strategy_candles'] = raw_strategy_candles
+                        # Append to results
+                        results.append(result)
+                if len(args_list) > 0:
+                    print("Assigning processing cores and processing backtests")
+                    # Run the backtests which share indicators one after another, so each worker calculates them
+                    # once. The results are put back in the order of the grid search
+                    order = strategy_lib.group_by_indicators(strategy_settings, [args[3][16] for args in args_list])
+                    # Run the backtests, reusing any cached results
+                    grouped_results = run_cached_backtests(
+                        function=run_forex_task,
+                        args_list=[args_list[position] for position in order],
+                        cache_keys=[cache_keys[position] for position in order],
+                        cache_stats=cache_stats,
+                        cache_location=cache_location,
+                        worker_pool=worker_pool
+                    )
+                    backtest_results = [None] * len(args_list)
+                    for position, result in zip(order, grouped_results):
+                        backtest_results[position] = result
+                    # Extract the profit from backtest_results
+                    for result, variant in zip(backtest_results, variants):
+                        # Strategy settings without any trades have no result
+                        if result is None:
+                            continue
                         # Update the result
                         result['symbol'] = symbol
                         result['timeframe'] = timeframe
+                        result['variant'] = variant
+                        # The workers leave out the raw strategy candles, which are the same for every backtest
+                        result['raw_strategy_candles'] = raw_strategy_candles
                         # Append to results
                         results.append(result)
+            # Release the M1 candles of the symbol
+            del historic_data
+    finally:
+        worker_pool_lib.close_worker_pool(worker_pool)
     # Iterate through the results, and find the result with the highest profit
     best_result = None
     for result in results:
@@ -297,8 +613,53 @@ def forex_backtest(strategy, cash, commission, symbols, timeframes, time_to_test
             best_result = result
         elif result['profit'] > best_result['profit']:
             best_result = result
+    # Report the cache performance
+    cache_lib.report_cache_stats(cache_stats)
+    # Report the sweep profile
+    sweep_wall_time = time.perf_counter() - sweep_start_time
+    sweep_profile = instrumentation_lib.get_profile()
+    instrumentation_lib.print_profile_summary(sweep_profile, sweep_wall_time, len(results), worker_pool["processes"])
+    # Save the sweep profile
+    if profile_save_location is None:
+        profile_save_location = os.path.join(
+            os.path.abspath(os.getcwd()), "profiles",
+            f"forex_backtest_{strategy}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    instrumentation_lib.write_profile(
+        sweep_profile=sweep_profile,
+        file_path=profile_save_location,
+        wall_time=sweep_wall_time,
+        tasks=len(results),
+        processes=worker_pool["processes"],
+        metadata={
+            "strategy": strategy,
+            "symbols": symbols,
+            "timeframes": timeframes,
+            "time_to_test": time_to_test,
+            "cache_hits": cache_stats["hits"],
+            "cache_misses": cache_stats["misses"]
+        }
+    )
     # Print the best result
     print(f"Best result: {best_result['profit']}")
+    # Save the results of every backtest as a columnar table, one row per set of parameters
+    if save_results:
+        if results_save_location is None:
+            results_save_location = os.path.join(
+                os.path.abspath(os.getcwd()), "results",
+                f"forex_backtest_{strategy}_{time.strftime('%Y%m%d_%H%M%S')}.parquet"
+            )
+        save_results_table(results, results_save_location, strategy_settings["parameter_names"])
+    # Export a static report of the best results. This doesn't start a server, so can be used from a headless sweep
+    if export_report:
+        report_lib.export_report(
+            results=results,
+            parameter_names=strategy_settings["parameter_names"],
+            top_k=report_top_k,
+            report_location=report_location,
+            title=f"{strategy} Backtest Report",
+            starting_balance=cash
+        )
     # Reprocess the best result to get a display dataframe
     if display_results:
         print("Generating results display")
@@ -321,11 +682,415 @@ def forex_backtest(strategy, cash, commission, symbols, timeframes, time_to_test
     return results
 
 
+# Function to backtest a FOREX strategy over a portfolio of symbols sharing one balance
+def forex_portfolio_backtest(strategy, cash, symbols, timeframe, time_to_test, risk_percent, strategy_parameters,
+                             exchange="mt5", my_currency="USD", trailing_stop_column=None, trailing_stop_pips=None,
+                             trailing_stop_percent=None, trailing_take_profit_column=None,
+                             trailing_take_profit_pips=None, trailing_take_profit_percent=None,
+                             trailing_update_summary=True):
+    """
+    Function to backtest a FOREX strategy over a portfolio of symbols which all trade from one balance. Unlike
+    forex_backtest, where each symbol has its own balance, trades on every symbol compete for the same account. See
+    portfolio_backtest_run
+    :param strategy: string of the strategy to be tested
+    :param cash: float of the starting cash
+    :param symbols: list of symbols in the portfolio
+    :param timeframe: string of the timeframe the strategy is run on
+    :param time_to_test: string of the time range to test over
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param strategy_parameters: tuple of the strategy parameters, in the same order as a forex_backtest grid search
+    (take profit multiplier, stop loss multiplier, macd fast, macd slow, macd signal, time to cancel)
+    :param exchange: string of the exchange
+    :param my_currency: string of the account currency
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, trailing updates are recorded as arrays of time and level
+    :return: dictionary of the results of the portfolio
+    """
+    strategy_lib.get_strategy(strategy, engine="forex")
+    if exchange != "mt5":
+        raise ValueError("Exchange not supported")
+    # Load the metadata of every symbol in one query
+    symbol_registry = mt5_lib.create_symbol_registry(symbols=symbols, ttl_seconds=None)
+    symbol_list = []
+    for symbol in symbols:
+        symbol_settings = dict(mt5_lib.get_symbol_metadata(symbol, registry=symbol_registry))
+        if symbol.split(".")[0] == "ETHUSD":
+            symbol_settings['pip_size'] = 0.01
+        symbol_list.append(symbol_settings)
+
+    # Function to load the candles of a symbol and run the strategy over them
+    def load_symbol(symbol_settings):
+        historic_data = mt5_lib.query_historic_data_by_time(
+            symbol=symbol_settings['name'],
+            timeframe="M1",
+            time_range=time_to_test
+        )
+        # Build the strategy candles from the M1 candles, so the two always agree
+        raw_strategy_candles = mt5_lib.resample_candles(historic_data, timeframe)
+        strategy_candles = generate_strategy_candles(strategy, time_to_test, strategy_parameters, raw_strategy_candles)
+        # A strategy without any trades returns False
+        if strategy_candles is False:
+            strategy_candles = None
+        return strategy_candles, raw_strategy_candles, historic_data
+
+    instrumentation_lib.reset_profile()
+    start_time = time.perf_counter()
+    result = portfolio_backtest_run(
+        symbol_list=symbol_list,
+        load_symbol=load_symbol,
+        cash=cash,
+        risk_percent=risk_percent,
+        my_currency=my_currency,
+        trailing_stop_column=trailing_stop_column,
+        trailing_stop_pips=trailing_stop_pips,
+        trailing_stop_percent=trailing_stop_percent,
+        trailing_take_profit_column=trailing_take_profit_column,
+        trailing_take_profit_pips=trailing_take_profit_pips,
+        trailing_take_profit_percent=trailing_take_profit_percent,
+        trailing_update_summary=trailing_update_summary,
+        parameters=strategy_parameters
+    )
+    instrumentation_lib.print_profile_summary(instrumentation_lib.get_profile(), time.perf_counter() - start_time, 1,
+                                              1)
+    print(f"Portfolio ending balance: {result['ending_balance']:.2f}, profit: {result['profit']}, "
+          f"trades: {result['total_trades']}, most open at once: {result['max_open_trades']}")
+    return result
+
+
+# Function to save the results of a sweep as a columnar table
+def save_results_table(results, file_path, parameter_names=None):
+    """
+    Function to save the results of a sweep to a Parquet file, with one row per backtest and a column for each
+    parameter and metric. The table can be explored with display_lib.display_parameter_surface
+    :param results: list of result dictionaries returned from forex_backtest_run
+    :param file_path: string of the file to write
+    :param parameter_names: list of names for each element of the result parameters
+    :return: dataframe of the results
+    """
+    results_table = report_lib.create_results_table(results, parameter_names)
+    # Make sure the folder exists
+    folder = os.path.dirname(file_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    results_table.to_parquet(file_path, index=False)
+    print(f"Results saved to {file_path}")
+    return results_table
+
+
+# Function to create the cache key for a single forex backtest
+def create_forex_cache_key(strategy, data_hash, args_tuple, variant=(), use_cache=True):
+    """
+    Function to create the cache key for a single forex backtest. Every argument other than the dataframes is included
+    in the key, along with a hash of the strategy source code, so any change to the backtest settings or the strategy
+    produces a new key
+    :param strategy: string of the strategy being tested
+    :param data_hash: string hash of the M1 and strategy candles
+    :param args_tuple: tuple of arguments being passed to forex_backtest_run
+    :param variant: tuple of any values which change the strategy dataframe but are not part of the strategy parameters
+    :param use_cache: boolean. If False, no key is created and the backtest will always be run
+    :return: string of the cache key, or None if caching is turned off
+    """
+    if not use_cache:
+        return None
+    # Drop the dataframes (strategy candles, raw strategy candles and historic data) from the arguments
+    scalar_args = tuple(arg for index, arg in enumerate(args_tuple) if index not in (0, 1, 5))
+    # Return the key
+    return cache_lib.create_cache_key(
+        data_hash=data_hash,
+        strategy=strategy,
+        parameters=scalar_args + tuple(variant),
+        engine_version=backtest_engine_version,
+        source_hash=strategy_lib.get_source_hash(strategy_lib.get_strategy(strategy, engine="forex"))
+    )
+
+
+# Function to run a list of backtests, reusing any results already in the cache
+def run_cached_backtests(function, args_list, cache_keys, cache_stats, cache_location, worker_pool):
+    """
+    Function to run a list of backtests across a pool of workers. Any backtest with a cached result is skipped, and
+    each new result is written to the cache by the worker as soon as it completes, so an interrupted sweep resumes
+    where it left off.
+    :param function: backtest function to run
+    :param args_list: list of argument tuples for the backtest function
+    :param cache_keys: list of cache keys, one per argument tuple. A key of None means the result is not cached
+    :param cache_stats: dictionary of cache statistics to update
+    :param cache_location: string of the folder the cache is stored in
+    :param worker_pool: dictionary of the worker pool (see worker_pool_lib.create_worker_pool)
+    :return: list of results, in the same order as args_list
+    """
+    # Create a list to store the results
+    results = [None] * len(args_list)
+    # Create a list of the backtests which still need to be run
+    pending = []
+    for index, cache_key in enumerate(cache_keys):
+        cached_entry = None
+        if cache_key is not None:
+            cached_entry = cache_lib.get_cached_result(cache_key, cache_location)
+        if cached_entry is not None:
+            cache_lib.record_cache_hit(cache_stats, cached_entry)
+            results[index] = cached_entry["result"]
+        else:
+            pending.append(index)
+    print(f"{len(args_list) - len(pending)} backtests retrieved from cache, {len(pending)} to run")
+    # Run the remaining backtests
+    if len(pending) > 0:
+        task_list = [
+            (cache_lib.run_and_cache, (function, cache_keys[index], cache_location, args_list[index]))
+            for index in pending
+        ]
+        # Estimate the time spent pickling tasks to send to the workers from a sample of tasks
+        sample_size = min(3, len(task_list))
+        start_time = time.perf_counter()
+        sample_bytes = sum(len(pickle.dumps(task)) for task in task_list[:sample_size])
+        sample_time = time.perf_counter() - start_time
+        instrumentation_lib.record_stage("task_pickling_estimate", sample_time / sample_size * len(task_list))
+        instrumentation_lib.increment_counter("task_bytes_estimate", sample_bytes // sample_size * len(task_list))
+        # Results are yielded as each backtest completes, so the progress bar moves as they do
+        outcomes = worker_pool_lib.run_tasks(worker_pool, task_list, function.__name__)
+        # Add the new results in their original positions
+        for index, ((result, duration), worker_profile) in zip(pending, tqdm(outcomes, total=len(task_list))):
+            cache_lib.record_cache_miss(cache_stats, duration)
+            instrumentation_lib.merge_profile(worker_profile)
+            instrumentation_lib.increment_counter("backtests_run")
+            results[index] = result
+    # Return the results
+    return results
+
+
+# Function to run a batch of backtests and cache each result
+def run_and_cache_batch(function, cache_keys, cache_location, args):
+    """
+    Function to run a batch of backtests (i.e. with run_forex_batch_task) and save each result to the cache under its
+    own key. Designed to be run inside a worker process, like cache_lib.run_and_cache
+    :param function: function to run, returning a list of results. Must be importable so it can be passed to a worker
+    :param cache_keys: list of cache keys, one per result. A key of None means the result is not cached
+    :param cache_location: string of the cache folder
+    :param args: tuple of arguments for the function
+    :return: tuple of the list of results and the number of seconds each took to run (shared evenly)
+    """
+    start_time = time.perf_counter()
+    results = function(*args)
+    duration = (time.perf_counter() - start_time) / max(len(results), 1)
+    for cache_key, result in zip(cache_keys, results):
+        if cache_key is not None:
+            cache_lib.save_cached_result(cache_key, result, duration, cache_location)
+    return results, duration
+
+
+# Function to run a list of backtest batches, reusing any results already in the cache
+def run_cached_backtest_batches(batch_list, cache_stats, cache_location, worker_pool, trailing_update_summary=False):
+    """
+    Function to run a list of take profit and stop loss multiplier batches across a pool of workers. Results are
+    cached one backtest at a time, so a batch only runs the settings without a cached result
+    :param batch_list: list of batch dictionaries, each with the dataset_key, strategy and time_to_test used by
+    run_forex_batch_task, the args (the first nine arguments of forex_backtest_run_batch, with None in place of the
+    dataframes), parameters_list (the grid search parameters, with the take profit and stop loss multipliers first)
+    and cache_keys (one per parameters)
+    :param cache_stats: dictionary of cache statistics to update
+    :param cache_location: string of the folder the cache is stored in
+    :param worker_pool: dictionary of the worker pool (see worker_pool_lib.create_worker_pool)
+    :param trailing_update_summary: boolean passed to forex_backtest_run_batch
+    :return: list of results, in the same order as the parameters of each batch
+    """
+    results = []
+    task_list = []
+    # Positions in results of the backtests each task runs
+    task_positions = []
+    for batch in batch_list:
+        pending_parameters = []
+        pending_keys = []
+        positions = []
+        for parameters, cache_key in zip(batch["parameters_list"], batch["cache_keys"]):
+            cached_entry = None
+            if cache_key is not None:
+                cached_entry = cache_lib.get_cached_result(cache_key, cache_location)
+            if cached_entry is not None:
+                cache_lib.record_cache_hit(cache_stats, cached_entry)
+                results.append(cached_entry["result"])
+            else:
+                positions.append(len(results))
+                results.append(None)
+                pending_parameters.append(parameters)
+                pending_keys.append(cache_key)
+        if len(pending_parameters) > 0:
+            strategy_settings = strategy_lib.get_strategy(batch["strategy"])
+            multipliers = [strategy_lib.get_exit_multipliers(strategy_settings, parameters)
+                           for parameters in pending_parameters]
+            task_args = (batch["dataset_key"], batch["strategy"], batch["time_to_test"], batch["args"], multipliers,
+                         pending_parameters, trailing_update_summary)
+            task_list.append((run_and_cache_batch, (run_forex_batch_task, pending_keys, cache_location, task_args)))
+            task_positions.append(positions)
+    pending = sum(len(positions) for positions in task_positions)
+    print(f"{len(results) - pending} backtests retrieved from cache, {pending} to run in {len(task_list)} batches")
+    if len(task_list) > 0:
+        outcomes = worker_pool_lib.run_tasks(worker_pool, task_list, run_forex_batch_task.__name__)
+        for positions, ((batch_results, duration), worker_profile) in zip(task_positions,
+                                                                          tqdm(outcomes, total=len(task_list))):
+            instrumentation_lib.merge_profile(worker_profile)
+            for position, result in zip(positions, batch_results):
+                cache_lib.record_cache_miss(cache_stats, duration)
+                instrumentation_lib.increment_counter("backtests_run")
+                results[position] = result
+    return results
+
+
+# Function to generate the strategy dataframe for a set of grid search parameters
+def generate_strategy_candles(strategy, time_to_test, parameters, raw_strategy_candles, indicator_candles=None):
+    """
+    Function to generate the strategy dataframe for a set of grid search parameters
+    :param strategy: string of the strategy
+    :param time_to_test: string of the time range to test over
+    :param parameters: tuple of the strategy parameters, in the order of the strategy's parameter names (see
+    strategy_lib)
+    :param raw_strategy_candles: dataframe of the candlesticks the strategy is run on. Not modified
+    :param indicator_candles: dataframe of the indicators for parameters with the same indicator key. None calculates
+    them
+    :return: dataframe of the strategy candles, or False if the strategy has no trades
+    """
+    strategy_settings = strategy_lib.get_strategy(strategy, engine="forex")
+    return strategy_lib.calc_signals(strategy_settings, raw_strategy_candles, parameters, indicator_candles)
+
+
+# Function to get the strategy dataframe for a set of grid search parameters inside a worker process
+def get_worker_strategy_candles(dataset_key, strategy, time_to_test, parameters):
+    """
+    Function to get the strategy dataframe for a set of grid search parameters inside a worker process, generating it
+    from the raw strategy candles of the dataset unless the previous task already did. The indicators are kept too,
+    so the next settings which share them only generate the signals
+    :param dataset_key: string of the key of the dataset the raw strategy candles are in
+    :param strategy: string of the strategy
+    :param time_to_test: string of the time range to test over
+    :param parameters: tuple of the strategy parameters
+    :return: dataframe of the strategy candles, or None if the strategy has no trades. Callers must copy the dataframe
+    before modifying it
+    """
+    key = (dataset_key, strategy, time_to_test, tuple(parameters))
+    if worker_strategy_candles["key"] != key:
+        with instrumentation_lib.stage_timer("strategy_generation"):
+            strategy_settings = strategy_lib.get_strategy(strategy, engine="forex")
+            raw_strategy_candles = worker_pool_lib.get_dataset(dataset_key)["raw_strategy_candles"]
+            indicator_key = (dataset_key, strategy, strategy_lib.get_indicator_key(strategy_settings, parameters))
+            if worker_indicator_candles["key"] != indicator_key:
+                worker_indicator_candles["key"] = indicator_key
+                worker_indicator_candles["candles"] = strategy_lib.calc_indicators(strategy_settings,
+                                                                                   raw_strategy_candles, parameters)
+            strategy_candles = generate_strategy_candles(strategy, time_to_test, parameters, raw_strategy_candles,
+                                                         worker_indicator_candles["candles"])
+        if strategy_candles is False or len(strategy_candles) == 0:
+            print(f"Params: {parameters}, Strategy dataframe: Empty")
+            strategy_candles = None
+        worker_strategy_candles["key"] = key
+        worker_strategy_candles["candles"] = strategy_candles
+    return worker_strategy_candles["candles"]
+
+
+# Function to run a FOREX backtest inside a worker process
+def run_forex_task(dataset_key, strategy, time_to_test, args_tuple, order_cancel_minutes=None):
+    """
+    Function to run forex_backtest_run inside a worker process. The task only carries the parameters of the backtest.
+    The candles come from the dataset the worker has loaded, and the strategy dataframe is generated from them
+    :param dataset_key: string of the key of the dataset holding the historic_data and raw_strategy_candles
+    :param strategy: string of the strategy
+    :param time_to_test: string of the time range to test over
+    :param args_tuple: tuple of the arguments of forex_backtest_run, with None in place of the dataframes
+    :param order_cancel_minutes: integer of the minutes after each trade its order is cancelled. None keeps the cancel
+    time of the strategy
+    :return: dictionary of the results of the backtest, or None if the strategy has no trades
+    """
+    strategy_candles = get_worker_strategy_candles(dataset_key, strategy, time_to_test, args_tuple[16])
+    if strategy_candles is None:
+        return None
+    dataset = worker_pool_lib.get_dataset(dataset_key)
+    # The backtest adds columns to the strategy dataframe, so it is given a copy
+    strategy_candles = strategy_candles.copy()
+    if order_cancel_minutes is not None:
+        strategy_candles['cancel_time'] = strategy_candles['human_time'] + timedelta(minutes=order_cancel_minutes)
+    args = list(args_tuple)
+    args[0] = strategy_candles
+    args[1] = dataset["raw_strategy_candles"]
+    args[5] = dataset["historic_data"]
+    return strip_raw_strategy_candles(forex_backtest_run(*args))
+
+
+# Function to run a batch of FOREX backtests inside a worker process
+def run_forex_batch_task(dataset_key, strategy, time_to_test, args, multipliers, parameters_list,
+                         trailing_update_summary):
+    """
+    Function to run forex_backtest_run_batch inside a worker process, in the same way as run_forex_task
+    :param dataset_key: string of the key of the dataset holding the historic_data and raw_strategy_candles
+    :param strategy: string of the strategy
+    :param time_to_test: string of the time range to test over
+    :param args: tuple of the first nine arguments of forex_backtest_run_batch, with None in place of the dataframes
+    :param multipliers: list of tuples of (take_profit_multiplier, stop_loss_multiplier)
+    :param parameters_list: list of the parameters of each multiplier tuple. Every parameter other than the
+    multipliers must be the same
+    :param trailing_update_summary: boolean passed to forex_backtest_run_batch
+    :return: list of the results of each backtest, or of None if the strategy has no trades
+    """
+    # The batch moves the stop loss and take profit of a strategy generated with multipliers of 1
+    strategy_settings = strategy_lib.get_strategy(strategy, engine="forex")
+    strategy_candles = get_worker_strategy_candles(dataset_key, strategy, time_to_test,
+                                                   strategy_lib.get_batch_parameters(strategy_settings,
+                                                                                     parameters_list[0]))
+    if strategy_candles is None:
+        return [None] * len(multipliers)
+    dataset = worker_pool_lib.get_dataset(dataset_key)
+    args = list(args)
+    args[0] = strategy_candles.copy()
+    args[1] = dataset["raw_strategy_candles"]
+    args[5] = dataset["historic_data"]
+    results = forex_backtest_run_batch(*args, multipliers, parameters_list, trailing_update_summary)
+    return [strip_raw_strategy_candles(result) for result in results]
+
+
+# Function to drop the raw strategy candles from the result of a worker
+def strip_raw_strategy_candles(result):
+    """
+    Function to drop the raw strategy candles from a result before it is sent back from a worker and cached. The
+    candles are the same for every backtest of a dataset, so rather than every result (and cache entry) carrying a copy,
+    forex_backtest adds back the candles it loaded
+    :param result: dictionary of the results of a backtest, or None
+    :return: dictionary of the results without the raw strategy candles, or None
+    """
+    if result is not None:
+        result['raw_strategy_candles'] = None
+    return result
+
+
+# Function to run part of a multi_optimize grid inside a worker process
+def run_optimization_task(dataset_key, strategy, cash, commission, combinations):
+    """
+    Function to run a list of parameter combinations of a backtesting.py strategy inside a worker process, with the
+    candles from the dataset the worker has loaded. Each combination is run on its own, so backtesting.py doesn't start
+    a pool of its own inside the worker
+    :param dataset_key: string of the key of the dataset holding the candles as data
+    :param strategy: string of the strategy
+    :param cash: integer of the cash to start with
+    :param commission: decimal value of the percentage commission fees
+    :param combinations: list of dictionaries of parameter name to value
+    :return: list of the final equity of each combination
+    """
+    data = format_backtesting_data(worker_pool_lib.get_dataset(dataset_key)["data"].copy())
+    backtest = Backtest(data, strategy_lib.get_strategy(strategy, engine="backtesting")["strategy_class"], cash=cash,
+                        commission=commission)
+    equity = []
+    with instrumentation_lib.stage_timer("simulation"):
+        for combination in combinations:
+            equity.append(backtest.run(**combination)['Equity Final [$]'])
+    return equity
+
+
 # Function to backtest a FOREX strategy
 def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, commission, symbol, historic_data, pip_size,
                        contract_size, risk_percent, trailing_stop_column=None, trailing_stop_pips=None,
                        trailing_stop_percent=None, trailing_take_profit_column=None, trailing_take_profit_pips=None,
-                       trailing_take_profit_percent=None, display_results=False, parameters=None):
+                       trailing_take_profit_percent=None, display_results=False, parameters=None, bar_skipping=True,
+                       trailing_update_summary=False):
     """
     Function to backtest a FOREX strategy. Runs a single pass of a backtest. Set up to be multi-processable, so all
     all information must be passed into function.
@@ -346,6 +1111,10 @@ def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, comm
     :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
     :param display_results: boolean of whether to display the results of the backtest
     :param parameters: dictionary of parameters to be passed to the strategy
+    :param bar_skipping: boolean. When True, M1 bars which can't touch any level are skipped (see
+    simulate_with_bar_skipping). When False, every M1 bar is tested. Both give the same results
+    :param trailing_update_summary: boolean. When True, the trailing stop and take profit updates of each trade are
+    recorded as arrays of the time and level of each update, rather than a dictionary per update
     :return: dictionary of the results of the backtest
     """
     ### Pseudocode ###
@@ -355,6 +1124,387 @@ def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, comm
     # 4. Return the results of the backtest
     # 5. Provide option to display results of the backtest
     # 6. Provide option to save results of the backtest
+    with instrumentation_lib.stage_timer("backtest_data_preparation"):
+        # Add the columns used to track each trade
+        add_trade_columns(strategy_dataframe)
+        # Convert historic_data to dictionaries. The bar skipping engine only converts the bars it needs
+        if not bar_skipping:
+            historic_data_dict = historic_data.to_dict('records')
+        # Convert the strategy dataframe to a dictionary
+        strategy_dataframe_dict = strategy_dataframe.to_dict('records')
+    instrumentation_lib.increment_counter("m1_bars_simulated", len(historic_data))
+    # Start timing the simulation
+    simulation_start_time = time.perf_counter()
+    # Simulate the trades
+    if bar_skipping:
+        completed_trades = simulate_with_bar_skipping(
+            strategy_dataframe_dict=strategy_dataframe_dict,
+            raw_strategy_candlesticks=raw_strategy_candlesticks,
+            cash=cash,
+            symbol=symbol,
+            historic_data=historic_data,
+            pip_size=pip_size,
+            contract_size=contract_size,
+            risk_percent=risk_percent,
+            trailing_stop_column=trailing_stop_column,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_column=trailing_take_profit_column,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent,
+            trailing_update_summary=trailing_update_summary
+        )
+    else:
+        completed_trades = simulate_every_bar(
+            strategy_dataframe_dict=strategy_dataframe_dict,
+            raw_strategy_candlesticks=raw_strategy_candlesticks,
+            cash=cash,
+            commission=commission,
+            symbol=symbol,
+            historic_data_dict=historic_data_dict,
+            pip_size=pip_size,
+            contract_size=contract_size,
+            risk_percent=risk_percent,
+            trailing_stop_column=trailing_stop_column,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_column=trailing_take_profit_column,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent
+        )
+    # Summarise any trailing updates still recorded as a dictionary per update
+    if trailing_update_summary:
+        for trade in completed_trades:
+            summarize_trailing_updates(trade)
+    # Record the simulation time
+    instrumentation_lib.record_stage("simulation", time.perf_counter() - simulation_start_time)
+    instrumentation_lib.increment_counter("trades_completed", len(completed_trades))
+    # Step 3: Calculate the results of the backtest
+    backtest_results = calculate_backtest_results(completed_trades, contract_size, parameters,
+                                                  raw_strategy_candlesticks, strategy_dataframe)
+
+    # todo: Handle any open trades
+
+    return backtest_results
+
+
+# Function to backtest a FOREX strategy for a batch of take profit and stop loss multipliers
+def forex_backtest_run_batch(strategy_dataframe, raw_strategy_candlesticks, cash, commission, symbol, historic_data,
+                             pip_size, contract_size, risk_percent, multipliers, parameters_list=None,
+                             trailing_update_summary=False):
+    """
+    Function to backtest a FOREX strategy for a batch of take profit and stop loss multipliers in one pass. The
+    multipliers only move the stop loss and take profit, so every setting fills the same orders in the same bars. The
+    fills are found once, then each trade's M1 path is scanned once for every setting (see find_batch_exits). Gives
+    the same results as calling forex_backtest_run with the strategy dataframe of each setting. Trailing stops and take
+    profits aren't supported.
+    :param strategy_dataframe: dataframe of the strategy candles (i.e. the trades), generated with take profit and
+    stop loss multipliers of 1
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param cash: float of the starting cash
+    :param commission: float of the commission per trade
+    :param symbol: string of the symbol being traded
+    :param historic_data: dataframe of 1 Minute candlesticks over the period of the strategy
+    :param pip_size: float of the pip size of a symbol
+    :param contract_size: contract size for converting a lot into a dollar value
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param multipliers: list of tuples of (take_profit_multiplier, stop_loss_multiplier)
+    :param parameters_list: list of the parameters of each multiplier tuple, passed through to its results
+    :param trailing_update_summary: boolean. When True, the (empty) trailing updates are recorded as arrays, matching
+    forex_backtest_run
+    :return: list of dictionaries of the results of each backtest, in the same order as multipliers
+    """
+    if parameters_list is None:
+        parameters_list = [None] * len(multipliers)
+    with instrumentation_lib.stage_timer("backtest_data_preparation"):
+        take_profit_multipliers = numpy.array([multiplier[0] for multiplier in multipliers], dtype=float)
+        stop_loss_multipliers = numpy.array([multiplier[1] for multiplier in multipliers], dtype=float)
+        # Convert the strategy dataframe to a dictionary
+        strategy_dataframe_dict = strategy_dataframe.to_dict('records')
+    instrumentation_lib.increment_counter("m1_bars_simulated", len(historic_data))
+    # Start timing the simulation
+    simulation_start_time = time.perf_counter()
+    entry_list = []
+    chunk_cache = {}
+    if len(historic_data) > 0:
+        bar_arrays = {
+            "high": historic_data['high'].to_numpy(dtype=float),
+            "low": historic_data['low'].to_numpy(dtype=float)
+        }
+        pyramid = create_price_pyramid(bar_arrays["high"], bar_arrays["low"])
+        historic_times = historic_data['human_time'].to_numpy().astype("datetime64[ns]")
+        # Step 1: Find the bar each order fills in. This is the same for every setting
+        entries = find_order_entries(strategy_dataframe_dict, historic_times, pyramid)
+        entry_list = sorted(entries.items())
+    # Step 2: Calculate the stop loss and take profit of each setting (rows) for each trade (columns)
+    stop_losses = numpy.array([strategy_dataframe_dict[row_index]['stop_loss'] for _, row_index in entry_list],
+                              dtype=float)
+    take_profits = numpy.array([strategy_dataframe_dict[row_index]['take_profit'] for _, row_index in entry_list],
+                               dtype=float)
+    stop_loss_levels = numpy.outer(stop_loss_multipliers, stop_losses)
+    take_profit_levels = numpy.outer(take_profit_multipliers, take_profits)
+    # Step 3: Find the bar each trade closes in for every setting
+    exit_indexes = numpy.full(stop_loss_levels.shape, -1, dtype=numpy.int64)
+    stop_loss_hits = numpy.zeros(stop_loss_levels.shape, dtype=bool)
+    for trade_number, (entry_index, row_index) in enumerate(entry_list):
+        exit_indexes[:, trade_number], stop_loss_hits[:, trade_number] = find_batch_exits(
+            order_type=strategy_dataframe_dict[row_index]['order_type'],
+            entry_index=entry_index,
+            bar_arrays=bar_arrays,
+            stop_losses=stop_loss_levels[:, trade_number],
+            take_profits=take_profit_levels[:, trade_number]
+        )
+    # Step 4: Replay the trades of each setting
+    batch_trades = []
+    for setting in range(len(multipliers)):
+        # Create the strategy dataframe of the setting, in the same way as forex_backtest_run
+        proposed_trades = strategy_dataframe.copy()
+        proposed_trades['stop_loss'] = strategy_dataframe['stop_loss'] * stop_loss_multipliers[setting]
+        proposed_trades['take_profit'] = strategy_dataframe['take_profit'] * take_profit_multipliers[setting]
+        proposed_trades['trailing_stop_update'] = np.empty((len(proposed_trades), 0)).tolist()
+        proposed_trades['trailing_take_profit_update'] = np.empty((len(proposed_trades), 0)).tolist()
+        proposed_trades['original_stop_loss'] = proposed_trades['stop_loss']
+        proposed_trades['original_take_profit'] = proposed_trades['take_profit']
+        proposed_trades_dict = proposed_trades.to_dict('records')
+        trades = {}
+        exits = []
+        for trade_number, (entry_index, row_index) in enumerate(entry_list):
+            trades[entry_index] = proposed_trades_dict[row_index]
+            if exit_indexes[setting, trade_number] >= 0:
+                reason = "stop_loss" if stop_loss_hits[setting, trade_number] else "take_profit"
+                exits.append((int(exit_indexes[setting, trade_number]), entry_index, reason))
+        completed_trades = replay_trades(trades, exits, cash, symbol, historic_data, pip_size, contract_size,
+                                         risk_percent, chunk_cache)
+        if trailing_update_summary:
+            for trade in completed_trades:
+                summarize_trailing_updates(trade)
+        batch_trades.append((completed_trades, proposed_trades))
+    # Record the simulation time
+    instrumentation_lib.record_stage("simulation", time.perf_counter() - simulation_start_time)
+    # Step 5: Calculate the results of each backtest
+    results = []
+    for setting, (completed_trades, proposed_trades) in enumerate(batch_trades):
+        instrumentation_lib.increment_counter("trades_completed", len(completed_trades))
+        results.append(calculate_backtest_results(completed_trades, contract_size, parameters_list[setting],
+                                                  raw_strategy_candlesticks, proposed_trades))
+    return results
+
+
+# Function to convert the profit of a trade to the account currency
+def convert_profit(profit, closing_price, symbol_settings, my_currency="USD"):
+    """
+    Function to convert a profit in the profit (quote) currency of a symbol to the account currency. Symbols quoted
+    in the account currency need no conversion. Symbols with the account currency as the base (i.e. USDJPY for a USD
+    account) are converted at the closing price of the trade
+    :param profit: float of the profit in the profit currency of the symbol
+    :param closing_price: float of the price the trade closed at
+    :param symbol_settings: dictionary of the symbol settings (see portfolio_backtest_run)
+    :param my_currency: string of the account currency
+    :return: float of the profit in the account currency
+    """
+    if symbol_settings['currency_profit'] == my_currency:
+        return profit
+    return profit / closing_price
+
+
+# Function to find the fill and close events of a symbol
+def create_symbol_events(symbol_number, strategy_dataframe, raw_strategy_candlesticks, historic_data, pip_size,
+                         trailing_stop_column=None, trailing_stop_pips=None, trailing_stop_percent=None,
+                         trailing_take_profit_column=None, trailing_take_profit_pips=None,
+                         trailing_take_profit_percent=None, trailing_update_summary=True):
+    """
+    Function to find the fill and close events of every trade of a symbol. Only the M1 bars an event happens in are
+    kept, so the M1 data can be released once the events are found
+    :param symbol_number: integer of the position of the symbol in the portfolio
+    :param strategy_dataframe: dataframe of the strategy candles (i.e. the trades), or None if there are no trades.
+    Trade columns are added in place
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param historic_data: dataframe of 1 Minute candlesticks over the period of the strategy
+    :param pip_size: float of the pip size of the symbol
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, trailing updates are recorded as arrays of time and level
+    :return: tuple of the dictionary of the bar each trade filled in to the trade, and the list of events sorted by
+    time. Each event is a tuple of (time, 0 for a close or 1 for a fill, symbol_number, fill bar, reason, M1 bar)
+    """
+    instrumentation_lib.increment_counter("m1_bars_simulated", len(historic_data))
+    if strategy_dataframe is None or len(strategy_dataframe) == 0 or len(historic_data) == 0:
+        return {}, []
+    with instrumentation_lib.stage_timer("backtest_data_preparation"):
+        add_trade_columns(strategy_dataframe)
+        strategy_dataframe_dict = strategy_dataframe.to_dict('records')
+    chunk_cache = {}
+    with instrumentation_lib.stage_timer("simulation"):
+        trades, exits = find_fills_and_exits(
+            strategy_dataframe_dict=strategy_dataframe_dict,
+            raw_strategy_candlesticks=raw_strategy_candlesticks,
+            historic_data=historic_data,
+            pip_size=pip_size,
+            trailing_stop_column=trailing_stop_column,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_column=trailing_take_profit_column,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent,
+            trailing_update_summary=trailing_update_summary,
+            chunk_cache=chunk_cache
+        )
+    events = []
+    for bar_index, event_type, entry_index, reason in \
+            [(entry_index, 1, entry_index, None) for entry_index in trades] + \
+            [(exit_index, 0, entry_index, reason) for exit_index, entry_index, reason in exits]:
+        historic_row = get_historic_chunk(historic_data, chunk_cache, bar_index // historic_chunk_size,
+                                          historic_chunk_size)[bar_index % historic_chunk_size]
+        events.append((historic_row['human_time'], event_type, symbol_number, entry_index, reason, historic_row))
+    # Closes in a bar come before a fill, and trades closing in the same bar close in the order they opened
+    events.sort(key=get_event_order)
+    return trades, events
+
+
+# Function to get the sort order of a portfolio event
+def get_event_order(event):
+    """
+    Function to get the sort order of a portfolio event: time, then closes before fills, then symbol, then the order
+    trades filled in
+    :param event: tuple of the event
+    :return: tuple to sort on
+    """
+    return event[:4]
+
+
+# Function to backtest a FOREX strategy over a portfolio of symbols sharing one balance
+def portfolio_backtest_run(symbol_list, load_symbol, cash, risk_percent, my_currency="USD", trailing_stop_column=None,
+                           trailing_stop_pips=None, trailing_stop_percent=None, trailing_take_profit_column=None,
+                           trailing_take_profit_pips=None, trailing_take_profit_percent=None,
+                           trailing_update_summary=True, parameters=None):
+    """
+    Function to backtest a FOREX strategy over a portfolio of symbols which all trade from one balance, so a trade is
+    sized against the balance left by every other symbol's trades. Where a trade fills and closes doesn't depend on
+    the balance, so each symbol is loaded in turn, its fill and close events found (see find_fills_and_exits), and its
+    M1 data released before the next symbol is loaded. The event streams of every symbol are then merged on time and
+    replayed against the shared balance. Only one symbol's M1 data is held at a time, so many symbols over many years
+    can be backtested on one machine.
+    :param symbol_list: list of dictionaries of the settings of each symbol, with the keys name, pip_size,
+    contract_size, currency_base and currency_profit (i.e. from mt5_lib.get_symbol_metadata)
+    :param load_symbol: function called with the settings of a symbol, returning a tuple of the strategy dataframe
+    (None if the strategy has no trades), the raw strategy candlesticks and the M1 candlesticks of the symbol
+    :param cash: float of the starting cash
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param my_currency: string of the account currency. Every symbol must be quoted in it or have it as the base
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, trailing updates are recorded as arrays of time and level,
+    which keeps the M1 bars they happened in out of memory
+    :param parameters: parameters the backtest was run with
+    :return: dictionary of the results of the portfolio. The results of each symbol (in the profit currency of the
+    symbol, as forex_backtest_run) are under 'symbols'
+    """
+    for symbol_settings in symbol_list:
+        if my_currency not in [symbol_settings['currency_profit'], symbol_settings['currency_base']]:
+            raise ValueError(f"Profits of {symbol_settings['name']} can't be converted to {my_currency}")
+    # Step 1: Find the events of each symbol, one symbol at a time
+    event_streams = []
+    symbol_trades = []
+    for symbol_number, symbol_settings in enumerate(symbol_list):
+        with instrumentation_lib.stage_timer("data_fetch"):
+            strategy_dataframe, raw_strategy_candlesticks, historic_data = load_symbol(symbol_settings)
+        trades, events = create_symbol_events(
+            symbol_number=symbol_number,
+            strategy_dataframe=strategy_dataframe,
+            raw_strategy_candlesticks=raw_strategy_candlesticks,
+            historic_data=historic_data,
+            pip_size=symbol_settings['pip_size'],
+            trailing_stop_column=trailing_stop_column,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_column=trailing_take_profit_column,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent,
+            trailing_update_summary=trailing_update_summary
+        )
+        event_streams.append(events)
+        symbol_trades.append({
+            "trades": trades,
+            "raw_strategy_candlesticks": raw_strategy_candlesticks,
+            "proposed_trades": strategy_dataframe,
+            "completed_trades": []
+        })
+        # Release the M1 data before the next symbol is loaded
+        del historic_data
+    # Step 2: Replay the merged events against the shared balance
+    current_balance = cash
+    open_trades = 0
+    max_open_trades = 0
+    balance_times = []
+    balances = []
+    with instrumentation_lib.stage_timer("simulation"):
+        for event_time, event_type, symbol_number, entry_index, reason, historic_row in \
+                heapq.merge(*event_streams, key=get_event_order):
+            symbol_settings = symbol_list[symbol_number]
+            trade = symbol_trades[symbol_number]["trades"][entry_index]
+            if event_type == 1:
+                open_trade(trade, historic_row, current_balance, risk_percent, symbol_settings['name'],
+                           symbol_settings['pip_size'])
+                # Subtract the amount risked from the balance
+                current_balance -= current_balance * risk_percent
+                open_trades += 1
+                max_open_trades = max(max_open_trades, open_trades)
+            else:
+                profit = close_trade(trade, historic_row, reason, symbol_settings['contract_size'])
+                if profit > 0:
+                    current_balance += convert_profit(profit, trade['closing_price'], symbol_settings, my_currency)
+                open_trades -= 1
+                symbol_trades[symbol_number]["completed_trades"].append(trade)
+            balance_times.append(event_time)
+            balances.append(current_balance)
+    # Step 3: Calculate the results of each symbol and of the portfolio
+    symbol_results = {}
+    profit = 0.0
+    for symbol_settings, trade_details in zip(symbol_list, symbol_trades):
+        completed_trades = trade_details["completed_trades"]
+        instrumentation_lib.increment_counter("trades_completed", len(completed_trades))
+        if trailing_update_summary:
+            for trade in completed_trades:
+                summarize_trailing_updates(trade)
+        result = calculate_backtest_results(completed_trades, symbol_settings['contract_size'], parameters,
+                                            trade_details["raw_strategy_candlesticks"],
+                                            trade_details["proposed_trades"])
+        for trade_object in result['win_objects'] + result['loss_objects']:
+            profit += convert_profit(trade_object['profit'], trade_object['closing_price'], symbol_settings,
+                                     my_currency)
+        symbol_results[symbol_settings['name']] = result
+    return {
+        'total_trades': sum(result['total_trades'] for result in symbol_results.values()),
+        'total_wins': sum(result['total_wins'] for result in symbol_results.values()),
+        'total_losses': sum(result['total_losses'] for result in symbol_results.values()),
+        'profit': round(profit, 2),
+        'starting_balance': cash,
+        'ending_balance': current_balance,
+        'max_open_trades': max_open_trades,
+        'balance_history': {
+            "time": numpy.array(balance_times, dtype="datetime64[ns]"),
+            "balance": numpy.array(balances, dtype=float)
+        },
+        'parameters': parameters,
+        'symbols': symbol_results
+    }
+
+
+# Function to add the columns used to track each trade to a strategy dataframe
+def add_trade_columns(strategy_dataframe):
+    """
+    Function to add the columns used to track each trade to a strategy dataframe. Updates the dataframe in place
+    :param strategy_dataframe: dataframe of the strategy candles (i.e. the trades)
+    :return: None
+    """
     # Add a column to strategy_dataframe called 'trailing_stop_update'
     strategy_dataframe['trailing_stop_update'] = np.empty((len(strategy_dataframe), 0)).tolist()
     # Add a column to strategy_dataframe called 'trailing_take_profit_update'
@@ -363,10 +1513,830 @@ def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, comm
     strategy_dataframe['original_stop_loss'] = strategy_dataframe['stop_loss']
     # Add a column to strategy_dataframe called 'original_take_profit', setting it to the strategy take profit
     strategy_dataframe['original_take_profit'] = strategy_dataframe['take_profit']
-    # Convert historic_data from a dataframe to a dictionary
-    historic_data_dict = historic_data.to_dict('records')
-    # Convert the strategy dataframe to a dictionary
-    strategy_dataframe_dict = strategy_dataframe.to_dict('records')
+
+
+# Function to update the trailing stop and trailing take profit of a trade
+def update_trailing_levels(historic_row, trade, raw_strategy_candlesticks, pip_size, trailing_stop_column=None,
+                           trailing_stop_pips=None, trailing_stop_percent=None, trailing_take_profit_column=None,
+                           trailing_take_profit_pips=None, trailing_take_profit_percent=None):
+    """
+    Function to move the stop loss and take profit of an open trade for a single M1 bar, recording each change
+    :param historic_row: dictionary of the M1 bar
+    :param trade: dictionary of the open trade. Updated in place
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param pip_size: float of the pip size of a symbol
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :return: None
+    """
+    # Check to see if any trailing stops need to be updated
+    new_stop_loss = check_trailing_stops(
+        historic_row=historic_row,
+        trade_row=trade,
+        raw_candlesticks=raw_strategy_candlesticks,
+        trailing_stop_column=trailing_stop_column,
+        trailing_stop_pips=trailing_stop_pips,
+        trailing_stop_percent=trailing_stop_percent,
+        pip_size=pip_size
+    )
+    # If a new stop loss is returned, update the trade
+    if new_stop_loss["new_stop_loss"] is not None:
+        # Create a dictionary to store the update
+        update = {
+            'time': historic_row['time'],
+            'human_time': historic_row['human_time'],
+            'new_stop_loss': new_stop_loss["new_stop_loss"],
+            'previous_stop_loss': trade['stop_loss'],
+            'historic_row': historic_row,
+            'details': new_stop_loss
+        }
+        # Add an update to the trade dictionary recording the stop loss change
+        trade['trailing_stop_update'].append(update)
+        # Update the trade dictionary with the new stop loss
+        trade['stop_loss'] = new_stop_loss["new_stop_loss"]
+    # Check to see if any trailing take profits need to be updated
+    new_take_profit = check_trailing_take_profits(
+        historic_row=historic_row,
+        trade_row=trade,
+        raw_candlesticks=raw_strategy_candlesticks,
+        trailing_take_profit_column=trailing_take_profit_column,
+        trailing_take_profit_pips=trailing_take_profit_pips,
+        trailing_take_profit_percent=trailing_take_profit_percent,
+        pip_size=pip_size
+    )
+    if new_take_profit["new_take_profit"] is not None:
+        # Create a dictionary to store the update
+        update = {
+            'time': historic_row['time'],
+            'human_time': historic_row['human_time'],
+            'new_take_profit': new_take_profit,
+            'previous_take_profit': trade['take_profit'],
+            'historic_row': historic_row,
+            'details': new_take_profit
+        }
+        # Add an update to the trade dictionary recording the take profit change
+        trade['trailing_take_profit_update'].append(update)
+        # Update the trade dictionary with the new take profit
+        trade['take_profit'] = new_take_profit["new_take_profit"]
+
+
+# Function to open a trade
+def open_trade(trade, historic_row, balance, risk_percent, symbol, pip_size):
+    """
+    Function to open a trade, sizing it against the balance at the time it filled
+    :param trade: dictionary of the trade. Updated in place
+    :param historic_row: dictionary of the M1 bar the trade filled in
+    :param balance: float of the balance when the trade filled
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param symbol: string of the symbol being traded
+    :param pip_size: float of the pip size of a symbol
+    :return: None
+    """
+    # Add the historic_row data to the strategy_row in the column 'trade_open_details'
+    trade['trade_open_details'] = historic_row
+    # Calculate the lot_size for the trade
+    trade['lot_size'] = helper_functions.calc_lot_size(
+        balance=balance,
+        risk_amount=risk_percent,
+        stop_loss=trade['original_stop_loss'],
+        stop_price=trade['stop_price'],
+        symbol=symbol,
+        pip_size=pip_size,
+        base_currency="USD"
+    )
+    # Add in the original starting time
+    trade['original_start_time'] = historic_row['human_time']
+
+
+# Function to close a trade
+def close_trade(trade, historic_row, reason, contract_size):
+    """
+    Function to close a trade at its stop loss or take profit
+    :param trade: dictionary of the open trade. Updated in place
+    :param historic_row: dictionary of the M1 bar the trade closed in
+    :param reason: string of "stop_loss" or "take_profit"
+    :param contract_size: contract size for converting a lot into a dollar value
+    :return: float of the profit. Only a profit is added back to the balance
+    """
+    # Update the trade dictionary with 'trade_close_details' as the current historic row
+    trade['trade_close_details'] = historic_row
+    trade['closing_price'] = trade[reason]
+    trade['closing_time'] = historic_row['human_time']
+    # Calculate the profit
+    profit = calculate_profit(trade, reason, contract_size)
+    trade['trade_win'] = profit > 0
+    return profit
+
+
+# Function to create a price pyramid
+def create_price_pyramid(high, low, block_sizes=pyramid_block_sizes):
+    """
+    Function to create a pyramid of the highest high and lowest low over blocks of M1 bars. The engine checks a whole
+    block at once, and only tests the bars of blocks whose range could contain the price being searched for
+    :param high: numpy array of the M1 highs
+    :param low: numpy array of the M1 lows
+    :param block_sizes: list of block sizes in bars, from smallest to largest. Each must divide the next
+    :return: dictionary of the pyramid. Level 0 is the bars themselves
+    """
+    pyramid = {
+        "block_sizes": [1],
+        "high": [high.tolist()],
+        "low": [low.tolist()],
+        "length": len(high)
+    }
+    for block_size in block_sizes:
+        if block_size >= len(high):
+            break
+        block_starts = numpy.arange(0, len(high), block_size)
+        pyramid["block_sizes"].append(block_size)
+        pyramid["high"].append(numpy.maximum.reduceat(high, block_starts).tolist())
+        pyramid["low"].append(numpy.minimum.reduceat(low, block_starts).tolist())
+    return pyramid
+
+
+# Function to find the first M1 bar to reach a price
+def find_first_bar(pyramid, start, end, high_at_least=None, low_at_most=None):
+    """
+    Function to find the first M1 bar where the high is at least one price and/or the low is at most another. Blocks
+    of bars which can't match are skipped whole, largest first
+    :param pyramid: dictionary of the price pyramid
+    :param start: integer of the first bar to check
+    :param end: integer of the bar to stop before
+    :param high_at_least: float the high must reach, or None
+    :param low_at_most: float the low must reach, or None
+    :return: integer of the bar, or None if no bar matches
+    """
+    block_sizes = pyramid["block_sizes"]
+    highs = pyramid["high"]
+    lows = pyramid["low"]
+    index = start
+    while index < end:
+        # Skip the largest block starting here which can't match
+        for level in range(len(block_sizes) - 1, 0, -1):
+            block_size = block_sizes[level]
+            if index % block_size == 0 and index + block_size <= end:
+                block = index // block_size
+                if (high_at_least is not None and highs[level][block] < high_at_least) or \
+                        (low_at_most is not None and lows[level][block] > low_at_most):
+                    index += block_size
+                    break
+        else:
+            # No block could be skipped, so test the bar
+            if (high_at_least is None or highs[0][index] >= high_at_least) and \
+                    (low_at_most is None or lows[0][index] <= low_at_most):
+                return index
+            index += 1
+    return None
+
+
+# Function to convert M1 bars to dictionaries
+def get_historic_rows(historic_data, start, end):
+    """
+    Function to convert a range of M1 bars to dictionaries, in the same format as historic_data.to_dict('records')
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param start: integer of the first bar
+    :param end: integer of the bar to stop before
+    :return: list of dictionaries
+    """
+    return historic_data.iloc[start:end].to_dict('records')
+
+
+# Function to get a chunk of M1 bars as dictionaries
+def get_historic_chunk(historic_data, chunk_cache, chunk_number, chunk_size):
+    """
+    Function to get a chunk of M1 bars as dictionaries, converting it the first time it is needed. Trades stepping
+    through the same bars share the conversion
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param chunk_cache: dictionary of chunk number to list of dictionaries
+    :param chunk_number: integer of the chunk
+    :param chunk_size: integer of the number of bars in each chunk
+    :return: list of dictionaries
+    """
+    if chunk_number not in chunk_cache:
+        chunk_cache[chunk_number] = get_historic_rows(historic_data, chunk_number * chunk_size,
+                                                      (chunk_number + 1) * chunk_size)
+    return chunk_cache[chunk_number]
+
+
+# Function to get the size of a pip or percent trailing level
+def get_trailing_size(trade, trailing_pips=None, trailing_percent=None, pip_size=None):
+    """
+    Function to get the distance a pip or percent trailing stop (or take profit) trails price by. Pips take priority
+    over percent, as they do in check_trailing_stops
+    :param trade: dictionary of the trade
+    :param trailing_pips: float of the number of pips the level trails by
+    :param trailing_percent: float of the percent of the stop price the level trails by
+    :param pip_size: float of the pip size of a symbol
+    :return: tuple of the size and the type ("PIPS" or "PERCENT"), or (None, None) if the level doesn't trail
+    """
+    if trailing_pips:
+        return trailing_pips * pip_size, "PIPS"
+    elif trailing_percent:
+        return trailing_percent * trade['stop_price'], "PERCENT"
+    return None, None
+
+
+# Function to calculate a trailing level over a slice of M1 bars
+def calculate_trailing_levels(candidates, start_level, trail_up):
+    """
+    Function to calculate a pip or percent trailing level over a slice of M1 bars. The level only ever moves one way,
+    so after each bar it is the running max (or min) of the price it trails at in each bar so far
+    :param candidates: numpy array of the price the level would trail at in each bar (i.e. high - trailing stop size)
+    :param start_level: float of the level before the first bar
+    :param trail_up: Boolean. True if the level only moves up (BUY_STOP), False if it only moves down (SELL_STOP)
+    :return: tuple of numpy arrays of the level after each bar, the level before each bar, and whether it moved
+    """
+    if trail_up:
+        levels = numpy.maximum(numpy.maximum.accumulate(candidates), start_level)
+    else:
+        levels = numpy.minimum(numpy.minimum.accumulate(candidates), start_level)
+    previous_levels = numpy.empty_like(levels)
+    previous_levels[0] = start_level
+    previous_levels[1:] = levels[:-1]
+    return levels, previous_levels, levels != previous_levels
+
+
+# Function to record the trailing updates found by a cumulative scan
+def record_trailing_updates(trade, bar_arrays, historic_data, chunk_cache, chunk_size, stop_updates,
+                            take_profit_updates, stop_size, stop_type, take_profit_size, take_profit_type,
+                            trailing_update_summary=False):
+    """
+    Function to record the trailing updates found by resolve_trailing_exit on a trade. By default each update is
+    recorded in the same format as update_trailing_levels. When summarised, only the time and level of each update are
+    kept, which avoids converting every bar the level moved in to a dictionary
+    :param trade: dictionary of the trade. Updated in place
+    :param bar_arrays: dictionary of numpy arrays of the M1 bar high, low and time
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param chunk_cache: dictionary of the M1 bars already converted to dictionaries, shared between trades
+    :param chunk_size: integer of the number of bars in each chunk
+    :param stop_updates: list of tuples of numpy arrays of the bar, new level and previous level of each stop update
+    :param take_profit_updates: list of tuples of numpy arrays of the same for each take profit update
+    :param stop_size: float of the trailing stop size, or None
+    :param stop_type: string of the trailing stop type ("PIPS" or "PERCENT")
+    :param take_profit_size: float of the trailing take profit size, or None
+    :param take_profit_type: string of the trailing take profit type ("PIPS" or "PERCENT")
+    :param trailing_update_summary: Boolean. When True, updates are recorded as arrays of time and level
+    :return: None
+    """
+    for updates, size, update_key, level_key in [
+        (stop_updates, stop_size, 'trailing_stop_update', 'stop_loss'),
+        (take_profit_updates, take_profit_size, 'trailing_take_profit_update', 'take_profit')
+    ]:
+        if size is None:
+            continue
+        indexes = numpy.concatenate([update[0] for update in updates]) if updates else numpy.array([], dtype=int)
+        levels = numpy.concatenate([update[1] for update in updates]) if updates else numpy.array([])
+        previous_levels = numpy.concatenate([update[2] for update in updates]) if updates else numpy.array([])
+        if trailing_update_summary:
+            trade[update_key] = {"time": bar_arrays["time"][indexes], "level": levels}
+            continue
+        for index, level, previous_level in zip(indexes.tolist(), levels.tolist(), previous_levels.tolist()):
+            historic_row = get_historic_chunk(historic_data, chunk_cache, index // chunk_size, chunk_size)[
+                index % chunk_size]
+            if level_key == 'stop_loss':
+                details = {
+                    'new_stop_loss': level,
+                    'stop_loss_type': f"TRAILING_STOP_{stop_type}",
+                    'stop_loss_details': size
+                }
+                trade[update_key].append({
+                    'time': historic_row['time'],
+                    'human_time': historic_row['human_time'],
+                    'new_stop_loss': level,
+                    'previous_stop_loss': previous_level,
+                    'historic_row': historic_row,
+                    'details': details
+                })
+            else:
+                details = {
+                    'new_take_profit': level,
+                    'take_profit_type': f"TRAILING_TAKE_PROFIT_{take_profit_type}",
+                    'take_profit_details': size
+                }
+                trade[update_key].append({
+                    'time': historic_row['time'],
+                    'human_time': historic_row['human_time'],
+                    'new_take_profit': details,
+                    'previous_take_profit': previous_level,
+                    'historic_row': historic_row,
+                    'details': details
+                })
+
+
+# Function to resolve a trade with pip or percent trailing levels
+def resolve_trailing_exit(trade, entry_index, bar_arrays, historic_data, chunk_cache, chunk_size, pip_size,
+                          trailing_stop_pips=None, trailing_stop_percent=None, trailing_take_profit_pips=None,
+                          trailing_take_profit_percent=None, trailing_update_summary=False, window_size=256,
+                          max_window_size=65536):
+    """
+    Function to find the M1 bar a trade with pip or percent trailing levels closes in, without stepping through the
+    bars one at a time. The levels are calculated over a window of bars with a cumulative max (or min) scan, and the
+    first bar crossing either level closes the trade. Windows double in size until the trade closes.
+    :param trade: dictionary of the open trade. The final levels and the trailing updates are recorded in place
+    :param entry_index: integer of the bar the trade opened in. The trade is first tested on the bar after
+    :param bar_arrays: dictionary of numpy arrays of the M1 bar high, low and time
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param chunk_cache: dictionary of the M1 bars already converted to dictionaries, shared between trades
+    :param chunk_size: integer of the number of bars in each chunk
+    :param pip_size: float of the pip size of a symbol
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, updates are recorded as arrays of time and level
+    :param window_size: integer of the number of bars in the first window
+    :param max_window_size: integer of the largest window
+    :return: tuple of the exit bar and the reason, or (None, None) if still open. None if the trade can't be
+    resolved this way (see below), in which case the trade is left unchanged
+    """
+    if trade['order_type'] == "BUY_STOP":
+        buy = True
+    elif trade['order_type'] == "SELL_STOP":
+        buy = False
+    else:
+        return None, None
+    stop_size, stop_type = get_trailing_size(trade, trailing_stop_pips, trailing_stop_percent, pip_size)
+    take_profit_size, take_profit_type = get_trailing_size(trade, trailing_take_profit_pips,
+                                                           trailing_take_profit_percent, pip_size)
+    # A level trailing the wrong way (i.e. negative pips) can't be scanned
+    if (stop_size is not None and stop_size <= 0) or (take_profit_size is not None and take_profit_size <= 0):
+        return None
+    stop_loss = trade['stop_loss']
+    take_profit = trade['take_profit']
+    stop_updates = []
+    take_profit_updates = []
+    exit_index = None
+    reason = None
+    number_of_bars = len(bar_arrays["high"])
+    start = entry_index + 1
+    while start < number_of_bars:
+        end = min(start + window_size, number_of_bars)
+        highs = bar_arrays["high"][start:end]
+        lows = bar_arrays["low"][start:end]
+        # Calculate the levels in each bar. Levels are updated before the bar is tested, as in update_trailing_levels
+        if stop_size is None:
+            stop_levels = numpy.full(end - start, stop_loss)
+        else:
+            stop_levels, previous_stop_levels, stop_moved = calculate_trailing_levels(
+                highs - stop_size if buy else lows + stop_size, stop_loss, buy)
+        if take_profit_size is None:
+            take_profit_levels = numpy.full(end - start, take_profit)
+        else:
+            take_profit_levels, previous_take_profit_levels, take_profit_moved = calculate_trailing_levels(
+                highs + take_profit_size if buy else lows - take_profit_size, take_profit, buy)
+        # Find the first bar crossing a level. The stop loss is tested first, so wins a tie
+        if buy:
+            stop_hit = lows <= stop_levels
+            take_profit_hit = highs >= take_profit_levels
+        else:
+            stop_hit = highs >= stop_levels
+            take_profit_hit = lows <= take_profit_levels
+        closed = stop_hit | take_profit_hit
+        bars_used = end - start
+        if closed.any():
+            bars_used = int(numpy.argmax(closed)) + 1
+            exit_index = start + bars_used - 1
+            reason = "stop_loss" if stop_hit[bars_used - 1] else "take_profit"
+        # Record the bars each level moved in, up to the exit
+        if stop_size is not None:
+            moved = numpy.flatnonzero(stop_moved[:bars_used])
+            # A pip trailing stop also needs price to be more than the stop size past the old stop. Rounding can
+            # make that disagree with the scan, in which case the trade is stepped through bar by bar instead
+            if stop_type == "PIPS":
+                if buy:
+                    gaps = highs[moved] - previous_stop_levels[moved]
+                else:
+                    gaps = previous_stop_levels[moved] - lows[moved]
+                if not numpy.all(gaps > stop_size):
+                    return None
+            stop_updates.append((moved + start, stop_levels[moved], previous_stop_levels[moved]))
+        if take_profit_size is not None:
+            moved = numpy.flatnonzero(take_profit_moved[:bars_used])
+            take_profit_updates.append((moved + start, take_profit_levels[moved],
+                                        previous_take_profit_levels[moved]))
+        stop_loss = stop_levels[bars_used - 1].item()
+        take_profit = take_profit_levels[bars_used - 1].item()
+        if exit_index is not None:
+            break
+        start = end
+        window_size = min(window_size * 2, max_window_size)
+    # Update the trade
+    trade['stop_loss'] = stop_loss
+    trade['take_profit'] = take_profit
+    record_trailing_updates(trade, bar_arrays, historic_data, chunk_cache, chunk_size, stop_updates,
+                            take_profit_updates, stop_size, stop_type, take_profit_size, take_profit_type,
+                            trailing_update_summary)
+    return exit_index, reason
+
+
+# Function to summarise the trailing updates of a trade
+def summarize_trailing_updates(trade):
+    """
+    Function to summarise the trailing updates of a trade as arrays of the time and level of each update, the same
+    format resolve_trailing_exit records when summarising
+    :param trade: dictionary of the trade. Updated in place
+    :return: None
+    """
+    if isinstance(trade['trailing_stop_update'], list):
+        trade['trailing_stop_update'] = {
+            "time": numpy.array([update['time'] for update in trade['trailing_stop_update']], dtype=numpy.int64),
+            "level": numpy.array([update['new_stop_loss'] for update in trade['trailing_stop_update']], dtype=float)
+        }
+    if isinstance(trade['trailing_take_profit_update'], list):
+        trade['trailing_take_profit_update'] = {
+            "time": numpy.array([update['time'] for update in trade['trailing_take_profit_update']],
+                                dtype=numpy.int64),
+            "level": numpy.array([update['details']['new_take_profit']
+                                  for update in trade['trailing_take_profit_update']], dtype=float)
+        }
+
+
+# Function to find the M1 bar a trade closes in
+def find_trade_exit(trade, entry_index, pyramid, historic_data, raw_strategy_candlesticks, pip_size,
+                    trailing_stop_column=None, trailing_stop_pips=None, trailing_stop_percent=None,
+                    trailing_take_profit_column=None, trailing_take_profit_pips=None,
+                    trailing_take_profit_percent=None, chunk_cache=None, chunk_size=historic_chunk_size,
+                    bar_arrays=None, trailing_update_summary=False):
+    """
+    Function to find the M1 bar a trade closes in. Trades are independent of each other once open, so each can be
+    resolved on its own. Fixed levels are found with the price pyramid. Pip and percent trailing levels are found with
+    a cumulative scan (see resolve_trailing_exit). Column trailing levels depend on the strategy candles, so those
+    trades are stepped through bar by bar, exactly as simulate_every_bar does
+    :param trade: dictionary of the open trade. Trailing updates are recorded in place
+    :param entry_index: integer of the bar the trade opened in. The trade is first tested on the bar after
+    :param pyramid: dictionary of the price pyramid
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param pip_size: float of the pip size of a symbol
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param chunk_cache: dictionary of the M1 bars already converted to dictionaries, shared between trades
+    :param chunk_size: integer of the number of bars converted to dictionaries at a time when stepping bar by bar
+    :param bar_arrays: dictionary of numpy arrays of the M1 bar high, low and time. Needed for pip and percent
+    trailing levels to be scanned
+    :param trailing_update_summary: Boolean. When True, scanned trailing updates are recorded as arrays of time and
+    level
+    :return: tuple of the exit bar and the reason ("stop_loss" or "take_profit"), or (None, None) if still open
+    """
+    number_of_bars = pyramid["length"]
+    trailing = trailing_stop_column or trailing_stop_pips or trailing_stop_percent or trailing_take_profit_column \
+        or trailing_take_profit_pips or trailing_take_profit_percent
+    if not trailing:
+        # Find the first bar reaching the stop loss, then the first reaching the take profit before it
+        if trade['order_type'] == "BUY_STOP":
+            stop_loss_index = find_first_bar(pyramid, entry_index + 1, number_of_bars, low_at_most=trade['stop_loss'])
+            search_end = number_of_bars if stop_loss_index is None else stop_loss_index
+            take_profit_index = find_first_bar(pyramid, entry_index + 1, search_end,
+                                               high_at_least=trade['take_profit'])
+        elif trade['order_type'] == "SELL_STOP":
+            stop_loss_index = find_first_bar(pyramid, entry_index + 1, number_of_bars,
+                                             high_at_least=trade['stop_loss'])
+            search_end = number_of_bars if stop_loss_index is None else stop_loss_index
+            take_profit_index = find_first_bar(pyramid, entry_index + 1, search_end, low_at_most=trade['take_profit'])
+        else:
+            return None, None
+        # The stop loss is tested first, so wins a tie
+        if take_profit_index is not None:
+            return take_profit_index, "take_profit"
+        if stop_loss_index is not None:
+            return stop_loss_index, "stop_loss"
+        return None, None
+    if chunk_cache is None:
+        chunk_cache = {}
+    # Scan pip and percent trailing levels
+    scannable = bar_arrays is not None and not trailing_stop_column and not trailing_take_profit_column and \
+        not ((trailing_stop_pips or trailing_take_profit_pips) and pip_size is None)
+    if scannable:
+        outcome = resolve_trailing_exit(
+            trade=trade,
+            entry_index=entry_index,
+            bar_arrays=bar_arrays,
+            historic_data=historic_data,
+            chunk_cache=chunk_cache,
+            chunk_size=chunk_size,
+            pip_size=pip_size,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent,
+            trailing_update_summary=trailing_update_summary
+        )
+        if outcome is not None:
+            return outcome
+    # Step through the bars, converting a chunk at a time
+    for chunk_number in range((entry_index + 1) // chunk_size, (number_of_bars - 1) // chunk_size + 1):
+        historic_rows = get_historic_chunk(historic_data, chunk_cache, chunk_number, chunk_size)
+        chunk_start = chunk_number * chunk_size
+        first_offset = max(entry_index + 1 - chunk_start, 0)
+        for offset in range(first_offset, len(historic_rows)):
+            historic_row = historic_rows[offset]
+            update_trailing_levels(
+                historic_row=historic_row,
+                trade=trade,
+                raw_strategy_candlesticks=raw_strategy_candlesticks,
+                pip_size=pip_size,
+                trailing_stop_column=trailing_stop_column,
+                trailing_stop_pips=trailing_stop_pips,
+                trailing_stop_percent=trailing_stop_percent,
+                trailing_take_profit_column=trailing_take_profit_column,
+                trailing_take_profit_pips=trailing_take_profit_pips,
+                trailing_take_profit_percent=trailing_take_profit_percent
+            )
+            if test_for_stop_loss(historic_row, trade):
+                return chunk_start + offset, "stop_loss"
+            if test_for_take_profit(historic_row, trade):
+                return chunk_start + offset, "take_profit"
+    return None, None
+
+
+# Function to find the M1 bar each pending order is filled in
+def find_order_entries(strategy_dataframe_dict, historic_times, pyramid):
+    """
+    Function to find the M1 bar each pending order (strategy row) is filled in. An order can fill from the bar after
+    its candle opens until its cancel time. Only one order can fill in each bar; when several could, the first in the
+    strategy dataframe fills and the others wait for the next bar their stop price is reached in
+    :param strategy_dataframe_dict: list of strategy rows
+    :param historic_times: numpy datetime64 array of the M1 bar times
+    :param pyramid: dictionary of the price pyramid
+    :return: dictionary of bar index to the index of the strategy row filled in it
+    """
+    number_of_bars = pyramid["length"]
+    # Work out the first and last bar of each order, and the first bar its stop price is reached in
+    windows = {}
+    candidates = []
+    for row_index, strategy_row in enumerate(strategy_dataframe_dict):
+        if strategy_row['order_type'] not in ["BUY_STOP", "SELL_STOP"]:
+            continue
+        start = int(numpy.searchsorted(historic_times, pandas.Timestamp(strategy_row['human_time']).to_datetime64(),
+                                       side="right"))
+        cancel_time = strategy_row['cancel_time']
+        if isinstance(cancel_time, str) and cancel_time == "GTC":
+            end = number_of_bars
+        elif pandas.isna(cancel_time):
+            continue
+        else:
+            end = int(numpy.searchsorted(historic_times, pandas.Timestamp(cancel_time).to_datetime64(), side="left"))
+        windows[row_index] = end
+        entry_index = find_first_bar(pyramid, start, end, high_at_least=strategy_row['stop_price'],
+                                     low_at_most=strategy_row['stop_price'])
+        if entry_index is not None:
+            candidates.append((entry_index, row_index))
+    # Fill the orders in time order. An order beaten to a bar looks for the next bar it could fill in
+    heapq.heapify(candidates)
+    entries = {}
+    while candidates:
+        entry_index, row_index = heapq.heappop(candidates)
+        if entry_index not in entries:
+            entries[entry_index] = row_index
+            continue
+        stop_price = strategy_dataframe_dict[row_index]['stop_price']
+        entry_index = find_first_bar(pyramid, entry_index + 1, windows[row_index], high_at_least=stop_price,
+                                     low_at_most=stop_price)
+        if entry_index is not None:
+            heapq.heappush(candidates, (entry_index, row_index))
+    return entries
+
+
+# Function to find the bar each order fills in and the bar each trade closes in
+def find_fills_and_exits(strategy_dataframe_dict, raw_strategy_candlesticks, historic_data, pip_size,
+                         trailing_stop_column=None, trailing_stop_pips=None, trailing_stop_percent=None,
+                         trailing_take_profit_column=None, trailing_take_profit_pips=None,
+                         trailing_take_profit_percent=None, trailing_update_summary=False, chunk_cache=None):
+    """
+    Function to find the M1 bar each order (strategy row) fills in and the M1 bar each trade closes in. Neither
+    depends on the balance, so they can be found before the trades are sized
+    :param strategy_dataframe_dict: list of strategy rows (i.e. the pending orders)
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param historic_data: dataframe of 1 Minute candlesticks over the period of the strategy. Must not be empty
+    :param pip_size: float of the pip size of a symbol
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, pip and percent trailing updates are recorded as arrays of
+    time and level
+    :param chunk_cache: dictionary of the M1 bars already converted to dictionaries, shared between trades
+    :return: tuple of a dictionary of the bar each trade filled in to the trade, and a list of tuples of the bar a
+    trade closed in, the bar it filled in and the reason it closed
+    """
+    if chunk_cache is None:
+        chunk_cache = {}
+    bar_arrays = {
+        "high": historic_data['high'].to_numpy(dtype=float),
+        "low": historic_data['low'].to_numpy(dtype=float),
+        "time": historic_data['time'].to_numpy(dtype=numpy.int64)
+    }
+    pyramid = create_price_pyramid(bar_arrays["high"], bar_arrays["low"])
+    historic_times = historic_data['human_time'].to_numpy().astype("datetime64[ns]")
+    # Find the bar each order fills in
+    entries = find_order_entries(strategy_dataframe_dict, historic_times, pyramid)
+    # Find the bar each trade closes in
+    exits = []
+    for entry_index, row_index in entries.items():
+        trade = strategy_dataframe_dict[row_index]
+        exit_index, reason = find_trade_exit(
+            trade=trade,
+            entry_index=entry_index,
+            pyramid=pyramid,
+            historic_data=historic_data,
+            raw_strategy_candlesticks=raw_strategy_candlesticks,
+            pip_size=pip_size,
+            trailing_stop_column=trailing_stop_column,
+            trailing_stop_pips=trailing_stop_pips,
+            trailing_stop_percent=trailing_stop_percent,
+            trailing_take_profit_column=trailing_take_profit_column,
+            trailing_take_profit_pips=trailing_take_profit_pips,
+            trailing_take_profit_percent=trailing_take_profit_percent,
+            chunk_cache=chunk_cache,
+            bar_arrays=bar_arrays,
+            trailing_update_summary=trailing_update_summary
+        )
+        if exit_index is not None:
+            exits.append((exit_index, entry_index, reason))
+    trades = {entry_index: strategy_dataframe_dict[row_index] for entry_index, row_index in entries.items()}
+    return trades, exits
+
+
+# Function to replay the fills and closes of a set of trades
+def replay_trades(trades, exits, cash, symbol, historic_data, pip_size, contract_size, risk_percent, chunk_cache,
+                  chunk_size=historic_chunk_size):
+    """
+    Function to replay the fills and closes of a set of trades in time order, working out the lot size of each trade
+    from the balance at the time it filled. Closes in a bar come before a fill, and trades closing in the same bar
+    close in the order they opened, as in simulate_every_bar
+    :param trades: dictionary of the bar each trade filled in to the trade dictionary. Trades are updated in place
+    :param exits: list of tuples of the bar a trade closed in, the bar it filled in and the reason it closed
+    :param cash: float of the starting cash
+    :param symbol: string of the symbol being traded
+    :param historic_data: dataframe of 1 Minute candlesticks
+    :param pip_size: float of the pip size of a symbol
+    :param contract_size: contract size for converting a lot into a dollar value
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param chunk_cache: dictionary of the M1 bars already converted to dictionaries, shared between trades
+    :param chunk_size: integer of the number of bars in each chunk
+    :return: list of completed trades, in the order they closed
+    """
+    events = [(exit_index, 0, entry_index, reason) for exit_index, entry_index, reason in exits]
+    events += [(entry_index, 1, entry_index, None) for entry_index in trades]
+    events.sort()
+    completed_trades = []
+    current_balance = cash
+    for bar_index, event_type, entry_index, reason in events:
+        trade = trades[entry_index]
+        historic_row = get_historic_chunk(historic_data, chunk_cache, bar_index // chunk_size, chunk_size)[
+            bar_index % chunk_size]
+        if event_type == 1:
+            open_trade(trade, historic_row, current_balance, risk_percent, symbol, pip_size)
+            # Subtract the amount risked from the balance
+            current_balance -= current_balance * risk_percent
+        else:
+            profit = close_trade(trade, historic_row, reason, contract_size)
+            if profit > 0:
+                current_balance += profit
+            completed_trades.append(trade)
+    return completed_trades
+
+
+# Function to simulate a FOREX strategy, skipping bars which can't change anything
+def simulate_with_bar_skipping(strategy_dataframe_dict, raw_strategy_candlesticks, cash, symbol, historic_data,
+                               pip_size, contract_size, risk_percent, trailing_stop_column=None,
+                               trailing_stop_pips=None, trailing_stop_percent=None, trailing_take_profit_column=None,
+                               trailing_take_profit_pips=None, trailing_take_profit_percent=None,
+                               trailing_update_summary=False):
+    """
+    Function to simulate a FOREX strategy with the same results as simulate_every_bar, without testing every M1 bar.
+    Where an order fills and where a trade closes only depend on price, so they are found first using a pyramid of
+    block highs and lows, which skips straight past blocks of bars where price is nowhere near a level. The balance
+    (and so the lot size of each trade) is then worked out by replaying the fills and closes in time order.
+    :param strategy_dataframe_dict: list of strategy rows (i.e. the pending orders)
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param cash: float of the starting cash
+    :param symbol: string of the symbol being traded
+    :param historic_data: dataframe of 1 Minute candlesticks over the period of the strategy
+    :param pip_size: float of the pip size of a symbol
+    :param contract_size: contract size for converting a lot into a dollar value
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :param trailing_update_summary: Boolean. When True, pip and percent trailing updates are recorded as arrays of
+    time and level
+    :return: list of completed trades, in the order they closed
+    """
+    if len(historic_data) == 0:
+        return []
+    chunk_cache = {}
+    # Step 1: Find the bar each order fills in and the bar each trade closes in
+    trades, exits = find_fills_and_exits(
+        strategy_dataframe_dict=strategy_dataframe_dict,
+        raw_strategy_candlesticks=raw_strategy_candlesticks,
+        historic_data=historic_data,
+        pip_size=pip_size,
+        trailing_stop_column=trailing_stop_column,
+        trailing_stop_pips=trailing_stop_pips,
+        trailing_stop_percent=trailing_stop_percent,
+        trailing_take_profit_column=trailing_take_profit_column,
+        trailing_take_profit_pips=trailing_take_profit_pips,
+        trailing_take_profit_percent=trailing_take_profit_percent,
+        trailing_update_summary=trailing_update_summary,
+        chunk_cache=chunk_cache
+    )
+    # Step 2: Replay the fills and closes in time order to work out the balance
+    return replay_trades(trades, exits, cash, symbol, historic_data, pip_size, contract_size, risk_percent,
+                         chunk_cache)
+
+
+# Function to find the exits of a trade for a batch of stop losses and take profits
+def find_batch_exits(order_type, entry_index, bar_arrays, stop_losses, take_profits, window_size=256,
+                     max_window_size=65536):
+    """
+    Function to find the M1 bar a trade closes in for a batch of stop losses and take profits. The running high and low
+    since the trade opened only ever move one way, so the first bar reaching each level is found with a binary search,
+    and the M1 path is only scanned once for the whole batch. Windows double in size until every level has closed.
+    :param order_type: string of the order type ("BUY_STOP" or "SELL_STOP")
+    :param entry_index: integer of the bar the trade opened in. The trade is first tested on the bar after
+    :param bar_arrays: dictionary of numpy arrays of the M1 bar high and low
+    :param stop_losses: numpy array of the stop loss of each setting
+    :param take_profits: numpy array of the take profit of each setting
+    :param window_size: integer of the number of bars in the first window
+    :param max_window_size: integer of the largest window
+    :return: tuple of numpy arrays of the exit bar of each setting (-1 if still open) and whether it was the stop loss
+    """
+    exit_indexes = numpy.full(len(stop_losses), -1, dtype=numpy.int64)
+    stop_loss_hits = numpy.zeros(len(stop_losses), dtype=bool)
+    if order_type == "BUY_STOP":
+        buy = True
+    elif order_type == "SELL_STOP":
+        buy = False
+    else:
+        return exit_indexes, stop_loss_hits
+    open_settings = numpy.arange(len(stop_losses))
+    highest = -numpy.inf
+    lowest = numpy.inf
+    number_of_bars = len(bar_arrays["high"])
+    start = entry_index + 1
+    while start < number_of_bars and len(open_settings) > 0:
+        end = min(start + window_size, number_of_bars)
+        running_high = numpy.maximum(numpy.maximum.accumulate(bar_arrays["high"][start:end]), highest)
+        running_low = numpy.minimum(numpy.minimum.accumulate(bar_arrays["low"][start:end]), lowest)
+        # Binary searches need an ascending array, so the running low is negated
+        if buy:
+            stop_bars = numpy.searchsorted(-running_low, -stop_losses[open_settings], side="left")
+            take_profit_bars = numpy.searchsorted(running_high, take_profits[open_settings], side="left")
+        else:
+            stop_bars = numpy.searchsorted(running_high, stop_losses[open_settings], side="left")
+            take_profit_bars = numpy.searchsorted(-running_low, -take_profits[open_settings], side="left")
+        exit_bars = numpy.minimum(stop_bars, take_profit_bars)
+        closed = exit_bars < end - start
+        exit_indexes[open_settings[closed]] = exit_bars[closed] + start
+        # The stop loss is tested first, so wins a tie
+        stop_loss_hits[open_settings[closed]] = stop_bars[closed] <= take_profit_bars[closed]
+        open_settings = open_settings[~closed]
+        highest = running_high[-1]
+        lowest = running_low[-1]
+        start = end
+        window_size = min(window_size * 2, max_window_size)
+    return exit_indexes, stop_loss_hits
+
+
+# Function to simulate a FOREX strategy one M1 bar at a time
+def simulate_every_bar(strategy_dataframe_dict, raw_strategy_candlesticks, cash, commission, symbol,
+                       historic_data_dict, pip_size, contract_size, risk_percent, trailing_stop_column=None,
+                       trailing_stop_pips=None, trailing_stop_percent=None, trailing_take_profit_column=None,
+                       trailing_take_profit_pips=None, trailing_take_profit_percent=None):
+    """
+    Function to simulate a FOREX strategy by testing every open trade and pending order against every M1 bar. This is
+    the reference engine which simulate_with_bar_skipping must match
+    :param strategy_dataframe_dict: list of strategy rows (i.e. the pending orders)
+    :param raw_strategy_candlesticks: dataframe of the candlesticks used to generate the strategy dataframe
+    :param cash: float of the starting cash
+    :param commission: float of the commission per trade
+    :param symbol: string of the symbol being traded
+    :param historic_data_dict: list of 1 Minute candlesticks over the period of the strategy
+    :param pip_size: float of the pip size of a symbol
+    :param contract_size: contract size for converting a lot into a dollar value
+    :param risk_percent: float of the amount of the balance being risked for each trade
+    :param trailing_stop_column: string of the column the trailing stop should be pinned to
+    :param trailing_stop_pips: float of the number of pips the trailing stop should be applied against
+    :param trailing_stop_percent: float of the percent the trailing stop should be applied against
+    :param trailing_take_profit_column: string of the column the trailing take profit should be pinned to
+    :param trailing_take_profit_pips: float of the number of pips the trailing take profit should be applied against
+    :param trailing_take_profit_percent: float of the percent the trailing take profit should be applied against
+    :return: list of completed trades, in the order they closed
+    """
     # Create an empty list to store the trades
     trades = []
     # Create an empty list to store completed trades
@@ -375,95 +2345,36 @@ def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, comm
     current_balance = cash
     # Iterate through historic_data_dict and test each row against the strategy
     for historic_row in historic_data_dict:
-        # Step 1: Check trades for any updates
-        for trade in trades:
-            # Step 1.1: Check to see if any trailing stops need to be updated
-            new_stop_loss = check_trailing_stops(
+        # Step 1: Check trades for any updates. Iterate over a copy, as closed trades are removed from the list
+        for trade in list(trades):
+            # Step 1.1: Update any trailing stops and take profits
+            update_trailing_levels(
                 historic_row=historic_row,
-                trade_row=trade,
-                raw_candlesticks=raw_strategy_candlesticks,
+                trade=trade,
+                raw_strategy_candlesticks=raw_strategy_candlesticks,
+                pip_size=pip_size,
                 trailing_stop_column=trailing_stop_column,
                 trailing_stop_pips=trailing_stop_pips,
                 trailing_stop_percent=trailing_stop_percent,
-                pip_size=pip_size
-            )
-            # If a new stop loss is returned, update the trade
-            if new_stop_loss["new_stop_loss"] is not None:
-                # Create a dictionary to store the update
-                update = {
-                    'time': historic_row['time'],
-                    'human_time': historic_row['human_time'],
-                    'new_stop_loss': new_stop_loss["new_stop_loss"],
-                    'previous_stop_loss': trade['stop_loss'],
-                    'historic_row': historic_row,
-                    'details': new_stop_loss
-                }
-                # Add an update to the trade dictionary recording the stop loss change
-                trade['trailing_stop_update'].append(update)
-                # Update the trade dictionary with the new stop loss
-                trade['stop_loss'] = new_stop_loss["new_stop_loss"]
-            # Step 1.2: Check to see if any trailing take profits need to be updated
-            new_take_profit = check_trailing_take_profits(
-                historic_row=historic_row,
-                trade_row=trade,
-                raw_candlesticks=raw_strategy_candlesticks,
                 trailing_take_profit_column=trailing_take_profit_column,
                 trailing_take_profit_pips=trailing_take_profit_pips,
-                trailing_take_profit_percent=trailing_take_profit_percent,
-                pip_size=pip_size
+                trailing_take_profit_percent=trailing_take_profit_percent
             )
-            if new_take_profit["new_take_profit"] is not None:
-                # Create a dictionary to store the update
-                update = {
-                    'time': historic_row['time'],
-                    'human_time': historic_row['human_time'],
-                    'new_take_profit': new_take_profit,
-                    'previous_take_profit': trade['take_profit'],
-                    'historic_row': historic_row,
-                    'details': new_take_profit
-                }
-                # Add an update to the trade dictionary recording the take profit change
-                trade['trailing_take_profit_update'].append(update)
-                # Update the trade dictionary with the new take profit
-                trade['take_profit'] = new_take_profit["new_take_profit"]
-            # Step 1.3: Check to see if any stop losses have been reached
-            stop_loss_reached = test_for_stop_loss(historic_row, trade)
-            # If Stop Loss reached, update
-            if stop_loss_reached:
-                # Update the trade dictionary with 'trade_close_details' as the current historic row
-                trade['trade_close_details'] = historic_row
-                trade['closing_price'] = trade['stop_loss']
-                trade['closing_time'] = historic_row['human_time']
-                profit = calculate_profit(trade, "stop_loss", contract_size)
-                if profit > 0:
-                    trade['trade_win'] = True
-                    current_balance += profit
-                else:
-                    trade['trade_win'] = False
-                # Append to completed trades
-                completed_trades.append(trade)
-                # Remove from trades list
-                trades.remove(trade)
+            # Step 1.2: Check to see if the stop loss or take profit has been reached. Stop loss takes priority
+            if test_for_stop_loss(historic_row, trade):
+                reason = "stop_loss"
+            elif test_for_take_profit(historic_row, trade):
+                reason = "take_profit"
             else:
-                # Step 1.4: Check to see if Take Profit has been reached
-                take_profit_reached = test_for_take_profit(historic_row, trade)
-                # If Take Profit reached, update
-                if take_profit_reached:
-                    # Update the trade dictionary with 'trade_close_details' as the current historic row
-                    trade['trade_close_details'] = historic_row
-                    trade['closing_price'] = trade['take_profit']
-                    trade['closing_time'] = historic_row['human_time']
-                    # Calculate the profit
-                    profit = calculate_profit(trade, "take_profit", contract_size)
-                    if profit > 0:
-                        trade['trade_win'] = True
-                        current_balance += profit
-                    else:
-                        trade['trade_win'] = False
-                    # Append to completed trades
-                    completed_trades.append(trade)
-                    # Remove from trades list
-                    trades.remove(trade)
+                continue
+            # Close the trade
+            profit = close_trade(trade, historic_row, reason, contract_size)
+            if profit > 0:
+                current_balance += profit
+            # Append to completed trades
+            completed_trades.append(trade)
+            # Remove from trades list
+            trades.remove(trade)
 
         # Step 2: Check the strategy to see if any new trades should be opened
         for strategy_row in strategy_dataframe_dict:
@@ -512,13 +2423,7 @@ def forex_backtest_run(strategy_dataframe, raw_strategy_candlesticks, cash, comm
                         # Remove from strategy_dataframe_dict
                         strategy_dataframe_dict.remove(strategy_row)
                         break
-    # Step 3: Calculate the results of the backtest
-    backtest_results = calculate_backtest_results(completed_trades, contract_size, parameters,
-                                                  raw_strategy_candlesticks, strategy_dataframe)
-
-    # todo: Handle any open trades
-
-    return backtest_results
+    return completed_trades
 
 
 # Function to display the results of a backtest
@@ -854,6 +2759,21 @@ def calculate_backtest_results(results_dict, contract_size, parameters, raw_stra
     :param results_dict: dictionary of all the completed trade actions
     :return: dictionary of backtest results
     """
+    with instrumentation_lib.stage_timer("result_building"):
+        return build_backtest_results(results_dict, contract_size, parameters, raw_strategy_candles, proposed_trades)
+
+
+# Function to build the backtest results dictionary
+def build_backtest_results(results_dict, contract_size, parameters, raw_strategy_candles, proposed_trades):
+    """
+    Function to build the backtest results dictionary from a list of completed trades
+    :param results_dict: dictionary of all the completed trade actions
+    :param contract_size: contract size for converting a lot into a dollar value
+    :param parameters: parameters the backtest was run with
+    :param raw_strategy_candles: dataframe of the candlesticks used to generate the strategy dataframe
+    :param proposed_trades: dataframe of the proposed trades
+    :return: dictionary of backtest results
+    """
     # Create an ID number for trades in backtest
     trade_id = 0
     # Convert results_dict to a dataframe
@@ -957,7 +2877,13 @@ def calculate_backtest_results(results_dict, contract_size, parameters, raw_stra
 
 
 # Function to calculate a grid search for a symbol
-def create_grid_search(params, optimize_params=False, optimize_take_profit=False, optimize_stop_loss=False):
+def create_grid_search(params, optimize_params=False, optimize_take_profit=False, optimize_stop_loss=False,
+                       parameter_count=None):
+    # A list of full parameter tuples (i.e. explicit settings) is run as it is. Otherwise params is a list of the
+    # candidate values of each parameter
+    if not optimize_params and not optimize_take_profit and not optimize_stop_loss and \
+            is_parameter_tuple_list(params, parameter_count):
+        return list(params)
     # Create a list of all the possible combinations of the parameters with each element a dictionary
     # of the parameters
     if optimize_params and not optimize_take_profit and not optimize_stop_loss:
@@ -1006,14 +2932,31 @@ def create_grid_search(params, optimize_params=False, optimize_take_profit=False
         # Add a new element to the second position in the params list which is a range from 0.5 to 5.0 in increments
         # of 0.1
         params.insert(1, numpy.arange(0.5, 5.0, 0.1))
-    if not optimize_params and not optimize_take_profit and not optimize_stop_loss:
-        return params
     param_combinations = list(itertools.product(*params))
 
     # Return the list of combinations
     return param_combinations
 
 
+# Function to check if a list of parameters holds full parameter tuples
+def is_parameter_tuple_list(params, parameter_count=None):
+    """
+    Function to check if a list of parameters holds full parameter tuples (i.e. [(1, 1, 12, 26, 9, "GTC")]) rather
+    than a list of the candidate values of each parameter (i.e. [[1], [1], [12], [26], [9], ["GTC"]])
+    :param params: list of parameters
+    :param parameter_count: integer of the number of parameters of the strategy. None accepts tuples of any length
+    :return: Boolean
+    """
+    if len(params) == 0:
+        return False
+    for parameters in params:
+        if not isinstance(parameters, tuple):
+            return False
+        if parameter_count is not None and len(parameters) != parameter_count:
+            return False
+    return True
+
+
 # Function to calculate the profit or loss from a trade
 def calculate_profit(row, reason, contract_size):
     # Determine if this occurred due to a stop loss or take profit
@@ -1,42 +1,45 @@
-from backtesting import Strategy, Backtest
-from backtesting.lib import crossover
+from backtesting_py_strategies.signal_strategy import SignalStrategy
+import numpy
 import talib
 
 
-class EMACross(Strategy):
+class EMACross(SignalStrategy):
     n1 = 20
     n2 = 50
     forex = False
 
-    def init(self):
+    def calc_signals(self):
         #print(f"Testing EMA Cross Strategy with Parameters: N1 = {self.n1}, N2 = {self.n2}")
         self.ema_1 = self.I(talib.EMA, self.data.Close, self.n1)
         self.ema_2 = self.I(talib.EMA, self.data.Close, self.n2)
+        return calc_ema_cross_signals(self.data.Close, self.data.Low, self.ema_1, self.ema_2)
 
-    def next(self):
-
-        if crossover(self.ema_1, self.ema_2):
-            # Close any open positions
-            self.position.close()
-            # Create a buy order
-            self.order_create("BUY")
-        elif crossover(self.ema_2, self.ema_1):
-            # Close open positions
-            self.position.close()
-            # Create the order
-            self.order_create("SELL")
-
-    def order_create(self, order_type):
-        if order_type == "BUY":
-            # Create a stop price for the order at 1% above the previous close
-            stop_price = self.data.Low[-1] * 1.01
-            # Create a stop_loss price for the order at 5% below the previous close
-            stop_loss = self.data.Close[-1] * 0.9
-            self.buy(sl=stop_loss, limit=stop_price, volume=0.01)
-        elif order_type == "SELL":
-            # Create a stop price for the order at 1% below the previous close
-            stop_price = self.data.Close[-1] * 0.99
-            # Create a stop_loss price for the order at 5% above the previous close
-            stop_loss = self.data.Low[-1] * 1.1
-            self.sell(sl=stop_loss, limit=stop_price)
 
+# Function to calculate the signals of the EMA Cross strategy
+def calc_ema_cross_signals(close, low, ema_1, ema_2):
+    """
+    Function to calculate the signals of the EMA Cross strategy for every bar at once. A buy is signalled on the bar
+    ema_1 crosses above ema_2, and a sell on the bar it crosses below
+    :param close: array of close prices
+    :param low: array of low prices
+    :param ema_1: array of the fast EMA
+    :param ema_2: array of the slow EMA
+    :return: dictionary of signal arrays for SignalStrategy
+    """
+    close = numpy.asarray(close, dtype=float)
+    low = numpy.asarray(low, dtype=float)
+    ema_1 = numpy.asarray(ema_1, dtype=float)
+    ema_2 = numpy.asarray(ema_2, dtype=float)
+    # Compare each bar with the one before, as backtesting.lib.crossover does. Comparisons with NaN are False
+    cross_up = numpy.zeros(len(close), dtype=bool)
+    cross_down = numpy.zeros(len(close), dtype=bool)
+    cross_up[1:] = (ema_1[:-1] < ema_2[:-1]) & (ema_1[1:] > ema_2[1:])
+    cross_down[1:] = (ema_2[:-1] < ema_1[:-1]) & (ema_2[1:] > ema_1[1:])
+    signals = numpy.where(cross_up, 1, numpy.where(cross_down, -1, 0))
+    return {
+        "signals": signals,
+        # Buy with a limit 1% above the low and a stop loss 10% below the close
+        # Sell with a limit 1% below the close and a stop loss 10% above the low
+        "entry_limits": numpy.where(cross_up, low * 1.01, numpy.where(cross_down, close * 0.99, numpy.nan)),
+        "stop_losses": numpy.where(cross_up, close * 0.9, numpy.where(cross_down, low * 1.1, numpy.nan))
+    }
@@ -0,0 +1,105 @@
+from backtesting import Strategy
+import numpy
+import pandas
+
+
+class SignalStrategy(Strategy):
+    """
+    backtesting.py strategy which trades from signals calculated before the backtest starts. The signals are either
+    passed in as arrays (i.e. Backtest.run(signals=...)) or calculated once in calc_signals by a subclass, so next only
+    looks up the current bar instead of recalculating indicators on every bar.
+    Each array has one value per bar of the data:
+    signals: 1 to buy, -1 to sell, 0 (or NaN) to do nothing
+    entry_stops / entry_limits: stop and limit prices of the entry order. NaN places a market order
+    stop_losses / take_profits: stop loss and take profit prices of the entry order. NaN leaves them unset
+    """
+    signals = None
+    entry_stops = None
+    entry_limits = None
+    stop_losses = None
+    take_profits = None
+    # Close any open position before placing the order of a new signal
+    close_on_signal = True
+
+    def init(self):
+        signals = self.calc_signals()
+        if signals.get("signals") is None:
+            raise ValueError("No signals to trade")
+        # Lists of Python values are quicker to index one bar at a time than numpy arrays
+        self.signal_values = self.prepare_values(signals["signals"], 0)
+        self.entry_stop_values = self.prepare_values(signals.get("entry_stops"), None)
+        self.entry_limit_values = self.prepare_values(signals.get("entry_limits"), None)
+        self.stop_loss_values = self.prepare_values(signals.get("stop_losses"), None)
+        self.take_profit_values = self.prepare_values(signals.get("take_profits"), None)
+
+    def calc_signals(self):
+        """
+        Function to calculate the signals of the strategy. Override to calculate them from the data and parameters
+        :return: dictionary of the signals, entry_stops, entry_limits, stop_losses and take_profits arrays
+        """
+        return {
+            "signals": self.signals,
+            "entry_stops": self.entry_stops,
+            "entry_limits": self.entry_limits,
+            "stop_losses": self.stop_losses,
+            "take_profits": self.take_profits
+        }
+
+    def prepare_values(self, values, missing_value):
+        """
+        Function to convert an array of values to a list with one value per bar, with NaN replaced
+        :param values: array of values, or None
+        :param missing_value: value used in place of NaN, or for every bar if values is None
+        :return: list of values
+        """
+        if values is None:
+            return [missing_value] * len(self.data)
+        values = numpy.asarray(values, dtype=float)
+        if len(values) != len(self.data):
+            raise ValueError(f"Expected {len(self.data)} signal values, got {len(values)}")
+        return numpy.where(numpy.isnan(values), missing_value, values).tolist()
+
+    def next(self):
+        index = len(self.data) - 1
+        signal = self.signal_values[index]
+        if signal == 0:
+            return
+        if self.close_on_signal:
+            self.position.close()
+        order = {}
+        if self.entry_stop_values[index] is not None:
+            order["stop"] = self.entry_stop_values[index]
+        if self.entry_limit_values[index] is not None:
+            order["limit"] = self.entry_limit_values[index]
+        if self.stop_loss_values[index] is not None:
+            order["sl"] = self.stop_loss_values[index]
+        if self.take_profit_values[index] is not None:
+            order["tp"] = self.take_profit_values[index]
+        if signal > 0:
+            self.buy(**order)
+        else:
+            self.sell(**order)
+
+
+# Function to convert a strategy dataframe into signal arrays
+def create_signals_from_strategy_dataframe(data, strategy_dataframe):
+    """
+    Function to convert the trades of a strategy dataframe (i.e. from strategies/macd_crossover_strategy.py) into the
+    signal arrays of SignalStrategy, lined up with the candles being backtested
+    :param data: dataframe of candlesticks formatted for backtesting.py (indexed by human_time)
+    :param strategy_dataframe: dataframe of trades with human_time, order_type, stop_price, stop_loss and take_profit
+    :return: dictionary of signal arrays to pass to Backtest.run
+    """
+    trades = strategy_dataframe.set_index("human_time")
+    trades = trades[~trades.index.duplicated(keep="last")].reindex(data.index)
+    order_type = trades["order_type"].fillna("").astype(str)
+    signals = numpy.where(order_type.str.startswith("BUY"), 1, numpy.where(order_type.str.startswith("SELL"), -1, 0))
+    # Only stop orders wait for an entry price, the others enter at market
+    stop_order = order_type.str.endswith("_STOP").to_numpy()
+    entry_stops = numpy.where(stop_order, pandas.to_numeric(trades["stop_price"], errors="coerce"), numpy.nan)
+    return {
+        "signals": signals,
+        "entry_stops": entry_stops,
+        "stop_losses": pandas.to_numeric(trades["stop_loss"], errors="coerce").to_numpy(),
+        "take_profits": pandas.to_numeric(trades["take_profit"], errors="coerce").to_numpy()
+    }
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Make the repository modules importable when run as a script
+repository_location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repository_location not in sys.path:
+    sys.path.insert(0, repository_location)
+
+import binance_async_lib
+from benchmarks import binance_mock_server
+
+
+# Function to time a coroutine
+async def time_coroutine(coroutine):
+    """
+    Function to time a coroutine
+    :param coroutine: coroutine to be timed
+    :return: tuple of the seconds taken and the result
+    """
+    start_time = time.perf_counter()
+    result = await coroutine
+    return time.perf_counter() - start_time, result
+
+
+# Function to fetch candles one symbol at a time, as the synchronous loop does
+async def fetch_sequentially(client, symbols, timeframe, number_of_candles):
+    """
+    Function to fetch candles for each symbol one after another
+    :param client: dictionary of the client
+    :param symbols: list of symbols
+    :param timeframe: string of the timeframe
+    :param number_of_candles: integer of the number of candles
+    :return: dictionary of symbol to dataframe
+    """
+    candles = {}
+    for symbol in symbols:
+        candles[symbol] = await binance_async_lib.get_candlesticks(client, symbol, timeframe, number_of_candles)
+    return candles
+
+
+# Function to place orders one at a time, as the synchronous loop does
+async def place_sequentially(client, order_list):
+    """
+    Function to place each order one after another
+    :param client: dictionary of the client
+    :param order_list: list of order dictionaries
+    :return: list of outcomes
+    """
+    return [await binance_async_lib.place_order(client, **order) for order in order_list]
+
+
+# Function to run the benchmark
+async def run_benchmark(number_of_symbols, latency, number_of_candles=500):
+    """
+    Function to benchmark sequential against concurrent kline fetches, order placements and cancellations against the
+    mock Binance server
+    :param number_of_symbols: integer of the number of symbols
+    :param latency: float of the seconds the mock server takes to answer each request
+    :param number_of_candles: integer of the number of candles fetched for each symbol
+    :return: list of result dictionaries
+    """
+    state = binance_mock_server.create_mock_state(latency=latency)
+    runner, base_url = await binance_mock_server.start_mock_server(state)
+    client = await binance_async_lib.create_client(
+        api_key=binance_mock_server.mock_api_key,
+        api_secret=binance_mock_server.mock_api_secret,
+        base_url=base_url
+    )
+    symbols = [f"SYM{index}USDT" for index in range(number_of_symbols)]
+    order_list = [
+        {
+            "order_type": "BUY_STOP",
+            "symbol": symbol,
+            "quantity": 1.0,
+            "stop_loss": 90.0,
+            "stop_price": 110.0,
+            "take_profit": 130.0,
+            "comment": "benchmark"
+        }
+        for symbol in symbols
+    ]
+    results = []
+    try:
+        # Kline fetches
+        sequential_time, sequential = await time_coroutine(
+            fetch_sequentially(client, symbols, "M1", number_of_candles))
+        concurrent_time, concurrent = await time_coroutine(
+            binance_async_lib.get_candlesticks_for_symbols(client, symbols, "M1", number_of_candles))
+        # Check both ways return the same candles
+        for symbol in symbols:
+            if not sequential[symbol].equals(concurrent[symbol]):
+                raise ValueError(f"Candles for {symbol} differ between sequential and concurrent fetches")
+        results.append(("klines", sequential_time, concurrent_time))
+        # Order placement. Each order is tested then placed, so two requests per order
+        sequential_time, sequential = await time_coroutine(place_sequentially(client, order_list))
+        concurrent_time, concurrent = await time_coroutine(binance_async_lib.place_orders(client, order_list))
+        if not all(isinstance(outcome, dict) and outcome.get("status") == "NEW" for outcome in sequential + concurrent):
+            raise ValueError("Not every order was placed")
+        results.append(("place_orders", sequential_time, concurrent_time))
+        # Cancel every order placed above
+        cancel_time, outcomes = await time_coroutine(binance_async_lib.cancel_orders_for_symbols(client, symbols))
+        if len(outcomes) != 2 * number_of_symbols or not all(outcomes.values()):
+            raise ValueError("Not every order was cancelled")
+        results.append(("cancel_orders_for_symbols", None, cancel_time))
+    finally:
+        await binance_async_lib.close_client(client)
+        await runner.cleanup()
+    print(f"{number_of_symbols} symbols, {latency * 1000:.0f}ms latency, {state['requests']} requests, "
+          f"max {state['max_concurrent']} concurrent")
+    for name, sequential_time, concurrent_time in results:
+        if sequential_time is None:
+            print(f"{name:<28}{'':>12}{concurrent_time:>11.3f}s")
+        else:
+            print(f"{name:<28}{sequential_time:>11.3f}s{concurrent_time:>11.3f}s"
+                  f"{sequential_time / concurrent_time:>9.1f}x")
+    return [
+        {"name": name, "sequential": sequential_time, "concurrent": concurrent_time}
+        for name, sequential_time, concurrent_time in results
+    ]
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the asynchronous Binance client against a mock server")
+    parser.add_argument("--symbols", type=int, default=50, help="number of symbols")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the mock server takes per request")
+    parser.add_argument("--candles", type=int, default=500, help="number of candles fetched per symbol")
+    arguments = parser.parse_args()
+    asyncio.run(run_benchmark(arguments.symbols, arguments.latency, arguments.candles))
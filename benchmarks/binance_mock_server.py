@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import hashlib
+import hmac
+import itertools
+import time
+
+from aiohttp import web
+
+# API key and secret accepted by the mock server
+mock_api_key = "mock_api_key"
+mock_api_secret = "mock_api_secret"
+# Milliseconds between candles for each Binance interval
+interval_milliseconds = {
+    "1s": 1000, "1m": 60000, "3m": 180000, "5m": 300000, "15m": 900000, "30m": 1800000, "1h": 3600000,
+    "2h": 7200000, "4h": 14400000, "6h": 21600000, "8h": 28800000, "12h": 43200000, "1d": 86400000,
+    "3d": 259200000, "1w": 604800000, "1M": 2592000000
+}
+# Request weight of each endpoint, matching binance_async_lib
+endpoint_weights = {
+    "/api/v3/klines": 2,
+    "/api/v3/order/test": 1,
+    "/api/v3/order": 1,
+    "/api/v3/openOrders": 6
+}
+
+
+# Function to create the state of the mock server
+def create_mock_state(latency=0.05, weight_limit=6000):
+    """
+    Function to create the state of the mock server
+    :param latency: float of the seconds each request takes to answer, standing in for the round trip to Binance
+    :param weight_limit: integer of the request weight allowed each minute before the server answers with HTTP 429
+    :return: dictionary of the mock server state
+    """
+    return {
+        "latency": latency,
+        "weight_limit": weight_limit,
+        "window_start": int(time.time() // 60),
+        "used_weight": 0,
+        "requests": 0,
+        "max_concurrent": 0,
+        "concurrent": 0,
+        "order_ids": itertools.count(1),
+        "orders": {}
+    }
+
+
+# Function to check the signature of a signed request
+def check_signature(request):
+    """
+    Function to check the API key and HMAC SHA256 signature of a signed request
+    :param request: aiohttp request
+    :return: Boolean. True if the signature is valid
+    """
+    if request.headers.get("X-MBX-APIKEY") != mock_api_key:
+        return False
+    query = request.query_string
+    if "&signature=" not in query:
+        return False
+    payload, signature = query.rsplit("&signature=", 1)
+    expected = hmac.new(mock_api_secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+# Function to create the mock server application
+def create_mock_app(state):
+    """
+    Function to create an aiohttp application which answers the Binance Spot endpoints used by binance_async_lib
+    :param state: dictionary of the mock server state
+    :return: aiohttp application
+    """
+    @web.middleware
+    async def binance_middleware(request, handler):
+        # Count the request weight in the current minute, as Binance does
+        window = int(time.time() // 60)
+        if window != state["window_start"]:
+            state["window_start"] = window
+            state["used_weight"] = 0
+        state["used_weight"] += endpoint_weights.get(request.path, 1)
+        state["requests"] += 1
+        headers = {"X-MBX-USED-WEIGHT-1M": str(state["used_weight"])}
+        if state["used_weight"] > state["weight_limit"]:
+            return web.json_response({"code": -1003, "msg": "Too many requests"}, status=429,
+                                     headers={**headers, "Retry-After": "1"})
+        state["concurrent"] += 1
+        state["max_concurrent"] = max(state["max_concurrent"], state["concurrent"])
+        try:
+            # Stand in for the round trip to Binance
+            await asyncio.sleep(state["latency"])
+            response = await handler(request)
+        finally:
+            state["concurrent"] -= 1
+        response.headers.update(headers)
+        return response
+
+    async def klines(request):
+        interval = interval_milliseconds[request.query["interval"]]
+        limit = int(request.query.get("limit", 500))
+        # Candles end at the current interval and are priced from the symbol so each symbol is different
+        last_open = int(time.time() * 1000) // interval * interval
+        base_price = 100 + sum(ord(character) for character in request.query["symbol"]) % 100
+        candles = []
+        for index in range(limit):
+            open_time = last_open - (limit - 1 - index) * interval
+            price = base_price + (index % 20) * 0.1
+            candles.append([open_time, f"{price:.8f}", f"{price + 0.2:.8f}", f"{price - 0.2:.8f}",
+                            f"{price + 0.1:.8f}", "10.00000000", open_time + interval - 1, "1000.00000000", 10,
+                            "5.00000000", "500.00000000", "0"])
+        return web.json_response(candles)
+
+    async def order_test(request):
+        if not check_signature(request):
+            return web.json_response({"code": -1022, "msg": "Signature for this request is not valid."}, status=400)
+        return web.json_response({})
+
+    async def new_order(request):
+        if not check_signature(request):
+            return web.json_response({"code": -1022, "msg": "Signature for this request is not valid."}, status=400)
+        order_id = next(state["order_ids"])
+        order = {
+            "symbol": request.query["symbol"],
+            "orderId": order_id,
+            "side": request.query["side"],
+            "type": request.query["type"],
+            "origQty": request.query["quantity"],
+            "stopPrice": request.query["stopPrice"],
+            "status": "NEW"
+        }
+        state["orders"][order_id] = order
+        return web.json_response(order)
+
+    async def cancel_order(request):
+        if not check_signature(request):
+            return web.json_response({"code": -1022, "msg": "Signature for this request is not valid."}, status=400)
+        order = state["orders"].pop(int(request.query["orderId"]), None)
+        if order is None:
+            return web.json_response({"code": -2011, "msg": "Unknown order sent."}, status=400)
+        return web.json_response({**order, "status": "CANCELED"})
+
+    async def open_orders(request):
+        if not check_signature(request):
+            return web.json_response({"code": -1022, "msg": "Signature for this request is not valid."}, status=400)
+        symbol = request.query.get("symbol")
+        return web.json_response([order for order in state["orders"].values()
+                                  if symbol is None or order["symbol"] == symbol])
+
+    app = web.Application(middlewares=[binance_middleware])
+    app.router.add_get("/api/v3/klines", klines)
+    app.router.add_post("/api/v3/order/test", order_test)
+    app.router.add_post("/api/v3/order", new_order)
+    app.router.add_delete("/api/v3/order", cancel_order)
+    app.router.add_get("/api/v3/openOrders", open_orders)
+    return app
+
+
+# Function to start the mock server
+async def start_mock_server(state, host="127.0.0.1", port=0):
+    """
+    Function to start the mock server in the running event loop
+    :param state: dictionary of the mock server state
+    :param host: string of the host to listen on
+    :param port: integer of the port to listen on. 0 picks a free port
+    :return: tuple of the aiohttp runner (call runner.cleanup() to stop) and the base URL of the server
+    """
+    runner = web.AppRunner(create_mock_app(state))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a mock Binance Spot API server")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each request takes to answer")
+    arguments = parser.parse_args()
+    web.run_app(create_mock_app(create_mock_state(latency=arguments.latency)), host="127.0.0.1", port=arguments.port)
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import aiohttp
+from aiohttp import web
+
+# Make the repository modules importable when run as a script
+repository_location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repository_location not in sys.path:
+    sys.path.insert(0, repository_location)
+
+import binance_stream_lib
+
+
+# Function to create recorded kline messages from candles
+def generate_kline_messages(symbol, interval, candles_dataframe, updates_per_candle=3):
+    """
+    Function to create the kline stream messages Binance would send for a dataframe of candles. Each candle is sent
+    as a number of forming updates followed by a closed update, so recordings can be made without a connection
+    :param symbol: string of the symbol
+    :param interval: string of the Binance interval (i.e. "1m")
+    :param candles_dataframe: dataframe of candlesticks with time (in milliseconds), open, high, low, close and volume
+    :param updates_per_candle: integer of the number of forming updates sent before each candle closes
+    :return: list of combined stream messages
+    """
+    stream = f"{symbol.lower()}@kline_{interval}"
+    interval_milliseconds = binance_stream_lib.interval_milliseconds[interval]
+    messages = []
+    for candle in candles_dataframe.to_dict("records"):
+        for update in range(updates_per_candle + 1):
+            closed = update == updates_per_candle
+            # Forming updates show the close moving towards its final value
+            fraction = (update + 1) / (updates_per_candle + 1)
+            close = candle["open"] + (candle["close"] - candle["open"]) * fraction
+            messages.append({
+                "stream": stream,
+                "data": {
+                    "e": "kline",
+                    "E": int(candle["time"] + interval_milliseconds * fraction) - 1,
+                    "s": symbol.upper(),
+                    "k": {
+                        "t": int(candle["time"]),
+                        "T": int(candle["time"]) + interval_milliseconds - 1,
+                        "s": symbol.upper(),
+                        "i": interval,
+                        "o": f"{candle['open']:.8f}",
+                        "c": f"{close:.8f}",
+                        "h": f"{candle['high']:.8f}",
+                        "l": f"{candle['low']:.8f}",
+                        "v": f"{candle['volume'] * fraction:.8f}",
+                        "n": int(10 * fraction),
+                        "x": closed,
+                        "q": f"{candle['volume'] * fraction * candle['close']:.8f}",
+                        "V": f"{candle['volume'] * fraction / 2:.8f}",
+                        "Q": f"{candle['volume'] * fraction * candle['close'] / 2:.8f}",
+                        "B": "0"
+                    }
+                }
+            })
+    return messages
+
+
+# Function to create recorded trade messages from candles
+def generate_trade_messages(symbol, candles_dataframe, first_trade_id=1):
+    """
+    Function to create the trade stream messages for a dataframe of candles. Each candle is traded at its open, high,
+    low and close in turn, so candles assembled from the trades have the same prices as the originals
+    :param symbol: string of the symbol
+    :param candles_dataframe: dataframe of candlesticks with time (in milliseconds), open, high, low, close and volume
+    :param first_trade_id: integer of the first trade id
+    :return: list of combined stream messages
+    """
+    stream = f"{symbol.lower()}@trade"
+    messages = []
+    trade_id = first_trade_id
+    for candle in candles_dataframe.to_dict("records"):
+        for offset, price in enumerate([candle["open"], candle["high"], candle["low"], candle["close"]]):
+            messages.append({
+                "stream": stream,
+                "data": {
+                    "e": "trade",
+                    "E": int(candle["time"]) + offset * 1000,
+                    "s": symbol.upper(),
+                    "t": trade_id,
+                    "p": f"{price:.8f}",
+                    "q": f"{candle['volume'] / 4:.8f}",
+                    "T": int(candle["time"]) + offset * 1000,
+                    "m": offset % 2 == 0,
+                    "M": True
+                }
+            })
+            trade_id += 1
+    return messages
+
+
+# Function to record messages from a live stream
+async def record_messages(stream_names, file_path, number_of_messages,
+                          stream_url=binance_stream_lib.default_stream_url):
+    """
+    Function to record messages from a Binance combined stream to a file, one JSON message per line
+    :param stream_names: list of stream names (i.e. ["btcusdt@kline_1m", "btcusdt@trade"])
+    :param file_path: string of the file to write
+    :param number_of_messages: integer of the number of messages to record
+    :param stream_url: string of the Binance WebSocket URL
+    :return: None
+    """
+    url = f"{stream_url}/stream?streams={'/'.join(stream_names)}"
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(url) as websocket:
+            with open(file_path, "w") as f:
+                for _ in range(number_of_messages):
+                    message = await websocket.receive_str()
+                    f.write(message + "\n")
+
+
+# Function to load recorded messages
+def load_messages(file_path):
+    """
+    Function to load recorded messages from a file, one JSON message per line
+    :param file_path: string of the file
+    :return: list of messages
+    """
+    with open(file_path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Function to create the stub application
+def create_stub_app(messages, delay=0.0):
+    """
+    Function to create an aiohttp application which replays recorded messages to each client connecting to /stream.
+    Only messages for the streams a client subscribes to are sent, then the connection is closed
+    :param messages: list of combined stream messages
+    :param delay: float of the seconds to wait between messages
+    :return: aiohttp application
+    """
+    async def stream(request):
+        streams = set(request.query.get("streams", "").split("/"))
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        for message in messages:
+            if message["stream"] in streams:
+                await websocket.send_str(json.dumps(message))
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        await websocket.close()
+        return websocket
+
+    app = web.Application()
+    app.router.add_get("/stream", stream)
+    return app
+
+
+# Function to start the stub server
+async def start_stub_server(messages, delay=0.0, host="127.0.0.1", port=0):
+    """
+    Function to start the stub server in the running event loop
+    :param messages: list of combined stream messages
+    :param delay: float of the seconds to wait between messages
+    :param host: string of the host to listen on
+    :param port: integer of the port to listen on. 0 picks a free port
+    :return: tuple of the aiohttp runner (call runner.cleanup() to stop) and the stream URL of the server
+    """
+    runner = web.AppRunner(create_stub_app(messages, delay))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"ws://{host}:{port}"
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded Binance stream messages over a local WebSocket")
+    parser.add_argument("file", help="file of recorded messages, one JSON message per line")
+    parser.add_argument("--port", type=int, default=8766, help="port to listen on")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between messages")
+    arguments = parser.parse_args()
+    web.run_app(create_stub_app(load_messages(arguments.file), arguments.delay), host="127.0.0.1",
+                port=arguments.port)
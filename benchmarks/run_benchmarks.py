@@ -0,0 +1,373 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# Make the repository modules importable when run as a script
+repository_location = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repository_location not in sys.path:
+    sys.path.insert(0, repository_location)
+# Benchmarks never need a MetaTrader 5 terminal, so use the offline simulator unless told otherwise
+os.environ.setdefault("MT5_SIMULATOR", "1")
+
+import numpy
+import pandas
+
+import backtest_lib
+import helper_functions
+import indicator_lib
+from benchmarks import synthetic_data
+from strategies import macd_crossover_strategy
+from strategies import macd_zero_cross_strategy
+
+# Data sizes (in bars) to benchmark at
+default_sizes = [10000, 100000, 1000000]
+# Location to save benchmark results
+default_results_location = os.path.join(repository_location, "benchmarks", "results")
+# Symbol settings used for the synthetic backtests
+benchmark_pip_size = 0.0001
+benchmark_contract_size = 100000
+# Timeframe (in minutes) of the strategy candles used for the backtest benchmarks
+strategy_timeframe_minutes = 60
+# Take profit and stop loss multipliers run as one batch by the multiplier batch benchmark
+benchmark_multipliers = [(take_profit, stop_loss) for take_profit in [0.998, 0.999, 1.0, 1.001, 1.002]
+                         for stop_loss in [0.999, 0.9995, 1.0, 1.0005, 1.001]]
+
+
+# Function to time a function
+def time_function(setup, function, repeats):
+    """
+    Function to time a function over several repeats. Setup is run before every repeat and is not timed, so functions
+    which modify their input always start from the same state.
+    :param setup: function returning a tuple of arguments for the function being timed
+    :param function: function to be timed
+    :param repeats: integer of the number of repeats
+    :return: list of timings in seconds
+    """
+    timings = []
+    for repeat in range(repeats):
+        args = setup()
+        # Collect garbage up front so a collection from a previous run isn't counted against this one
+        gc.collect()
+        start_time = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start_time)
+    return timings
+
+
+# Function to calculate the strategy candles for the backtest benchmarks
+def create_strategy_candles(m1_candles, macd_fast=12, macd_slow=26, macd_signal=9):
+    """
+    Function to create the strategy dataframe for the backtest benchmarks from synthetic M1 candles
+    :param m1_candles: dataframe of M1 candlesticks
+    :param macd_fast: fast EMA size
+    :param macd_slow: slow EMA size
+    :param macd_signal: signal EMA size
+    :return: tuple of the raw strategy candles and the strategy dataframe
+    """
+    raw_strategy_candles = synthetic_data.generate_timeframe_candles(m1_candles, strategy_timeframe_minutes)
+    strategy_candles = macd_crossover_strategy.macd_crossover_strategy(
+        time_to_test="1Year",
+        time_to_cancel=strategy_timeframe_minutes,
+        macd_fast=macd_fast,
+        macd_slow=macd_slow,
+        macd_signal=macd_signal,
+        dataframe=raw_strategy_candles.copy()
+    )
+    return raw_strategy_candles, strategy_candles
+
+
+# Function to run a single backtest over synthetic data
+def run_single_backtest(strategy_candles, raw_strategy_candles, m1_candles):
+    """
+    Function to run a single backtest over synthetic data
+    :param strategy_candles: dataframe of the strategy (i.e. the trades)
+    :param raw_strategy_candles: dataframe of the candlesticks used to generate the strategy dataframe
+    :param m1_candles: dataframe of M1 candlesticks
+    :return: dictionary of the backtest results
+    """
+    return backtest_lib.forex_backtest_run(
+        strategy_dataframe=strategy_candles,
+        raw_strategy_candlesticks=raw_strategy_candles,
+        cash=10000,
+        commission=0,
+        symbol="EURUSD",
+        historic_data=m1_candles,
+        pip_size=benchmark_pip_size,
+        contract_size=benchmark_contract_size,
+        risk_percent=0.01
+    )
+
+
+# Function to run a small grid sweep over synthetic data
+def run_grid_sweep(m1_candles):
+    """
+    Function to run a small grid sweep over synthetic data. Signal generation and the backtest are both included,
+    as both are repeated for every grid point in a real sweep. Runs in a single process so the timing is stable.
+    :param m1_candles: dataframe of M1 candlesticks
+    :return: list of profits
+    """
+    profits = []
+    for macd_fast in [8, 12]:
+        for macd_slow in [26, 30]:
+            raw_strategy_candles, strategy_candles = create_strategy_candles(
+                m1_candles=m1_candles,
+                macd_fast=macd_fast,
+                macd_slow=macd_slow
+            )
+            if strategy_candles is False:
+                continue
+            result = run_single_backtest(strategy_candles, raw_strategy_candles, m1_candles)
+            profits.append(result["profit"])
+    return profits
+
+
+# Function to run a batch of take profit and stop loss multipliers over synthetic data
+def run_multiplier_batch(strategy_candles, raw_strategy_candles, m1_candles):
+    """
+    Function to run every benchmark multiplier setting as one batch over synthetic data
+    :param strategy_candles: dataframe of the strategy (i.e. the trades), with multipliers of 1
+    :param raw_strategy_candles: dataframe of the candlesticks used to generate the strategy dataframe
+    :param m1_candles: dataframe of M1 candlesticks
+    :return: list of profits
+    """
+    results = backtest_lib.forex_backtest_run_batch(
+        strategy_dataframe=strategy_candles,
+        raw_strategy_candlesticks=raw_strategy_candles,
+        cash=10000,
+        commission=0,
+        symbol="EURUSD",
+        historic_data=m1_candles,
+        pip_size=benchmark_pip_size,
+        contract_size=benchmark_contract_size,
+        risk_percent=0.01,
+        multipliers=benchmark_multipliers
+    )
+    return [result["profit"] for result in results]
+
+
+# Function to create the list of benchmark cases
+def create_benchmark_cases():
+    """
+    Function to create the list of benchmark cases. Each case has a setup function which receives the synthetic M1
+    candles and returns the arguments for the timed function. max_size limits cases which are too slow to be useful at
+    the largest sizes.
+    :return: list of benchmark case dictionaries
+    """
+    return [
+        {
+            "name": "indicator_calc_ema",
+            "setup": lambda candles: (candles.copy(), 50),
+            "function": lambda dataframe, size: indicator_lib.calc_ema(dataframe, size),
+            "max_size": 10000
+        },
+        {
+            "name": "indicator_calc_ema_ta",
+            "setup": lambda candles: (candles.copy(), 50),
+            "function": lambda dataframe, size: indicator_lib.calc_ema_ta(dataframe, size),
+            "max_size": None
+        },
+        {
+            "name": "indicator_calc_macd",
+            "setup": lambda candles: (candles.copy(),),
+            "function": lambda dataframe: indicator_lib.calc_macd(dataframe),
+            "max_size": None
+        },
+        {
+            "name": "indicator_calc_rsi",
+            "setup": lambda candles: (candles.copy(),),
+            "function": lambda dataframe: indicator_lib.calc_rsi(dataframe),
+            "max_size": None
+        },
+        {
+            "name": "indicator_calc_crossover",
+            "setup": lambda candles: (indicator_lib.calc_macd(candles.copy()),),
+            "function": lambda dataframe: indicator_lib.calc_crossover(dataframe, "macd", "macd_signal"),
+            "max_size": None
+        },
+        {
+            "name": "indicator_calc_zero_cross",
+            "setup": lambda candles: (indicator_lib.calc_macd(candles.copy()),),
+            "function": lambda dataframe: indicator_lib.calc_zero_cross(dataframe, "macd"),
+            "max_size": None
+        },
+        {
+            "name": "signal_macd_crossover",
+            "setup": lambda candles: (macd_crossover_strategy.calc_indicators(candles.copy()),),
+            "function": lambda dataframe: macd_crossover_strategy.calc_signal(dataframe),
+            "max_size": 100000
+        },
+        {
+            "name": "signal_macd_zero_cross",
+            "setup": lambda candles: (macd_zero_cross_strategy.calc_indicators(candles.copy()).reset_index(drop=True),),
+            "function": lambda dataframe: macd_zero_cross_strategy.calc_signal(dataframe),
+            "max_size": 100000
+        },
+        {
+            "name": "sizing_calc_lot_sizes",
+            "setup": lambda candles: (candles["close"].to_numpy(), candles["low"].to_numpy() - benchmark_pip_size),
+            "function": lambda stop_price, stop_loss: helper_functions.calc_lot_sizes(
+                balance=10000,
+                risk_amount=0.01,
+                stop_loss=stop_loss,
+                stop_price=stop_price,
+                symbol="EURUSD",
+                pip_size=benchmark_pip_size,
+                base_currency="EUR"
+            ),
+            "max_size": None
+        },
+        {
+            "name": "backtest_single",
+            "setup": lambda candles: create_strategy_candles(candles)[::-1] + (candles,),
+            "function": run_single_backtest,
+            "max_size": 100000
+        },
+        {
+            "name": "backtest_multiplier_batch",
+            "setup": lambda candles: create_strategy_candles(candles)[::-1] + (candles,),
+            "function": run_multiplier_batch,
+            "max_size": 100000
+        },
+        {
+            "name": "backtest_grid_sweep",
+            "setup": lambda candles: (candles,),
+            "function": run_grid_sweep,
+            "max_size": 100000
+        }
+    ]
+
+
+# Function to retrieve the current git commit
+def get_git_commit():
+    """
+    Function to retrieve the current git commit, so results can be compared between commits
+    :return: string of the commit hash, or "unknown" if git isn't available
+    """
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=repository_location,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        return output.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+# Function to run the benchmarks
+def run_benchmarks(sizes, repeats, case_names=None, ignore_size_limits=False, seed=42):
+    """
+    Function to run each benchmark case at each data size
+    :param sizes: list of integer data sizes in bars
+    :param repeats: integer of the number of repeats for each case
+    :param case_names: list of case names to run. Defaults to all cases
+    :param ignore_size_limits: boolean. When True, cases are run at every size regardless of their max_size
+    :param seed: integer seed for the synthetic data
+    :return: list of result dictionaries
+    """
+    results = []
+    cases = create_benchmark_cases()
+    if case_names:
+        cases = [case for case in cases if case["name"] in case_names]
+    for size in sizes:
+        print(f"Generating {size} synthetic M1 candles")
+        candles = synthetic_data.generate_m1_candles(number_of_candles=size, seed=seed)
+        for case in cases:
+            if case["max_size"] is not None and size > case["max_size"] and not ignore_size_limits:
+                print(f"Skipping {case['name']} at {size} bars (max_size {case['max_size']})")
+                continue
+            timings = time_function(
+                setup=lambda: case["setup"](candles),
+                function=case["function"],
+                repeats=repeats
+            )
+            result = {
+                "name": case["name"],
+                "size": size,
+                "repeats": repeats,
+                "min": min(timings),
+                "mean": sum(timings) / len(timings),
+                "timings": timings
+            }
+            print(f"{case['name']:<28}{size:>10}{result['min']:>12.4f}s (min){result['mean']:>12.4f}s (mean)")
+            results.append(result)
+    return results
+
+
+# Function to save the benchmark results
+def save_results(results, results_location=default_results_location, seed=42):
+    """
+    Function to save benchmark results to a JSON file
+    :param results: list of result dictionaries
+    :param results_location: string of the folder to save results in
+    :param seed: integer seed used for the synthetic data
+    :return: string of the file path
+    """
+    commit = get_git_commit()
+    output = {
+        "commit": commit,
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "seed": seed,
+        "results": results
+    }
+    os.makedirs(results_location, exist_ok=True)
+    file_path = os.path.join(results_location, f"benchmark_{commit}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(file_path, "w") as f:
+        json.dump(output, f, indent=4)
+    return file_path
+
+
+# Function to compare benchmark results against a previous run
+def compare_results(results, previous_file_path):
+    """
+    Function to print a comparison of benchmark results against a previous run
+    :param results: list of result dictionaries
+    :param previous_file_path: string of the previous results JSON file
+    :return: None
+    """
+    with open(previous_file_path, "r") as f:
+        previous = json.load(f)
+    previous_results = {(result["name"], result["size"]): result for result in previous["results"]}
+    print(f"Comparison against commit {previous['commit']} (ratio > 1 is faster)")
+    for result in results:
+        previous_result = previous_results.get((result["name"], result["size"]))
+        if previous_result is None:
+            continue
+        ratio = previous_result["min"] / result["min"] if result["min"] > 0 else float("inf")
+        print(f"{result['name']:<28}{result['size']:>10}{previous_result['min']:>12.4f}s{result['min']:>12.4f}s"
+              f"{ratio:>10.2f}x")
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite over synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes, help="data sizes in bars")
+    parser.add_argument("--repeats", type=int, default=3, help="number of repeats for each case")
+    parser.add_argument("--cases", nargs="+", default=None, help="names of the cases to run")
+    parser.add_argument("--ignore-size-limits", action="store_true", help="run slow cases at every size")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the synthetic data")
+    parser.add_argument("--compare", default=None, help="previous results file to compare against")
+    arguments = parser.parse_args()
+    benchmark_results = run_benchmarks(
+        sizes=arguments.sizes,
+        repeats=arguments.repeats,
+        case_names=arguments.cases,
+        ignore_size_limits=arguments.ignore_size_limits,
+        seed=arguments.seed
+    )
+    results_file = save_results(benchmark_results, seed=arguments.seed)
+    print(f"Results saved to {results_file}")
+    if arguments.compare:
+        compare_results(benchmark_results, arguments.compare)
@@ -0,0 +1,91 @@
+import datetime
+
+import numpy
+import pandas
+
+
+# Function to generate synthetic M1 candlesticks
+def generate_m1_candles(number_of_candles, start_price=1.10000, volatility=0.0002, gap_probability=0.0005,
+                        gap_size=0.002, skip_weekends=True, seed=42, start_time=datetime.datetime(2020, 1, 6)):
+    """
+    Function to generate deterministic synthetic M1 candlesticks using a random walk. The output uses the same columns
+    as mt5_lib.query_historic_data_by_time so it can be passed straight into the strategies and backtest engine.
+    :param number_of_candles: integer of the number of candles to generate
+    :param start_price: float of the first open price
+    :param volatility: float of the standard deviation of the per-minute log return
+    :param gap_probability: float of the probability that a candle opens away from the previous close
+    :param gap_size: float of the standard deviation of a price gap, expressed as a log return
+    :param skip_weekends: boolean. When True, no candles are generated on a Saturday or Sunday, like FOREX markets
+    :param seed: integer seed for the random number generator. The same seed always produces the same candles
+    :param start_time: datetime of the first candle
+    :return: dataframe of candlesticks
+    """
+    # Use a dedicated generator so the output doesn't depend on any global random state
+    generator = numpy.random.default_rng(seed)
+    # Generate the candle times. Generate extra minutes to allow for the weekends being removed
+    minutes_needed = number_of_candles * 2 if skip_weekends else number_of_candles
+    start_seconds = int(pandas.Timestamp(start_time).timestamp())
+    times = start_seconds + numpy.arange(minutes_needed, dtype=numpy.int64) * 60
+    if skip_weekends:
+        # 1970-01-01 was a Thursday, so (days + 3) % 7 gives 0 for Monday through to 6 for Sunday
+        weekday = (times // 86400 + 3) % 7
+        times = times[weekday < 5]
+    times = times[:number_of_candles]
+    # Generate the close prices as a random walk
+    returns = generator.normal(0, volatility, number_of_candles)
+    # Add in price gaps
+    gaps = generator.random(number_of_candles) < gap_probability
+    gap_returns = numpy.where(gaps, generator.normal(0, gap_size, number_of_candles), 0.0)
+    # Each candle opens at the previous close, moved by any gap
+    log_close = numpy.log(start_price) + numpy.cumsum(returns + gap_returns)
+    log_open = numpy.concatenate(([numpy.log(start_price)], log_close[:-1])) + gap_returns
+    open_prices = numpy.exp(log_open)
+    close_prices = numpy.exp(log_close)
+    # The high and low extend past the open and close by a random amount
+    wick_size = numpy.abs(generator.normal(0, volatility, (2, number_of_candles))) * close_prices
+    high_prices = numpy.maximum(open_prices, close_prices) + wick_size[0]
+    low_prices = numpy.minimum(open_prices, close_prices) - wick_size[1]
+    # Construct the dataframe
+    dataframe = pandas.DataFrame({
+        "time": times,
+        "open": numpy.round(open_prices, 5),
+        "high": numpy.round(high_prices, 5),
+        "low": numpy.round(low_prices, 5),
+        "close": numpy.round(close_prices, 5),
+        "tick_volume": generator.integers(1, 500, number_of_candles),
+        "spread": generator.integers(0, 20, number_of_candles),
+        "real_volume": numpy.zeros(number_of_candles, dtype=numpy.int64)
+    })
+    # Rounding can move the open or close outside of the high and low, so clip them back in
+    dataframe["high"] = dataframe[["open", "high", "close"]].max(axis=1)
+    dataframe["low"] = dataframe[["open", "low", "close"]].min(axis=1)
+    # Add a 'Human Time' column
+    dataframe["human_time"] = pandas.to_datetime(dataframe["time"], unit="s")
+    return dataframe
+
+
+# Function to aggregate synthetic M1 candlesticks into a higher timeframe
+def generate_timeframe_candles(m1_candles, minutes):
+    """
+    Function to aggregate M1 candlesticks into a higher timeframe, so that the strategy candles always agree with the
+    M1 candles used to simulate the trades
+    :param m1_candles: dataframe of M1 candlesticks
+    :param minutes: integer of the number of minutes in each higher timeframe candle
+    :return: dataframe of candlesticks
+    """
+    # Group the candles by the start of the higher timeframe candle they belong to
+    bucket = m1_candles["time"] // (minutes * 60) * (minutes * 60)
+    grouped = m1_candles.groupby(bucket, sort=True)
+    dataframe = pandas.DataFrame({
+        "time": grouped["time"].first().index.values,
+        "open": grouped["open"].first().values,
+        "high": grouped["high"].max().values,
+        "low": grouped["low"].min().values,
+        "close": grouped["close"].last().values,
+        "tick_volume": grouped["tick_volume"].sum().values,
+        "spread": grouped["spread"].min().values,
+        "real_volume": grouped["real_volume"].sum().values
+    })
+    # Add a 'Human Time' column
+    dataframe["human_time"] = pandas.to_datetime(dataframe["time"], unit="s")
+    return dataframe
@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import hmac
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+import yarl
+
+import binance_lib
+
+# Base URL of the Binance Spot API
+default_base_url = "https://api.binance.com"
+# Binance allows a total request weight of 6000 per minute for each IP address
+default_weight_limit = 6000
+# Length of the Binance request weight window in seconds
+weight_interval_seconds = 60
+# Request weight of each endpoint
+# Documentation: https://github.com/binance/binance-spot-api-docs/blob/master/rest-api.md
+endpoint_weights = {
+    "/api/v3/klines": 2,
+    "/api/v3/order/test": 1,
+    "/api/v3/order": 1,
+    "/api/v3/openOrders": 6
+}
+# Number of times a request is retried after Binance asks for it to back off (HTTP 429)
+max_retries = 3
+# Milliseconds a signed request is valid for after its timestamp
+receive_window = 5000
+
+
+# Function to create a request weight rate limiter
+def create_rate_limiter(weight_limit=default_weight_limit, interval_seconds=weight_interval_seconds):
+    """
+    Function to create a rate limiter which keeps the request weight sent to Binance under its limit. Binance counts
+    the weight used in fixed windows (i.e. each minute), so the limiter does the same and waits for the next window
+    when a request would go over the limit. Must be created inside a running event loop.
+    :param weight_limit: integer of the maximum request weight in each window
+    :param interval_seconds: integer of the length of a window in seconds
+    :return: dictionary of the rate limiter
+    """
+    return {
+        "lock": asyncio.Lock(),
+        "weight_limit": weight_limit,
+        "interval_seconds": interval_seconds,
+        "window_start": time.time() // interval_seconds * interval_seconds,
+        "used_weight": 0,
+        "waits": 0
+    }
+
+
+# Function to reserve request weight with a rate limiter
+async def acquire_weight(rate_limiter, weight):
+    """
+    Function to reserve the weight of a request, waiting for the next window if the current one is full
+    :param rate_limiter: dictionary of the rate limiter
+    :param weight: integer of the request weight
+    :return: None
+    """
+    async with rate_limiter["lock"]:
+        while True:
+            now = time.time()
+            interval_seconds = rate_limiter["interval_seconds"]
+            # Start a new window if the current one has ended
+            if now >= rate_limiter["window_start"] + interval_seconds:
+                rate_limiter["window_start"] = now // interval_seconds * interval_seconds
+                rate_limiter["used_weight"] = 0
+            if rate_limiter["used_weight"] + weight <= rate_limiter["weight_limit"]:
+                rate_limiter["used_weight"] += weight
+                return
+            # Wait for the next window. Holding the lock keeps every other request waiting too
+            rate_limiter["waits"] += 1
+            await asyncio.sleep(rate_limiter["window_start"] + interval_seconds - now)
+
+
+# Function to update a rate limiter from the weight Binance reports
+def update_used_weight(rate_limiter, headers):
+    """
+    Function to update a rate limiter with the weight Binance reports as used. Binance counts every request from the
+    IP address, so its count can be higher than the limiter's own (i.e. another program is using the same IP address)
+    :param rate_limiter: dictionary of the rate limiter
+    :param headers: response headers
+    :return: None
+    """
+    used_weight = headers.get("X-MBX-USED-WEIGHT-1M")
+    if used_weight is not None:
+        rate_limiter["used_weight"] = max(rate_limiter["used_weight"], int(used_weight))
+
+
+# Function to create an asynchronous Binance client
+async def create_client(api_key=None, api_secret=None, base_url=default_base_url, weight_limit=default_weight_limit,
+                        connection_limit=100):
+    """
+    Function to create an asynchronous Binance client. Every request made with the client shares one HTTP session
+    (and its pool of connections) and one rate limiter. Close the client with close_client when finished.
+    :param api_key: string of the API key. Only needed for orders
+    :param api_secret: string of the API secret. Only needed for orders
+    :param base_url: string of the Binance API URL
+    :param weight_limit: integer of the request weight allowed each minute
+    :param connection_limit: integer of the maximum number of open connections
+    :return: dictionary of the client
+    """
+    return {
+        "session": aiohttp.ClientSession(
+            base_url=base_url,
+            connector=aiohttp.TCPConnector(limit=connection_limit)
+        ),
+        "api_key": api_key,
+        "api_secret": api_secret,
+        "rate_limiter": create_rate_limiter(weight_limit=weight_limit)
+    }
+
+
+# Function to create an asynchronous Binance client from the project settings
+async def create_client_from_settings(project_settings, base_url=default_base_url):
+    """
+    Function to create an asynchronous Binance client using the API keys in the project settings
+    :param project_settings: JSON object with project_settings
+    :param base_url: string of the Binance API URL
+    :return: dictionary of the client
+    """
+    api_key, api_secret = binance_lib.get_api_keys(project_settings=project_settings)
+    return await create_client(api_key=api_key, api_secret=api_secret, base_url=base_url)
+
+
+# Function to close an asynchronous Binance client
+async def close_client(client):
+    """
+    Function to close the HTTP session of an asynchronous Binance client
+    :param client: dictionary of the client
+    :return: None
+    """
+    await client["session"].close()
+
+
+# Function to sign the parameters of a request
+def sign_parameters(parameters, api_secret):
+    """
+    Function to add a timestamp and HMAC SHA256 signature to the parameters of a request, as Binance requires for
+    trading endpoints
+    :param parameters: dictionary of the request parameters
+    :param api_secret: string of the API secret
+    :return: string of the signed query
+    """
+    parameters = dict(parameters)
+    parameters["timestamp"] = int(time.time() * 1000)
+    parameters["recvWindow"] = receive_window
+    query = urlencode(parameters)
+    signature = hmac.new(api_secret.encode("utf-8"), query.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{query}&signature={signature}"
+
+
+# Function to send a request to Binance
+async def send_request(client, method, path, parameters=None, signed=False):
+    """
+    Function to send a request to Binance through the shared session and rate limiter
+    :param client: dictionary of the client
+    :param method: string of the HTTP method
+    :param path: string of the endpoint path
+    :param parameters: dictionary of the request parameters
+    :param signed: Boolean. When True, the request is signed with the API secret
+    :return: decoded JSON response
+    """
+    if parameters is None:
+        parameters = {}
+    headers = {}
+    if signed:
+        if client["api_key"] is None or client["api_secret"] is None:
+            raise ValueError("API keys are required for this request")
+        headers["X-MBX-APIKEY"] = client["api_key"]
+    for attempt in range(max_retries + 1):
+        await acquire_weight(client["rate_limiter"], endpoint_weights.get(path, 1))
+        # Sign on each attempt so the timestamp is current
+        query = sign_parameters(parameters, client["api_secret"]) if signed else urlencode(parameters)
+        # Mark the query as encoded so it is sent exactly as it was signed
+        url = yarl.URL(f"{path}?{query}", encoded=True)
+        async with client["session"].request(method, url, headers=headers) as response:
+            update_used_weight(client["rate_limiter"], response.headers)
+            data = await response.json(content_type=None)
+            # Back off when Binance asks, then try again
+            if response.status == 429 and attempt < max_retries:
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            if response.status >= 400:
+                raise ValueError(f"Binance error {response.status}: {data}")
+            return data
+
+
+# Function to get the candles from Binance
+async def get_candlesticks(client, symbol, timeframe, number_of_candles):
+    """
+    Function to retrieve candlestick data from Binance. Asynchronous version of binance_lib.get_candlesticks
+    :param client: dictionary of the client
+    :param symbol: string of the symbol to retrieve
+    :param timeframe: string of the timeframe of the candles to be retrieved
+    :param number_of_candles: integer of the number of candles to retrieve
+    :return: dataframe with the candlesticks
+    """
+    # Convert the timeframe into a Binance friendly format
+    timeframe = binance_lib.set_query_timeframe(timeframe=timeframe)
+    # Make sure that no more than 1000 candles are being retrieved as this is a hard limit from Binance
+    if number_of_candles > 1000:
+        raise ValueError("Number of candles cannot be greater than 1000")
+    # Retrieve the candles
+    candles = await send_request(client, "GET", "/api/v3/klines", {
+        "symbol": symbol,
+        "interval": timeframe,
+        "limit": number_of_candles
+    })
+    # Format the candles into a dataframe
+    return binance_lib.format_candlesticks(candles)
+
+
+# Function to get the candles for many symbols from Binance
+async def get_candlesticks_for_symbols(client, symbols, timeframe, number_of_candles):
+    """
+    Function to retrieve candlestick data for a list of symbols concurrently
+    :param client: dictionary of the client
+    :param symbols: list of symbols to retrieve
+    :param timeframe: string of the timeframe of the candles to be retrieved
+    :param number_of_candles: integer of the number of candles to retrieve
+    :return: dictionary of symbol to dataframe. A symbol which failed has the exception instead
+    """
+    candles = await asyncio.gather(
+        *[get_candlesticks(client, symbol, timeframe, number_of_candles) for symbol in symbols],
+        return_exceptions=True
+    )
+    return dict(zip(symbols, candles))
+
+
+# Function to make a trade with Binance
+async def place_order(client, order_type, symbol, quantity, stop_loss, stop_price, take_profit, comment, direct=False):
+    """
+    Function to place an order on Binance. Checks to see if the order is valid first. Asynchronous version of
+    binance_lib.place_order
+    :param client: dictionary of the client
+    :param order_type: string of the order type. Options are "BUY_STOP" or "SELL_STOP"
+    :param symbol: string of the symbol to be traded. Must be Binance compatible.
+    :param quantity: Float of the quantity to be traded.
+    :param stop_loss: Float of the stop loss
+    :param stop_price: Float of the stop price
+    :param take_profit: Float of the take profit
+    :param comment: string of the comment for the trade
+    :param direct: Boolean as to if the order check should be bypassed. Default is False.
+    :return: Outcome
+    """
+    # Make sure that all the inputs are correct and set up the parameters dictionary
+    parameters = binance_lib.create_order_parameters(
+        order_type=order_type,
+        symbol=symbol,
+        quantity=quantity,
+        stop_loss=stop_loss,
+        stop_price=stop_price,
+        take_profit=take_profit,
+        comment=comment,
+        direct=direct
+    )
+    # Test the order first, unless told not to
+    if not direct:
+        try:
+            response = await send_request(client, "POST", "/api/v3/order/test", parameters, signed=True)
+        except Exception as e:
+            print(f"Order for {symbol} is not valid. {e}")
+            return e
+        if response != {}:
+            return response
+    # Place the order
+    try:
+        response = await send_request(client, "POST", "/api/v3/order", parameters, signed=True)
+    except Exception as e:
+        print(f"Order for {symbol} failed. {e}")
+        response = e
+    return response
+
+
+# Function to place a batch of orders on Binance
+async def place_orders(client, order_list, direct=False):
+    """
+    Function to place a list of orders on Binance concurrently
+    :param client: dictionary of the client
+    :param order_list: list of dictionaries, each with the order_type, symbol, quantity, stop_loss, stop_price,
+    take_profit and comment of an order
+    :param direct: Boolean as to if the order check should be bypassed. Default is False.
+    :return: list of outcomes, in the same order as order_list. An order with invalid inputs has the exception
+    """
+    return await asyncio.gather(
+        *[place_order(client, direct=direct, **order) for order in order_list],
+        return_exceptions=True
+    )
+
+
+# Function to get a list of current orders on Binance
+async def get_open_orders(client, symbol):
+    """
+    Function to get a list of current orders on Binance. Asynchronous version of binance_lib.get_open_orders
+    :param client: dictionary of the client
+    :param symbol: string of the symbol to get orders on
+    :return: list of the order(s)
+    """
+    return await send_request(client, "GET", "/api/v3/openOrders", {"symbol": symbol}, signed=True)
+
+
+# Function to cancel an order on Binance
+async def cancel_order(client, symbol, order_id):
+    """
+    Function to cancel an order on Binance. Asynchronous version of binance_lib.cancel_order
+    :param client: dictionary of the client
+    :param symbol: string of the symbol to cancel the order on
+    :param order_id: string of the order id to cancel the order on
+    :return: True if the order was cancelled, False if not
+    """
+    try:
+        await send_request(client, "DELETE", "/api/v3/order", {"symbol": symbol, "orderId": order_id}, signed=True)
+        return True
+    except Exception as e:
+        print(e)
+        return False
+
+
+# Function to cancel every open order for a list of symbols on Binance
+async def cancel_orders_for_symbols(client, symbols):
+    """
+    Function to cancel every open order for a list of symbols. The open orders of every symbol are retrieved
+    concurrently, then every order is cancelled concurrently
+    :param client: dictionary of the client
+    :param symbols: list of symbols
+    :return: dictionary of order id to True if cancelled or False if not
+    """
+    open_orders = await asyncio.gather(*[get_open_orders(client, symbol) for symbol in symbols])
+    orders = [order for symbol_orders in open_orders for order in symbol_orders]
+    outcomes = await asyncio.gather(*[cancel_order(client, order["symbol"], order["orderId"]) for order in orders])
+    return {order["orderId"]: outcome for order, outcome in zip(orders, outcomes)}
+
+
+# Function to retrieve candles for many symbols from a synchronous program
+def fetch_candlesticks_for_symbols(symbols, timeframe, number_of_candles, base_url=default_base_url):
+    """
+    Function to retrieve candlestick data for a list of symbols concurrently from ordinary (synchronous) code
+    :param symbols: list of symbols to retrieve
+    :param timeframe: string of the timeframe of the candles to be retrieved
+    :param number_of_candles: integer of the number of candles to retrieve
+    :param base_url: string of the Binance API URL
+    :return: dictionary of symbol to dataframe
+    """
+    async def fetch():
+        client = await create_client(base_url=base_url)
+        try:
+            return await get_candlesticks_for_symbols(client, symbols, timeframe, number_of_candles)
+        finally:
+            await close_client(client)
+    return asyncio.run(fetch())
@@ -71,9 +71,22 @@ def get_candlesticks(symbol, timeframe, number_of_candles):
         interval=timeframe,
         limit=number_of_candles
     )
+    # Step 4: Format the candles into a dataframe
+    candles_dataframe = format_candlesticks(candles)
+    # Step 5: Return the dataframe
+    return candles_dataframe
+
+
+# Function to format candles from Binance into a dataframe
+def format_candlesticks(candles):
+    """
+    Function to convert the candles (klines) returned by Binance into a dataframe with labelled columns
+    :param candles: list of candles from Binance
+    :return: dataframe with the candlesticks
+    """
     # Convert to a dataframe
     candles_dataframe = pandas.DataFrame(candles)
-    # Step 4: Format the columns of the Dataframe.
+    # Format the columns of the Dataframe.
     # Documentation: https://github.com/binance/binance-spot-api-docs/blob/master/rest-api.md#klinecandlestick-data
     candles_dataframe.columns = ["time", "open", "high", "low", "close", "volume", "close Time", "Quote Asset Volume",
                                 "Number of Trades", "Taker Buy Base Asset Volume", "Taker Buy Quote Asset Volume",
@@ -82,7 +95,6 @@ def get_candlesticks(symbol, timeframe, number_of_candles):
     candles_dataframe['human_time'] = pandas.to_datetime(candles_dataframe['time'], unit='ms')
     # Make sure that the "open", "high", "low", "close", "volume" columns are floats
     candles_dataframe[["open", "high", "low", "close", "volume"]] = candles_dataframe[["open", "high", "low", "close", "volume"]].astype(float)
-    # Step 5: Return the dataframe
     return candles_dataframe
 
 
@@ -156,41 +168,21 @@ def place_order(order_type, symbol, quantity, stop_loss, stop_price, take_profit
     # 2. Place the order
     # 3. Return the outcome
 
-    # Make sure that all the inputs are correct
-    if order_type not in ["BUY_STOP", "SELL_STOP"]:
-        raise ValueError("Incorrect order type provided. Must be 'BUY_STOP' or 'SELL_STOP'")
-    if not isinstance(symbol, str):
-        raise ValueError("Incorrect symbol provided. Must be a string")
-    if not isinstance(quantity, float):
-        float(quantity)
-    if not isinstance(stop_loss, float):
-        float(stop_loss)
-    if not isinstance(stop_price, float):
-        float(stop_price)
-    if not isinstance(take_profit, float):
-        float(take_profit)
-    if not isinstance(comment, str):
-        raise ValueError("Incorrect comment provided. Must be a string")
-    if not isinstance(direct, bool):
-        raise ValueError("Incorrect direct provided. Must be a boolean")
+    # Make sure that all the inputs are correct and set up the parameters dictionary
+    parameters = create_order_parameters(
+        order_type=order_type,
+        symbol=symbol,
+        quantity=quantity,
+        stop_loss=stop_loss,
+        stop_price=stop_price,
+        take_profit=take_profit,
+        comment=comment,
+        direct=direct
+    )
     # Get Keys for the API
     api_key, secret_key = get_api_keys(project_settings=project_settings)
     # Set up the API Client
     client = Client(api_key, secret_key)
-    # Set up the parameters dictionary
-    parameters = {
-        "symbol": symbol,
-        "type": "STOP_LOSS_LIMIT",
-        "timeInForce": "GTC",
-        "quantity": quantity,
-        "stopPrice": stop_price,
-        "price": stop_price
-    }
-    # Apply the correct side based upon the order type
-    if order_type == "BUY_STOP":
-        parameters["side"] = "BUY"
-    elif order_type == "SELL_STOP":
-        parameters["side"] = "SELL"
 
     if direct:
         try:
@@ -230,6 +222,54 @@ def place_order(order_type, symbol, quantity, stop_loss, stop_price, take_profit
     return response
 
 
+# Function to create the parameters for an order on Binance
+def create_order_parameters(order_type, symbol, quantity, stop_loss, stop_price, take_profit, comment, direct=False):
+    """
+    Function to check the inputs of an order and create the parameters Binance expects for it
+    :param order_type: string of the order type. Options are "BUY_STOP" or "SELL_STOP"
+    :param symbol: string of the symbol to be traded. Must be Binance compatible.
+    :param quantity: Float of the quantity to be traded.
+    :param stop_loss: Float of the stop loss
+    :param stop_price: Float of the stop price
+    :param take_profit: Float of the take profit
+    :param comment: string of the comment for the trade
+    :param direct: Boolean as to if the order check should be bypassed. Default is False.
+    :return: dictionary of the order parameters
+    """
+    # Make sure that all the inputs are correct
+    if order_type not in ["BUY_STOP", "SELL_STOP"]:
+        raise ValueError("Incorrect order type provided. Must be 'BUY_STOP' or 'SELL_STOP'")
+    if not isinstance(symbol, str):
+        raise ValueError("Incorrect symbol provided. Must be a string")
+    if not isinstance(quantity, float):
+        float(quantity)
+    if not isinstance(stop_loss, float):
+        float(stop_loss)
+    if not isinstance(stop_price, float):
+        float(stop_price)
+    if not isinstance(take_profit, float):
+        float(take_profit)
+    if not isinstance(comment, str):
+        raise ValueError("Incorrect comment provided. Must be a string")
+    if not isinstance(direct, bool):
+        raise ValueError("Incorrect direct provided. Must be a boolean")
+    # Set up the parameters dictionary
+    parameters = {
+        "symbol": symbol,
+        "type": "STOP_LOSS_LIMIT",
+        "timeInForce": "GTC",
+        "quantity": quantity,
+        "stopPrice": stop_price,
+        "price": stop_price
+    }
+    # Apply the correct side based upon the order type
+    if order_type == "BUY_STOP":
+        parameters["side"] = "BUY"
+    elif order_type == "SELL_STOP":
+        parameters["side"] = "SELL"
+    return parameters
+
+
 # Function to get a list of current orders on Binance
 def get_open_orders(project_settings, symbol):
     """
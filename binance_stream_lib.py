@@ -0,0 +1,279 @@
+import asyncio
+import collections
+import json
+
+import aiohttp
+import pandas
+
+import binance_lib
+
+# Base URL of the Binance combined WebSocket streams
+default_stream_url = "wss://stream.binance.com:9443"
+# Milliseconds in each Binance interval, used to place trades into candles
+interval_milliseconds = {
+    "1s": 1000, "1m": 60000, "3m": 180000, "5m": 300000, "15m": 900000, "30m": 1800000, "1h": 3600000,
+    "2h": 7200000, "4h": 14400000, "6h": 21600000, "8h": 28800000, "12h": 43200000, "1d": 86400000,
+    "3d": 259200000, "1w": 604800000
+}
+# Columns of the candles dataframe, matching binance_lib.get_candlesticks
+candle_columns = ["time", "open", "high", "low", "close", "volume", "close Time", "Quote Asset Volume",
+                  "Number of Trades", "Taker Buy Base Asset Volume", "Taker Buy Quote Asset Volume", "Ignore"]
+
+
+# Function to create a candle assembler
+def create_candle_assembler(symbol, timeframe, source="kline", callbacks=None, max_candles=1000):
+    """
+    Function to create a candle assembler. The assembler turns the messages of a Binance stream into closed candles
+    for one symbol and timeframe, and calls each callback the moment a candle closes.
+    :param symbol: string of the symbol (i.e. "BTCUSDT")
+    :param timeframe: string of the timeframe (i.e. "M1")
+    :param source: string of the stream the candles are built from. "kline" uses the candles Binance builds. "trade"
+    builds candles from individual trades, which Binance doesn't offer for every interval (i.e. 1s on old accounts)
+    :param callbacks: list of functions called with (symbol, timeframe, candles dataframe) when a candle closes
+    :param max_candles: integer of the number of closed candles kept
+    :return: dictionary of the candle assembler
+    """
+    if source not in ["kline", "trade"]:
+        raise ValueError("Source must be 'kline' or 'trade'")
+    interval = binance_lib.set_query_timeframe(timeframe=timeframe)
+    if source == "trade" and interval not in interval_milliseconds:
+        raise ValueError(f"Candles can't be built from trades for {timeframe}")
+    return {
+        "symbol": symbol.upper(),
+        "timeframe": timeframe,
+        "interval": interval,
+        "interval_milliseconds": interval_milliseconds.get(interval),
+        "source": source,
+        "callbacks": list(callbacks) if callbacks is not None else [],
+        "candles": collections.deque(maxlen=max_candles),
+        "forming_candle": None,
+        "last_trade_id": None
+    }
+
+
+# Function to get the name of the stream an assembler needs
+def get_stream_name(assembler):
+    """
+    Function to get the name of the Binance stream an assembler is built from
+    :param assembler: dictionary of the candle assembler
+    :return: string of the stream name (i.e. "btcusdt@kline_1m")
+    """
+    if assembler["source"] == "kline":
+        return f"{assembler['symbol'].lower()}@kline_{assembler['interval']}"
+    return f"{assembler['symbol'].lower()}@trade"
+
+
+# Function to add historic candles to an assembler
+def seed_candles(assembler, candles_dataframe):
+    """
+    Function to add candles retrieved over REST (i.e. from binance_lib.get_candlesticks) to an assembler, so a
+    strategy has history from the first candle to close. The last candle from REST is still forming, so it is dropped
+    :param assembler: dictionary of the candle assembler
+    :param candles_dataframe: dataframe of candlesticks
+    :return: None
+    """
+    for candle in candles_dataframe[candle_columns].iloc[:-1].to_dict("records"):
+        add_closed_candle(assembler, candle, notify=False)
+
+
+# Function to add a closed candle to an assembler
+def add_closed_candle(assembler, candle, notify=True):
+    """
+    Function to add a closed candle to an assembler and call the callbacks. A candle which is already in the assembler
+    (i.e. sent again after a reconnect) is ignored
+    :param assembler: dictionary of the candle assembler
+    :param candle: dictionary of the candle
+    :param notify: Boolean. When True, the callbacks are called
+    :return: Boolean. True if the candle was added
+    """
+    if len(assembler["candles"]) > 0 and candle["time"] <= assembler["candles"][-1]["time"]:
+        return False
+    assembler["candles"].append(candle)
+    if notify and len(assembler["callbacks"]) > 0:
+        candles_dataframe = get_candles_dataframe(assembler)
+        for callback in assembler["callbacks"]:
+            callback(assembler["symbol"], assembler["timeframe"], candles_dataframe)
+    return True
+
+
+# Function to get the closed candles of an assembler as a dataframe
+def get_candles_dataframe(assembler):
+    """
+    Function to get the closed candles of an assembler as a dataframe, in the same format as
+    binance_lib.get_candlesticks
+    :param assembler: dictionary of the candle assembler
+    :return: dataframe of the candlesticks
+    """
+    candles_dataframe = pandas.DataFrame(list(assembler["candles"]), columns=candle_columns)
+    candles_dataframe['human_time'] = pandas.to_datetime(candles_dataframe['time'], unit='ms')
+    candles_dataframe[["open", "high", "low", "close", "volume"]] = \
+        candles_dataframe[["open", "high", "low", "close", "volume"]].astype(float)
+    return candles_dataframe
+
+
+# Function to process a kline message
+def process_kline_message(assembler, message):
+    """
+    Function to process a message from a kline stream. Binance sends the forming candle every few seconds, and marks
+    the final update of each candle as closed
+    Documentation: https://github.com/binance/binance-spot-api-docs/blob/master/web-socket-streams.md#klinecandlestick-streams
+    :param assembler: dictionary of the candle assembler
+    :param message: dictionary of the kline message
+    :return: Boolean. True if a candle closed
+    """
+    kline = message["k"]
+    candle = {
+        "time": kline["t"],
+        "open": float(kline["o"]),
+        "high": float(kline["h"]),
+        "low": float(kline["l"]),
+        "close": float(kline["c"]),
+        "volume": float(kline["v"]),
+        "close Time": kline["T"],
+        "Quote Asset Volume": float(kline["q"]),
+        "Number of Trades": kline["n"],
+        "Taker Buy Base Asset Volume": float(kline["V"]),
+        "Taker Buy Quote Asset Volume": float(kline["Q"]),
+        "Ignore": kline.get("B", "0")
+    }
+    if kline["x"]:
+        assembler["forming_candle"] = None
+        return add_closed_candle(assembler, candle)
+    assembler["forming_candle"] = candle
+    return False
+
+
+# Function to process a trade message
+def process_trade_message(assembler, message):
+    """
+    Function to process a message from a trade stream, adding the trade to the forming candle. A candle closes when
+    the first trade of the next candle arrives, so an interval with no trades produces no candle
+    Documentation: https://github.com/binance/binance-spot-api-docs/blob/master/web-socket-streams.md#trade-streams
+    :param assembler: dictionary of the candle assembler
+    :param message: dictionary of the trade message
+    :return: Boolean. True if a candle closed
+    """
+    # Ignore trades already seen (i.e. sent again after a reconnect)
+    if assembler["last_trade_id"] is not None and message["t"] <= assembler["last_trade_id"]:
+        return False
+    assembler["last_trade_id"] = message["t"]
+    price = float(message["p"])
+    quantity = float(message["q"])
+    # Work out which candle the trade belongs to
+    interval = assembler["interval_milliseconds"]
+    candle_time = message["T"] // interval * interval
+    candle_closed = False
+    forming_candle = assembler["forming_candle"]
+    if forming_candle is not None and candle_time > forming_candle["time"]:
+        candle_closed = add_closed_candle(assembler, forming_candle)
+        forming_candle = None
+    if forming_candle is None:
+        forming_candle = {
+            "time": candle_time,
+            "open": price,
+            "high": price,
+            "low": price,
+            "close": price,
+            "volume": 0.0,
+            "close Time": candle_time + interval - 1,
+            "Quote Asset Volume": 0.0,
+            "Number of Trades": 0,
+            "Taker Buy Base Asset Volume": 0.0,
+            "Taker Buy Quote Asset Volume": 0.0,
+            "Ignore": "0"
+        }
+        assembler["forming_candle"] = forming_candle
+    # Add the trade to the candle
+    forming_candle["high"] = max(forming_candle["high"], price)
+    forming_candle["low"] = min(forming_candle["low"], price)
+    forming_candle["close"] = price
+    forming_candle["volume"] += quantity
+    forming_candle["Quote Asset Volume"] += price * quantity
+    forming_candle["Number of Trades"] += 1
+    # The buyer is the taker when the buyer isn't the market maker
+    if not message["m"]:
+        forming_candle["Taker Buy Base Asset Volume"] += quantity
+        forming_candle["Taker Buy Quote Asset Volume"] += price * quantity
+    return candle_closed
+
+
+# Function to process a message from a combined stream
+def process_stream_message(assemblers, raw_message):
+    """
+    Function to send a message from a Binance combined stream to the assemblers built from it
+    :param assemblers: dictionary of stream name to list of candle assemblers
+    :param raw_message: string of the JSON message
+    :return: integer of the number of candles closed
+    """
+    message = json.loads(raw_message)
+    candles_closed = 0
+    for assembler in assemblers.get(message.get("stream"), []):
+        if assembler["source"] == "kline":
+            candles_closed += process_kline_message(assembler, message["data"])
+        else:
+            candles_closed += process_trade_message(assembler, message["data"])
+    return candles_closed
+
+
+# Function to stream candles from Binance
+async def run_stream(assembler_list, stream_url=default_stream_url, stop_event=None, reconnect=True,
+                     reconnect_delay=1.0):
+    """
+    Function to connect to a Binance combined stream for every assembler and process messages until stopped.
+    Reconnects if the connection drops, as Binance closes every connection after 24 hours
+    :param assembler_list: list of candle assemblers
+    :param stream_url: string of the Binance WebSocket URL
+    :param stop_event: asyncio.Event which stops the stream when set. None streams forever
+    :param reconnect: Boolean. When False, returns when the connection closes
+    :param reconnect_delay: float of the seconds to wait before reconnecting
+    :return: integer of the number of candles closed
+    """
+    # Group the assemblers by the stream they need, so each stream is only subscribed to once
+    assemblers = {}
+    for assembler in assembler_list:
+        assemblers.setdefault(get_stream_name(assembler), []).append(assembler)
+    url = f"{stream_url}/stream?streams={'/'.join(assemblers)}"
+    candles_closed = 0
+    async with aiohttp.ClientSession() as session:
+        while stop_event is None or not stop_event.is_set():
+            try:
+                async with session.ws_connect(url, heartbeat=30) as websocket:
+                    async for message in websocket:
+                        if message.type == aiohttp.WSMsgType.TEXT:
+                            candles_closed += process_stream_message(assemblers, message.data)
+                        elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        if stop_event is not None and stop_event.is_set():
+                            break
+            except aiohttp.ClientError as e:
+                print(f"Binance stream error. {e}")
+            if not reconnect:
+                break
+            if stop_event is None or not stop_event.is_set():
+                await asyncio.sleep(reconnect_delay)
+    return candles_closed
+
+
+# Function to stream candles for a list of symbols from a synchronous program
+def stream_candles(symbols, timeframe, callback, source="kline", stream_url=default_stream_url, seed=True,
+                   number_of_candles=1000):
+    """
+    Function to stream candles for a list of symbols, calling the callback (i.e. a strategy) each time a candle
+    closes. Blocks until interrupted.
+    :param symbols: list of symbols
+    :param timeframe: string of the timeframe
+    :param callback: function called with (symbol, timeframe, candles dataframe) when a candle closes
+    :param source: string of the stream the candles are built from. "kline" or "trade"
+    :param stream_url: string of the Binance WebSocket URL
+    :param seed: Boolean. When True, each assembler starts with candles retrieved over REST
+    :param number_of_candles: integer of the number of candles to retrieve when seeding
+    :return: None
+    """
+    assembler_list = []
+    for symbol in symbols:
+        assembler = create_candle_assembler(symbol, timeframe, source=source, callbacks=[callback],
+                                            max_candles=number_of_candles)
+        if seed:
+            seed_candles(assembler, binance_lib.get_candlesticks(symbol, timeframe, number_of_candles))
+        assembler_list.append(assembler)
+    asyncio.run(run_stream(assembler_list, stream_url=stream_url))
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import pickle
+import time
+
+import pandas
+
+
+# Default location for the backtest cache
+default_cache_location = os.path.join(os.path.abspath(os.getcwd()), "backtest_cache")
+
+
+# Function to hash the contents of a dataframe
+def hash_dataframe(dataframe):
+    """
+    Function to create a stable hash of the contents of a dataframe. Used to identify the candle range a backtest was
+    run against, so that any change in the underlying data invalidates the cached results.
+    :param dataframe: pandas dataframe to be hashed
+    :return: string of the hex digest
+    """
+    # Hash each row of the dataframe. The index is ignored as it carries no pricing information
+    row_hashes = pandas.util.hash_pandas_object(dataframe, index=False)
+    # Combine the row hashes with the column names so that a schema change also changes the hash
+    hasher = hashlib.sha256()
+    hasher.update(",".join(str(column) for column in dataframe.columns).encode())
+    hasher.update(row_hashes.values.tobytes())
+    # Return the hex digest
+    return hasher.hexdigest()
+
+
+# Function to normalize a value before it is used in a cache key
+def normalize_cache_value(value):
+    """
+    Function to convert numpy values into python values, so that equal parameters always produce the same cache key
+    regardless of whether they came from a numpy range or a list
+    :param value: value to be normalized. Tuples and lists are normalized recursively
+    :return: normalized value
+    """
+    if isinstance(value, (tuple, list)):
+        return tuple(normalize_cache_value(item) for item in value)
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+# Function to hash the source code of a list of files
+def hash_source_files(file_paths):
+    """
+    Function to create a hash of the source code of a list of files (i.e. the modules of a strategy), so that editing
+    the code invalidates the cached results which depend on it
+    :param file_paths: list of strings of file paths
+    :return: string of the hex digest
+    """
+    hasher = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+# Function to create a cache key for a single backtest
+def create_cache_key(data_hash, strategy, parameters, engine_version, source_hash=""):
+    """
+    Function to create a cache key for a single backtest
+    :param data_hash: string hash of the candle data the backtest is run against
+    :param strategy: string of the strategy being tested
+    :param parameters: tuple of every parameter which can change the outcome of the backtest
+    :param engine_version: string of the backtest engine version. Bump this whenever the engine logic changes
+    :param source_hash: string hash of the source code of the strategy (see hash_source_files)
+    :return: string of the cache key
+    """
+    # Build the key from each component
+    key_string = f"{engine_version}|{source_hash}|{strategy}|{data_hash}|{repr(normalize_cache_value(parameters))}"
+    # Return the hashed key
+    return hashlib.sha256(key_string.encode()).hexdigest()
+
+
+# Function to get the file path for a cache key
+def get_cache_path(cache_key, cache_location=default_cache_location):
+    """
+    Function to get the file path for a cache key. Keys are split into sub folders so that large sweeps don't put
+    hundreds of thousands of files into a single folder
+    :param cache_key: string of the cache key
+    :param cache_location: string of the cache folder
+    :return: string of the file path
+    """
+    return os.path.join(cache_location, cache_key[:2], cache_key + ".pkl")
+
+
+# Function to retrieve a cached result
+def get_cached_result(cache_key, cache_location=default_cache_location):
+    """
+    Function to retrieve a cached backtest result
+    :param cache_key: string of the cache key
+    :param cache_location: string of the cache folder
+    :return: dictionary with 'result' and 'duration', or None if the result has not been cached
+    """
+    cache_path = get_cache_path(cache_key, cache_location)
+    # Return None if no cached result exists
+    if not os.path.exists(cache_path):
+        return None
+    # Load the cached result
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        # A corrupt cache entry is treated as a miss, and will be overwritten
+        print(f"Error reading cached result {cache_key}. {e}")
+        return None
+
+
+# Function to save a result to the cache
+def save_cached_result(cache_key, result, duration, cache_location=default_cache_location):
+    """
+    Function to save a backtest result to the cache. The result is written to a temporary file first then moved into
+    place, so an interrupted sweep never leaves a partially written entry behind.
+    :param cache_key: string of the cache key
+    :param result: result of the backtest
+    :param duration: float of the number of seconds the backtest took to run
+    :param cache_location: string of the cache folder
+    :return: None
+    """
+    cache_path = get_cache_path(cache_key, cache_location)
+    # Make sure the folder exists
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # Write to a temporary file unique to this process
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump({"result": result, "duration": duration}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Move into place
+    os.replace(temp_path, cache_path)
+
+
+# Function to run a function and cache its result
+def run_and_cache(function, cache_key, cache_location, args):
+    """
+    Function to run a backtest function and save the result to the cache as soon as it completes. Designed to be run
+    inside a worker process so that completed results survive a crash of the overall sweep.
+    :param function: function to run. Must be importable so it can be passed to a worker process
+    :param cache_key: string of the cache key. If None, the result is not cached
+    :param cache_location: string of the cache folder
+    :param args: tuple of arguments for the function
+    :return: tuple of the result and the number of seconds it took to run
+    """
+    # Time the function
+    start_time = time.perf_counter()
+    result = function(*args)
+    duration = time.perf_counter() - start_time
+    # Save the result
+    if cache_key is not None:
+        save_cached_result(cache_key, result, duration, cache_location)
+    return result, duration
+
+
+# Function to create a dictionary for tracking cache statistics
+def create_cache_stats():
+    """
+    Function to create a dictionary for tracking cache statistics across a sweep
+    :return: dictionary of cache statistics
+    """
+    return {
+        "hits": 0,
+        "misses": 0,
+        "time_saved": 0.00,
+        "time_spent": 0.00
+    }
+
+
+# Function to record a cache hit
+def record_cache_hit(cache_stats, cached_entry):
+    """
+    Function to record a cache hit
+    :param cache_stats: dictionary of cache statistics
+    :param cached_entry: dictionary returned from get_cached_result
+    :return: None
+    """
+    cache_stats["hits"] += 1
+    cache_stats["time_saved"] += cached_entry["duration"]
+
+
+# Function to record a cache miss
+def record_cache_miss(cache_stats, duration):
+    """
+    Function to record a cache miss
+    :param cache_stats: dictionary of cache statistics
+    :param duration: float of the number of seconds the backtest took to run
+    :return: None
+    """
+    cache_stats["misses"] += 1
+    cache_stats["time_spent"] += duration
+
+
+# Function to report the cache statistics
+def report_cache_stats(cache_stats):
+    """
+    Function to print a summary of the cache statistics at the end of a sweep
+    :param cache_stats: dictionary of cache statistics
+    :return: None
+    """
+    total = cache_stats["hits"] + cache_stats["misses"]
+    if total == 0:
+        print("Backtest cache: no backtests run")
+        return
+    hit_rate = cache_stats["hits"] / total * 100
+    print(f"Backtest cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({hit_rate:.1f}% hit rate)")
+    print(f"Backtest cache: {cache_stats['time_saved']:.2f}s of backtest time saved, "
+          f"{cache_stats['time_spent']:.2f}s spent on new backtests")
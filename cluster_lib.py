@@ -0,0 +1,466 @@
+import argparse
+import collections
+import math
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import worker_pool_lib
+
+# Port the coordinator listens on when none is given
+default_port = 6100
+# Environment variable holding the key workers use to authenticate with the coordinator
+authkey_environment_variable = "BACKTEST_CLUSTER_AUTHKEY"
+# Seconds a worker keeps trying to connect to a coordinator which isn't listening yet
+default_connect_timeout = 60.0
+# Seconds between messages about waiting for workers to connect
+waiting_message_interval = 30.0
+
+
+# Function to get the key used to authenticate workers
+def get_authkey(authkey=None):
+    """
+    Function to get the key workers use to authenticate with the coordinator. Tasks and results are pickled, so only
+    hosts holding the key are allowed to connect
+    :param authkey: string or bytes of the key. None reads it from the BACKTEST_CLUSTER_AUTHKEY environment variable
+    :return: bytes of the key
+    """
+    if authkey is None:
+        authkey = os.environ.get(authkey_environment_variable)
+    if authkey is None or len(authkey) == 0:
+        raise ValueError(f"A cluster authkey is required. Pass one or set {authkey_environment_variable}")
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    return authkey
+
+
+# Function to convert an address string into a (host, port) tuple
+def parse_address(address):
+    """
+    Function to convert an address into the (host, port) tuple used by multiprocessing.connection
+    :param address: string of "host:port" or "host", or a tuple of (host, port)
+    :return: tuple of the host and port
+    """
+    if isinstance(address, tuple):
+        return address[0], int(address[1])
+    host, _, port = address.rpartition(":")
+    if host == "":
+        return port, default_port
+    return host, int(port)
+
+
+# Function to create a pool of workers on any number of hosts
+def create_cluster_pool(address=("0.0.0.0", default_port), authkey=None, local_workers=0,
+                        max_datasets=worker_pool_lib.default_max_datasets):
+    """
+    Function to start a coordinator which hands tasks to worker processes on any number of hosts (see run_worker). The
+    returned dictionary can be used anywhere a worker pool from worker_pool_lib.create_worker_pool can, so a sweep runs
+    the same way across several hosts as it does locally. Tasks are handed out in chunks, an idle worker steals the
+    unstarted half of the largest chunk still running, and the unfinished tasks of a worker which disconnects are
+    handed to the others. Workers need the same version of the repository, as tasks refer to its functions by name
+    :param address: tuple of (host, port), or string of "host:port", to listen on. Port 0 picks a free port
+    :param authkey: string or bytes of the key workers authenticate with. See get_authkey
+    :param local_workers: integer of the number of worker processes to start on this host
+    :param max_datasets: integer of the number of datasets each worker keeps loaded
+    :return: dictionary of the worker pool
+    """
+    authkey = get_authkey(authkey)
+    worker_pool = worker_pool_lib.create_worker_pool(processes=1, max_datasets=max_datasets)
+    listener = Listener(parse_address(address), authkey=authkey)
+    worker_pool["processes"] = 0
+    worker_pool["coordinator"] = {
+        "listener": listener,
+        "address": listener.address,
+        "authkey": authkey,
+        "condition": threading.Condition(),
+        "running": True,
+        # Task ids waiting to be handed out, in the order they should run
+        "queue": collections.deque(),
+        # Task id to tuple of (job id, task)
+        "tasks": {},
+        # Job id to dictionary of the task name, results received and any error
+        "jobs": {},
+        # Worker id to dictionary of the chunk the worker is running
+        "workers": {},
+        "next_task_id": 0,
+        "next_job_id": 0,
+        "next_worker_id": 0,
+        "threads": [],
+        "local_workers": []
+    }
+    accept_thread = threading.Thread(target=accept_workers, args=(worker_pool,), daemon=True)
+    accept_thread.start()
+    worker_pool["coordinator"]["threads"].append(accept_thread)
+    print(f"Coordinator listening on {listener.address[0]}:{listener.address[1]}")
+    if local_workers > 0:
+        worker_pool["coordinator"]["local_workers"] = start_local_workers(
+            ("127.0.0.1", listener.address[1]), authkey, local_workers, max_datasets
+        )
+    return worker_pool
+
+
+# Function to start worker processes on this host
+def start_local_workers(address, authkey, processes, max_datasets=worker_pool_lib.default_max_datasets):
+    """
+    Function to start worker processes on this host, each connected to the coordinator
+    :param address: tuple of the (host, port) of the coordinator
+    :param authkey: bytes of the key to authenticate with
+    :param processes: integer of the number of worker processes
+    :param max_datasets: integer of the number of datasets each worker keeps loaded
+    :return: list of the worker processes
+    """
+    worker_processes = []
+    for _ in range(processes):
+        worker_process = multiprocessing.Process(target=run_worker, args=(address, authkey, max_datasets))
+        worker_process.start()
+        worker_processes.append(worker_process)
+    return worker_processes
+
+
+# Function to close a cluster pool
+def close_cluster_pool(worker_pool):
+    """
+    Function to stop the coordinator. Connected workers are told to stop, and any worker processes started on this
+    host are waited for
+    :param worker_pool: dictionary of the worker pool
+    :return: None
+    """
+    coordinator = worker_pool["coordinator"]
+    with coordinator["condition"]:
+        coordinator["running"] = False
+        coordinator["condition"].notify_all()
+    # Closing the listener doesn't wake a thread waiting for a connection, so connect to it once
+    try:
+        Client(("127.0.0.1", coordinator["address"][1]), authkey=coordinator["authkey"]).close()
+    except OSError:
+        pass
+    coordinator["listener"].close()
+    for thread in coordinator["threads"]:
+        thread.join(timeout=10)
+    for worker_process in coordinator["local_workers"]:
+        worker_process.join(timeout=10)
+        if worker_process.is_alive():
+            worker_process.terminate()
+    if worker_pool["remove_data_location"]:
+        shutil.rmtree(worker_pool["data_location"], ignore_errors=True)
+
+
+# Function to accept connections from workers
+def accept_workers(worker_pool):
+    """
+    Function run in a thread of the coordinator, starting a thread for each worker which connects
+    :param worker_pool: dictionary of the worker pool
+    :return: None
+    """
+    coordinator = worker_pool["coordinator"]
+    while coordinator["running"]:
+        try:
+            connection = coordinator["listener"].accept()
+        except multiprocessing.AuthenticationError:
+            print("Worker failed to authenticate")
+            continue
+        except (EOFError, ConnectionError):
+            # The worker disconnected before authenticating
+            continue
+        except OSError:
+            # The listener was closed
+            break
+        if not coordinator["running"]:
+            connection.close()
+            break
+        thread = threading.Thread(target=handle_worker, args=(worker_pool, connection), daemon=True)
+        thread.start()
+        coordinator["threads"].append(thread)
+
+
+# Function to handle the messages of one worker
+def handle_worker(worker_pool, connection):
+    """
+    Function run in a thread of the coordinator for each connected worker. The worker asks for a chunk of tasks, sends
+    each result as it completes, and is told after each one how many tasks of its chunk it should still run, as the
+    end of the chunk may have been stolen by another worker
+    :param worker_pool: dictionary of the worker pool
+    :param connection: multiprocessing connection to the worker
+    :return: None
+    """
+    coordinator = worker_pool["coordinator"]
+    condition = coordinator["condition"]
+    worker_id = None
+    worker_name = "unknown worker"
+    try:
+        _, host, pid = connection.recv()
+        worker_name = f"{host}:{pid}"
+        with condition:
+            worker_id = coordinator["next_worker_id"]
+            coordinator["next_worker_id"] += 1
+            coordinator["workers"][worker_id] = {"task_ids": [], "position": 0, "length": 0}
+            worker_pool["processes"] = len(coordinator["workers"])
+            condition.notify_all()
+        print(f"Worker {worker_name} connected")
+        while True:
+            message = connection.recv()
+            if message[0] == "request":
+                chunk = get_next_chunk(worker_pool, worker_id)
+                if chunk is None:
+                    connection.send(("stop",))
+                    break
+                connection.send(("chunk", chunk[0], chunk[1], list(worker_pool["dataset_keys"])))
+            elif message[0] == "dataset":
+                dataset_path = worker_pool_lib.get_dataset_path(worker_pool["data_location"], message[1])
+                with open(dataset_path, "rb") as f:
+                    connection.send_bytes(f.read())
+            elif message[0] in ["result", "error"]:
+                connection.send(("continue", record_outcome(worker_pool, worker_id, message)))
+    except (EOFError, OSError):
+        pass
+    finally:
+        connection.close()
+        if worker_id is not None:
+            with condition:
+                worker = coordinator["workers"].pop(worker_id)
+                # Hand the unfinished tasks of the worker to the others, ahead of anything still queued
+                unfinished = worker["task_ids"][worker["position"]:worker["length"]]
+                coordinator["queue"].extendleft(task_id for task_id in reversed(unfinished)
+                                                if task_id in coordinator["tasks"])
+                worker_pool["processes"] = len(coordinator["workers"])
+                condition.notify_all()
+            if coordinator["running"]:
+                print(f"Worker {worker_name} disconnected. {len(unfinished)} unfinished tasks queued again")
+
+
+# Function to get the next chunk of tasks for a worker
+def get_next_chunk(worker_pool, worker_id):
+    """
+    Function to get the next chunk of tasks for a worker, waiting until there is one. Chunks come from the queue,
+    sized from the measured duration of the tasks (see worker_pool_lib.get_chunk_size). When the queue is empty, the
+    worker steals the unstarted half of the chunk with the most unstarted tasks
+    :param worker_pool: dictionary of the worker pool
+    :param worker_id: integer of the worker id
+    :return: tuple of the list of task ids and the list of tasks, or None when the coordinator is stopping
+    """
+    coordinator = worker_pool["coordinator"]
+    condition = coordinator["condition"]
+    queue = coordinator["queue"]
+    with condition:
+        worker = coordinator["workers"][worker_id]
+        while coordinator["running"]:
+            # Drop any tasks of jobs which have finished early
+            while len(queue) > 0 and queue[0] not in coordinator["tasks"]:
+                queue.popleft()
+            if len(queue) > 0:
+                job = coordinator["jobs"][coordinator["tasks"][queue[0]][0]]
+                chunk_size = worker_pool_lib.get_chunk_size(worker_pool, job["task_name"], len(queue))
+                task_ids = []
+                while len(queue) > 0 and len(task_ids) < chunk_size:
+                    task_id = queue.popleft()
+                    if task_id in coordinator["tasks"]:
+                        task_ids.append(task_id)
+            else:
+                task_ids = steal_tasks(coordinator, worker_id)
+            if len(task_ids) > 0:
+                worker["task_ids"] = task_ids
+                worker["position"] = 0
+                worker["length"] = len(task_ids)
+                return task_ids, [coordinator["tasks"][task_id][1] for task_id in task_ids]
+            condition.wait()
+    return None
+
+
+# Function to steal tasks from the worker with the most unstarted tasks
+def steal_tasks(coordinator, worker_id):
+    """
+    Function to take the unstarted half of the chunk with the most unstarted tasks, rounded up. The worker running the
+    chunk is sent its shorter length with the acknowledgement of its next result, and the coordinator only steals
+    tasks after the one it is running, so no task runs twice. Must be called holding the coordinator condition
+    :param coordinator: dictionary of the coordinator
+    :param worker_id: integer of the id of the worker stealing
+    :return: list of the task ids stolen
+    """
+    victim = None
+    most_unstarted = 0
+    for other_id, other in coordinator["workers"].items():
+        # The task at position is running, so only the tasks after it can be stolen
+        unstarted = other["length"] - other["position"] - 1
+        if other_id != worker_id and unstarted > most_unstarted:
+            victim = other
+            most_unstarted = unstarted
+    if victim is None:
+        return []
+    cut = victim["length"] - math.ceil(most_unstarted / 2)
+    task_ids = victim["task_ids"][cut:victim["length"]]
+    victim["length"] = cut
+    return [task_id for task_id in task_ids if task_id in coordinator["tasks"]]
+
+
+# Function to record a result sent by a worker
+def record_outcome(worker_pool, worker_id, message):
+    """
+    Function to record a result or error sent by a worker
+    :param worker_pool: dictionary of the worker pool
+    :param worker_id: integer of the worker id
+    :param message: tuple of ("result", task id, outcome, seconds taken) or ("error", task id, exception)
+    :return: integer of the number of tasks of its chunk the worker should run
+    """
+    coordinator = worker_pool["coordinator"]
+    with coordinator["condition"]:
+        worker = coordinator["workers"][worker_id]
+        worker["position"] += 1
+        task = coordinator["tasks"].pop(message[1], None)
+        # Results of a job which finished early are dropped
+        if task is not None:
+            job = coordinator["jobs"][task[0]]
+            if message[0] == "result":
+                job["results"][message[1]] = message[2]
+                worker_pool_lib.record_task_duration(worker_pool, job["task_name"], message[3])
+            else:
+                job["error"] = message[2]
+        coordinator["condition"].notify_all()
+        return worker["length"]
+
+
+# Function to run a list of tasks on the workers of a cluster pool
+def run_cluster_tasks(worker_pool, task_list, task_name):
+    """
+    Function to run a list of tasks on the workers connected to the coordinator, yielding each outcome in order. Used
+    by worker_pool_lib.run_tasks for cluster pools
+    :param worker_pool: dictionary of the worker pool
+    :param task_list: list of tuples of (function, args). Functions must be importable by the workers
+    :param task_name: string of the kind of task, used to size chunks
+    :return: generator of the outcome of instrumentation_lib.run_profiled_task for each task
+    """
+    coordinator = worker_pool["coordinator"]
+    condition = coordinator["condition"]
+    with condition:
+        job_id = coordinator["next_job_id"]
+        coordinator["next_job_id"] += 1
+        job = {"task_name": task_name, "results": {}, "error": None}
+        coordinator["jobs"][job_id] = job
+        task_ids = list(range(coordinator["next_task_id"], coordinator["next_task_id"] + len(task_list)))
+        coordinator["next_task_id"] += len(task_list)
+        for task_id, task in zip(task_ids, task_list):
+            coordinator["tasks"][task_id] = (job_id, task)
+        coordinator["queue"].extend(task_ids)
+        condition.notify_all()
+    try:
+        last_message_time = time.perf_counter()
+        for task_id in task_ids:
+            with condition:
+                while task_id not in job["results"] and job["error"] is None:
+                    if len(coordinator["workers"]) == 0 and \
+                            time.perf_counter() - last_message_time > waiting_message_interval:
+                        address = coordinator["address"]
+                        print(f"Waiting for workers to connect to {address[0]}:{address[1]}")
+                        last_message_time = time.perf_counter()
+                    condition.wait(timeout=waiting_message_interval)
+                if job["error"] is not None:
+                    raise job["error"]
+                outcome = job["results"].pop(task_id)
+            yield outcome
+    finally:
+        # Drop any tasks still to run, for instance if a task failed, and stop each worker after its current task
+        with condition:
+            for task_id in task_ids:
+                coordinator["tasks"].pop(task_id, None)
+            del coordinator["jobs"][job_id]
+            for worker in coordinator["workers"].values():
+                for index in range(worker["position"] + 1, worker["length"]):
+                    if worker["task_ids"][index] not in coordinator["tasks"]:
+                        worker["length"] = index
+                        break
+
+
+# Function to run a worker
+def run_worker(address, authkey=None, max_datasets=worker_pool_lib.default_max_datasets,
+               connect_timeout=default_connect_timeout):
+    """
+    Function to run a worker, which connects to a coordinator and runs the tasks it is given until told to stop. The
+    datasets tasks use are downloaded from the coordinator the first time they are seen
+    :param address: tuple of (host, port), or string of "host:port", of the coordinator
+    :param authkey: string or bytes of the key to authenticate with. See get_authkey
+    :param max_datasets: integer of the number of datasets to keep loaded
+    :param connect_timeout: float of the seconds to keep trying to connect
+    :return: integer of the number of tasks run
+    """
+    address = parse_address(address)
+    authkey = get_authkey(authkey)
+    # Keep trying to connect, as workers may be started before the coordinator
+    start_time = time.perf_counter()
+    while True:
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.perf_counter() - start_time > connect_timeout:
+                raise
+            time.sleep(1)
+    data_location = tempfile.mkdtemp(prefix="backtest_worker_data_")
+    worker_pool_lib.initialize_worker(data_location, [], max_datasets)
+    downloaded_keys = set()
+    tasks_run = 0
+    try:
+        connection.send(("hello", socket.gethostname(), os.getpid()))
+        while True:
+            connection.send(("request",))
+            message = connection.recv()
+            if message[0] == "stop":
+                break
+            _, task_ids, tasks, dataset_keys = message
+            # Download any datasets which are new since the last chunk
+            for dataset_key in dataset_keys:
+                if dataset_key not in downloaded_keys:
+                    connection.send(("dataset", dataset_key))
+                    with open(worker_pool_lib.get_dataset_path(data_location, dataset_key), "wb") as f:
+                        f.write(connection.recv_bytes())
+                    downloaded_keys.add(dataset_key)
+            # Run the chunk. After each result, the coordinator replies with the length of the chunk, which is shorter
+            # if the end of it has been stolen
+            position = 0
+            length = len(task_ids)
+            while position < length:
+                try:
+                    outcome, duration = worker_pool_lib.run_timed_task(tasks[position])
+                    message = ("result", task_ids[position], outcome, duration)
+                except Exception as e:
+                    message = ("error", task_ids[position], e)
+                try:
+                    connection.send(message)
+                except Exception:
+                    # Send the traceback if the exception or outcome can't be pickled
+                    connection.send(("error", task_ids[position], ValueError(traceback.format_exc())))
+                _, length = connection.recv()
+                position += 1
+                tasks_run += 1
+    except (EOFError, OSError):
+        # The coordinator has stopped
+        pass
+    finally:
+        connection.close()
+        shutil.rmtree(data_location, ignore_errors=True)
+    return tasks_run
+
+
+# Main function
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run backtest workers for a coordinator on another host")
+    parser.add_argument("address", help="host:port of the coordinator")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="number of worker processes. Defaults to the number of cores less one")
+    parser.add_argument("--authkey", default=None,
+                        help=f"key to authenticate with. Defaults to ${authkey_environment_variable}")
+    parser.add_argument("--max-datasets", type=int, default=worker_pool_lib.default_max_datasets,
+                        help="number of datasets each worker keeps loaded")
+    arguments = parser.parse_args()
+    worker_processes = start_local_workers(
+        parse_address(arguments.address),
+        get_authkey(arguments.authkey),
+        worker_pool_lib.get_worker_count(arguments.processes),
+        arguments.max_datasets
+    )
+    for worker_process in worker_processes:
+        worker_process.join()
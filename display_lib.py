@@ -1,7 +1,17 @@
+import numpy
+import pandas
 import plotly.graph_objects as go
-from dash import Dash, html, dcc
+from dash import Dash, html, dcc, Input, Output, State, ALL
+from dash.exceptions import PreventUpdate
 from plotly.subplots import make_subplots
 
+import live_feed_lib
+
+# Default number of points to render per trace when downsampling. Roughly the width of a screen in pixels
+default_max_points = 2000
+# Metric columns in a sweep results table (see report_lib.create_results_table)
+results_metrics = ["profit", "win_rate", "total_trades", "total_wins", "total_losses"]
+
 
 # Function to display a plotly graph in dash
 def display_graph(plotly_fig, graph_title, dash=False):
@@ -95,14 +105,359 @@ def display_backtest(proposed_trades, completed_trades, win_objects, loss_object
 
 
 
+# Function to display a graph in dash which is resampled as the user zooms
+def display_decimated_graph(dataframe, graph_title, figure_function=None, max_points=default_max_points):
+    """
+    Function to display a graph of any length in Dash. The browser is only ever sent max_points candles. Whenever the
+    user zooms or pans, the visible range is resampled from the full dataframe on the server, so detail is recovered
+    when zooming in.
+    :param dataframe: dataframe with human_time and OHLC columns (plus any columns the figure function needs)
+    :param graph_title: string
+    :param figure_function: function taking (dataframe, title, max_points=) and returning a figure. Defaults to
+    construct_base_candlestick_graph
+    :param max_points: integer of the maximum number of points per trace
+    :return: None
+    """
+    if figure_function is None:
+        figure_function = construct_base_candlestick_graph
+    # Sort once so each zoom can slice the visible range with a binary search
+    dataframe = dataframe.sort_values("human_time").reset_index(drop=True)
+    times = dataframe["human_time"].values
+
+    # Function to build the figure for a range of the dataframe
+    def build_figure(start_time=None, end_time=None):
+        start = 0
+        end = len(dataframe)
+        if start_time is not None:
+            start = int(numpy.searchsorted(times, numpy.datetime64(pandas.Timestamp(start_time)), side="left"))
+        if end_time is not None:
+            end = int(numpy.searchsorted(times, numpy.datetime64(pandas.Timestamp(end_time)), side="right"))
+        fig = figure_function(dataframe.iloc[start:end], graph_title, max_points=max_points)
+        fig.update_layout(
+            xaxis_rangeslider_visible=False,
+            autosize=True,
+            height=800,
+            # Keep the user's zoom when the figure is replaced
+            uirevision=graph_title
+        )
+        return fig
+
+    # Create the Dash object
+    app = Dash(__name__)
+    # Construct view
+    app.layout = html.Div(children=[
+        html.H1(children=graph_title),
+        html.Div("Created by James Hinton from AlgoQuant.Trade"),
+        dcc.Graph(
+            id="decimated_graph",
+            figure=build_figure()
+        )
+    ])
+
+    # Resample the visible range whenever the user zooms or pans
+    @app.callback(Output("decimated_graph", "figure"), Input("decimated_graph", "relayoutData"),
+                  prevent_initial_call=True)
+    def resample_graph(relayout_data):
+        relayout_data = relayout_data or {}
+        if "xaxis.range[0]" in relayout_data:
+            return build_figure(relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"])
+        if "xaxis.range" in relayout_data:
+            return build_figure(relayout_data["xaxis.range"][0], relayout_data["xaxis.range"][1])
+        # Autoscale or reset axes shows the full range again
+        return build_figure()
+
+    # Run the image
+    app.run_server(debug=True)
+
+
+# Function to display a live dashboard
+def display_live_dashboard(feed, graph_title="Live Dashboard", interval_milliseconds=1000,
+                           max_points=default_max_points):
+    """
+    Function to display a live dashboard of a running strategy. The browser polls the live feed every interval and
+    only the candles, indicator values and trades published since the last poll are sent, which are appended to the
+    existing traces with extendData rather than redrawing the figure. Traces are capped at max_points, so the browser
+    and server do the same amount of work however long the session runs.
+    :param feed: dictionary of the live feed (see live_feed_lib.create_live_feed)
+    :param graph_title: string
+    :param interval_milliseconds: integer of the number of milliseconds between polls
+    :param max_points: integer of the maximum number of points kept in each trace
+    :return: None
+    """
+    indicator_names = feed["indicator_names"]
+    # Create the Dash object
+    app = Dash(__name__)
+    # Construct view
+    app.layout = html.Div(children=[
+        html.H1(children=graph_title),
+        html.Div("Created by James Hinton from AlgoQuant.Trade"),
+        dcc.Graph(
+            id="live_graph",
+            figure=construct_live_figure(indicator_names),
+            style={"height": "85vh"}
+        ),
+        # The last sequence number received by this browser
+        dcc.Store(id="live_sequence", data=0),
+        dcc.Interval(id="live_interval", interval=interval_milliseconds)
+    ])
+
+    # Send anything new to the browser
+    @app.callback(Output("live_graph", "extendData"), Output("live_sequence", "data"),
+                  Input("live_interval", "n_intervals"), State("live_sequence", "data"))
+    def update_live_graph(n_intervals, since_sequence):
+        updates = live_feed_lib.get_updates(feed, since_sequence or 0)
+        if updates["sequence"] == (since_sequence or 0):
+            raise PreventUpdate
+        return create_live_extension(updates, indicator_names, max_points), updates["sequence"]
+
+    # Run the image. The reloader is turned off as it would restart the process publishing to the feed
+    app.run_server(debug=True, use_reloader=False)
+
+
+# Function to construct the empty figure for a live dashboard
+def construct_live_figure(indicator_names):
+    """
+    Function to construct the empty figure for a live dashboard. Trace 0 is the candles, followed by one trace per
+    indicator, then the buy and sell trades
+    :param indicator_names: list of indicator names
+    :return: plotly figure
+    """
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Candlestick(x=[], open=[], high=[], low=[], close=[], name="Candles"), secondary_y=False)
+    for name in indicator_names:
+        fig.add_trace(go.Scattergl(x=[], y=[], mode="lines", name=name), secondary_y=True)
+    fig.add_trace(go.Scatter(x=[], y=[], text=[], mode="markers", name="Buys",
+                             marker=dict(size=10, symbol="triangle-up", color="blue")), secondary_y=False)
+    fig.add_trace(go.Scatter(x=[], y=[], text=[], mode="markers", name="Sells",
+                             marker=dict(size=10, symbol="triangle-down", color="purple")), secondary_y=False)
+    fig.update_layout(xaxis_rangeslider_visible=False, autosize=True, uirevision="live")
+    return fig
+
+
+# Function to turn live feed updates into extendData
+def create_live_extension(updates, indicator_names, max_points):
+    """
+    Function to turn the updates from a live feed into the extendData for a live dashboard figure. Every trace is
+    given every key, with empty lists where a key doesn't apply, as plotly extends all traces with the same keys
+    :param updates: dictionary returned from live_feed_lib.get_updates
+    :param indicator_names: list of indicator names
+    :param max_points: integer of the maximum number of points kept in each trace
+    :return: tuple of the extension dictionary, trace indexes and max_points
+    """
+    number_of_traces = len(indicator_names) + 3
+    extension = {key: [[] for trace in range(number_of_traces)] for key in ["x", "y", "open", "high", "low",
+                                                                               "close", "text"]}
+    # Candles
+    for candle in updates["candles"]:
+        extension["x"][0].append(str(candle["human_time"]))
+        for key in ["open", "high", "low", "close"]:
+            extension[key][0].append(candle[key])
+    # Indicators
+    for item in updates["indicators"]:
+        for index, name in enumerate(indicator_names, start=1):
+            extension["x"][index].append(str(item["human_time"]))
+            extension["y"][index].append(item[name])
+    # Trades
+    for trade in updates["trades"]:
+        index = number_of_traces - 2 if trade["order_type"] == "BUY" else number_of_traces - 1
+        extension["x"][index].append(str(trade["human_time"]))
+        extension["y"][index].append(trade["price"])
+        extension["text"][index].append(trade["description"])
+    return extension, list(range(number_of_traces)), max_points
+
+
+# Function to display a parameter surface from the results of a sweep
+def display_parameter_surface(results_table, parameter_names=None, metrics=None, graph_title="Parameter Surface"):
+    """
+    Function to explore the results of a sweep in Dash. Any two parameters can be chosen as the axes of a heatmap,
+    and every other parameter can be fixed to a single value (a slice) or left as "All", in which case the metric is
+    aggregated across it. The aggregation is done with a groupby on the columnar table whenever a control changes, so
+    it stays responsive with hundreds of thousands of results.
+    :param results_table: dataframe from report_lib.create_results_table, or string of a Parquet file of one
+    :param parameter_names: list of the parameter columns. Defaults to every column which isn't a metric or run_id
+    :param metrics: list of the metric columns which can be plotted. Defaults to results_metrics
+    :param graph_title: string
+    :return: None
+    """
+    if isinstance(results_table, str):
+        results_table = pandas.read_parquet(results_table)
+    if metrics is None:
+        metrics = [metric for metric in results_metrics if metric in results_table.columns]
+    if parameter_names is None:
+        parameter_names = [column for column in results_table.columns if column not in metrics and column != "run_id"]
+    if len(parameter_names) < 2:
+        raise ValueError("At least two parameters are needed to display a parameter surface")
+    # Store the unique values of each parameter for the slice controls
+    parameter_values = {name: sorted(results_table[name].dropna().unique().tolist()) for name in parameter_names}
+
+    # Function to build the options for a dropdown
+    def create_options(values):
+        return [{"label": str(value), "value": value} for value in values]
+
+    # Create the Dash object
+    app = Dash(__name__)
+    # Construct view
+    app.layout = html.Div(children=[
+        html.H1(children=graph_title),
+        html.Div(f"{len(results_table)} backtests"),
+        html.Div([
+            html.Label("X axis"),
+            dcc.Dropdown(id="surface_x", options=create_options(parameter_names), value=parameter_names[0],
+                         clearable=False),
+            html.Label("Y axis"),
+            dcc.Dropdown(id="surface_y", options=create_options(parameter_names), value=parameter_names[1],
+                         clearable=False),
+            html.Label("Metric"),
+            dcc.Dropdown(id="surface_metric", options=create_options(metrics), value=metrics[0], clearable=False),
+            html.Label("Aggregation"),
+            dcc.Dropdown(id="surface_aggregation", options=create_options(["mean", "max", "min", "median", "count"]),
+                         value="mean", clearable=False)
+        ], style={"width": "30%", "display": "inline-block", "verticalAlign": "top"}),
+        html.Div([
+            html.Div([
+                html.Label(f"{name} (slice)"),
+                dcc.Dropdown(
+                    id={"type": "surface_slice", "index": name},
+                    options=[{"label": "All", "value": "All"}] + create_options(parameter_values[name]),
+                    value="All",
+                    clearable=False
+                )
+            ]) for name in parameter_names
+        ], style={"width": "30%", "display": "inline-block", "verticalAlign": "top", "marginLeft": "20px"}),
+        dcc.Graph(id="surface_graph", style={"height": "80vh"})
+    ])
+
+    # Rebuild the heatmap whenever a control changes
+    @app.callback(Output("surface_graph", "figure"), Input("surface_x", "value"), Input("surface_y", "value"),
+                  Input("surface_metric", "value"), Input("surface_aggregation", "value"),
+                  Input({"type": "surface_slice", "index": ALL}, "value"))
+    def update_surface(x_name, y_name, metric, aggregation, slice_values):
+        return create_parameter_surface(
+            results_table=results_table,
+            x_name=x_name,
+            y_name=y_name,
+            metric=metric,
+            aggregation=aggregation,
+            slices=dict(zip(parameter_names, slice_values))
+        )
+
+    # Run the image
+    app.run_server(debug=True)
+
+
+# Function to create a heatmap of a metric across two parameters
+def create_parameter_surface(results_table, x_name, y_name, metric="profit", aggregation="mean", slices=None):
+    """
+    Function to create a heatmap of a metric across two parameters of a sweep
+    :param results_table: dataframe from report_lib.create_results_table
+    :param x_name: string of the parameter for the x axis
+    :param y_name: string of the parameter for the y axis
+    :param metric: string of the metric to plot
+    :param aggregation: string of the pandas aggregation used where several results share a cell (i.e. "mean")
+    :param slices: dictionary of parameter name to the value it is fixed to. A value of "All" (or None) aggregates
+    across the parameter
+    :return: plotly figure
+    """
+    if x_name == y_name:
+        fig = go.Figure()
+        fig.update_layout(title_text="Choose two different parameters")
+        return fig
+    # Filter to the slice
+    mask = numpy.ones(len(results_table), dtype=bool)
+    if slices is not None:
+        for name, value in slices.items():
+            if value is not None and value != "All" and name not in (x_name, y_name):
+                mask &= (results_table[name] == value).values
+    selected = results_table[mask]
+    # Aggregate each cell
+    surface = selected.groupby([y_name, x_name], sort=True)[metric].agg(aggregation).unstack(x_name)
+    fig = go.Figure(data=[go.Heatmap(
+        x=surface.columns.tolist(),
+        y=surface.index.tolist(),
+        z=surface.values,
+        colorscale="RdYlGn",
+        colorbar=dict(title=f"{aggregation} {metric}")
+    )])
+    fig.update_layout(
+        title_text=f"{aggregation} {metric} by {x_name} and {y_name} ({len(selected)} backtests)",
+        xaxis_title=x_name,
+        yaxis_title=y_name
+    )
+    return fig
+
+
+# Function to downsample candlesticks
+def downsample_ohlc(dataframe, max_points=default_max_points):
+    """
+    Function to downsample candlesticks into at most max_points candles. Each output candle covers a bucket of
+    consecutive input candles, keeping the first open, highest high, lowest low and last close, so no price extreme
+    is lost.
+    :param dataframe: dataframe with human_time, open, high, low and close columns
+    :param max_points: integer of the maximum number of candles. None returns the dataframe unchanged
+    :return: dataframe of candlesticks
+    """
+    number_of_candles = len(dataframe)
+    if max_points is None or number_of_candles <= max_points:
+        return dataframe
+    # Work out where each bucket starts and ends
+    bucket_size = int(numpy.ceil(number_of_candles / max_points))
+    starts = numpy.arange(0, number_of_candles, bucket_size)
+    ends = numpy.append(starts[1:], number_of_candles) - 1
+    # Aggregate each bucket
+    downsampled = pandas.DataFrame({
+        "human_time": dataframe["human_time"].values[starts],
+        "open": dataframe["open"].values[starts],
+        "high": numpy.maximum.reduceat(dataframe["high"].values, starts),
+        "low": numpy.minimum.reduceat(dataframe["low"].values, starts),
+        "close": dataframe["close"].values[ends]
+    })
+    return downsampled
+
+
+# Function to downsample a line
+def downsample_line(dataframe, dataframe_column, max_points=default_max_points):
+    """
+    Function to downsample a line into at most max_points points. Each bucket of consecutive points is reduced to its
+    minimum and maximum (in time order), so spikes are still visible.
+    :param dataframe: dataframe with a human_time column
+    :param dataframe_column: string of the column to downsample
+    :param max_points: integer of the maximum number of points. None returns every point
+    :return: tuple of the x values and y values
+    """
+    x_values = dataframe["human_time"].values
+    y_values = dataframe[dataframe_column].values.astype(float)
+    number_of_points = len(y_values)
+    if max_points is None or number_of_points <= max_points:
+        return x_values, y_values
+    # Each bucket produces two points
+    bucket_size = int(numpy.ceil(number_of_points / max(max_points // 2, 1)))
+    number_of_buckets = int(numpy.ceil(number_of_points / bucket_size))
+    # Pad the values so they can be reshaped into one row per bucket. NaN values (i.e. the start of an indicator) are
+    # never chosen unless the whole bucket is NaN
+    padded = numpy.full(number_of_buckets * bucket_size, numpy.nan)
+    padded[:number_of_points] = y_values
+    buckets = padded.reshape(number_of_buckets, bucket_size)
+    minimum_index = numpy.argmin(numpy.where(numpy.isnan(buckets), numpy.inf, buckets), axis=1)
+    maximum_index = numpy.argmax(numpy.where(numpy.isnan(buckets), -numpy.inf, buckets), axis=1)
+    # Keep the minimum and maximum of each bucket in time order
+    offsets = numpy.arange(number_of_buckets) * bucket_size
+    indexes = numpy.sort(numpy.stack([minimum_index, maximum_index], axis=1), axis=1) + offsets[:, None]
+    indexes = numpy.minimum(indexes.ravel(), number_of_points - 1)
+    return x_values[indexes], y_values[indexes]
+
+
 # Function to construct base candlestick graph
-def construct_base_candlestick_graph(dataframe, candlestick_title):
+def construct_base_candlestick_graph(dataframe, candlestick_title, max_points=None):
     """
     Function to construct base candlestick graph
     :param candlestick_title: String
     :param dataframe: Pandas dataframe object
+    :param max_points: integer of the maximum number of candles to render. Longer dataframes are downsampled with
+    downsample_ohlc. Defaults to None (every candle)
     :return: plotly figure
     """
+    # Downsample the candles if needed
+    dataframe = downsample_ohlc(dataframe, max_points)
     # Construct the figure
     fig = go.Figure(data=[go.Candlestick(
         x=dataframe['human_time'],
@@ -184,50 +539,62 @@ def add_bar_to_graph(base_fig, dataframe, dataframe_column, bar_name, layer=Fals
 
 
 # Function to display a MACD indicator
-def display_macd_indicator(dataframe, title):
+def display_macd_indicator(dataframe, title, max_points=None):
     """
     Function to display a MACD indicator
     :param dataframe: dataframe with all values
     :param title: Title of the data
+    :param max_points: integer of the maximum number of points per trace. When set, the candles and indicator are
+    downsampled and the indicator lines are drawn with WebGL (Scattergl). Defaults to None (every point)
     :return: figure with all data
     """
+    # Choose the line trace. WebGL handles far more points than SVG
+    if max_points is None:
+        line_trace = go.Scatter
+    else:
+        line_trace = go.Scattergl
+    # Downsample the candles if needed
+    candles = downsample_ohlc(dataframe, max_points)
     # Set up the figure
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     # Add in the candlesticks for the original data
     fig = fig.add_trace(
         go.Candlestick(
-            x=dataframe['human_time'],
-            open=dataframe['open'],
-            high=dataframe['high'],
-            close=dataframe['close'],
-            low=dataframe['low'],
+            x=candles['human_time'],
+            open=candles['open'],
+            high=candles['high'],
+            close=candles['close'],
+            low=candles['low'],
             name=title
         ),
         secondary_y=False
     )
     # Add in the MACD line
+    x_values, y_values = downsample_line(dataframe, "macd", max_points)
     fig = fig.add_trace(
-        go.Scatter(
-            x=dataframe['human_time'],
-            y=dataframe['macd'],
+        line_trace(
+            x=x_values,
+            y=y_values,
             name="MACD"
         ),
         secondary_y=True
     )
     # Add in the MACD signal line
+    x_values, y_values = downsample_line(dataframe, "macd_signal", max_points)
     fig = fig.add_trace(
-        go.Scatter(
-            x=dataframe['human_time'],
-            y=dataframe['macd_signal'],
+        line_trace(
+            x=x_values,
+            y=y_values,
             name="MACD Signal"
         ),
         secondary_y=True
     )
     # Add in the MACD histogram
+    x_values, y_values = downsample_line(dataframe, "macd_histogram", max_points)
     fig = fig.add_trace(
         go.Bar(
-            x=dataframe['human_time'],
-            y=dataframe['macd_histogram'],
+            x=x_values,
+            y=y_values,
             name="MACD Histogram"
         ),
         secondary_y=True
@@ -326,49 +693,72 @@ def add_proposed_trades_to_graph(dataframe):
     return fig
 
 
+# Function to create None separated line segments
+def create_segments(x_points, y_points):
+    """
+    Function to join several shapes into a single trace. Each row of the inputs is one shape, and a None is added
+    after each shape so plotly doesn't join it to the next one
+    :param x_points: 2D numpy array of x values with one row per shape
+    :param y_points: 2D numpy array of y values with one row per shape
+    :return: tuple of the x list and y list
+    """
+    # Nanosecond datetimes become integers when converted to objects, so convert via microseconds to keep datetimes
+    if numpy.issubdtype(x_points.dtype, numpy.datetime64):
+        x_points = x_points.astype("datetime64[us]")
+    # Add a column of None to the end of each row, then flatten into a single list
+    separator = numpy.full((len(x_points), 1), None, dtype=object)
+    x_values = numpy.hstack([x_points.astype(object), separator]).ravel()
+    y_values = numpy.hstack([y_points.astype(object), separator]).ravel()
+    return x_values, y_values
+
+
 # Function to add trades to graph
 def add_trades_to_graph(proposed_trades_dataframe, base_fig):
-    # Create a point plot list
-    point_plot = []
+    """
+    Function to add the proposed trades to a graph as rectangles from the stop loss to the take profit, running from
+    the signal until the order is cancelled. All buys are drawn as one trace and all sells as another
+    :param proposed_trades_dataframe: dataframe of proposed trades
+    :param base_fig: plotly figure
+    :return: updated plotly figure
+    """
     # Create the colors
-    buy_color = "blue"
-    sell_color = "purple"
-    # Add each set of trades
-    for index, row in proposed_trades_dataframe.iterrows():
-        # Set the colour
-        if row['order_type'] == "BUY_STOP":
-            color = buy_color
+    colors = {
+        "BUY_STOP": "blue",
+        "SELL_STOP": "purple"
+    }
+    for order_type, color in colors.items():
+        # Anything which isn't a buy is drawn as a sell
+        if order_type == "BUY_STOP":
+            trades = proposed_trades_dataframe[proposed_trades_dataframe['order_type'] == "BUY_STOP"]
         else:
-            color = sell_color
-        # Add in the stop loss and take profit
-        base_fig.add_shape(
-            type="rect",
-            x0=row['human_time'],
-            y0=row['stop_loss'],
-            x1=row['cancel_time'],
-            y1=row['take_profit'],
-            line=dict(
-                color=color,
-                width=2
-            )
+            trades = proposed_trades_dataframe[proposed_trades_dataframe['order_type'] != "BUY_STOP"]
+        if len(trades) == 0:
+            continue
+        # Trace each rectangle: bottom left, bottom right, top right, top left, back to bottom left
+        start_time = trades['human_time'].values
+        end_time = trades['cancel_time'].values
+        stop_loss = trades['stop_loss'].values
+        take_profit = trades['take_profit'].values
+        x_values, y_values = create_segments(
+            numpy.column_stack([start_time, end_time, end_time, start_time, start_time]),
+            numpy.column_stack([stop_loss, stop_loss, take_profit, take_profit, stop_loss])
         )
-        """
-        # Add in the stop price
-        base_fig.add_shape(
-            type="line",
-            x0=row['human_time'],
-            x1=row['human_time'],
-            y0=row['stop_price'],
-            line=dict(
-                color=color,
-                width=2
+        base_fig.add_trace(
+            go.Scatter(
+                x=x_values,
+                y=y_values,
+                mode="lines",
+                name=order_type,
+                line=dict(
+                    color=color,
+                    width=2
+                )
             )
         )
-        """
-        base_fig.update_layout(
-            xaxis_rangeslider_visible=False,
-            autosize=True,
-        )
+    base_fig.update_layout(
+        xaxis_rangeslider_visible=False,
+        autosize=True,
+    )
     return base_fig
 
 
@@ -392,60 +782,58 @@ def completed_trades(raw_candles, backtest_results):
         autosize=True,
     )
     fig.update_yaxes(automargin=True)
-    # Extract the winning Trades
-    winning_trades = backtest_results['win_objects']
-    # Iterate through each winning trade and add it to the plot
-    for index, trade in enumerate(winning_trades):
-        if index == 0:
-            fig = fig.add_trace(
-                go.Scatter(
-                    x=[trade['trade_open_time'], trade['closing_time']],
-                    y=[trade['closing_stop_price'], trade['closing_price']],
-                    name="Winning Trades",
-                    legendgroup="winning_trades",
-                    line=dict(color="blue")
-                )
-            )
-        else:
-            fig = fig.add_trace(
-                go.Scatter(
-                    x=[trade['trade_open_time'], trade['closing_time']],
-                    y=[trade['closing_stop_price'], trade['closing_price']],
-                    name="Winning Trades",
-                    legendgroup="winning_trades",
-                    line=dict(color="blue"),
-                    showlegend=False
-                )
-            )
-    # Extract the losing Trades
-    losing_trades = backtest_results['loss_objects']
-    # Iterate through each losing trade and add it to the plot
-    for index, trade in enumerate(losing_trades):
-        if index == 0:
-            fig = fig.add_trace(
-                go.Scatter(
-                    x=[trade['trade_open_time'], trade['closing_time']],
-                    y=[trade['closing_stop_price'], trade['closing_price']],
-                    name="Losing Trades",
-                    legendgroup="losing_trades",
-                    line=dict(color="red")
-                )
-            )
-        else:
-            fig = fig.add_trace(
-                go.Scatter(
-                    x=[trade['trade_open_time'], trade['closing_time']],
-                    y=[trade['closing_stop_price'], trade['closing_price']],
-                    name="Losing Trades",
-                    legendgroup="losing_trades",
-                    line=dict(color="red"),
-                    showlegend=False
-                )
-            )
+    # Add the winning and losing trades, each as a single trace
+    fig = add_completed_trades_to_graph(
+        base_fig=fig,
+        trades=backtest_results['win_objects'],
+        trace_name="Winning Trades",
+        legend_group="winning_trades",
+        color="blue"
+    )
+    fig = add_completed_trades_to_graph(
+        base_fig=fig,
+        trades=backtest_results['loss_objects'],
+        trace_name="Losing Trades",
+        legend_group="losing_trades",
+        color="red"
+    )
     # Return the figure
     return fig
 
 
+# Function to add a list of completed trades to a graph
+def add_completed_trades_to_graph(base_fig, trades, trace_name, legend_group, color):
+    """
+    Function to add a list of completed trades to a graph as a single trace, with a line from the entry to the exit
+    of each trade
+    :param base_fig: plotly figure
+    :param trades: list of trade objects from the backtest
+    :param trace_name: string of the trace name
+    :param legend_group: string of the legend group
+    :param color: string of the line color
+    :return: updated plotly figure
+    """
+    if len(trades) == 0:
+        return base_fig
+    trades = pandas.DataFrame(trades, columns=['trade_open_time', 'closing_time', 'closing_stop_price',
+                                               'closing_price'])
+    x_values, y_values = create_segments(
+        trades[['trade_open_time', 'closing_time']].values,
+        trades[['closing_stop_price', 'closing_price']].values
+    )
+    base_fig = base_fig.add_trace(
+        go.Scatter(
+            x=x_values,
+            y=y_values,
+            mode="lines",
+            name=trace_name,
+            legendgroup=legend_group,
+            line=dict(color=color)
+        )
+    )
+    return base_fig
+
+
 # Convert a dataframe into a table
 def dataframe_to_table(dataframe, title):
     """
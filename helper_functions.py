@@ -1,9 +1,12 @@
+import numpy
+
 import mt5_lib
 import binance_lib
 
 
 # Function to calculate FOREX lot size on MT5
-def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange="mt5", my_currency="USD", pip_size=None, base_currency=None):
+def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange="mt5", my_currency="USD", pip_size=None,
+                  base_currency=None, registry=None):
     """
     Function to calculate a lot size (or volume) for a FOREX trade on MT5. The balance is passed as a static amount,
     any compounding is taken care of in the parent function.
@@ -12,6 +15,8 @@ def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange=
     :param stop_loss: float of the stop_loss
     :param stop_price: float of the stop_price
     :param symbol: string of the symbol
+    :param registry: dictionary of the MT5 symbol registry to look up the pip size, base currency and exchange rate in.
+    Defaults to the mt5_lib registry
     :return: float of the lot_size
     """
     # Make sure symbol has any denotation of raw removed
@@ -23,7 +28,7 @@ def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange=
         pass
     else:
         # Get the exchange rate
-        exchange_rate = mt5_lib.get_exchange_rate(symbol=my_currency + "USD")
+        exchange_rate = mt5_lib.get_exchange_rate(symbol=my_currency + "USD", registry=registry)
         balance = balance * exchange_rate
 
     # Calculate the amount to risk
@@ -36,8 +41,8 @@ def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange=
     # Get the pip size
     if pip_size is None:
         if exchange == "mt5":
-            pip_size = mt5_lib.get_pip_size(symbol=symbol)
-            base_currency = mt5_lib.get_base_currency(symbol=symbol)
+            pip_size = mt5_lib.get_pip_size(symbol=symbol, registry=registry)
+            base_currency = mt5_lib.get_base_currency(symbol=symbol, registry=registry)
         else:
             raise ValueError("Exchange not supported")
     # Branch based on profit currency
@@ -72,6 +77,93 @@ def calc_lot_size(balance, risk_amount, stop_loss, stop_price, symbol, exchange=
         lot_size = 9.99
     return lot_size
 
+# Function to calculate FOREX lot sizes for a batch of trades on MT5
+def calc_lot_sizes(balance, risk_amount, stop_loss, stop_price, symbol, exchange="mt5", my_currency="USD",
+                   pip_size=None, base_currency=None, registry=None):
+    """
+    Function to calculate the lot sizes for a batch of FOREX trades on MT5 in one pass. Gives the same lot size as
+    calc_lot_size for each trade, including the rounding and the 9.99 cap.
+    :param balance: float, or array of floats, of the balance being risked for each trade
+    :param risk_amount: float, or array of floats, of the amount to risk
+    :param stop_loss: array of the stop_loss of each trade
+    :param stop_price: array of the stop_price of each trade
+    :param symbol: string of the symbol, or array of the symbol of each trade
+    :param exchange: string of the exchange. Only "mt5" is supported
+    :param my_currency: string of the account currency
+    :param pip_size: float of the pip size. Only used when every trade is for the same symbol
+    :param base_currency: string of the base currency. Must be specified along with pip_size
+    :param registry: dictionary of the MT5 symbol registry. Defaults to the mt5_lib registry
+    :return: numpy array of the lot sizes
+    """
+    stop_loss = numpy.asarray(stop_loss, dtype=float)
+    stop_price = numpy.asarray(stop_price, dtype=float)
+    balance = numpy.broadcast_to(numpy.asarray(balance, dtype=float), stop_price.shape)
+
+    # Get USD equivalent of balance
+    if my_currency != "USD":
+        exchange_rate = mt5_lib.get_exchange_rate(symbol=my_currency + "USD", registry=registry)
+        balance = balance * exchange_rate
+
+    # Calculate the amount to risk
+    amount_to_risk = balance * risk_amount
+
+    # Raise an error if pip_size is not None and base_currency is None
+    if pip_size is not None and base_currency is None:
+        raise ValueError("If pip_size is not None, base_currency must also be specified")
+
+    # Work out the pip size and lot size conversion of each symbol once, then spread them across the trades
+    if isinstance(symbol, str):
+        unique_symbols = [symbol]
+        symbol_index = numpy.zeros(stop_price.shape, dtype=int)
+    else:
+        if pip_size is not None:
+            raise ValueError("pip_size can only be specified when every trade is for the same symbol")
+        unique_symbols, symbol_index = numpy.unique(numpy.asarray(symbol), return_inverse=True)
+        symbol_index = symbol_index.reshape(stop_price.shape)
+    pip_sizes = numpy.empty(len(unique_symbols))
+    multipliers = numpy.ones(len(unique_symbols))
+    divisors = numpy.full(len(unique_symbols), 10.0)
+    for index, unique_symbol in enumerate(unique_symbols):
+        symbol_pip_size = pip_size
+        symbol_base_currency = base_currency
+        # Get the pip size
+        if symbol_pip_size is None:
+            if exchange == "mt5":
+                symbol_pip_size = mt5_lib.get_pip_size(symbol=unique_symbol, registry=registry)
+                symbol_base_currency = mt5_lib.get_base_currency(symbol=unique_symbol, registry=registry)
+            else:
+                raise ValueError("Exchange not supported")
+        pip_sizes[index] = symbol_pip_size
+        # Branch based on profit currency, as calc_lot_size does
+        symbol_name = str(unique_symbol).split(".")[0]
+        if symbol_base_currency == "USD":
+            if symbol_name == "USDJPY":
+                divisors[index] = 1000
+            elif symbol_name == "ETHUSD":
+                multipliers[index] = 100
+                divisors[index] = 1
+
+    # Calculate the amount of pips being risked
+    stop_pips_integer = numpy.abs((stop_price - stop_loss) / pip_sizes[symbol_index])
+    # Calculate the pip value
+    pip_value = amount_to_risk / stop_pips_integer
+    # Calculate the raw lot size
+    raw_lot_size = pip_value * multipliers[symbol_index] / divisors[symbol_index]
+
+    # Round to 2 decimal places. numpy rounds by scaling, which can differ from round() when the scaled value lands
+    # within a hair of a half, so those few values are rounded with round()
+    lot_size = numpy.round(raw_lot_size, 2)
+    scaled_remainder = numpy.abs(numpy.abs(raw_lot_size * 100) % 1 - 0.5)
+    near_half = numpy.flatnonzero(scaled_remainder < 1e-6)
+    flat_lot_size = lot_size.reshape(-1)
+    flat_raw_lot_size = raw_lot_size.reshape(-1)
+    for index in near_half:
+        flat_lot_size[index] = round(float(flat_raw_lot_size[index]), 2)
+    # Add in a quick catch to make sure lot size isn't extreme
+    lot_size[lot_size >= 10] = 9.99
+    return lot_size
+
+
 # Get Data function
 # todo: Update this accept a timerange
 def get_data(symbol, timeframe, exchange="mt5", ):
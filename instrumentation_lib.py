@@ -0,0 +1,173 @@
+import contextlib
+import copy
+import datetime
+import json
+import os
+import time
+
+
+# Profile for the current process. Each worker process has its own copy, which is returned to the parent process
+# alongside each result and merged there
+profile = {
+    "stages": {},
+    "counters": {}
+}
+
+
+# Function to reset the profile for the current process
+def reset_profile():
+    """
+    Function to reset the profile for the current process
+    :return: None
+    """
+    profile["stages"] = {}
+    profile["counters"] = {}
+
+
+# Function to retrieve a copy of the profile for the current process
+def get_profile():
+    """
+    Function to retrieve a copy of the profile for the current process
+    :return: dictionary of stages and counters
+    """
+    return copy.deepcopy(profile)
+
+
+# Function to record the duration of a stage
+def record_stage(stage_name, duration):
+    """
+    Function to record a single timing against a stage
+    :param stage_name: string of the stage name
+    :param duration: float of the number of seconds the stage took
+    :return: None
+    """
+    stage = profile["stages"].get(stage_name)
+    if stage is None:
+        profile["stages"][stage_name] = {
+            "count": 1,
+            "total": duration,
+            "min": duration,
+            "max": duration
+        }
+    else:
+        stage["count"] += 1
+        stage["total"] += duration
+        stage["min"] = min(stage["min"], duration)
+        stage["max"] = max(stage["max"], duration)
+
+
+# Context manager to time a stage
+@contextlib.contextmanager
+def stage_timer(stage_name):
+    """
+    Context manager to time a block of code and record it against a stage. Stages can be nested, in which case the
+    outer stage includes the time of the inner stage.
+    :param stage_name: string of the stage name
+    :return: None
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start_time)
+
+
+# Function to increment a counter
+def increment_counter(counter_name, amount=1):
+    """
+    Function to increment a counter in the profile
+    :param counter_name: string of the counter name
+    :param amount: number to add to the counter
+    :return: None
+    """
+    profile["counters"][counter_name] = profile["counters"].get(counter_name, 0) + amount
+
+
+# Function to merge another profile into the profile for the current process
+def merge_profile(other_profile):
+    """
+    Function to merge a profile (usually returned from a worker process) into the profile for the current process
+    :param other_profile: dictionary of stages and counters
+    :return: None
+    """
+    for stage_name, other_stage in other_profile["stages"].items():
+        stage = profile["stages"].get(stage_name)
+        if stage is None:
+            profile["stages"][stage_name] = dict(other_stage)
+        else:
+            stage["count"] += other_stage["count"]
+            stage["total"] += other_stage["total"]
+            stage["min"] = min(stage["min"], other_stage["min"])
+            stage["max"] = max(stage["max"], other_stage["max"])
+    for counter_name, amount in other_profile["counters"].items():
+        increment_counter(counter_name, amount)
+
+
+# Function to run a task in a worker process and return its profile
+def run_profiled_task(task):
+    """
+    Function to run a task inside a worker process and return the profile recorded while it ran. Takes a single
+    argument so it can be used with Pool.imap, which reports progress as each task completes.
+    :param task: tuple of (function, args)
+    :return: tuple of the function result and the profile recorded while it ran
+    """
+    function, args = task
+    # Start each task with an empty profile, so nothing is counted twice when the parent merges it
+    reset_profile()
+    result = function(*args)
+    return result, get_profile()
+
+
+# Function to print a summary of a profile
+def print_profile_summary(sweep_profile, wall_time, tasks, processes):
+    """
+    Function to print a per-stage summary of a sweep
+    :param sweep_profile: dictionary of stages and counters
+    :param wall_time: float of the number of seconds the whole sweep took
+    :param tasks: integer of the number of backtests run
+    :param processes: integer of the number of worker processes used
+    :return: None
+    """
+    print("Sweep profile")
+    print(f"{'Stage':<28}{'Count':>10}{'Total (s)':>14}{'Mean (ms)':>14}{'Max (ms)':>14}")
+    # Sort stages so the most expensive is printed first
+    stages = sorted(sweep_profile["stages"].items(), key=lambda item: item[1]["total"], reverse=True)
+    for stage_name, stage in stages:
+        mean = stage["total"] / stage["count"] * 1000
+        print(f"{stage_name:<28}{stage['count']:>10}{stage['total']:>14.3f}{mean:>14.3f}{stage['max'] * 1000:>14.3f}")
+    for counter_name, amount in sorted(sweep_profile["counters"].items()):
+        print(f"{counter_name:<28}{amount:>10}")
+    # Throughput
+    if wall_time > 0:
+        print(f"Wall time: {wall_time:.2f}s, {tasks} backtests, {tasks / wall_time:.2f} backtests/s across "
+              f"{processes} processes")
+
+
+# Function to write a profile to a JSON file
+def write_profile(sweep_profile, file_path, wall_time, tasks, processes, metadata=None):
+    """
+    Function to write a machine-readable profile of a sweep to a JSON file
+    :param sweep_profile: dictionary of stages and counters
+    :param file_path: string of the location to write the profile
+    :param wall_time: float of the number of seconds the whole sweep took
+    :param tasks: integer of the number of backtests run
+    :param processes: integer of the number of worker processes used
+    :param metadata: dictionary of any extra information to record with the profile (i.e. strategy, symbols)
+    :return: None
+    """
+    output = {
+        "created": datetime.datetime.now().isoformat(),
+        "wall_time": wall_time,
+        "tasks": tasks,
+        "processes": processes,
+        "throughput": tasks / wall_time if wall_time > 0 else None,
+        "metadata": metadata if metadata is not None else {},
+        "stages": sweep_profile["stages"],
+        "counters": sweep_profile["counters"]
+    }
+    # Make sure the folder exists
+    folder = os.path.dirname(file_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(output, f, indent=4, default=str)
@@ -0,0 +1,117 @@
+import collections
+import threading
+
+
+# Function to create a live feed
+def create_live_feed(indicator_names=(), max_items=5000):
+    """
+    Function to create a live feed. The feed is an in-memory buffer of the latest candles, indicator values and trades
+    published by a running strategy, which a dashboard polls for anything new. Each item is stamped with a sequence
+    number so a reader only ever receives the items it hasn't seen. The buffers are bounded, so memory use stays flat
+    however long the session runs.
+    :param indicator_names: list of the indicator columns to be published (i.e. ["macd", "macd_signal"])
+    :param max_items: integer of the maximum number of items kept in each buffer
+    :return: dictionary of the live feed
+    """
+    return {
+        "lock": threading.Lock(),
+        "sequence": 0,
+        "indicator_names": list(indicator_names),
+        "candles": collections.deque(maxlen=max_items),
+        "indicators": collections.deque(maxlen=max_items),
+        "trades": collections.deque(maxlen=max_items)
+    }
+
+
+# Function to add an item to one of the buffers of a live feed
+def publish(feed, buffer_name, item):
+    """
+    Function to add an item to one of the buffers of a live feed
+    :param feed: dictionary of the live feed
+    :param buffer_name: string of the buffer. One of "candles", "indicators" or "trades"
+    :param item: dictionary of the item
+    :return: integer of the sequence number of the item
+    """
+    with feed["lock"]:
+        feed["sequence"] += 1
+        feed[buffer_name].append((feed["sequence"], item))
+        return feed["sequence"]
+
+
+# Function to publish a closed candle
+def publish_candle(feed, human_time, open_price, high_price, low_price, close_price):
+    """
+    Function to publish a closed candle to a live feed
+    :param feed: dictionary of the live feed
+    :param human_time: datetime of the candle
+    :param open_price: float of the open
+    :param high_price: float of the high
+    :param low_price: float of the low
+    :param close_price: float of the close
+    :return: integer of the sequence number
+    """
+    return publish(feed, "candles", {
+        "human_time": human_time,
+        "open": float(open_price),
+        "high": float(high_price),
+        "low": float(low_price),
+        "close": float(close_price)
+    })
+
+
+# Function to publish indicator values
+def publish_indicators(feed, human_time, values):
+    """
+    Function to publish the indicator values for a candle to a live feed. Only the indicators the feed was created
+    with are kept
+    :param feed: dictionary of the live feed
+    :param human_time: datetime of the candle
+    :param values: dictionary (or pandas Series) of indicator name to value
+    :return: integer of the sequence number
+    """
+    item = {"human_time": human_time}
+    for name in feed["indicator_names"]:
+        item[name] = float(values[name]) if name in values else None
+    return publish(feed, "indicators", item)
+
+
+# Function to publish a trade
+def publish_trade(feed, human_time, price, order_type, description=""):
+    """
+    Function to publish a trade (i.e. an order being filled or a position closing) to a live feed
+    :param feed: dictionary of the live feed
+    :param human_time: datetime of the trade
+    :param price: float of the trade price
+    :param order_type: string of "BUY" or "SELL"
+    :param description: string shown when hovering over the trade
+    :return: integer of the sequence number
+    """
+    return publish(feed, "trades", {
+        "human_time": human_time,
+        "price": float(price),
+        "order_type": order_type,
+        "description": description
+    })
+
+
+# Function to retrieve everything published since a sequence number
+def get_updates(feed, since_sequence=0):
+    """
+    Function to retrieve every item published to a live feed after a sequence number. The buffers are read from
+    newest to oldest and stop at the first item already seen, so the cost depends only on the number of new items
+    :param feed: dictionary of the live feed
+    :param since_sequence: integer of the last sequence number the reader has seen
+    :return: dictionary with the latest sequence number and a list of new items for each buffer (oldest first)
+    """
+    updates = {}
+    with feed["lock"]:
+        for buffer_name in ["candles", "indicators", "trades"]:
+            items = []
+            for sequence, item in reversed(feed[buffer_name]):
+                if sequence <= since_sequence:
+                    break
+                items.append(item)
+            items.reverse()
+            updates[buffer_name] = items
+        updates["sequence"] = feed["sequence"]
+    return updates
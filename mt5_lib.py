@@ -1,8 +1,39 @@
-import MetaTrader5
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
 import pandas
 import datetime
 from dateutil.relativedelta import relativedelta
 
+import instrumentation_lib
+
+# Select the MetaTrader 5 implementation at import time. Setting the environment variable MT5_SIMULATOR=1 uses the
+# offline simulator in mt5_simulator.py, so the bot can be tested and benchmarked without a MetaTrader 5 terminal
+if os.environ.get("MT5_SIMULATOR", "").lower() in ["1", "true", "yes"]:
+    import mt5_simulator as MetaTrader5
+else:
+    import MetaTrader5
+
+# Single worker thread which sends every batch of order requests to the terminal, so batches from different threads
+# never interleave. Created on first use
+order_executor = None
+# Number of seconds symbol metadata is kept before being refreshed from the terminal. None never refreshes
+symbol_registry_ttl = 300
+# Symbol metadata registry used when one isn't passed in. Loaded on first use
+symbol_registry = None
+# Largest number of historic data queries sent to the terminal at once
+historic_query_threads = 8
+# Number of minutes in each candle of the timeframes with a fixed length. Every length divides a day, so candles line
+# up with midnight. W1 candles open on Sunday and MN1 candles on the first day of the month (see get_candle_start_times)
+timeframe_minutes = {
+    "M1": 1, "M2": 2, "M3": 3, "M4": 4, "M5": 5, "M6": 6, "M10": 10, "M12": 12, "M15": 15, "M20": 20, "M30": 30,
+    "H1": 60, "H2": 120, "H3": 180, "H4": 240, "H6": 360, "H8": 480, "H12": 720, "D1": 1440, "W1": 10080
+}
+# Number of seconds from the epoch (a Thursday) to the first Sunday, when W1 candles open
+weekly_candle_offset = 3 * 86400
+
 
 # Function to start MetaTrader 5
 def start_mt5(project_settings):
@@ -53,23 +84,20 @@ def start_mt5(project_settings):
 
 
 # Function to initalize a symbol
-def initialize_symbol(symbol):
+def initialize_symbol(symbol, registry=None):
     """
     MT5 requires symbols to be initialized before they can be queried. This function does that.
     :param symbol: string of symbol (include the symbol name for raw if needed. For instance, IC Markets uses .a to
     indicate raw)
+    :param registry: dictionary of the symbol registry to check the symbol against. Defaults to the module registry
     :return: Boolean. True if initialized, False if not.
     """
     # Check if symbol exists on MT5
-    # Get all symbols from MT5
-    all_symbols = MetaTrader5.symbols_get()
-    # Create a list of the symbol names
-    symbol_names = []
-    # Iterate through the retrieved data and add the symbol names to the list
-    for sym in all_symbols:
-        symbol_names.append(sym.name)
-    # Check the symbol string to see if it exists in symbol_names
-    if symbol in symbol_names:
+    # Get the set of symbol names from the symbol registry, rather than retrieving every symbol from MT5 each time
+    if registry is None:
+        registry = get_symbol_registry()
+    # Check the symbol string to see if it exists in the symbol names
+    if symbol in registry["names"]:
         # If the symbol does exist, attempt to initalize/enable
         try:
             MetaTrader5.symbol_select(symbol, True) # <- arguments cannot be declared here or will throw an error
@@ -87,13 +115,17 @@ def initialize_symbol(symbol):
 # Function to enable all the symbols in settings.json. This means you can trade more than one currency pair!
 def enable_all_symbols(symbol_array):
     """
-    Function to enable a list of symbols
+    Function to enable a list of symbols. The symbol registry is loaded for the symbols at the same time, so their
+    metadata is ready before the first trade
     :param symbol_array: list of symbols.
     :return: Boolean. True if enabled, False if not.
     """
+    global symbol_registry
+    # Load the symbol registry for the symbols. This retrieves every symbol from MT5 once
+    symbol_registry = create_symbol_registry(symbols=symbol_array)
     # Iterate through the list and enable
     for symbol in symbol_array:
-        init = initialize_symbol(symbol=symbol)
+        init = initialize_symbol(symbol=symbol, registry=symbol_registry)
         if init is False:
             return False
 
@@ -101,20 +133,148 @@ def enable_all_symbols(symbol_array):
     return True
 
 
-# Function to place an order on MT5
-def place_order(order_type, symbol, volume, stop_loss, take_profit, comment, direct=False, stop_price=0.00):
+# Function to create the metadata for a symbol
+def create_symbol_metadata(symbol_info):
     """
-    Function to place a trade on MetaTrader 5. Function checks the order first, as recommended by most traders. If it
-    passes the check, proceeds to place order
+    Function to convert the symbol information from MetaTrader 5 into a dictionary of the values used when trading.
+    Plain values are kept (rather than the MT5 object), so the metadata can be pickled. Only values which don't change
+    while trading are kept, as the registry is cached. Prices must always be queried live
+    :param symbol_info: symbol information from MetaTrader 5
+    :return: dictionary of the symbol metadata
+    """
+    return {
+        "name": symbol_info.name,
+        "pip_size": symbol_info.trade_tick_size * 10,
+        "tick_size": symbol_info.trade_tick_size,
+        "contract_size": symbol_info.trade_contract_size,
+        "currency_base": symbol_info.currency_base,
+        "currency_profit": symbol_info.currency_profit,
+        "digits": symbol_info.digits
+    }
+
+
+# Function to create a symbol registry
+def create_symbol_registry(symbols=None, ttl_seconds=symbol_registry_ttl):
+    """
+    Function to create a symbol registry. The registry holds the metadata (pip size, contract size, base currency etc)
+    of the configured symbols and a set of every symbol name on the terminal, all loaded from a single query to
+    MetaTrader 5. It is a plain dictionary, so it can be pickled into backtest workers.
+    :param symbols: list of symbols to load metadata for. None loads every symbol
+    :param ttl_seconds: integer of the number of seconds before the registry is refreshed. None never refreshes, which
+    should be used for a registry sent to a worker without a terminal connection
+    :return: dictionary of the symbol registry
+    """
+    registry = {
+        "names": set(),
+        "symbols": {},
+        "configured_symbols": None if symbols is None else list(symbols),
+        "ttl_seconds": ttl_seconds,
+        "loaded_time": None
+    }
+    return refresh_symbol_registry(registry)
+
+
+# Function to refresh a symbol registry
+def refresh_symbol_registry(registry):
+    """
+    Function to reload a symbol registry from MetaTrader 5. Any symbols added to the registry since it was created
+    are reloaded along with the configured symbols
+    :param registry: dictionary of the symbol registry
+    :return: dictionary of the symbol registry
+    """
+    with instrumentation_lib.stage_timer("mt5_symbols_get"):
+        all_symbols = MetaTrader5.symbols_get()
+    # Work out which symbols to keep metadata for
+    if registry["configured_symbols"] is None:
+        wanted_symbols = None
+    else:
+        wanted_symbols = set(registry["configured_symbols"]) | set(registry["symbols"])
+    names = set()
+    metadata = {}
+    for symbol_info in all_symbols:
+        names.add(symbol_info.name)
+        if wanted_symbols is None or symbol_info.name in wanted_symbols:
+            metadata[symbol_info.name] = create_symbol_metadata(symbol_info)
+    registry["names"] = names
+    registry["symbols"] = metadata
+    registry["loaded_time"] = time.time()
+    return registry
+
+
+# Function to get the module symbol registry
+def get_symbol_registry():
+    """
+    Function to get the symbol registry used when one isn't passed in, loading it on first use and refreshing it once
+    it has expired
+    :return: dictionary of the symbol registry
+    """
+    global symbol_registry
+    if symbol_registry is None:
+        symbol_registry = create_symbol_registry()
+    elif symbol_registry_expired(symbol_registry):
+        refresh_symbol_registry(symbol_registry)
+    return symbol_registry
+
+
+# Function to clear the module symbol registry
+def reset_symbol_registry():
+    """
+    Function to clear the module symbol registry, so it is reloaded on next use (i.e. after changing account)
+    :return: None
+    """
+    global symbol_registry
+    symbol_registry = None
+
+
+# Function to check if a symbol registry has expired
+def symbol_registry_expired(registry):
+    """
+    Function to check if a symbol registry is older than its time to live
+    :param registry: dictionary of the symbol registry
+    :return: Boolean. True if expired
+    """
+    if registry["ttl_seconds"] is None:
+        return False
+    return time.time() - registry["loaded_time"] > registry["ttl_seconds"]
+
+
+# Function to get the metadata of a symbol
+def get_symbol_metadata(symbol, registry=None):
+    """
+    Function to get the metadata of a symbol from a symbol registry. A symbol which isn't in the registry is loaded
+    from MetaTrader 5 and added, so it is only queried once
+    :param symbol: string of the symbol
+    :param registry: dictionary of the symbol registry. Defaults to the module registry
+    :return: dictionary of the symbol metadata
+    """
+    if registry is None:
+        registry = get_symbol_registry()
+    elif symbol_registry_expired(registry):
+        refresh_symbol_registry(registry)
+    metadata = registry["symbols"].get(symbol)
+    if metadata is None:
+        with instrumentation_lib.stage_timer("mt5_symbol_info"):
+            symbol_info = MetaTrader5.symbol_info(symbol)
+        if symbol_info is None:
+            raise ValueError(f"Symbol {symbol} does not exist")
+        metadata = create_symbol_metadata(symbol_info)
+        registry["symbols"][symbol] = metadata
+        registry["names"].add(symbol)
+    return metadata
+
+
+# Function to create an order request for MT5
+def create_order_request(order_type, symbol, volume, stop_loss, take_profit, comment, stop_price=0.00):
+    """
+    Function to create an order request dictionary in the format expected by MetaTrader 5
     :param order_type: String. Options are SELL_STOP, BUY_STOP
     :param symbol: String of the symbol to be traded
     :param volume: String or Float of the volume to be purchased
     :param stop_loss: String or Float of Stop_Loss price
     :param take_profit: String or Float of Take_Profit price
     :param comment: String of a comment.
-    :param direct: Boolean. Defaults to False. When true, bypasses the trade check
     :param stop_price: String or Float of the Stop Price
-    :return: Trade Outcome
+    :return: dictionary of the order request
     """
     # Massage the volume, stop_loss, take_profit and stop_prices
     # Volume can only be up to 2 decimal places on MT5
@@ -164,47 +324,67 @@ def place_order(order_type, symbol, volume, stop_loss, take_profit, comment, dir
     else:
         # This function can be expanded to accept all different types of values for buying/selling
         raise ValueError(f"Incorrect value for Order Type: {order_type}")
+    # Return the request
+    return request
 
-    # If direct is True, go straight to adding the order
-    if direct is True:
-        # Send the order to MT5
-        order_result = MetaTrader5.order_send(request)
-        # Notify based on the return outcomes
-        if order_result[0] == 10009:
-            print(f"Order for {symbol} successful")
-            return order_result[2]
-        # Notify the user if AutoTrading has been left on in MetaTrader 5
-        elif order_result[0] == 10027:
-            print("Turn off Algo Trading on MT5 Terminal")
-            raise Exception("Turn off Algo Trading on MT5 Terminal")
-        else:
-            # General catch all statement
-            print(f"Error placing order. Error Code {order_result[0]}, Error Details: {order_result}")
-            raise Exception("An error occurred placing an order")
-    # If direct turned off, check the order first
-    else:
-        # Check the order
-        result = MetaTrader5.order_check(request)
-        # If check passes, place an order
-        if result[0] == 0:
-            print(f"Order check for {symbol} successful. Placing the order") #<- This can be commented out.
-            # Place the order (little bit of recursion)
-            place_order(
-                order_type=order_type,
-                symbol=symbol,
-                volume=volume,
-                stop_price=stop_price,
-                stop_loss=stop_loss,
-                take_profit=take_profit,
-                comment=comment,
-                direct=True
-            )
+
+# Function to place an order on MT5
+def place_order(order_type, symbol, volume, stop_loss, take_profit, comment, direct=False, stop_price=0.00):
+    """
+    Function to place a trade on MetaTrader 5. Function checks the order first, as recommended by most traders. If it
+    passes the check, proceeds to place order. The order is sent through the order worker as a batch of one (see
+    place_orders)
+    :param order_type: String. Options are SELL_STOP, BUY_STOP
+    :param symbol: String of the symbol to be traded
+    :param volume: String or Float of the volume to be purchased
+    :param stop_loss: String or Float of Stop_Loss price
+    :param take_profit: String or Float of Take_Profit price
+    :param comment: String of a comment.
+    :param direct: Boolean. Defaults to False. When true, bypasses the trade check
+    :param stop_price: String or Float of the Stop Price
+    :return: Trade Outcome
+    """
+    # Check the order type before anything is sent, as place_orders would only record it in the result
+    create_order_request(
+        order_type=order_type,
+        symbol=symbol,
+        volume=volume,
+        stop_loss=stop_loss,
+        take_profit=take_profit,
+        comment=comment,
+        stop_price=stop_price
+    )
+    # Send the order to MT5
+    order_result = place_orders([{
+        "order_type": order_type,
+        "symbol": symbol,
+        "volume": volume,
+        "stop_loss": stop_loss,
+        "take_profit": take_profit,
+        "comment": comment,
+        "stop_price": stop_price
+    }], direct=direct)[0]
+    # If the check failed, the order was not sent
+    if not order_result['sent']:
         # Let the user know if an invalid price has been passed
-        elif result[0] == 100015:
+        if order_result['retcode'] == 100015:
             print(f"Invalid price passed for {symbol}")
         # Let user know if any other errors occurred
         else:
-            print(f"Order check failed. Details: {result}")
+            print(order_result['error'])
+        return None
+    # Notify based on the return outcomes
+    if order_result['success']:
+        print(f"Order for {symbol} successful")
+        return order_result['order']
+    # Notify the user if AutoTrading has been left on in MetaTrader 5
+    elif order_result['retcode'] == 10027:
+        print("Turn off Algo Trading on MT5 Terminal")
+        raise Exception("Turn off Algo Trading on MT5 Terminal")
+    else:
+        # General catch all statement
+        print(f"Error placing order. {order_result['error']}")
+        raise Exception("An error occurred placing an order")
 
 
 # Function to cancel an order
@@ -214,42 +394,21 @@ def cancel_order(order_number):
     :param order_number: int of the order number
     :return: Boolean. True means cancelled, False means not cancelled.
     """
-    # Create the request
-    request = {
-        "action": MetaTrader5.TRADE_ACTION_REMOVE,
-        "order": order_number,
-        "comment": "order removed"
-    }
-
-    # Attempt to send the order to MT5
-    try:
-        order_result = MetaTrader5.order_send(request)
-        if order_result[0] == 10009:
-            return True
-        else:
-            return False
-    except Exception as e:
-        print(f"Error cancelling order {order_number}. {e}")
-        # More advanced error handling is covered in later videos
-        return False
+    # Cancel the order through the order worker
+    order_result = cancel_orders([order_number])[0]
+    if order_result['error'] is not None and order_result['retcode'] is None:
+        print(f"Error cancelling order {order_number}. {order_result['error']}")
+    return order_result['success']
 
 
 # Function to cancel a list of open orders
 def cancel_all_orders(order_list):
     """
-    Function to cancel all open orders in a list
+    Function to cancel all open orders in a list. The cancellations are sent as one batch
     :param symbol_list: list of orders
     :return: Boolean. True if all are cancelled
     """
-    # Iterate through the list of order numbers
-    for order_number in order_list:
-        # Cancel each one
-        cancel = cancel_order(order_number)
-        # If an order is not cancelled, exit the function
-        if cancel is False:
-            return False
-    # If no exit event, return True
-    return True
+    return all(result['success'] for result in cancel_orders(order_list))
 
 
 # Function to retrieve all open orders from MT5
@@ -258,7 +417,7 @@ def get_all_open_orders():
     Function to retrieve all open orders from MetaTrader 5
     :return: list of orders
     """
-    return MetaTrader5.orders_get()
+    return run_order_task(MetaTrader5.orders_get)
 
 
 # Function to retrieve a filtered list of open orders from MT5
@@ -271,9 +430,9 @@ def get_filtered_list_of_orders(symbol, comment):
     :return: list of orders
     """
     # Retrieve open orders, filter by symbol
-    open_orders_by_symbol = MetaTrader5.orders_get(symbol)
+    open_orders_by_symbol = run_order_task(MetaTrader5.orders_get, symbol)
     # Check if any orders were retrieved (there might be none)
-    if open_orders_by_symbol is None:
+    if open_orders_by_symbol is None or len(open_orders_by_symbol) == 0:
         return []
     # Convert the returned orders into a dataframe
     open_orders_dataframe = pandas.DataFrame(list(open_orders_by_symbol), columns=open_orders_by_symbol[0]._asdict().keys())
@@ -288,6 +447,203 @@ def get_filtered_list_of_orders(symbol, comment):
     return open_orders
 
 
+# Function to get the order worker
+def get_order_executor():
+    """
+    Function to get the single worker thread which owns order traffic to MetaTrader 5, creating it on first use
+    :return: ThreadPoolExecutor with one worker
+    """
+    global order_executor
+    if order_executor is None:
+        order_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mt5_orders")
+    return order_executor
+
+
+# Function to run a function on the order worker
+def run_order_task(function, *args):
+    """
+    Function to run a function which talks to the MetaTrader 5 order book on the order worker, and wait for its result.
+    Every order query, placement and cancellation goes through here, so they never interleave between threads
+    :param function: function to run
+    :param args: arguments of the function
+    :return: the return value of the function
+    """
+    return get_order_executor().submit(function, *args).result()
+
+
+# Function to send a list of requests to MT5
+def send_requests(requests, check=True):
+    """
+    Function to send a list of requests to MetaTrader 5. Runs on the order worker. When checking, every request is
+    checked with order_check before any of them are sent, so the orders which pass are sent back to back rather than
+    each waiting on its own check. A failure only affects its own result
+    :param requests: list of request dictionaries. A request of None is skipped (i.e. it failed validation)
+    :param check: Boolean. When True, each request is checked with order_check before it is sent
+    :return: list of result dictionaries, in the same order as requests
+    """
+    results = [
+        {
+            "retcode": None,
+            "order": None,
+            "sent": False,
+            "success": False,
+            "error": None,
+            "check_time": 0.00,
+            "send_time": 0.00
+        }
+        for _ in requests
+    ]
+    # Check every order
+    ready = [request is not None for request in requests]
+    if check:
+        for index, request in enumerate(requests):
+            if not ready[index]:
+                continue
+            result = results[index]
+            start_time = time.perf_counter()
+            try:
+                check_result = MetaTrader5.order_check(request)
+                if check_result[0] != 0:
+                    result['retcode'] = check_result[0]
+                    result['error'] = f"Order check failed. Details: {check_result}"
+                    ready[index] = False
+            except Exception as e:
+                result['error'] = str(e)
+                ready[index] = False
+            result['check_time'] = time.perf_counter() - start_time
+    # Send every order which passed
+    for index, request in enumerate(requests):
+        if not ready[index]:
+            continue
+        result = results[index]
+        result['sent'] = True
+        start_time = time.perf_counter()
+        try:
+            order_result = MetaTrader5.order_send(request)
+            result['retcode'] = order_result[0]
+            if order_result[0] == 10009:
+                result['success'] = True
+                result['order'] = order_result[2]
+            elif order_result[0] == 10027:
+                result['error'] = "Turn off Algo Trading on MT5 Terminal"
+            else:
+                result['error'] = f"Error Code {order_result[0]}, Error Details: {order_result}"
+        except Exception as e:
+            result['error'] = str(e)
+        result['send_time'] = time.perf_counter() - start_time
+    return results
+
+
+# Function to place a batch of orders on MT5
+def place_orders(order_list, direct=False):
+    """
+    Function to place a batch of orders (i.e. a basket across symbols) on MetaTrader 5. Every order is validated and
+    turned into a request up front, then the whole batch is sent by the order worker in one pass
+    :param order_list: list of dictionaries, each with the arguments of place_order (order_type, symbol, volume,
+    stop_loss, take_profit, comment, stop_price)
+    :param direct: Boolean. Defaults to False. When true, bypasses the trade check
+    :return: list of result dictionaries in the same order as order_list, each with the symbol, comment, retcode,
+    order number, whether it was sent (i.e. passed the check), success, error and timings (in seconds)
+    """
+    batch_start_time = time.perf_counter()
+    # Validate each order
+    requests = []
+    errors = []
+    for order in order_list:
+        try:
+            requests.append(create_order_request(
+                order_type=order['order_type'],
+                symbol=order['symbol'],
+                volume=order['volume'],
+                stop_loss=order['stop_loss'],
+                take_profit=order['take_profit'],
+                comment=order['comment'],
+                stop_price=order.get('stop_price', 0.00)
+            ))
+            errors.append(None)
+        except (KeyError, ValueError) as e:
+            requests.append(None)
+            errors.append(f"Invalid order: {e}")
+    # Send the batch through the order worker
+    results = run_order_task(send_requests, requests, not direct)
+    # Add the details of each order to its result
+    for order, result, error in zip(order_list, results, errors):
+        result['symbol'] = order.get('symbol')
+        result['comment'] = order.get('comment')
+        result['order_type'] = order.get('order_type')
+        if error is not None:
+            result['error'] = error
+        result['batch_time'] = time.perf_counter() - batch_start_time
+    return results
+
+
+# Function to create a request to cancel an order
+def create_cancel_request(order_number):
+    """
+    Function to create a request to cancel an order, in the format expected by MetaTrader 5
+    :param order_number: int of the order number
+    :return: dictionary of the request
+    """
+    return {
+        "action": MetaTrader5.TRADE_ACTION_REMOVE,
+        "order": int(order_number),
+        "comment": "order removed"
+    }
+
+
+# Function to cancel a batch of orders on MT5
+def cancel_orders(order_numbers):
+    """
+    Function to cancel a batch of orders in one pass through the order worker. A failure doesn't stop the remaining
+    orders being cancelled
+    :param order_numbers: list of order numbers
+    :return: list of result dictionaries in the same order as order_numbers
+    """
+    requests = [create_cancel_request(order_number) for order_number in order_numbers]
+    # Cancellations don't need to be checked
+    results = run_order_task(send_requests, requests, False)
+    for order_number, result in zip(order_numbers, results):
+        result['order'] = order_number
+    return results
+
+
+# Function to cancel every order matching a filter
+def cancel_orders_by_filter(symbols=None, comment=None):
+    """
+    Function to cancel every open order matching a filter, across any number of symbols. All open orders are
+    retrieved with a single query rather than one query per symbol, and the query and cancellations run as one task
+    on the order worker, so no other thread can place orders between them
+    :param symbols: list of symbols to cancel orders for. None matches every symbol
+    :param comment: string of the comment to match. None matches every comment
+    :return: list of result dictionaries, one per cancelled order
+    """
+    return run_order_task(send_cancellations_by_filter, symbols, comment)
+
+
+# Function to cancel every order matching a filter on the order worker
+def send_cancellations_by_filter(symbols, comment):
+    """
+    Function to query the open orders and cancel those matching a filter. Runs on the order worker (see
+    cancel_orders_by_filter)
+    :param symbols: list of symbols to cancel orders for. None matches every symbol
+    :param comment: string of the comment to match. None matches every comment
+    :return: list of result dictionaries, one per cancelled order
+    """
+    open_orders = MetaTrader5.orders_get()
+    if open_orders is None or len(open_orders) == 0:
+        return []
+    symbol_set = set(symbols) if symbols is not None else None
+    order_numbers = [
+        order.ticket for order in open_orders
+        if (symbol_set is None or order.symbol in symbol_set) and (comment is None or order.comment == comment)
+    ]
+    # Cancellations don't need to be checked
+    results = send_requests([create_cancel_request(order_number) for order_number in order_numbers], False)
+    for order_number, result in zip(order_numbers, results):
+        result['order'] = order_number
+    return results
+
+
 # Function to convert a timeframe string into a MetaTrader 5 friendly format
 def set_query_timeframe(timeframe):
     """
@@ -358,7 +714,10 @@ def query_historic_data(symbol, timeframe, number_of_candles):
     # Convert the timeframe into MT5 friendly format
     mt5_timeframe = set_query_timeframe(timeframe=timeframe)
     # Retrieve the data
-    rates = MetaTrader5.copy_rates_from_pos(symbol, mt5_timeframe, 1, number_of_candles)
+    with instrumentation_lib.stage_timer("mt5_query"):
+        rates = MetaTrader5.copy_rates_from_pos(symbol, mt5_timeframe, 1, number_of_candles)
+    check_rates(rates, symbol, timeframe)
+    instrumentation_lib.increment_counter("mt5_candles_retrieved", len(rates))
     # Convert to a dataframe
     dataframe = pandas.DataFrame(rates)
     # Add a 'Human Time' column
@@ -366,6 +725,20 @@ def query_historic_data(symbol, timeframe, number_of_candles):
     return dataframe
 
 
+# Function to check the candles returned by MT5
+def check_rates(rates, symbol, timeframe):
+    """
+    Function to check the candles returned by a MetaTrader 5 query. MT5 returns None rather than raising when a query
+    fails, so the error is raised here with the details from MT5
+    :param rates: candles returned by MT5
+    :param symbol: string of the symbol queried
+    :param timeframe: string of the timeframe queried
+    :return: None
+    """
+    if rates is None:
+        raise ValueError(f"Error retrieving {timeframe} candles for {symbol}. MT5 error: {MetaTrader5.last_error()}")
+
+
 # Function to retrieve data from MT5 using a time range rather than a number of candles
 def query_historic_data_by_time(symbol, timeframe, time_range):
     """
@@ -400,7 +773,10 @@ def query_historic_data_by_time(symbol, timeframe, time_range):
         raise ValueError("Incorrect time range provided")
 
     # Retrieve the data
-    rates = MetaTrader5.copy_rates_range(symbol, mt5_timeframe,start_time, end_time)
+    with instrumentation_lib.stage_timer("mt5_query"):
+        rates = MetaTrader5.copy_rates_range(symbol, mt5_timeframe,start_time, end_time)
+    check_rates(rates, symbol, timeframe)
+    instrumentation_lib.increment_counter("mt5_candles_retrieved", len(rates))
     # Convert to a dataframe
     dataframe = pandas.DataFrame(rates)
     # Add a 'Human Time' column
@@ -408,43 +784,127 @@ def query_historic_data_by_time(symbol, timeframe, time_range):
     return dataframe
 
 
+# Function to retrieve data for several symbols and timeframes at once
+def query_historic_data_for_symbols(symbol_timeframes, time_range, max_threads=historic_query_threads):
+    """
+    Function to retrieve data for a list of symbols and timeframes using a time range. The queries are sent from a
+    pool of threads, so the time spent waiting on the terminal and converting each result overlaps
+    :param symbol_timeframes: list of tuples of (symbol, timeframe)
+    :param time_range: string of the time range to be retrieved. See query_historic_data_by_time
+    :param max_threads: integer of the largest number of queries sent at once
+    :return: dictionary of (symbol, timeframe) to the dataframe of the queried data
+    """
+    symbol_timeframes = list(dict.fromkeys(symbol_timeframes))
+    if len(symbol_timeframes) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_threads, len(symbol_timeframes)),
+                            thread_name_prefix="mt5_queries") as executor:
+        futures = {
+            (symbol, timeframe): executor.submit(query_historic_data_by_time, symbol, timeframe, time_range)
+            for symbol, timeframe in symbol_timeframes
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+# Function to get the open time of the candle each time falls in
+def get_candle_start_times(times, timeframe):
+    """
+    Function to get the open time of the candle of a timeframe each time falls in
+    :param times: numpy array of times, in seconds since epoch
+    :param timeframe: string of the timeframe. Any timeframe supported by set_query_timeframe
+    :return: numpy array of candle open times, in seconds since epoch
+    """
+    times = numpy.asarray(times, dtype=numpy.int64)
+    if timeframe == "MN1":
+        # Round down to the first day of the month
+        return times.astype("datetime64[s]").astype("datetime64[M]").astype("datetime64[s]").astype(numpy.int64)
+    if timeframe not in timeframe_minutes:
+        print(f"Incorrect timeframe provided. {timeframe}")
+        raise ValueError
+    seconds = timeframe_minutes[timeframe] * 60
+    offset = weekly_candle_offset if timeframe == "W1" else 0
+    return (times - offset) // seconds * seconds + offset
+
+
+# Function to build the candles of a timeframe from M1 candles
+def resample_candles(m1_candles, timeframe):
+    """
+    Function to build the candles of any timeframe from M1 candles, with the same columns as
+    query_historic_data_by_time. Each candle opens at the open of its first M1 candle, closes at the close of its last,
+    and has the highest high, lowest low, lowest spread and total volumes of its M1 candles. Building the strategy
+    candles from the M1 candles means only M1 needs retrieving, and the two always agree
+    :param m1_candles: dataframe of M1 candles, in time order
+    :param timeframe: string of the timeframe to build. Any timeframe supported by set_query_timeframe
+    :return: dataframe of the candles
+    """
+    columns = ["time", "open", "high", "low", "close", "tick_volume", "spread", "real_volume"]
+    with instrumentation_lib.stage_timer("resample"):
+        candle_times = get_candle_start_times(m1_candles["time"].to_numpy(), timeframe)
+        if len(candle_times) == 0:
+            dataframe = m1_candles[columns].copy()
+        else:
+            # Positions of the first and (one past) the last M1 candle of each candle
+            starts = numpy.flatnonzero(numpy.r_[True, candle_times[1:] != candle_times[:-1]])
+            ends = numpy.r_[starts[1:], len(candle_times)]
+            dataframe = pandas.DataFrame({
+                "time": candle_times[starts],
+                "open": m1_candles["open"].to_numpy()[starts],
+                "high": numpy.maximum.reduceat(m1_candles["high"].to_numpy(), starts),
+                "low": numpy.minimum.reduceat(m1_candles["low"].to_numpy(), starts),
+                "close": m1_candles["close"].to_numpy()[ends - 1],
+                "tick_volume": numpy.add.reduceat(m1_candles["tick_volume"].to_numpy(), starts),
+                "spread": numpy.minimum.reduceat(m1_candles["spread"].to_numpy(), starts),
+                "real_volume": numpy.add.reduceat(m1_candles["real_volume"].to_numpy(), starts)
+            })
+            # Keep the column types of the M1 candles
+            dataframe = dataframe.astype(m1_candles[columns].dtypes.to_dict())
+    # Add a 'Human Time' column
+    dataframe['human_time'] = pandas.to_datetime(dataframe['time'], unit='s')
+    return dataframe
+
+
 # Function to retrieve the pip_size of a symbol from MT5
-def get_pip_size(symbol):
+def get_pip_size(symbol, registry=None):
     """
     Function to retrieve the pip size of a symbol from MetaTrader 5
     :param symbol: string of the symbol to be queried
+    :param registry: dictionary of the symbol registry. Defaults to the module registry
     :return: float of the pip size
     """
     # Get the symbol information
-    symbol_info = MetaTrader5.symbol_info(symbol)
-    tick_size = symbol_info.trade_tick_size
-    pip_size = tick_size * 10
+    symbol_metadata = get_symbol_metadata(symbol, registry)
     # Return the pip size
-    return pip_size
+    return symbol_metadata["pip_size"]
 
 
 # Function to retrieve the base currency of a symbol from MT5
-def get_base_currency(symbol):
+def get_base_currency(symbol, registry=None):
     """
     Function to retrieve the base currency of a symbol from MetaTrader 5
     :param symbol: string of the symbol to be queried
+    :param registry: dictionary of the symbol registry. Defaults to the module registry
     :return: string of the base currency
     """
     # Get the symbol information
-    symbol_info = MetaTrader5.symbol_info(symbol)
+    symbol_metadata = get_symbol_metadata(symbol, registry)
     # Return the base currency
-    return symbol_info.currency_base
+    return symbol_metadata["currency_base"]
 
 
 # Function to retrieve the exchange rate of a symbol from MT5
-def get_exchange_rate(symbol):
+def get_exchange_rate(symbol, registry=None):
     """
-    Function to retrieve the exchange rate of a symbol from MetaTrader 5
+    Function to retrieve the exchange rate of a symbol from MetaTrader 5. The symbol is checked against the symbol
+    registry, but the rate itself is always queried live
     :param symbol: string of the symbol to be queried
+    :param registry: dictionary of the symbol registry. Defaults to the module registry
     :return: float of the exchange rate
     """
+    # Make sure the symbol exists. This is only queried from MT5 the first time the symbol is used
+    get_symbol_metadata(symbol, registry)
     # Get the symbol information
-    symbol_info = MetaTrader5.symbol_info(symbol)
+    with instrumentation_lib.stage_timer("mt5_symbol_info"):
+        symbol_info = MetaTrader5.symbol_info(symbol)
     # Return the exchange rate
     return symbol_info.bid
 
@@ -465,7 +925,10 @@ def get_candlesticks(symbol, timeframe, number_of_candles):
     # Convert the timeframe into MT5 friendly format
     mt5_timeframe = set_query_timeframe(timeframe=timeframe)
     # Retrieve the data
-    candles = MetaTrader5.copy_rates_from_pos(symbol, mt5_timeframe, 1, number_of_candles)
+    with instrumentation_lib.stage_timer("mt5_query"):
+        candles = MetaTrader5.copy_rates_from_pos(symbol, mt5_timeframe, 1, number_of_candles)
+    check_rates(candles, symbol, timeframe)
+    instrumentation_lib.increment_counter("mt5_candles_retrieved", len(candles))
     # Convert to a dataframe
     dataframe = pandas.DataFrame(candles)
     # Add a 'Human Time' column
@@ -474,16 +937,17 @@ def get_candlesticks(symbol, timeframe, number_of_candles):
 
 
 # Get the contract size for a symbol
-def get_contract_size(symbol):
+def get_contract_size(symbol, registry=None):
     """
     Function to retrieve the contract size of a symbol from MetaTrader 5
     :param symbol: string of the symbol to be queried
+    :param registry: dictionary of the symbol registry. Defaults to the module registry
     :return: float of the contract size
     """
     # Get the symbol information
-    symbol_info = MetaTrader5.symbol_info(symbol)
+    symbol_metadata = get_symbol_metadata(symbol, registry)
     # Return the contract size
-    return symbol_info.trade_contract_size
+    return symbol_metadata["contract_size"]
 
 
 # Function to get the balance from MT5
@@ -0,0 +1,964 @@
+# Offline simulator for the MetaTrader5 package. Implements the parts of the MetaTrader5 API used by mt5_lib, serving
+# candlesticks from local Parquet/CSV files and keeping orders in an in-memory order book. Select it by setting the
+# environment variable MT5_SIMULATOR=1 before mt5_lib is imported. Pending orders are filled and closed by replaying
+# candles through process_candle (see paper_trade_lib).
+import collections
+import json
+import os
+import threading
+import time
+
+import numpy
+import pandas
+
+# Timeframe constants, using the same values as the MetaTrader5 package
+TIMEFRAME_M1 = 1
+TIMEFRAME_M2 = 2
+TIMEFRAME_M3 = 3
+TIMEFRAME_M4 = 4
+TIMEFRAME_M5 = 5
+TIMEFRAME_M6 = 6
+TIMEFRAME_M10 = 10
+TIMEFRAME_M12 = 12
+TIMEFRAME_M15 = 15
+TIMEFRAME_M20 = 20
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H2 = 16386
+TIMEFRAME_H3 = 16387
+TIMEFRAME_H4 = 16388
+TIMEFRAME_H6 = 16390
+TIMEFRAME_H8 = 16392
+TIMEFRAME_H12 = 16396
+TIMEFRAME_D1 = 16408
+TIMEFRAME_W1 = 32769
+TIMEFRAME_MN1 = 49153
+
+# Order type constants
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TYPE_BUY_LIMIT = 2
+ORDER_TYPE_SELL_LIMIT = 3
+ORDER_TYPE_BUY_STOP = 4
+ORDER_TYPE_SELL_STOP = 5
+
+# Trade action constants
+TRADE_ACTION_DEAL = 1
+TRADE_ACTION_PENDING = 5
+TRADE_ACTION_SLTP = 6
+TRADE_ACTION_MODIFY = 7
+TRADE_ACTION_REMOVE = 8
+
+# Order filling and time constants
+ORDER_FILLING_FOK = 0
+ORDER_FILLING_IOC = 1
+ORDER_FILLING_RETURN = 2
+ORDER_TIME_GTC = 0
+
+# Order state constants
+ORDER_STATE_PLACED = 1
+
+# Position type constants
+POSITION_TYPE_BUY = 0
+POSITION_TYPE_SELL = 1
+
+# Deal constants
+DEAL_TYPE_BUY = 0
+DEAL_TYPE_SELL = 1
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+DEAL_REASON_EXPERT = 3
+DEAL_REASON_SL = 4
+DEAL_REASON_TP = 5
+
+# Trade return codes
+TRADE_RETCODE_REJECT = 10006
+TRADE_RETCODE_DONE = 10009
+TRADE_RETCODE_INVALID = 10013
+TRADE_RETCODE_INVALID_VOLUME = 10014
+TRADE_RETCODE_INVALID_PRICE = 10015
+TRADE_RETCODE_INVALID_STOPS = 10016
+TRADE_RETCODE_NO_MONEY = 10019
+
+# Names of each timeframe, used to find candle files
+timeframe_names = {
+    TIMEFRAME_M1: "M1", TIMEFRAME_M2: "M2", TIMEFRAME_M3: "M3", TIMEFRAME_M4: "M4", TIMEFRAME_M5: "M5",
+    TIMEFRAME_M6: "M6", TIMEFRAME_M10: "M10", TIMEFRAME_M12: "M12", TIMEFRAME_M15: "M15", TIMEFRAME_M20: "M20",
+    TIMEFRAME_M30: "M30", TIMEFRAME_H1: "H1", TIMEFRAME_H2: "H2", TIMEFRAME_H3: "H3", TIMEFRAME_H4: "H4",
+    TIMEFRAME_H6: "H6", TIMEFRAME_H8: "H8", TIMEFRAME_H12: "H12", TIMEFRAME_D1: "D1", TIMEFRAME_W1: "W1",
+    TIMEFRAME_MN1: "MN1"
+}
+
+# Structure of the candlestick arrays returned by the copy_rates functions
+rates_dtype = numpy.dtype([
+    ("time", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("tick_volume", "<u8"),
+    ("spread", "<i4"), ("real_volume", "<u8")
+])
+
+# Result structures. Named tuples match the MetaTrader5 package, which supports both indexing and _asdict()
+SymbolInfo = collections.namedtuple("SymbolInfo", [
+    "name", "currency_base", "currency_profit", "currency_margin", "digits", "point", "trade_tick_size",
+    "trade_contract_size", "volume_min", "volume_max", "volume_step", "bid", "ask", "visible", "time"
+])
+AccountInfo = collections.namedtuple("AccountInfo", [
+    "login", "balance", "equity", "profit", "margin", "margin_free", "currency", "server", "leverage"
+])
+TradeOrder = collections.namedtuple("TradeOrder", [
+    "ticket", "time_setup", "type", "state", "type_time", "type_filling", "volume_initial", "volume_current",
+    "price_open", "sl", "tp", "price_current", "symbol", "comment"
+])
+TradePosition = collections.namedtuple("TradePosition", [
+    "ticket", "time", "type", "volume", "price_open", "sl", "tp", "price_current", "profit", "symbol", "comment"
+])
+TradeDeal = collections.namedtuple("TradeDeal", [
+    "ticket", "order", "time", "type", "entry", "position_id", "volume", "price", "profit", "reason", "symbol",
+    "comment"
+])
+OrderCheckResult = collections.namedtuple("OrderCheckResult", [
+    "retcode", "balance", "equity", "profit", "margin", "margin_free", "margin_level", "comment", "request"
+])
+OrderSendResult = collections.namedtuple("OrderSendResult", [
+    "retcode", "deal", "order", "volume", "price", "bid", "ask", "comment", "request_id", "retcode_external",
+    "request"
+])
+
+# State of the simulator. The lock is held while reading or changing the order book, so the simulator can be called
+# from several threads at once when measuring concurrency
+state = {
+    "data_location": os.environ.get("MT5_SIMULATOR_DATA", os.path.join(os.path.abspath(os.getcwd()),
+                                                                        "simulator_data")),
+    "latency": float(os.environ.get("MT5_SIMULATOR_LATENCY", "0")),
+    "balance": float(os.environ.get("MT5_SIMULATOR_BALANCE", "10000")),
+    "currency": "USD",
+    "initialized": False,
+    "symbols": {},
+    "selected_symbols": set(),
+    "rates": {},
+    # Symbols and timeframes without a candle file, so the data folder is only searched once for each
+    "missing_rates": set(),
+    "orders": {},
+    "positions": {},
+    "deals": [],
+    "next_ticket": 1,
+    "current_time": None,
+    "last_error": (1, "Success"),
+    "lock": threading.RLock()
+}
+
+
+# Function to configure the simulator
+def configure(data_location=None, latency=None, balance=None, currency=None):
+    """
+    Function to configure the simulator. Any value left as None is unchanged.
+    :param data_location: string of the folder containing candle files named <symbol>_<timeframe>.parquet or .csv
+    :param latency: float of the number of seconds each call to the simulated terminal takes
+    :param balance: float of the account balance
+    :param currency: string of the account currency
+    :return: None
+    """
+    with state["lock"]:
+        if data_location is not None:
+            state["data_location"] = data_location
+            # Clear any cached data from the previous location
+            state["symbols"] = {}
+            state["rates"] = {}
+            state["missing_rates"] = set()
+        if latency is not None:
+            state["latency"] = latency
+        if balance is not None:
+            state["balance"] = balance
+        if currency is not None:
+            state["currency"] = currency
+
+
+# Function to reset the order book and account
+def reset(balance=None):
+    """
+    Function to reset the order book, positions, deal history and replay time
+    :param balance: float of the new account balance. Defaults to the current balance
+    :return: None
+    """
+    with state["lock"]:
+        state["orders"] = {}
+        state["positions"] = {}
+        state["deals"] = []
+        state["next_ticket"] = 1
+        state["current_time"] = None
+        if balance is not None:
+            state["balance"] = balance
+
+
+# Function to simulate the round trip to the terminal
+def simulate_latency():
+    """
+    Function to simulate the round trip to the MetaTrader 5 terminal
+    :return: None
+    """
+    if state["latency"] > 0:
+        time.sleep(state["latency"])
+
+
+# Function to create the default symbol information for a symbol
+def create_symbol_info(name, **overrides):
+    """
+    Function to create symbol information for a symbol. Defaults are based upon the symbol name, for instance
+    EURUSD.a has a base currency of EUR, a profit currency of USD and 5 digits.
+    :param name: string of the symbol
+    :param overrides: any SymbolInfo fields to override
+    :return: SymbolInfo
+    """
+    # Remove any denotation of raw from the symbol
+    symbol_name = name.split(".")[0]
+    # JPY quoted pairs are priced to 3 digits, everything else to 5
+    digits = 3 if symbol_name.endswith("JPY") else 5
+    point = 10 ** -digits
+    info = {
+        "name": name,
+        "currency_base": symbol_name[:3],
+        "currency_profit": symbol_name[3:6],
+        "currency_margin": symbol_name[:3],
+        "digits": digits,
+        "point": point,
+        "trade_tick_size": point,
+        "trade_contract_size": 100000.0,
+        "volume_min": 0.01,
+        "volume_max": 100.0,
+        "volume_step": 0.01,
+        "bid": 0.0,
+        "ask": 0.0,
+        "visible": False,
+        "time": 0
+    }
+    info.update(overrides)
+    return SymbolInfo(**info)
+
+
+# Function to add a symbol to the simulator
+def add_symbol(name, **overrides):
+    """
+    Function to add a symbol to the simulator, or update an existing symbol
+    :param name: string of the symbol
+    :param overrides: any SymbolInfo fields to override
+    :return: None
+    """
+    with state["lock"]:
+        load_symbols()
+        state["symbols"][name] = create_symbol_info(name, **overrides)
+
+
+# Function to load the symbols available in the data folder
+def load_symbols():
+    """
+    Function to load the available symbols. A symbol is available if it has a candle file in the data folder or is
+    listed in symbols.json, which can also override any SymbolInfo field (i.e. {"USDJPY": {"trade_tick_size": 0.001}})
+    :return: dictionary of symbol name to SymbolInfo
+    """
+    if state["symbols"]:
+        return state["symbols"]
+    symbols = {}
+    data_location = state["data_location"]
+    if os.path.isdir(data_location):
+        # Discover symbols from the candle files
+        for file_name in os.listdir(data_location):
+            name, extension = os.path.splitext(file_name)
+            if extension in (".parquet", ".csv") and "_" in name:
+                symbol = name.rsplit("_", 1)[0]
+                symbols[symbol] = create_symbol_info(symbol)
+        # Apply any overrides
+        settings_path = os.path.join(data_location, "symbols.json")
+        if os.path.exists(settings_path):
+            with open(settings_path, "r") as f:
+                symbol_settings = json.load(f)
+            for symbol, overrides in symbol_settings.items():
+                symbols[symbol] = create_symbol_info(symbol, **overrides)
+    state["symbols"] = symbols
+    return symbols
+
+
+# Function to load the candles for a symbol and timeframe
+def load_rates(symbol, timeframe):
+    """
+    Function to load the candles for a symbol and timeframe from the data folder. Files are loaded once and kept in
+    memory as a numpy structured array. A missing file is also remembered, so it is only searched for once
+    :param symbol: string of the symbol
+    :param timeframe: MetaTrader5 timeframe constant
+    :return: numpy structured array of candles, or None if no file exists
+    """
+    timeframe_name = timeframe_names.get(timeframe, str(timeframe))
+    key = (symbol, timeframe_name)
+    if key in state["rates"]:
+        return state["rates"][key]
+    if key in state["missing_rates"]:
+        state["last_error"] = (-2, f"No candle file for {symbol} {timeframe_name}")
+        return None
+    base_path = os.path.join(state["data_location"], f"{symbol}_{timeframe_name}")
+    if os.path.exists(base_path + ".parquet"):
+        dataframe = pandas.read_parquet(base_path + ".parquet")
+    elif os.path.exists(base_path + ".csv"):
+        dataframe = pandas.read_csv(base_path + ".csv")
+    else:
+        state["last_error"] = (-2, f"No candle file for {symbol} {timeframe_name}")
+        state["missing_rates"].add(key)
+        return None
+    state["rates"][key] = dataframe_to_rates(dataframe)
+    return state["rates"][key]
+
+
+# Function to convert a dataframe into a candle array
+def dataframe_to_rates(dataframe):
+    """
+    Function to convert a dataframe of candles into the structured array returned by the MetaTrader5 package
+    :param dataframe: dataframe with a time column (seconds since epoch or datetime) and OHLC columns
+    :return: numpy structured array sorted by time
+    """
+    rates = numpy.zeros(len(dataframe), dtype=rates_dtype)
+    times = dataframe["time"]
+    if not numpy.issubdtype(times.dtype, numpy.integer):
+        times = pandas.to_datetime(times).astype("int64") // 10 ** 9
+    rates["time"] = times
+    for column in ["open", "high", "low", "close", "tick_volume", "spread", "real_volume"]:
+        if column in dataframe.columns:
+            rates[column] = dataframe[column]
+    rates.sort(order="time")
+    return rates
+
+
+# Function to set candles for a symbol and timeframe directly
+def set_rates(symbol, timeframe, dataframe):
+    """
+    Function to serve a dataframe of candles for a symbol and timeframe, without needing a file. Useful for synthetic
+    data.
+    :param symbol: string of the symbol
+    :param timeframe: MetaTrader5 timeframe constant
+    :param dataframe: dataframe of candles
+    :return: None
+    """
+    with state["lock"]:
+        load_symbols()
+        state["rates"][(symbol, timeframe_names.get(timeframe, str(timeframe)))] = dataframe_to_rates(dataframe)
+        if symbol not in state["symbols"]:
+            state["symbols"][symbol] = create_symbol_info(symbol)
+
+
+# Function to convert a datetime or timestamp to seconds since epoch
+def to_seconds(value):
+    """
+    Function to convert a datetime or timestamp into seconds since epoch. Naive datetimes are treated as UTC, which
+    matches the MetaTrader5 package.
+    :param value: datetime, pandas Timestamp or number of seconds
+    :return: integer of seconds since epoch
+    """
+    if isinstance(value, (int, numpy.integer, float)):
+        return int(value)
+    timestamp = pandas.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert("UTC").tz_localize(None)
+    return int(timestamp.value // 10 ** 9)
+
+
+# Function to get the number of candles visible at the current replay time
+def visible_length(rates):
+    """
+    Function to get the number of candles which have opened at the current replay time. When no replay time is set
+    all candles are visible.
+    :param rates: numpy structured array of candles
+    :return: integer of the number of visible candles
+    """
+    if state["current_time"] is None:
+        return len(rates)
+    return int(numpy.searchsorted(rates["time"], state["current_time"], side="right"))
+
+
+# Function to get the latest price of a symbol
+def get_latest_price(symbol):
+    """
+    Function to get the latest close price of a symbol from the smallest timeframe loaded
+    :param symbol: string of the symbol
+    :return: float of the price, or 0.0 if no candles are available
+    """
+    for timeframe in sorted(timeframe_names):
+        rates = load_rates(symbol, timeframe)
+        if rates is not None:
+            length = visible_length(rates)
+            if length > 0:
+                # A candle which has only just opened has traded at its open price
+                if rates["time"][length - 1] == state["current_time"]:
+                    return float(rates["open"][length - 1])
+                return float(rates["close"][length - 1])
+    return 0.0
+
+
+# Function to hide the unfinished part of a candle which opens at the replay time
+def mask_forming_candle(rates):
+    """
+    Function to hide the future of a candle which opens exactly at the replay time. The candle has only traded at its
+    open price, so the high, low and close are set to the open. Stops the replay leaking future prices into a strategy
+    :param rates: numpy structured array of candles. Modified in place
+    :return: numpy structured array of candles
+    """
+    if state["current_time"] is not None and len(rates) > 0 and rates["time"][-1] == state["current_time"]:
+        rates["high"][-1] = rates["open"][-1]
+        rates["low"][-1] = rates["open"][-1]
+        rates["close"][-1] = rates["open"][-1]
+    return rates
+
+
+### Replay ###
+
+# Function to set the replay time
+def set_current_time(value):
+    """
+    Function to set the replay time. Only candles which have opened at or before the replay time are visible, and
+    orders placed are stamped with it. Set to None to make all candles visible
+    :param value: datetime, pandas Timestamp, seconds since epoch or None
+    :return: None
+    """
+    with state["lock"]:
+        state["current_time"] = None if value is None else to_seconds(value)
+
+
+# Function to check if a symbol has any open orders or positions
+def has_open_trades(symbol):
+    """
+    Function to check if a symbol has any pending orders or open positions. Used by the replay to skip candles where
+    nothing can happen
+    :param symbol: string of the symbol
+    :return: Boolean. True if there is an order or position for the symbol
+    """
+    with state["lock"]:
+        for order in state["orders"].values():
+            if order.symbol == symbol:
+                return True
+        for position in state["positions"].values():
+            if position.symbol == symbol:
+                return True
+    return False
+
+
+# Function to calculate the profit of a position
+def calculate_profit(symbol, position_type, volume, price_open, price_close):
+    """
+    Function to calculate the profit of a position in the account currency
+    :param symbol: string of the symbol
+    :param position_type: POSITION_TYPE_BUY or POSITION_TYPE_SELL
+    :param volume: float of the volume in lots
+    :param price_open: float of the open price
+    :param price_close: float of the close price
+    :return: float of the profit
+    """
+    info = load_symbols()[symbol]
+    direction = 1 if position_type == POSITION_TYPE_BUY else -1
+    profit = direction * (price_close - price_open) * volume * info.trade_contract_size
+    # Convert the profit into the account currency. Where the account currency is the base currency (i.e. USDJPY for
+    # a USD account) the close price is the exchange rate. Other crosses are left in the profit currency
+    if info.currency_profit != state["currency"] and info.currency_base == state["currency"]:
+        profit = profit / price_close
+    return round(profit, 2)
+
+
+# Function to record a deal
+def record_deal(order_ticket, deal_time, deal_type, entry, position_id, volume, price, profit, reason, symbol,
+                comment):
+    """
+    Function to record a deal in the deal history
+    :param order_ticket: integer of the order which caused the deal
+    :param deal_time: integer of the deal time in seconds since epoch
+    :param deal_type: DEAL_TYPE_BUY or DEAL_TYPE_SELL
+    :param entry: DEAL_ENTRY_IN or DEAL_ENTRY_OUT
+    :param position_id: integer of the position ticket
+    :param volume: float of the volume in lots
+    :param price: float of the deal price
+    :param profit: float of the profit in the account currency
+    :param reason: DEAL_REASON constant
+    :param symbol: string of the symbol
+    :param comment: string of the comment
+    :return: TradeDeal
+    """
+    deal = TradeDeal(
+        ticket=state["next_ticket"],
+        order=order_ticket,
+        time=deal_time,
+        type=deal_type,
+        entry=entry,
+        position_id=position_id,
+        volume=volume,
+        price=price,
+        profit=profit,
+        reason=reason,
+        symbol=symbol,
+        comment=comment
+    )
+    state["next_ticket"] += 1
+    state["deals"].append(deal)
+    return deal
+
+
+# Function to turn a triggered pending order into a position
+def open_position(order, price, open_time):
+    """
+    Function to fill a pending order and open a position. The position takes the ticket of the order, as it does on
+    a netting account
+    :param order: TradeOrder being filled
+    :param price: float of the fill price
+    :param open_time: integer of the fill time in seconds since epoch
+    :return: TradePosition
+    """
+    if order.type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_LIMIT):
+        position_type = POSITION_TYPE_BUY
+    else:
+        position_type = POSITION_TYPE_SELL
+    position = TradePosition(
+        ticket=order.ticket,
+        time=open_time,
+        type=position_type,
+        volume=order.volume_current,
+        price_open=price,
+        sl=order.sl,
+        tp=order.tp,
+        price_current=price,
+        profit=0.0,
+        symbol=order.symbol,
+        comment=order.comment
+    )
+    del state["orders"][order.ticket]
+    state["positions"][order.ticket] = position
+    record_deal(order.ticket, open_time, position_type, DEAL_ENTRY_IN, order.ticket, position.volume, price, 0.0,
+                DEAL_REASON_EXPERT, order.symbol, order.comment)
+    return position
+
+
+# Function to close a position
+def close_position(position, price, close_time, reason):
+    """
+    Function to close a position and add the profit to the balance
+    :param position: TradePosition being closed
+    :param price: float of the close price
+    :param close_time: integer of the close time in seconds since epoch
+    :param reason: DEAL_REASON_SL or DEAL_REASON_TP
+    :return: TradeDeal of the closing deal
+    """
+    profit = calculate_profit(position.symbol, position.type, position.volume, position.price_open, price)
+    del state["positions"][position.ticket]
+    state["balance"] = round(state["balance"] + profit, 2)
+    # The closing deal is in the opposite direction to the position
+    deal_type = DEAL_TYPE_SELL if position.type == POSITION_TYPE_BUY else DEAL_TYPE_BUY
+    return record_deal(position.ticket, close_time, deal_type, DEAL_ENTRY_OUT, position.ticket, position.volume, price,
+                       profit, reason, position.symbol, position.comment)
+
+
+# Function to process a candle against the order book
+def process_candle(symbol, candle_time, open_price, high_price, low_price, close_price):
+    """
+    Function to match a candle (normally M1) against the open positions and pending orders of a symbol. Positions are
+    checked before orders, so a position is never opened and closed by the same candle. Where a candle touches both
+    the stop loss and take profit, the stop loss is assumed to have been hit first. Where a candle opens through a
+    level, the fill is at the open price.
+    :param symbol: string of the symbol
+    :param candle_time: integer of the candle open time in seconds since epoch
+    :param open_price: float of the candle open
+    :param high_price: float of the candle high
+    :param low_price: float of the candle low
+    :param close_price: float of the candle close
+    :return: integer of the number of deals made
+    """
+    deals = 0
+    with state["lock"]:
+        # Check open positions for their stop loss and take profit
+        for position in list(state["positions"].values()):
+            if position.symbol != symbol:
+                continue
+            if position.type == POSITION_TYPE_BUY:
+                if position.sl and low_price <= position.sl:
+                    close_position(position, min(position.sl, open_price), candle_time, DEAL_REASON_SL)
+                    deals += 1
+                elif position.tp and high_price >= position.tp:
+                    close_position(position, max(position.tp, open_price), candle_time, DEAL_REASON_TP)
+                    deals += 1
+            else:
+                if position.sl and high_price >= position.sl:
+                    close_position(position, max(position.sl, open_price), candle_time, DEAL_REASON_SL)
+                    deals += 1
+                elif position.tp and low_price <= position.tp:
+                    close_position(position, min(position.tp, open_price), candle_time, DEAL_REASON_TP)
+                    deals += 1
+        # Check pending orders to see if they have been triggered
+        for order in list(state["orders"].values()):
+            if order.symbol != symbol:
+                continue
+            if order.type == ORDER_TYPE_BUY_STOP and high_price >= order.price_open:
+                open_position(order, max(order.price_open, open_price), candle_time)
+                deals += 1
+            elif order.type == ORDER_TYPE_SELL_STOP and low_price <= order.price_open:
+                open_position(order, min(order.price_open, open_price), candle_time)
+                deals += 1
+            elif order.type == ORDER_TYPE_BUY_LIMIT and low_price <= order.price_open:
+                open_position(order, min(order.price_open, open_price), candle_time)
+                deals += 1
+            elif order.type == ORDER_TYPE_SELL_LIMIT and high_price >= order.price_open:
+                open_position(order, max(order.price_open, open_price), candle_time)
+                deals += 1
+    return deals
+
+
+### MetaTrader5 API ###
+
+# Function to initialize the simulated terminal
+def initialize(path=None, login=None, password=None, server=None, timeout=None, portable=False):
+    """
+    Function to initialize the simulated terminal. Credentials are accepted but not checked
+    :return: Boolean. True
+    """
+    simulate_latency()
+    with state["lock"]:
+        load_symbols()
+        state["initialized"] = True
+    return True
+
+
+# Function to log into the simulated terminal
+def login(login, password=None, server=None, timeout=None):
+    """
+    Function to log into the simulated terminal. Credentials are accepted but not checked
+    :return: Boolean. True
+    """
+    simulate_latency()
+    return True
+
+
+# Function to shut down the simulated terminal
+def shutdown():
+    """
+    Function to shut down the simulated terminal
+    :return: Boolean. True
+    """
+    state["initialized"] = False
+    return True
+
+
+# Function to retrieve the last error
+def last_error():
+    """
+    Function to retrieve the last error
+    :return: tuple of the error code and description
+    """
+    return state["last_error"]
+
+
+# Function to retrieve all symbols
+def symbols_get(group=None):
+    """
+    Function to retrieve all symbols available to the simulator
+    :param group: ignored. Included for compatibility
+    :return: tuple of SymbolInfo
+    """
+    simulate_latency()
+    with state["lock"]:
+        return tuple(load_symbols().values())
+
+
+# Function to enable a symbol
+def symbol_select(symbol, enable=True):
+    """
+    Function to enable or disable a symbol
+    :param symbol: string of the symbol
+    :param enable: boolean. True to enable
+    :return: Boolean. True if the symbol exists
+    """
+    simulate_latency()
+    with state["lock"]:
+        if symbol not in load_symbols():
+            state["last_error"] = (-1, f"Unknown symbol {symbol}")
+            return False
+        if enable:
+            state["selected_symbols"].add(symbol)
+        else:
+            state["selected_symbols"].discard(symbol)
+        return True
+
+
+# Function to retrieve information about a symbol
+def symbol_info(symbol):
+    """
+    Function to retrieve information about a symbol. The bid and ask are taken from the latest visible candle
+    :param symbol: string of the symbol
+    :return: SymbolInfo, or None if the symbol doesn't exist
+    """
+    simulate_latency()
+    with state["lock"]:
+        info = load_symbols().get(symbol)
+        if info is None:
+            state["last_error"] = (-1, f"Unknown symbol {symbol}")
+            return None
+        # Use the latest candle for the current price, unless a price has been configured
+        if info.bid == 0.0:
+            price = get_latest_price(symbol)
+            spread = info.point * 10
+            info = info._replace(bid=price, ask=price + spread)
+        return info._replace(visible=symbol in state["selected_symbols"])
+
+
+# Function to retrieve the account information
+def account_info():
+    """
+    Function to retrieve the simulated account information
+    :return: AccountInfo
+    """
+    simulate_latency()
+    with state["lock"]:
+        return AccountInfo(
+            login=0,
+            balance=state["balance"],
+            equity=state["balance"],
+            profit=0.0,
+            margin=0.0,
+            margin_free=state["balance"],
+            currency=state["currency"],
+            server="MT5 Simulator",
+            leverage=100
+        )
+
+
+# Function to retrieve candles in a date range
+def copy_rates_range(symbol, timeframe, date_from, date_to):
+    """
+    Function to retrieve the candles which opened between two dates (inclusive)
+    :param symbol: string of the symbol
+    :param timeframe: MetaTrader5 timeframe constant
+    :param date_from: datetime or seconds since epoch of the first candle
+    :param date_to: datetime or seconds since epoch of the last candle
+    :return: numpy structured array of candles, or None if there is no data
+    """
+    simulate_latency()
+    with state["lock"]:
+        rates = load_rates(symbol, timeframe)
+    if rates is None:
+        return None
+    rates = rates[:visible_length(rates)]
+    start = numpy.searchsorted(rates["time"], to_seconds(date_from), side="left")
+    end = numpy.searchsorted(rates["time"], to_seconds(date_to), side="right")
+    return mask_forming_candle(rates[start:end].copy())
+
+
+# Function to retrieve a number of candles from a position
+def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+    """
+    Function to retrieve a number of candles counting back from a position. Position 0 is the most recent candle
+    :param symbol: string of the symbol
+    :param timeframe: MetaTrader5 timeframe constant
+    :param start_pos: integer of the position to start from
+    :param count: integer of the number of candles
+    :return: numpy structured array of candles, or None if there is no data
+    """
+    simulate_latency()
+    with state["lock"]:
+        rates = load_rates(symbol, timeframe)
+    if rates is None:
+        return None
+    # Position 0 is the current (most recent) candle
+    end = visible_length(rates) - start_pos
+    start = max(end - count, 0)
+    if end <= 0:
+        return rates[:0].copy()
+    return mask_forming_candle(rates[start:end].copy())
+
+
+# Function to retrieve a number of candles before a date
+def copy_rates_from(symbol, timeframe, date_from, count):
+    """
+    Function to retrieve a number of candles up to and including a date
+    :param symbol: string of the symbol
+    :param timeframe: MetaTrader5 timeframe constant
+    :param date_from: datetime or seconds since epoch of the last candle
+    :param count: integer of the number of candles
+    :return: numpy structured array of candles, or None if there is no data
+    """
+    simulate_latency()
+    with state["lock"]:
+        rates = load_rates(symbol, timeframe)
+    if rates is None:
+        return None
+    rates = rates[:visible_length(rates)]
+    end = numpy.searchsorted(rates["time"], to_seconds(date_from), side="right")
+    return mask_forming_candle(rates[max(end - count, 0):end].copy())
+
+
+# Function to retrieve open orders
+def orders_get(symbol=None, group=None, ticket=None):
+    """
+    Function to retrieve open (pending) orders
+    :param symbol: string of the symbol to filter by. Optional
+    :param group: ignored. Included for compatibility
+    :param ticket: integer of the order ticket to filter by. Optional
+    :return: tuple of TradeOrder
+    """
+    simulate_latency()
+    with state["lock"]:
+        orders = state["orders"].values()
+        if symbol is not None:
+            orders = [order for order in orders if order.symbol == symbol]
+        if ticket is not None:
+            orders = [order for order in orders if order.ticket == ticket]
+        return tuple(orders)
+
+
+# Function to retrieve open positions
+def positions_get(symbol=None, group=None, ticket=None):
+    """
+    Function to retrieve open positions
+    :param symbol: string of the symbol to filter by. Optional
+    :param group: ignored. Included for compatibility
+    :param ticket: integer of the position ticket to filter by. Optional
+    :return: tuple of TradePosition
+    """
+    simulate_latency()
+    with state["lock"]:
+        positions = state["positions"].values()
+        if symbol is not None:
+            positions = [position for position in positions if position.symbol == symbol]
+        if ticket is not None:
+            positions = [position for position in positions if position.ticket == ticket]
+        return tuple(positions)
+
+
+# Function to retrieve the deal history
+def history_deals_get(date_from=None, date_to=None, group=None, ticket=None, position=None):
+    """
+    Function to retrieve deals from the deal history
+    :param date_from: datetime or seconds since epoch of the earliest deal. Optional
+    :param date_to: datetime or seconds since epoch of the latest deal. Optional
+    :param group: ignored. Included for compatibility
+    :param ticket: integer of the order ticket to filter by. Optional
+    :param position: integer of the position ticket to filter by. Optional
+    :return: tuple of TradeDeal
+    """
+    simulate_latency()
+    with state["lock"]:
+        deals = state["deals"]
+        if date_from is not None:
+            deals = [deal for deal in deals if deal.time >= to_seconds(date_from)]
+        if date_to is not None:
+            deals = [deal for deal in deals if deal.time <= to_seconds(date_to)]
+        if ticket is not None:
+            deals = [deal for deal in deals if deal.order == ticket]
+        if position is not None:
+            deals = [deal for deal in deals if deal.position_id == position]
+        return tuple(deals)
+
+
+# Function to validate an order request
+def validate_request(request):
+    """
+    Function to validate an order request in the same way as the terminal
+    :param request: dictionary of the order request
+    :return: tuple of the return code (0 if valid) and a comment
+    """
+    action = request.get("action")
+    if action == TRADE_ACTION_REMOVE:
+        if request.get("order") not in state["orders"]:
+            return TRADE_RETCODE_INVALID, "Order not found"
+        return 0, "Done"
+    info = load_symbols().get(request.get("symbol"))
+    if info is None:
+        return TRADE_RETCODE_INVALID, "Unknown symbol"
+    # Check the volume
+    volume = request.get("volume", 0)
+    if volume < info.volume_min or volume > info.volume_max:
+        return TRADE_RETCODE_INVALID_VOLUME, "Invalid volume"
+    if action == TRADE_ACTION_PENDING:
+        price = request.get("price", 0)
+        if price <= 0:
+            return TRADE_RETCODE_INVALID_PRICE, "Invalid price"
+        order_type = request.get("type")
+        stop_loss = request.get("sl", 0)
+        take_profit = request.get("tp", 0)
+        # Stops must be on the correct side of the entry price
+        if order_type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_BUY_LIMIT):
+            if (stop_loss and stop_loss >= price) or (take_profit and take_profit <= price):
+                return TRADE_RETCODE_INVALID_STOPS, "Invalid stops"
+        elif order_type in (ORDER_TYPE_SELL_STOP, ORDER_TYPE_SELL_LIMIT):
+            if (stop_loss and stop_loss <= price) or (take_profit and take_profit >= price):
+                return TRADE_RETCODE_INVALID_STOPS, "Invalid stops"
+        else:
+            return TRADE_RETCODE_INVALID, "Unsupported order type"
+        # Stop orders must be away from the market in the direction of the trade, limit orders the other way
+        market_price = get_latest_price(request["symbol"])
+        if market_price > 0:
+            if order_type in (ORDER_TYPE_BUY_STOP, ORDER_TYPE_SELL_LIMIT) and price <= market_price:
+                return TRADE_RETCODE_INVALID_PRICE, "Invalid price"
+            if order_type in (ORDER_TYPE_SELL_STOP, ORDER_TYPE_BUY_LIMIT) and price >= market_price:
+                return TRADE_RETCODE_INVALID_PRICE, "Invalid price"
+        return 0, "Done"
+    return TRADE_RETCODE_INVALID, "Unsupported trade action"
+
+
+# Function to check an order request
+def order_check(request):
+    """
+    Function to check an order request without placing it
+    :param request: dictionary of the order request
+    :return: OrderCheckResult. A retcode of 0 means the request is valid
+    """
+    simulate_latency()
+    with state["lock"]:
+        retcode, comment = validate_request(request)
+        return OrderCheckResult(
+            retcode=retcode,
+            balance=state["balance"],
+            equity=state["balance"],
+            profit=0.0,
+            margin=0.0,
+            margin_free=state["balance"],
+            margin_level=0.0,
+            comment=comment,
+            request=dict(request)
+        )
+
+
+# Function to send an order request
+def order_send(request):
+    """
+    Function to send an order request to the order book
+    :param request: dictionary of the order request
+    :return: OrderSendResult. A retcode of TRADE_RETCODE_DONE means the request succeeded
+    """
+    simulate_latency()
+    with state["lock"]:
+        retcode, comment = validate_request(request)
+        ticket = 0
+        if retcode == 0:
+            retcode = TRADE_RETCODE_DONE
+            if request["action"] == TRADE_ACTION_REMOVE:
+                ticket = request["order"]
+                del state["orders"][ticket]
+            elif request["action"] == TRADE_ACTION_PENDING:
+                ticket = state["next_ticket"]
+                state["next_ticket"] += 1
+                state["orders"][ticket] = TradeOrder(
+                    ticket=ticket,
+                    time_setup=state["current_time"] if state["current_time"] is not None else int(time.time()),
+                    type=request["type"],
+                    state=ORDER_STATE_PLACED,
+                    type_time=request.get("type_time", ORDER_TIME_GTC),
+                    type_filling=request.get("type_filling", ORDER_FILLING_RETURN),
+                    volume_initial=request["volume"],
+                    volume_current=request["volume"],
+                    price_open=request["price"],
+                    sl=request.get("sl", 0.0),
+                    tp=request.get("tp", 0.0),
+                    price_current=get_latest_price(request["symbol"]),
+                    symbol=request["symbol"],
+                    comment=request.get("comment", "")
+                )
+        return OrderSendResult(
+            retcode=retcode,
+            deal=0,
+            order=ticket,
+            volume=request.get("volume", 0.0),
+            price=request.get("price", 0.0),
+            bid=0.0,
+            ask=0.0,
+            comment=comment,
+            request_id=0,
+            retcode_external=0,
+            request=dict(request)
+        )
@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import os
+import time
+
+import numpy
+import pandas
+
+import instrumentation_lib
+import live_feed_lib
+import make_trade
+import mt5_lib
+import mt5_simulator
+
+# Order types produced by the live strategies
+supported_order_types = ["BUY_STOP", "SELL_STOP"]
+
+
+# Function to make sure mt5_lib is talking to the simulator
+def check_simulator():
+    """
+    Function to make sure mt5_lib is using the offline simulator, so a replay can never place orders on a real account
+    :return: None
+    """
+    if mt5_lib.MetaTrader5 is not mt5_simulator:
+        raise ValueError("Paper trading requires the MetaTrader 5 simulator. Set MT5_SIMULATOR=1 before importing "
+                         "mt5_lib")
+
+
+# Function to run one step of a live strategy
+def run_strategy_step(strategy_function, strategy_kwargs, symbol, timeframe, comment, signal_time, risk_percent,
+                      cancel_previous_orders=True):
+    """
+    Function to run one step of a live strategy, exactly as the live bot does when a new candle opens. Any orders left
+    over from the previous candle are cancelled, the strategy is run, and a trade is made if the strategy signalled on
+    the candle which has just closed.
+    :param strategy_function: live strategy function. Called with symbol, timeframe and strategy_kwargs, and must
+    return a dataframe with human_time, order_type, stop_price, stop_loss and take_profit columns
+    :param strategy_kwargs: dictionary of extra arguments for the strategy function
+    :param symbol: string of the symbol
+    :param timeframe: string of the timeframe
+    :param comment: string of the comment used to identify orders placed by this strategy
+    :param signal_time: pandas Timestamp of the candle which has just closed
+    :param risk_percent: float of the amount to risk (expressed as decimal)
+    :param cancel_previous_orders: Boolean. When True, unfilled orders from the previous candle are cancelled
+    :return: tuple of the order type signalled (or None if there was no signal) and the strategy row for the candle
+    which has just closed (or None if the strategy didn't return one)
+    """
+    # Cancel any unfilled orders
+    if cancel_previous_orders:
+        mt5_lib.cancel_orders_by_filter(symbols=[symbol], comment=comment)
+    # Run the strategy
+    data = strategy_function(symbol=symbol, timeframe=timeframe, **strategy_kwargs)
+    if data is False or data is None or len(data) == 0:
+        return None, None
+    # Only a signal on the candle which has just closed can be traded
+    signal = data[data["human_time"] == signal_time]
+    if len(signal) == 0:
+        return None, None
+    signal = signal.iloc[-1]
+    if signal["order_type"] not in supported_order_types:
+        return None, signal
+    # Make the trade through the live order placement code
+    make_trade.make_trade(
+        balance=mt5_lib.get_balance(),
+        comment=comment,
+        amount_to_risk=risk_percent,
+        symbol=symbol,
+        take_profit=signal["take_profit"],
+        stop_loss=signal["stop_loss"],
+        stop_price=signal["stop_price"]
+    )
+    return signal["order_type"], signal
+
+
+# Function to replay M1 candles through the simulated order book
+def replay_m1_candles(symbol, m1_candles, start, end):
+    """
+    Function to replay a range of M1 candles through the simulated order book, filling pending orders and closing
+    positions at their stop loss or take profit. Stops as soon as there is nothing left to match, as new orders can
+    only be placed when the next strategy candle opens.
+    :param symbol: string of the symbol
+    :param m1_candles: numpy structured array of M1 candles
+    :param start: integer of the first candle to replay
+    :param end: integer of the candle to stop at (exclusive)
+    :return: integer of the number of candles replayed
+    """
+    replayed = 0
+    for index in range(start, end):
+        if not mt5_simulator.has_open_trades(symbol):
+            break
+        candle = m1_candles[index]
+        mt5_simulator.set_current_time(int(candle["time"]))
+        mt5_simulator.process_candle(
+            symbol=symbol,
+            candle_time=int(candle["time"]),
+            open_price=float(candle["open"]),
+            high_price=float(candle["high"]),
+            low_price=float(candle["low"]),
+            close_price=float(candle["close"])
+        )
+        replayed += 1
+    return replayed
+
+
+# Function to publish the latest candle, indicators and trades to a live feed
+def publish_to_live_feed(feed, candle, strategy_row, deals_published):
+    """
+    Function to publish the candle which has just closed, its indicator values and any new deals to a live feed
+    :param feed: dictionary of the live feed
+    :param candle: numpy record of the candle which has just closed
+    :param strategy_row: pandas Series of the strategy row for the candle, or None
+    :param deals_published: integer of the number of deals already published
+    :return: integer of the number of deals published
+    """
+    human_time = pandas.to_datetime(int(candle["time"]), unit="s")
+    live_feed_lib.publish_candle(feed, human_time, candle["open"], candle["high"], candle["low"], candle["close"])
+    if strategy_row is not None:
+        live_feed_lib.publish_indicators(feed, human_time, strategy_row)
+    # Publish the deals made since the last call
+    deals = mt5_simulator.history_deals_get()
+    for deal in deals[deals_published:]:
+        order_type = "BUY" if deal.type == mt5_simulator.DEAL_TYPE_BUY else "SELL"
+        if deal.entry == mt5_simulator.DEAL_ENTRY_IN:
+            description = f"Opened {order_type} {deal.volume} lots"
+        else:
+            description = f"Closed, profit {deal.profit:.2f}"
+        live_feed_lib.publish_trade(feed, pandas.to_datetime(deal.time, unit="s"), deal.price, order_type,
+                                    description)
+    return len(deals)
+
+
+# Function to paper trade a live strategy over stored candles
+def paper_trade(symbol, timeframe, strategy_function, strategy_kwargs=None, comment="paper_trade", balance=10000.00,
+                risk_percent=0.01, start_time=None, end_time=None, warmup_candles=1000, cancel_previous_orders=True,
+                quiet=True, live_feed=None, replay_delay=0.0):
+    """
+    Function to paper trade a live strategy by replaying stored candles bar by bar. At each strategy candle the live
+    strategy function and make_trade are run against the simulator, exactly as the live bot runs against MetaTrader 5.
+    The M1 candles until the next strategy candle are then replayed to fill and close the orders placed.
+    :param symbol: string of the symbol
+    :param timeframe: string of the strategy timeframe
+    :param strategy_function: live strategy function (i.e. macd_crossover_strategy.macd_crossover_strategy)
+    :param strategy_kwargs: dictionary of extra arguments for the strategy function
+    :param comment: string of the comment used to identify orders placed by this strategy
+    :param balance: float of the starting balance
+    :param risk_percent: float of the amount to risk (expressed as decimal)
+    :param start_time: datetime of the first strategy candle to trade. Optional
+    :param end_time: datetime of the last strategy candle to trade. Optional
+    :param warmup_candles: integer of the number of strategy candles to skip so the indicators have enough history
+    :param cancel_previous_orders: Boolean. When True, unfilled orders are cancelled when the next candle opens
+    :param quiet: Boolean. When True, the output of the live code (i.e. order confirmations) is hidden
+    :param live_feed: dictionary of a live feed (see live_feed_lib) to publish candles, indicators and trades to, so
+    the replay can be watched with display_lib.display_live_dashboard. Optional
+    :param replay_delay: float of the number of seconds to wait after each strategy candle, to slow the replay down
+    enough to watch
+    :return: dictionary of the paper trading results
+    """
+    check_simulator()
+    if strategy_kwargs is None:
+        strategy_kwargs = {}
+    # Start from a clean account
+    instrumentation_lib.reset_profile()
+    mt5_simulator.reset(balance=balance)
+    # The simulator symbols may have changed, so reload the symbol registry
+    mt5_lib.reset_symbol_registry()
+    # Load the candles
+    strategy_candles = mt5_simulator.load_rates(symbol, mt5_lib.set_query_timeframe(timeframe))
+    m1_candles = mt5_simulator.load_rates(symbol, mt5_simulator.TIMEFRAME_M1)
+    if strategy_candles is None or m1_candles is None:
+        raise ValueError(f"Paper trading requires {timeframe} and M1 candles for {symbol}")
+    # Enable the symbol, as the live bot does on start up
+    if mt5_lib.initialize_symbol(symbol) is False:
+        raise ValueError(f"Unable to initialize {symbol}")
+    # Work out the range of strategy candles to trade
+    first_candle = max(warmup_candles, 1)
+    last_candle = len(strategy_candles)
+    if start_time is not None:
+        first_candle = max(first_candle, int(numpy.searchsorted(strategy_candles["time"],
+                                                                mt5_simulator.to_seconds(start_time))))
+    if end_time is not None:
+        last_candle = min(last_candle, int(numpy.searchsorted(strategy_candles["time"],
+                                                              mt5_simulator.to_seconds(end_time), side="right")))
+    # Find the first M1 candle of each strategy candle
+    m1_boundaries = numpy.searchsorted(m1_candles["time"], strategy_candles["time"])
+    m1_boundaries = numpy.append(m1_boundaries, len(m1_candles))
+    signals = 0
+    deals_published = 0
+    # Hide the output of the live code if requested
+    output = open(os.devnull, "w") if quiet else None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            for index in range(first_candle, last_candle):
+                # Move the clock to the open of the strategy candle
+                mt5_simulator.set_current_time(int(strategy_candles["time"][index]))
+                signal_time = pandas.to_datetime(strategy_candles["time"][index - 1], unit="s")
+                # Run the live strategy
+                with instrumentation_lib.stage_timer("paper_strategy_step"):
+                    order_type, strategy_row = run_strategy_step(
+                        strategy_function=strategy_function,
+                        strategy_kwargs=strategy_kwargs,
+                        symbol=symbol,
+                        timeframe=timeframe,
+                        comment=comment,
+                        signal_time=signal_time,
+                        risk_percent=risk_percent,
+                        cancel_previous_orders=cancel_previous_orders
+                    )
+                if order_type is not None:
+                    signals += 1
+                # Replay the M1 candles until the next strategy candle opens
+                with instrumentation_lib.stage_timer("paper_order_matching"):
+                    replayed = replay_m1_candles(
+                        symbol=symbol,
+                        m1_candles=m1_candles,
+                        start=m1_boundaries[index],
+                        end=m1_boundaries[index + 1]
+                    )
+                instrumentation_lib.increment_counter("strategy_candles_replayed")
+                instrumentation_lib.increment_counter("m1_candles_matched", replayed)
+                if live_feed is not None:
+                    deals_published = publish_to_live_feed(live_feed, strategy_candles[index - 1], strategy_row,
+                                                           deals_published)
+                if replay_delay > 0:
+                    time.sleep(replay_delay)
+    finally:
+        if output is not None:
+            output.close()
+    wall_time = time.perf_counter() - start
+    # Leave all candles visible once the replay is complete
+    mt5_simulator.set_current_time(None)
+    # Collect the deal history
+    deals = pandas.DataFrame(
+        [deal._asdict() for deal in mt5_simulator.history_deals_get()],
+        columns=mt5_simulator.TradeDeal._fields
+    )
+    deals["human_time"] = pandas.to_datetime(deals["time"], unit="s")
+    m1_covered = int(m1_boundaries[last_candle] - m1_boundaries[first_candle]) if last_candle > first_candle else 0
+    results = {
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "starting_balance": balance,
+        "final_balance": mt5_lib.get_balance(),
+        "profit": round(mt5_lib.get_balance() - balance, 2),
+        "signals": signals,
+        "trades": int((deals["entry"] == mt5_simulator.DEAL_ENTRY_OUT).sum()),
+        "deals": deals,
+        "strategy_candles": max(last_candle - first_candle, 0),
+        "m1_candles": m1_covered,
+        "wall_time": wall_time,
+        "m1_candles_per_second": m1_covered / wall_time if wall_time > 0 else None,
+        "profile": instrumentation_lib.get_profile()
+    }
+    return results
+
+
+# Function to print a summary of a paper trading run
+def print_summary(results):
+    """
+    Function to print a summary of a paper trading run
+    :param results: dictionary returned from paper_trade
+    :return: None
+    """
+    print(f"Paper trading {results['symbol']} {results['timeframe']}")
+    print(f"Balance: {results['starting_balance']:.2f} -> {results['final_balance']:.2f} "
+          f"(profit {results['profit']:.2f}), {results['signals']} signals, {results['trades']} trades closed")
+    # Passing a wall time of 0 skips the backtest throughput line, which doesn't apply here
+    instrumentation_lib.print_profile_summary(results["profile"], wall_time=0, tasks=0, processes=1)
+    if results["m1_candles_per_second"] is not None:
+        print(f"Replayed {results['strategy_candles']} strategy candles and {results['m1_candles']} M1 candles in "
+              f"{results['wall_time']:.2f}s ({results['m1_candles_per_second']:.0f} M1 candles/s)")
+
+
+# Main function
+if __name__ == '__main__':
+    from strategies import macd_crossover_strategy
+    parser = argparse.ArgumentParser(description="Paper trade the MACD crossover strategy over stored candles. Run "
+                                                 "with MT5_SIMULATOR=1 set, so mt5_lib uses the offline simulator")
+    parser.add_argument("--symbol", default="EURUSD", help="symbol to trade")
+    parser.add_argument("--timeframe", default="H1", help="strategy timeframe")
+    parser.add_argument("--data-location", default=None, help="folder of <symbol>_<timeframe> candle files")
+    parser.add_argument("--synthetic", type=int, default=None,
+                        help="replay this many synthetic M1 candles (H1 only) instead of candle files")
+    parser.add_argument("--balance", type=float, default=10000.00, help="starting balance")
+    parser.add_argument("--warmup", type=int, default=100, help="number of strategy candles to skip")
+    parser.add_argument("--live", action="store_true", help="watch the replay on the live dashboard")
+    parser.add_argument("--replay-delay", type=float, default=0.5,
+                        help="seconds to wait after each strategy candle when watching live")
+    arguments = parser.parse_args()
+    if arguments.data_location is not None:
+        mt5_simulator.configure(data_location=arguments.data_location)
+    if arguments.synthetic is not None:
+        # Synthetic strategy candles are aggregated into H1
+        if arguments.timeframe != "H1":
+            raise ValueError("Synthetic candles are only supported on H1")
+        from benchmarks import synthetic_data
+        synthetic_m1 = synthetic_data.generate_m1_candles(number_of_candles=arguments.synthetic)
+        mt5_simulator.set_rates(arguments.symbol, mt5_simulator.TIMEFRAME_M1, synthetic_m1)
+        mt5_simulator.set_rates(
+            arguments.symbol,
+            mt5_lib.set_query_timeframe(arguments.timeframe),
+            synthetic_data.generate_timeframe_candles(synthetic_m1, 60)
+        )
+    paper_trade_kwargs = {
+        "symbol": arguments.symbol,
+        "timeframe": arguments.timeframe,
+        "strategy_function": macd_crossover_strategy.macd_crossover_strategy,
+        "strategy_kwargs": {"time_to_test": "All", "time_to_cancel": "GTC"},
+        "balance": arguments.balance,
+        "warmup_candles": arguments.warmup
+    }
+    if arguments.live:
+        import threading
+        import display_lib
+        # Run the replay in the background and watch it on the live dashboard
+        paper_trade_kwargs["live_feed"] = live_feed_lib.create_live_feed(indicator_names=["macd", "macd_signal"])
+        paper_trade_kwargs["replay_delay"] = arguments.replay_delay
+        threading.Thread(target=paper_trade, kwargs=paper_trade_kwargs, daemon=True).start()
+        display_lib.display_live_dashboard(paper_trade_kwargs["live_feed"], graph_title="Paper Trading")
+    else:
+        paper_results = paper_trade(**paper_trade_kwargs)
+        print_summary(paper_results)
@@ -0,0 +1,358 @@
+import html
+import itertools
+import json
+import os
+import time
+
+import pandas
+import plotly
+import plotly.graph_objects as go
+
+import display_lib
+
+# Columns kept from each win / loss object in the trade tables
+trade_columns = ['trade_id', 'order_type', 'lot_size', 'closing_stop_price', 'closing_price', 'trade_open_time',
+                 'closing_time', 'profit']
+# Maximum number of candles stored for each symbol and timeframe in a report
+report_max_candles = 5000
+# Maximum number of parameter heatmaps in a report
+report_max_heatmaps = 6
+
+# Page template. The plotly library is shared by every page in a report, so it is only written once
+page_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<script src="plotly.min.js"></script>
+__SCRIPTS__
+<style>
+body { font-family: sans-serif; margin: 20px; }
+table { border-collapse: collapse; font-size: 13px; }
+th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: right; }
+th { background: #eee; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+__BODY__
+</body>
+</html>
+"""
+
+# Script to render a paginated table from JSON held in the page, so only one page of rows is in the DOM at a time
+table_script = """<div id="__ID__"></div>
+<div><button onclick="__ID___page(-1)">Previous</button> <span id="__ID___label"></span>
+<button onclick="__ID___page(1)">Next</button></div>
+<script>
+var __ID___data = __DATA__;
+var __ID___current = 0;
+var __ID___size = __ROWS__;
+function __ID___page(step) {
+    var pages = Math.max(Math.ceil(__ID___data.data.length / __ID___size), 1);
+    __ID___current = Math.min(Math.max(__ID___current + step, 0), pages - 1);
+    var rows = __ID___data.data.slice(__ID___current * __ID___size, (__ID___current + 1) * __ID___size);
+    // Cells are filled with textContent, so values (i.e. symbols and comments) are never parsed as HTML
+    var table = document.createElement("table");
+    var header = table.insertRow();
+    __ID___data.columns.forEach(function (c) {
+        var cell = document.createElement("th");
+        cell.textContent = c;
+        header.appendChild(cell);
+    });
+    rows.forEach(function (row) {
+        var tableRow = table.insertRow();
+        row.forEach(function (v) { tableRow.insertCell().textContent = (v === null ? "" : v); });
+    });
+    document.getElementById("__ID__").replaceChildren(table);
+    document.getElementById("__ID___label").innerText = "Page " + (__ID___current + 1) + " of " + pages;
+}
+__ID___page(0);
+</script>
+"""
+
+# Script to render a candlestick chart from the shared candle file, with the run's own traces layered on top
+candle_chart_script = """<div id="__ID__" style="height:700px"></div>
+<script>
+var __ID___figure = __FIGURE__;
+var __ID___candles = reportCandles["__CANDLES__"];
+__ID___figure.data.unshift({
+    type: "candlestick", name: "__CANDLES__", x: __ID___candles.x, open: __ID___candles.open,
+    high: __ID___candles.high, low: __ID___candles.low, close: __ID___candles.close
+});
+Plotly.newPlot("__ID__", __ID___figure.data, __ID___figure.layout);
+</script>
+"""
+
+
+# Function to create a results table from a sweep
+def create_results_table(results, parameter_names=None):
+    """
+    Function to create a table of sweep results, with one row per backtest and one column per parameter and metric.
+    The trade objects and dataframes are left out, so the table stays small for large sweeps
+    :param results: list of result dictionaries returned from backtest_lib.forex_backtest
+    :param parameter_names: list of names for each element of the result parameters. Defaults to parameter_0, ...
+    Any values in a result's variant dictionary (values swept outside of the parameters) get a column of their own
+    :return: dataframe of results
+    """
+    rows = []
+    for run_id, result in enumerate(results):
+        row = {
+            "run_id": run_id,
+            "symbol": result.get('symbol'),
+            "timeframe": result.get('timeframe'),
+            "profit": result['profit'],
+            "total_trades": result['total_trades'],
+            "total_wins": result['total_wins'],
+            "total_losses": result['total_losses']
+        }
+        # Expand the parameters into their own columns
+        parameters = result.get('parameters')
+        if parameters is not None and not isinstance(parameters, (list, tuple)):
+            parameters = [parameters]
+        if parameters is not None:
+            for index, value in enumerate(parameters):
+                if parameter_names is not None and index < len(parameter_names):
+                    name = parameter_names[index]
+                else:
+                    name = f"parameter_{index}"
+                # Convert numpy values so every row has the same column type
+                row[name] = value.item() if hasattr(value, "item") else value
+        # Add any values swept outside of the parameters (i.e. the trailing stop pips) as their own columns
+        for name, value in (result.get('variant') or {}).items():
+            row[name] = value.item() if hasattr(value, "item") else value
+        rows.append(row)
+    dataframe = pandas.DataFrame(rows)
+    # Calculate the win rate
+    if len(dataframe) > 0:
+        dataframe['win_rate'] = (dataframe['total_wins'] / dataframe['total_trades'].where(
+            dataframe['total_trades'] > 0)).fillna(0.0)
+    return dataframe
+
+
+# Function to create a table of the trades from a single result
+def create_trades_table(result):
+    """
+    Function to create a table of the completed trades from a single result, ordered by closing time
+    :param result: result dictionary returned from backtest_lib.forex_backtest_run
+    :return: dataframe of trades
+    """
+    wins = pandas.DataFrame(result['win_objects'], columns=trade_columns)
+    wins['outcome'] = "win"
+    losses = pandas.DataFrame(result['loss_objects'], columns=trade_columns)
+    losses['outcome'] = "loss"
+    trades = pandas.concat([wins, losses], ignore_index=True)
+    trades = trades.sort_values('closing_time', kind="stable").reset_index(drop=True)
+    return trades
+
+
+# Function to calculate an equity curve from a table of trades
+def calculate_equity_curve(trades, starting_balance=0.00):
+    """
+    Function to calculate an equity curve from a table of trades
+    :param trades: dataframe of trades from create_trades_table
+    :param starting_balance: float of the starting balance
+    :return: dataframe with closing_time and equity columns
+    """
+    equity = pandas.DataFrame({
+        "closing_time": trades['closing_time'],
+        "equity": starting_balance + trades['profit'].cumsum()
+    })
+    return equity
+
+
+# Function to create the parameter heatmaps for a sweep
+def create_parameter_heatmaps(results_table, parameter_names, metric="profit"):
+    """
+    Function to create heatmaps of a metric across each pair of parameters which were varied in the sweep. Where
+    other parameters were also varied, the mean of the metric is shown
+    :param results_table: dataframe from create_results_table
+    :param parameter_names: list of parameter column names
+    :param metric: string of the column to plot
+    :return: list of plotly figures
+    """
+    # Only parameters with more than one value make a useful axis
+    varied = [name for name in parameter_names
+              if name in results_table.columns and results_table[name].nunique() > 1]
+    figures = []
+    for x_name, y_name in itertools.islice(itertools.combinations(varied, 2), report_max_heatmaps):
+        surface = results_table.groupby([y_name, x_name])[metric].mean().unstack(x_name)
+        fig = go.Figure(data=[go.Heatmap(
+            x=surface.columns.tolist(),
+            y=surface.index.tolist(),
+            z=surface.values,
+            colorscale="RdYlGn",
+            colorbar=dict(title=metric)
+        )])
+        fig.update_layout(title_text=f"Mean {metric} by {x_name} and {y_name}", xaxis_title=x_name,
+                          yaxis_title=y_name, height=500)
+        figures.append(fig)
+    return figures
+
+
+# Function to write the shared candle file for a symbol and timeframe
+def write_candle_file(raw_candles, candle_key, report_location):
+    """
+    Function to write the candles for a symbol and timeframe to a script shared by every run page, downsampled to
+    report_max_candles candles. Also writes the full candles to Parquet for analysis
+    :param raw_candles: dataframe of candlesticks
+    :param candle_key: string identifying the symbol and timeframe
+    :param report_location: string of the report folder
+    :return: string of the script file name
+    """
+    raw_candles[['human_time', 'open', 'high', 'low', 'close']].to_parquet(
+        os.path.join(report_location, f"candles_{candle_key}.parquet"), index=False)
+    candles = display_lib.downsample_ohlc(raw_candles, report_max_candles)
+    candle_data = {
+        "x": pandas.to_datetime(candles['human_time']).dt.strftime("%Y-%m-%d %H:%M:%S").tolist(),
+        "open": candles['open'].tolist(),
+        "high": candles['high'].tolist(),
+        "low": candles['low'].tolist(),
+        "close": candles['close'].tolist()
+    }
+    file_name = f"candles_{candle_key}.js"
+    with open(os.path.join(report_location, file_name), "w") as f:
+        f.write("var reportCandles = window.reportCandles || {};\n")
+        f.write(f"reportCandles[{json.dumps(candle_key)}] = {json.dumps(candle_data)};\n")
+    return file_name
+
+
+# Function to render a dataframe as a paginated table
+def render_table(dataframe, table_id, rows_per_page):
+    """
+    Function to render a dataframe as a paginated HTML table
+    :param dataframe: dataframe to render
+    :param table_id: string of a unique id for the table
+    :param rows_per_page: integer of the number of rows on each page
+    :return: string of HTML
+    """
+    data = dataframe.to_json(orient="split", index=False, date_format="iso", double_precision=5)
+    return table_script.replace("__ID__", table_id).replace("__DATA__", data).replace("__ROWS__",
+                                                                                        str(rows_per_page))
+
+
+# Function to render a figure without the plotly library
+def render_figure(fig):
+    """
+    Function to render a figure as HTML, relying on the plotly library shared by the report
+    :param fig: plotly figure
+    :return: string of HTML
+    """
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+# Function to write a page of the report
+def write_page(file_path, title, body, scripts=()):
+    """
+    Function to write a page of the report
+    :param file_path: string of the file to write
+    :param title: string of the page title
+    :param body: string of the page body
+    :param scripts: list of extra script files to include
+    :return: None
+    """
+    script_tags = "\n".join(f'<script src="{script}"></script>' for script in scripts)
+    page = page_template.replace("__TITLE__", html.escape(title)).replace("__SCRIPTS__", script_tags)
+    with open(file_path, "w") as f:
+        f.write(page.replace("__BODY__", body))
+
+
+# Function to export a report of a sweep
+def export_report(results, parameter_names=None, top_k=10, report_location=None, title="Backtest Report",
+                  starting_balance=0.00, rows_per_page=50):
+    """
+    Function to export a self-contained HTML/Parquet report of a sweep, without starting a server. The report contains
+    a summary of every backtest, parameter heatmaps, and a page for each of the top_k results with an equity curve,
+    candlestick chart of the trades and a paginated trade table. The plotly library and the candles for each symbol
+    and timeframe are written once and shared by every page, so large reports stay small.
+    :param results: list of result dictionaries returned from backtest_lib.forex_backtest
+    :param parameter_names: list of names for each element of the result parameters
+    :param top_k: integer of the number of best results to write pages for
+    :param report_location: string of the report folder. Defaults to reports/<timestamp> in the working directory
+    :param title: string of the report title
+    :param starting_balance: float added to the equity curves
+    :param rows_per_page: integer of the number of trades on each page of a trade table
+    :return: string of the report folder
+    """
+    if report_location is None:
+        report_location = os.path.join(os.path.abspath(os.getcwd()), "reports", time.strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(report_location, exist_ok=True)
+    # Write the plotly library once
+    with open(os.path.join(report_location, "plotly.min.js"), "w", encoding="utf-8") as f:
+        f.write(plotly.offline.get_plotlyjs())
+    # Write the results of every backtest
+    results_table = create_results_table(results, parameter_names)
+    results_table.to_parquet(os.path.join(report_location, "results.parquet"), index=False)
+    if parameter_names is None:
+        parameter_names = [column for column in results_table.columns if column.startswith("parameter_")]
+    # Values swept outside of the parameters (see create_results_table) are plotted like any other parameter
+    for result in results:
+        for name in (result.get('variant') or {}):
+            if name not in parameter_names:
+                parameter_names = list(parameter_names) + [name]
+    # Rank the results by profit
+    ranked = results_table.sort_values("profit", ascending=False, kind="stable").head(top_k)
+    candle_files = {}
+    trade_tables = []
+    equity_figure = go.Figure()
+    for rank, run_id in enumerate(ranked['run_id'], start=1):
+        result = results[run_id]
+        candle_key = f"{result.get('symbol')}_{result.get('timeframe')}"
+        # Write each symbol and timeframe's candles once
+        if candle_key not in candle_files and result.get('raw_strategy_candles') is not None:
+            candle_files[candle_key] = write_candle_file(result['raw_strategy_candles'], candle_key, report_location)
+        trades = create_trades_table(result)
+        trades.insert(0, "run_id", run_id)
+        trade_tables.append(trades)
+        equity = calculate_equity_curve(trades, starting_balance)
+        equity_figure.add_trace(go.Scatter(x=equity['closing_time'], y=equity['equity'], mode="lines",
+                                           name=f"#{rank} (run {run_id})"))
+        # Build the run page
+        body = "<p><a href=\"index.html\">Back to summary</a></p>"
+        body += render_table(ranked[ranked['run_id'] == run_id], f"summary_{run_id}", 1)
+        run_equity_figure = go.Figure(data=[go.Scatter(x=equity['closing_time'], y=equity['equity'],
+                                                       mode="lines", name="Equity")])
+        run_equity_figure.update_layout(title_text="Equity Curve", height=400)
+        body += render_figure(run_equity_figure)
+        if candle_key in candle_files:
+            # Only the trades are held in the page. The candles come from the shared candle file
+            trade_figure = go.Figure()
+            trade_figure = display_lib.add_completed_trades_to_graph(
+                base_fig=trade_figure,
+                trades=result['win_objects'],
+                trace_name="Winning Trades",
+                legend_group="winning_trades",
+                color="blue"
+            )
+            trade_figure = display_lib.add_completed_trades_to_graph(
+                base_fig=trade_figure,
+                trades=result['loss_objects'],
+                trace_name="Losing Trades",
+                legend_group="losing_trades",
+                color="red"
+            )
+            trade_figure.update_layout(title_text="Completed Trades", xaxis_rangeslider_visible=False)
+            body += candle_chart_script.replace("__ID__", f"trades_{run_id}").replace(
+                "__FIGURE__", trade_figure.to_json()).replace("__CANDLES__", candle_key)
+        body += "<h2>Trades</h2>"
+        body += render_table(trades.drop(columns=["run_id"]), f"trades_table_{run_id}", rows_per_page)
+        scripts = [candle_files[candle_key]] if candle_key in candle_files else []
+        write_page(os.path.join(report_location, f"run_{run_id}.html"), f"{title}: #{rank} (run {run_id})", body,
+                   scripts)
+    # Write the trades of the top results
+    if trade_tables:
+        pandas.concat(trade_tables, ignore_index=True).to_parquet(os.path.join(report_location, "trades.parquet"),
+                                                                  index=False)
+    # Build the summary page
+    body = f"<p>{len(results_table)} backtests. Top {len(ranked)} by profit:</p><ul>"
+    for rank, row in enumerate(ranked.itertuples(), start=1):
+        body += f"<li><a href=\"run_{row.run_id}.html\">#{rank}: run {row.run_id}, profit {row.profit:.2f}</a></li>"
+    body += "</ul>"
+    body += render_table(ranked, "top_results", rows_per_page)
+    equity_figure.update_layout(title_text="Equity Curves", height=500)
+    body += render_figure(equity_figure)
+    for fig in create_parameter_heatmaps(results_table, parameter_names):
+        body += render_figure(fig)
+    write_page(os.path.join(report_location, "index.html"), title, body)
+    print(f"Report written to {report_location}")
+    return report_location
@@ -5,8 +5,14 @@
 
 import mt5_lib
 import indicator_lib
+import instrumentation_lib
+import numpy
 import pandas
 
+# Names of the strategy parameters, in the order they appear in each backtest_lib.create_grid_search tuple
+parameter_names = ["take_profit_multiplier", "stop_loss_multiplier", "macd_fast", "macd_slow", "macd_signal",
+                   "time_to_cancel"]
+
 
 # Main MACD Crossover Strategy Function
 def macd_crossover_strategy(time_to_test, time_to_cancel, macd_fast=12, macd_slow=26, macd_signal=9, exchange="mt5",
@@ -52,21 +58,45 @@ def macd_crossover_strategy(time_to_test, time_to_cancel, macd_fast=12, macd_slo
     # Return False if the dataframe is empty
     if len(data) == 0:
         return False
-    data = calc_indicators(
-        dataframe=data,
-        macd_fast=macd_fast,
-        macd_slow=macd_slow,
-        macd_signal=macd_signal
-    )
+    with instrumentation_lib.stage_timer("indicator_calculation"):
+        data = calc_indicators(
+            dataframe=data,
+            macd_fast=macd_fast,
+            macd_slow=macd_slow,
+            macd_signal=macd_signal
+        )
     # If data is False, return False
     if data is False:
         return False
-    # Step 3: Calculate trade events
-    data = calc_signal(
+    # Step 3 and 4: Calculate trade events and when they are cancelled
+    return calc_trades(
         dataframe=data,
+        time_to_cancel=time_to_cancel,
         take_profit_multiplier=take_profit_multiplier,
         stop_loss_multiplier=stop_loss_multiplier
     )
+
+
+# Function to calculate the trades of the strategy from a dataframe with indicators
+def calc_trades(dataframe, time_to_cancel, take_profit_multiplier=1, stop_loss_multiplier=1):
+    """
+    Function to calculate the trades of the strategy from a dataframe with indicators (see calc_indicators). Only the
+    take profit, stop loss and cancel time depend on the parameters, so the indicators can be calculated once and
+    reused for each of them
+    :param dataframe: dataframe with indicators. Not modified
+    :param time_to_cancel: time to cancel orders on dataframe. Accepted values: "Candle", "GTC", "OCO",
+    "num_minutes=<val>"
+    :param take_profit_multiplier: float multiplied with the take profit
+    :param stop_loss_multiplier: float multiplied with the stop loss
+    :return: trade signal dataframe, or False if there are no candles
+    """
+    # Step 3: Calculate trade events
+    with instrumentation_lib.stage_timer("signal_generation"):
+        data = calc_signal(
+            dataframe=dataframe.copy(),
+            take_profit_multiplier=take_profit_multiplier,
+            stop_loss_multiplier=stop_loss_multiplier
+        )
     if data is False:
         return False
     # If Time to Cancel set to the next candle, shift the dataframe
@@ -82,9 +112,16 @@ def macd_crossover_strategy(time_to_test, time_to_cancel, macd_fast=12, macd_slo
     elif time_to_cancel == "OCO":
         # Set the cancel_time to the human_time from the next row
         data["cancel_time"] = data["human_time"].shift(-1)
+    elif time_to_cancel == "Candle":
+        # The cancel time was set to the next candle above
+        pass
     else:
         # Convert to integer
-        time_to_cancel = int(time_to_cancel)
+        try:
+            time_to_cancel = int(time_to_cancel)
+        except (TypeError, ValueError):
+            raise ValueError(f"Unsupported time_to_cancel: {time_to_cancel}. Accepted values are Candle, GTC, OCO or "
+                             f"a number of minutes")
         # Add this to the 'human_time' column of the dataframe to get the cancel time
         data["cancel_time"] = data["human_time"] + pandas.Timedelta(minutes=time_to_cancel)
     # Return outcome to user
@@ -144,7 +181,7 @@ def calc_indicators(dataframe, macd_fast=12, macd_slow=26, macd_signal=9):
 # Function to calculate trade signals
 def calc_signal(dataframe, take_profit_multiplier=1, stop_loss_multiplier=1):
     """
-    Function to calculate trade signals
+    Function to calculate trade signals. Every candle is calculated at once
     :param dataframe: dataframe of data to be analyzed
     :return: dataframe with trade signals
     """
@@ -155,66 +192,32 @@ def calc_signal(dataframe, take_profit_multiplier=1, stop_loss_multiplier=1):
     dataframe['take_profit'] = 0
     if len(dataframe) == 0:
         return False
-    # Get the initial index value
-    start_index = dataframe.index[0]
-    # Iterate through dataframe. If 'crossover' column is true, determine which direction the cross occurred
-    for index, row in dataframe.iterrows():
-        # Set the signal variable
-        signal = 0
-        # Check if crossover occurred
-        if row['crossover']:
-            # Check if MACD is above signal line
-            if row['macd'] > row['macd_signal']:
-                # Set signal to 1
-                signal = 1
-            # Check if MACD is below signal line
-            elif row['macd'] < row['macd_signal']:
-                # Set signal to -1
-                signal = -1
-        # Skip the first row
-        if index > start_index:
-            # Branch based upon signal value
-            if signal == 1:
-                # Set order type to buy
-                order_type = "BUY_STOP"
-                # Set stop price to high of previous candle
-                stop_price = dataframe.loc[index - 1, 'high'] # <- Change this to change your stop price
-                # Set stop loss to low of previous candle
-                stop_loss = dataframe.loc[index - 1, 'low'] # <- Change this to change your stop loss
-                # Set take profit to the distance between the stop price and stop loss added to stop price
-                distance = stop_price - stop_loss # <- Change this to change your take profit distance
-                take_profit = stop_price + distance
-                # Multiply stop loss by stop loss multiplier
-                stop_loss = stop_loss * stop_loss_multiplier
-                # Multiply take profit by take profit multiplier
-                take_profit = take_profit * take_profit_multiplier
-            elif signal == -1:
-                # Set order type to sell
-                order_type = "SELL_STOP"
-                # Set stop price to low of previous candle
-                stop_price = dataframe.loc[index - 1, 'low'] # <- Change this to change your stop price
-                # Set stop loss to high of previous candle
-                stop_loss = dataframe.loc[index - 1, 'high'] # <- Change this to change your stop loss
-                # Set take profit to the distance between the stop price and stop loss added to stop price
-                distance = stop_loss - stop_price # <- Change this to change your take profit distance
-                take_profit = stop_price - distance
-                # Multiply stop loss by stop loss multiplier
-                stop_loss = stop_loss * stop_loss_multiplier
-                # Multiply take profit by take profit multiplier
-                take_profit = take_profit * take_profit_multiplier
-            else:
-                # Set order type to None
-                order_type = None
-                # Set stop price to 0
-                stop_price = 0
-                # Set stop loss to 0
-                stop_loss = 0
-                # Set take profit to 0
-                take_profit = 0
-            # Set values in dataframe
-            dataframe.loc[index, 'order_type'] = order_type
-            dataframe.loc[index, 'stop_price'] = stop_price
-            dataframe.loc[index, 'stop_loss'] = stop_loss
-            dataframe.loc[index, 'take_profit'] = take_profit
+    # The first row is skipped, as it has no previous candle
+    later_row = dataframe.index > dataframe.index[0]
+    # Determine which direction each crossover occurred. 1 if MACD is above the signal line, -1 if below
+    crossover = dataframe['crossover'].to_numpy(dtype=bool)
+    buy = later_row & crossover & (dataframe['macd'] > dataframe['macd_signal']).to_numpy()
+    sell = later_row & crossover & (dataframe['macd'] < dataframe['macd_signal']).to_numpy()
+    # Get the high and low of the previous candle
+    previous_high = dataframe['high'].reindex(dataframe.index - 1).to_numpy(dtype=float)
+    previous_low = dataframe['low'].reindex(dataframe.index - 1).to_numpy(dtype=float)
+    # Buy: stop price at the high of the previous candle, stop loss at its low <- Change these to change your levels
+    # Sell: stop price at the low of the previous candle, stop loss at its high
+    stop_price = numpy.where(buy, previous_high, numpy.where(sell, previous_low, 0.0))
+    stop_loss = numpy.where(buy, previous_low, numpy.where(sell, previous_high, 0.0))
+    # Set take profit to the distance between the stop price and stop loss added to (or taken from) the stop price
+    take_profit = numpy.where(buy, stop_price + (stop_price - stop_loss),
+                              numpy.where(sell, stop_price - (stop_loss - stop_price), 0.0))
+    # Multiply stop loss and take profit by their multipliers
+    stop_loss = stop_loss * stop_loss_multiplier
+    take_profit = take_profit * take_profit_multiplier
+    # Rows after the first without a signal have an order type of None
+    order_type = numpy.where(buy, "BUY_STOP", numpy.where(sell, "SELL_STOP", None)).astype(object)
+    # Set values in dataframe, leaving the first row as it was
+    dataframe.loc[later_row, 'order_type'] = order_type[later_row]
+    if later_row.any():
+        dataframe['stop_price'] = numpy.where(later_row, stop_price, dataframe['stop_price'])
+        dataframe['stop_loss'] = numpy.where(later_row, stop_loss, dataframe['stop_loss'])
+        dataframe['take_profit'] = numpy.where(later_row, take_profit, dataframe['take_profit'])
     # Return dataframe
     return dataframe
@@ -5,6 +5,9 @@
 
 import indicator_lib # <- Import your indicator library
 import helper_functions
+import instrumentation_lib
+import numpy
+import pandas
 
 
 # Function to define the MACD Zero Cross Strategy
@@ -26,16 +29,18 @@ def macd_zero_cross_strategy(symbol, timeframe, macd_fast=12, macd_slow=26, macd
         exchange=exchange
     )
     # Calculate indicators
-    data = calc_indicators(
-        dataframe=data,
-        macd_fast=macd_fast,
-        macd_slow=macd_slow,
-        macd_signal=macd_signal
-    )
+    with instrumentation_lib.stage_timer("indicator_calculation"):
+        data = calc_indicators(
+            dataframe=data,
+            macd_fast=macd_fast,
+            macd_slow=macd_slow,
+            macd_signal=macd_signal
+        )
     # Calculate trade signals
-    data = calc_signal(
-        dataframe=data
-    )
+    with instrumentation_lib.stage_timer("signal_generation"):
+        data = calc_signal(
+            dataframe=data
+        )
     # Return outcome to user
     return data
 
@@ -88,13 +93,13 @@ def calc_signal(dataframe):
                 stop_price = dataframe.loc[index-1, "low"]
                 stop_loss = dataframe.loc[index-1, "high"]
                 distance = stop_loss - stop_price
-                take_profit = stop_loss - distance
+                take_profit = stop_price - distance
             else:
                 order_type = "BUY_STOP"
                 stop_price = dataframe.loc[index-1, "high"]
                 stop_loss = dataframe.loc[index-1, "low"]
                 distance = stop_price - stop_loss
-                take_profit = stop_loss + distance
+                take_profit = stop_price + distance
             # Update the dataframe with values
             dataframe.at[index, "order_type"] = order_type
             dataframe.at[index, "stop_price"] = stop_price
@@ -104,3 +109,54 @@ def calc_signal(dataframe):
             dataframe.at[index, "order_type"] = ""
     # Return dataframe
     return dataframe
+
+
+# Function to calculate the trades of the strategy for a backtest
+def calc_trades(dataframe, time_to_cancel, take_profit_multiplier=1, stop_loss_multiplier=1):
+    """
+    Function to calculate the trades of the strategy from a dataframe with indicators (see calc_indicators), in the
+    same form as the MACD Crossover strategy so it can be backtested by backtest_lib.forex_backtest. Every candle is
+    calculated at once. Orders are placed as in calc_signal, with the take profit set one stop loss distance past the
+    stop price
+    :param dataframe: dataframe with indicators. Not modified
+    :param time_to_cancel: time to cancel orders. Accepted values: "Candle", "GTC", "OCO" or a number of minutes
+    :param take_profit_multiplier: float multiplied with the take profit
+    :param stop_loss_multiplier: float multiplied with the stop loss
+    :return: trade signal dataframe, or False if there are no candles
+    """
+    if len(dataframe) < 2:
+        return False
+    with instrumentation_lib.stage_timer("signal_generation"):
+        # Skip the first row, as it will always be a zero cross but lacks the previous candle for the stop price
+        data = dataframe.iloc[1:]
+        data = data[data["zero_cross"].to_numpy(dtype=bool)].copy()
+        # Get the high and low of the previous candle, by position so any index works
+        previous_high = dataframe["high"].shift(1).loc[data.index].to_numpy(dtype=float)
+        previous_low = dataframe["low"].shift(1).loc[data.index].to_numpy(dtype=float)
+        # Sell when the MACD crosses below zero, buy when it crosses above
+        sell = (data["macd"] < 0).to_numpy()
+        data["order_type"] = numpy.where(sell, "SELL_STOP", "BUY_STOP")
+        stop_price = numpy.where(sell, previous_low, previous_high)
+        stop_loss = numpy.where(sell, previous_high, previous_low)
+        take_profit = stop_price + (stop_price - stop_loss)
+        data["stop_price"] = stop_price
+        data["stop_loss"] = stop_loss * stop_loss_multiplier
+        data["take_profit"] = take_profit * take_profit_multiplier
+    # Update the dataframe with a column for trade cancellation
+    if time_to_cancel == "GTC":
+        data["cancel_time"] = "GTC"
+    elif time_to_cancel == "OCO":
+        # Set the cancel_time to the human_time from the next trade
+        data["cancel_time"] = data["human_time"].shift(-1)
+    elif time_to_cancel == "Candle":
+        # Set the cancel_time to the human_time of the next candle
+        data["cancel_time"] = dataframe["human_time"].shift(-1).loc[data.index]
+    else:
+        try:
+            time_to_cancel = int(time_to_cancel)
+        except (TypeError, ValueError):
+            raise ValueError(f"Unsupported time_to_cancel: {time_to_cancel}. Accepted values are Candle, GTC, OCO or "
+                             f"a number of minutes")
+        # Add the number of minutes to the 'human_time' column of the dataframe to get the cancel time
+        data["cancel_time"] = data["human_time"] + pandas.Timedelta(minutes=time_to_cancel)
+    return data
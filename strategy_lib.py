@@ -0,0 +1,371 @@
+import itertools
+
+import talib
+
+import cache_lib
+import indicator_lib
+import instrumentation_lib
+from backtesting_py_strategies import ema_cross
+from backtesting_py_strategies import signal_strategy
+from strategies import macd_crossover_strategy
+from strategies import macd_zero_cross_strategy
+
+# Engines a strategy can be backtested with. "forex" strategies are run by backtest_lib.forex_backtest over M1 data,
+# "backtesting" strategies are backtesting.py Strategy classes run by backtest_lib.run_backtest and multi_optimize
+strategy_engines = ["forex", "backtesting"]
+# Parameters the forex engine can apply to a strategy dataframe after it is generated, so every value of them can be
+# run as one batch (see backtest_lib.forex_backtest_run_batch)
+batch_parameters = ["take_profit_multiplier", "stop_loss_multiplier"]
+
+# Registered strategies, keyed by name. See register_strategy
+strategy_registry = {}
+
+
+# Function to register a strategy
+def register_strategy(name, engine, parameter_names, parameter_space, indicator_parameters, exit_parameters,
+                      calc_indicators, calc_signals, constraint=None, strategy_class=None, source_modules=()):
+    """
+    Function to register a strategy so the backtests can run it by name. Each parameter is declared as either an
+    indicator parameter (changing it means the indicators must be calculated again) or an exit parameter (changing it
+    only moves the exit levels of the same trades). Any other parameter only changes the signals, so the indicators
+    are reused. Backtests use this to share indicators between parameters and to batch exit parameters together
+    :param name: string of the strategy name
+    :param engine: string of the engine the strategy is backtested with. See strategy_engines
+    :param parameter_names: list of the parameter names, in the order of a parameter tuple
+    :param parameter_space: dictionary of parameter name to the list of values tested by default
+    :param indicator_parameters: list of the names of the parameters the indicators depend on
+    :param exit_parameters: dictionary of the names of the parameters which only change the exit levels, to the value
+    which leaves the exit levels unchanged
+    :param calc_indicators: function of (dataframe, parameters) returning a new dataframe with the indicators, or False
+    :param calc_signals: function of (indicator dataframe, parameters) returning the signals without modifying the
+    dataframe. For the forex engine, a dataframe of trades (or False if there are none). For the backtesting engine, a
+    dictionary of SignalStrategy arrays
+    :param constraint: function of a parameter dictionary returning False for combinations which can't be run
+    :param strategy_class: backtesting.py Strategy class, for the backtesting engine
+    :param source_modules: list of the modules the results of the strategy depend on (i.e. its strategy and indicator
+    modules). Their source is part of each cache key, so editing them invalidates the cached results
+    :return: dictionary of the strategy settings
+    """
+    if engine not in strategy_engines:
+        raise ValueError(f"Engine {engine} not supported")
+    for parameter in list(parameter_space) + list(indicator_parameters) + list(exit_parameters):
+        if parameter not in parameter_names:
+            raise ValueError(f"Parameter {parameter} is not a parameter of {name}")
+    if len(set(indicator_parameters) & set(exit_parameters)) > 0:
+        raise ValueError("A parameter can't be both an indicator parameter and an exit parameter")
+    if engine == "backtesting" and strategy_class is None:
+        raise ValueError("Strategies for the backtesting engine need a strategy class")
+    strategy_settings = {
+        "name": name,
+        "engine": engine,
+        "parameter_names": list(parameter_names),
+        "parameter_space": dict(parameter_space),
+        "indicator_parameters": list(indicator_parameters),
+        "exit_parameters": dict(exit_parameters),
+        "calc_indicators": calc_indicators,
+        "calc_signals": calc_signals,
+        "constraint": constraint,
+        "strategy_class": strategy_class,
+        # This module is always included, as it connects the strategy to the backtests
+        "source_files": [__file__] + [module.__file__ for module in source_modules],
+        # Hash of the source files. Calculated on first use by get_source_hash
+        "source_hash": None,
+        # The forex engine can only batch the exit parameters it knows how to apply
+        "batchable": engine == "forex" and len(exit_parameters) > 0 and set(exit_parameters) <= set(batch_parameters)
+    }
+    strategy_registry[name] = strategy_settings
+    return strategy_settings
+
+
+# Function to get the settings of a registered strategy
+def get_strategy(strategy, engine=None):
+    """
+    Function to get the settings of a registered strategy
+    :param strategy: string of the strategy name
+    :param engine: string of the engine the strategy must be backtested with. None allows any engine
+    :return: dictionary of the strategy settings
+    """
+    strategy_settings = strategy_registry.get(strategy)
+    if strategy_settings is None:
+        raise ValueError("Strategy not supported")
+    if engine is not None and strategy_settings["engine"] != engine:
+        raise ValueError(f"Strategy {strategy} is backtested with the {strategy_settings['engine']} engine, not "
+                         f"{engine}")
+    return strategy_settings
+
+
+# Function to get the hash of the source code of a strategy
+def get_source_hash(strategy_settings):
+    """
+    Function to get the hash of the source code a strategy's results depend on, for its cache keys. The files are read
+    the first time it is needed in a process
+    :param strategy_settings: dictionary of the strategy settings
+    :return: string of the hex digest
+    """
+    if strategy_settings["source_hash"] is None:
+        strategy_settings["source_hash"] = cache_lib.hash_source_files(strategy_settings["source_files"])
+    return strategy_settings["source_hash"]
+
+
+# Function to convert a parameter tuple to a dictionary
+def get_parameter_dictionary(strategy_settings, parameters):
+    """
+    Function to convert a parameter tuple, in the order of the parameter names, to a dictionary
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple (or list) of parameter values, or a dictionary which is returned as it is
+    :return: dictionary of parameter name to value
+    """
+    if isinstance(parameters, dict):
+        return parameters
+    if len(parameters) != len(strategy_settings["parameter_names"]):
+        raise ValueError(f"Expected {len(strategy_settings['parameter_names'])} parameters for "
+                         f"{strategy_settings['name']}, got {len(parameters)}")
+    return dict(zip(strategy_settings["parameter_names"], parameters))
+
+
+# Function to get the key of the indicators a set of parameters needs
+def get_indicator_key(strategy_settings, parameters):
+    """
+    Function to get the values of the parameters the indicators depend on. Parameters with the same key share
+    indicators
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple or dictionary of parameter values
+    :return: tuple of the indicator parameter values
+    """
+    parameters = get_parameter_dictionary(strategy_settings, parameters)
+    return tuple(parameters[name] for name in strategy_settings["indicator_parameters"])
+
+
+# Function to get the key of the batch a set of parameters belongs to
+def get_batch_key(strategy_settings, parameters):
+    """
+    Function to get the values of every parameter other than the exit parameters. Parameters with the same key trade
+    the same orders, so can be run as one batch
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple or dictionary of parameter values
+    :return: tuple of the parameter values other than the exit parameters
+    """
+    parameters = get_parameter_dictionary(strategy_settings, parameters)
+    return tuple(parameters[name] for name in strategy_settings["parameter_names"]
+                 if name not in strategy_settings["exit_parameters"])
+
+
+# Function to get the parameters of a batch
+def get_batch_parameters(strategy_settings, parameters):
+    """
+    Function to get a parameter tuple with every exit parameter set to the value which leaves the exit levels
+    unchanged. The signals of a batch are generated with these, and the exit parameters applied afterwards
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple or dictionary of parameter values
+    :return: tuple of parameter values
+    """
+    parameters = get_parameter_dictionary(strategy_settings, parameters)
+    return tuple(strategy_settings["exit_parameters"].get(name, parameters[name])
+                 for name in strategy_settings["parameter_names"])
+
+
+# Function to get the take profit and stop loss multipliers of a set of parameters
+def get_exit_multipliers(strategy_settings, parameters):
+    """
+    Function to get the take profit and stop loss multipliers of a set of parameters, as used by
+    backtest_lib.forex_backtest_run_batch. A strategy without one of them uses a multiplier of 1
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple or dictionary of parameter values
+    :return: tuple of (take_profit_multiplier, stop_loss_multiplier)
+    """
+    parameters = get_parameter_dictionary(strategy_settings, parameters)
+    return tuple(parameters.get(name, 1) for name in batch_parameters)
+
+
+# Function to check if a set of parameters can be run
+def check_constraint(strategy_settings, parameters):
+    """
+    Function to check a set of parameters against the constraint of a strategy
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters: tuple or dictionary of parameter values
+    :return: boolean. True if the parameters can be run
+    """
+    if strategy_settings["constraint"] is None:
+        return True
+    return bool(strategy_settings["constraint"](get_parameter_dictionary(strategy_settings, parameters)))
+
+
+# Function to create every combination of the parameters to be tested
+def create_parameter_combinations(strategy_settings, params=None):
+    """
+    Function to create every combination of the parameters to be tested, in the same order as Backtest.optimize,
+    leaving out those the strategy's constraint doesn't allow
+    :param strategy_settings: dictionary of the strategy settings
+    :param params: dictionary of parameter name to the list (or range) of values to test. Parameters left out use the
+    parameter space of the strategy. None uses the parameter space for every parameter
+    :return: list of dictionaries of parameter name to value
+    """
+    if params is None:
+        params = {}
+    names = [name for name in strategy_settings["parameter_names"]
+             if name in params or name in strategy_settings["parameter_space"]]
+    values = [params.get(name, strategy_settings["parameter_space"].get(name)) for name in names]
+    combinations = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    combinations = [combination for combination in combinations if check_constraint(strategy_settings, combination)]
+    if len(combinations) == 0:
+        raise ValueError("No parameter combinations to test")
+    return combinations
+
+
+# Function to group parameters which share indicators
+def group_by_indicators(strategy_settings, parameters_list):
+    """
+    Function to order a list of parameters so those which share indicators are next to each other, keeping their order
+    otherwise. Workers running them one after another then only calculate the indicators once
+    :param strategy_settings: dictionary of the strategy settings
+    :param parameters_list: list of tuples or dictionaries of parameter values
+    :return: list of the positions in parameters_list, in the grouped order
+    """
+    groups = {}
+    for position, parameters in enumerate(parameters_list):
+        groups.setdefault(get_indicator_key(strategy_settings, parameters), []).append(position)
+    return [position for positions in groups.values() for position in positions]
+
+
+# Function to calculate the indicators of a strategy
+def calc_indicators(strategy_settings, dataframe, parameters):
+    """
+    Function to calculate the indicators of a strategy for a set of parameters
+    :param strategy_settings: dictionary of the strategy settings
+    :param dataframe: dataframe of candlesticks. Not modified
+    :param parameters: tuple or dictionary of parameter values
+    :return: dataframe with the indicators, or False if they can't be calculated
+    """
+    if len(dataframe) == 0:
+        return False
+    with instrumentation_lib.stage_timer("indicator_calculation"):
+        return strategy_settings["calc_indicators"](dataframe, get_parameter_dictionary(strategy_settings, parameters))
+
+
+# Function to calculate the signals of a strategy
+def calc_signals(strategy_settings, dataframe, parameters, indicator_dataframe=None):
+    """
+    Function to calculate the signals of a strategy for a set of parameters
+    :param strategy_settings: dictionary of the strategy settings
+    :param dataframe: dataframe of candlesticks. Not modified
+    :param parameters: tuple or dictionary of parameter values
+    :param indicator_dataframe: dataframe returned by calc_indicators for parameters with the same indicator key. None
+    calculates the indicators
+    :return: signals (see register_strategy), or False if the parameters have none
+    """
+    if not check_constraint(strategy_settings, parameters):
+        return False
+    if indicator_dataframe is None:
+        indicator_dataframe = calc_indicators(strategy_settings, dataframe, parameters)
+    if indicator_dataframe is False:
+        return False
+    parameters = get_parameter_dictionary(strategy_settings, parameters)
+    return strategy_settings["calc_signals"](indicator_dataframe, parameters)
+
+
+# Function to calculate the indicators of the MACD strategies
+def calc_macd_indicators(dataframe, parameters, calc_strategy_indicators):
+    """
+    Function to calculate the indicators of a MACD strategy on a copy of a dataframe
+    :param dataframe: dataframe of candlesticks. Not modified
+    :param parameters: dictionary of parameter values
+    :param calc_strategy_indicators: calc_indicators function of the strategy module
+    :return: dataframe with the indicators
+    """
+    return calc_strategy_indicators(
+        dataframe=dataframe.copy(),
+        macd_fast=parameters["macd_fast"],
+        macd_slow=parameters["macd_slow"],
+        macd_signal=parameters["macd_signal"]
+    )
+
+
+# Function to calculate the indicators of the EMA Cross strategy
+def calc_ema_cross_indicators(dataframe, parameters):
+    """
+    Function to calculate the two EMAs of the EMA Cross strategy on a copy of a dataframe formatted for backtesting.py
+    :param dataframe: dataframe of candlesticks with a Close column. Not modified
+    :param parameters: dictionary of parameter values
+    :return: dataframe with ema_1 and ema_2 columns
+    """
+    dataframe = dataframe.copy()
+    dataframe['ema_1'] = talib.EMA(dataframe['Close'].to_numpy(dtype=float), parameters["n1"])
+    dataframe['ema_2'] = talib.EMA(dataframe['Close'].to_numpy(dtype=float), parameters["n2"])
+    return dataframe
+
+
+# The MACD Crossover strategy, take profit and stop loss multipliers first as backtest_lib.create_grid_search expects
+register_strategy(
+    name="MACD_Crossover",
+    engine="forex",
+    parameter_names=macd_crossover_strategy.parameter_names,
+    parameter_space={
+        "take_profit_multiplier": [1],
+        "stop_loss_multiplier": [1],
+        "macd_fast": [12],
+        "macd_slow": [26],
+        "macd_signal": [9],
+        "time_to_cancel": ["GTC"]
+    },
+    indicator_parameters=["macd_fast", "macd_slow", "macd_signal"],
+    exit_parameters={"take_profit_multiplier": 1, "stop_loss_multiplier": 1},
+    calc_indicators=lambda dataframe, parameters: calc_macd_indicators(dataframe, parameters,
+                                                                       macd_crossover_strategy.calc_indicators),
+    calc_signals=lambda dataframe, parameters: macd_crossover_strategy.calc_trades(
+        dataframe=dataframe,
+        time_to_cancel=parameters["time_to_cancel"],
+        take_profit_multiplier=parameters["take_profit_multiplier"],
+        stop_loss_multiplier=parameters["stop_loss_multiplier"]
+    ),
+    # The fast EMA can't be longer than the slow EMA
+    constraint=lambda parameters: parameters["macd_fast"] <= parameters["macd_slow"],
+    source_modules=[macd_crossover_strategy, indicator_lib]
+)
+
+# The MACD Zero Cross strategy, with the same parameters as the MACD Crossover strategy
+register_strategy(
+    name="MACD_Zero_Cross",
+    engine="forex",
+    parameter_names=macd_crossover_strategy.parameter_names,
+    parameter_space={
+        "take_profit_multiplier": [1],
+        "stop_loss_multiplier": [1],
+        "macd_fast": [12],
+        "macd_slow": [26],
+        "macd_signal": [9],
+        "time_to_cancel": ["GTC"]
+    },
+    indicator_parameters=["macd_fast", "macd_slow", "macd_signal"],
+    exit_parameters={"take_profit_multiplier": 1, "stop_loss_multiplier": 1},
+    calc_indicators=lambda dataframe, parameters: calc_macd_indicators(dataframe, parameters,
+                                                                       macd_zero_cross_strategy.calc_indicators),
+    calc_signals=lambda dataframe, parameters: macd_zero_cross_strategy.calc_trades(
+        dataframe=dataframe,
+        time_to_cancel=parameters["time_to_cancel"],
+        take_profit_multiplier=parameters["take_profit_multiplier"],
+        stop_loss_multiplier=parameters["stop_loss_multiplier"]
+    ),
+    constraint=lambda parameters: parameters["macd_fast"] <= parameters["macd_slow"],
+    source_modules=[macd_zero_cross_strategy, indicator_lib]
+)
+
+# The EMA Cross strategy, run by backtesting.py
+register_strategy(
+    name="EMACross",
+    engine="backtesting",
+    parameter_names=["n1", "n2"],
+    parameter_space={
+        "n1": [ema_cross.EMACross.n1],
+        "n2": [ema_cross.EMACross.n2]
+    },
+    indicator_parameters=["n1", "n2"],
+    exit_parameters={},
+    calc_indicators=calc_ema_cross_indicators,
+    calc_signals=lambda dataframe, parameters: ema_cross.calc_ema_cross_signals(
+        dataframe['Close'], dataframe['Low'], dataframe['ema_1'], dataframe['ema_2']
+    ),
+    # The fast EMA must be shorter than the slow EMA
+    constraint=lambda parameters: parameters["n1"] < parameters["n2"],
+    strategy_class=ema_cross.EMACross,
+    source_modules=[ema_cross, signal_strategy]
+)
@@ -0,0 +1,250 @@
+import collections
+import math
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import instrumentation_lib
+
+# Seconds of work each chunk of tasks sent to a worker should take. Long enough that the cost of sending a chunk is
+# small next to the work in it, short enough that the workers finish at about the same time
+target_chunk_seconds = 0.5
+# Number of chunks each worker should receive at least, so one slow chunk doesn't leave the other workers idle
+minimum_chunks_per_worker = 4
+# Number of datasets each worker keeps loaded
+default_max_datasets = 1
+
+# Datasets loaded in a worker process, with the most recently used last. Only filled inside worker processes
+worker_datasets = collections.OrderedDict()
+# Settings of a worker process, set by initialize_worker
+worker_settings = {
+    "data_location": None,
+    "max_datasets": default_max_datasets
+}
+
+
+# Function to get the number of worker processes to use
+def get_worker_count(processes=None):
+    """
+    Function to get the number of worker processes to use. One core is left for the main process, which checks the
+    cache, sends tasks and collects results
+    :param processes: integer of the number of worker processes. None uses the number of cores
+    :return: integer of the number of worker processes
+    """
+    if processes is not None:
+        return max(1, int(processes))
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+# Function to create a worker pool
+def create_worker_pool(processes=None, data_location=None, max_datasets=default_max_datasets, preload=True):
+    """
+    Function to create a long-lived worker pool. The worker processes are started the first time tasks are run, and
+    kept until close_worker_pool is called. Data shared by many tasks (i.e. the candles of a symbol) is saved once with
+    save_dataset and loaded once by each worker, so tasks only need to carry their parameters.
+    :param processes: integer of the number of worker processes. None uses the number of cores
+    :param data_location: string of the folder datasets are saved to. None uses a temporary folder, which is removed
+    when the pool is closed
+    :param max_datasets: integer of the number of datasets each worker keeps loaded
+    :param preload: boolean. When True, each worker loads the most recently saved datasets as it starts
+    :return: dictionary of the worker pool
+    """
+    remove_data_location = data_location is None
+    if data_location is None:
+        data_location = tempfile.mkdtemp(prefix="backtest_data_")
+    else:
+        os.makedirs(data_location, exist_ok=True)
+    return {
+        "pool": None,
+        # Set by cluster_lib.create_cluster_pool when the workers are connected over the network
+        "coordinator": None,
+        "processes": get_worker_count(processes),
+        "data_location": data_location,
+        "remove_data_location": remove_data_location,
+        "max_datasets": max_datasets,
+        "preload": preload,
+        "dataset_keys": [],
+        # Mean seconds taken by each kind of task, measured as tasks complete
+        "task_seconds": {},
+        "task_counts": {}
+    }
+
+
+# Function to start the worker processes of a pool
+def start_worker_pool(worker_pool):
+    """
+    Function to start the worker processes of a pool, if they aren't running already
+    :param worker_pool: dictionary of the worker pool
+    :return: multiprocessing pool
+    """
+    if worker_pool["pool"] is None:
+        preload_keys = []
+        if worker_pool["preload"] and worker_pool["max_datasets"] > 0:
+            preload_keys = worker_pool["dataset_keys"][-worker_pool["max_datasets"]:]
+        worker_pool["pool"] = multiprocessing.Pool(
+            worker_pool["processes"],
+            initializer=initialize_worker,
+            initargs=(worker_pool["data_location"], preload_keys, worker_pool["max_datasets"])
+        )
+    return worker_pool["pool"]
+
+
+# Function to close a worker pool
+def close_worker_pool(worker_pool):
+    """
+    Function to stop the worker processes of a pool and remove its datasets, if they were saved to a temporary folder
+    :param worker_pool: dictionary of the worker pool
+    :return: None
+    """
+    # Pools created by cluster_lib.create_cluster_pool run their tasks on workers which may be on other hosts
+    if worker_pool.get("coordinator") is not None:
+        import cluster_lib
+        cluster_lib.close_cluster_pool(worker_pool)
+        return
+    if worker_pool["pool"] is not None:
+        worker_pool["pool"].close()
+        worker_pool["pool"].join()
+        worker_pool["pool"] = None
+    if worker_pool["remove_data_location"]:
+        shutil.rmtree(worker_pool["data_location"], ignore_errors=True)
+
+
+# Function to get the file a dataset is saved to
+def get_dataset_path(data_location, dataset_key):
+    """
+    Function to get the file a dataset is saved to
+    :param data_location: string of the dataset folder
+    :param dataset_key: string of the dataset key
+    :return: string of the file path
+    """
+    return os.path.join(data_location, f"{dataset_key}.pkl")
+
+
+# Function to save a dataset for the workers of a pool
+def save_dataset(worker_pool, dataset_key, dataset):
+    """
+    Function to save a dataset so the workers of a pool can load it. A key must only be saved once in the life of a
+    pool, as workers which have already loaded it won't see the change
+    :param worker_pool: dictionary of the worker pool
+    :param dataset_key: string of the dataset key. Used as a file name
+    :param dataset: dictionary of the data (i.e. dataframes) shared by tasks
+    :return: None
+    """
+    with open(get_dataset_path(worker_pool["data_location"], dataset_key), "wb") as f:
+        pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
+    worker_pool["dataset_keys"].append(dataset_key)
+
+
+# Function to initialize a worker process
+def initialize_worker(data_location, preload_keys, max_datasets):
+    """
+    Function run once in each worker process as it starts. Records where datasets are saved and loads the datasets the
+    first tasks will need
+    :param data_location: string of the dataset folder
+    :param preload_keys: list of the keys of the datasets to load
+    :param max_datasets: integer of the number of datasets to keep loaded
+    :return: None
+    """
+    worker_settings["data_location"] = data_location
+    worker_settings["max_datasets"] = max(1, max_datasets)
+    worker_datasets.clear()
+    for dataset_key in preload_keys:
+        get_dataset(dataset_key)
+
+
+# Function to get a dataset inside a worker process
+def get_dataset(dataset_key):
+    """
+    Function to get a dataset inside a worker process. The dataset is loaded the first time it is needed and kept for
+    the tasks which follow. The least recently used dataset is dropped once more than max_datasets are loaded
+    :param dataset_key: string of the dataset key
+    :return: dictionary of the dataset
+    """
+    dataset = worker_datasets.get(dataset_key)
+    if dataset is not None:
+        worker_datasets.move_to_end(dataset_key)
+        return dataset
+    with instrumentation_lib.stage_timer("dataset_load"):
+        with open(get_dataset_path(worker_settings["data_location"], dataset_key), "rb") as f:
+            dataset = pickle.load(f)
+    worker_datasets[dataset_key] = dataset
+    while len(worker_datasets) > worker_settings["max_datasets"]:
+        worker_datasets.popitem(last=False)
+    return dataset
+
+
+# Function to run a task in a worker process and time it
+def run_timed_task(task):
+    """
+    Function to run a task inside a worker process, returning how long it took alongside its outcome
+    :param task: tuple of (function, args)
+    :return: tuple of the outcome of instrumentation_lib.run_profiled_task and the number of seconds it took
+    """
+    start_time = time.perf_counter()
+    outcome = instrumentation_lib.run_profiled_task(task)
+    return outcome, time.perf_counter() - start_time
+
+
+# Function to record how long a task took
+def record_task_duration(worker_pool, task_name, duration):
+    """
+    Function to add the duration of a task to the running mean for its kind of task
+    :param worker_pool: dictionary of the worker pool
+    :param task_name: string of the kind of task
+    :param duration: float of the number of seconds the task took
+    :return: None
+    """
+    count = worker_pool["task_counts"].get(task_name, 0)
+    mean = worker_pool["task_seconds"].get(task_name, 0.0)
+    worker_pool["task_counts"][task_name] = count + 1
+    worker_pool["task_seconds"][task_name] = mean + (duration - mean) / (count + 1)
+
+
+# Function to get the number of tasks sent to a worker at a time
+def get_chunk_size(worker_pool, task_name, task_count):
+    """
+    Function to get the number of tasks sent to a worker at a time, from the measured duration of the kind of task.
+    Short tasks are sent in larger chunks so the cost of sending them doesn't outweigh the work
+    :param worker_pool: dictionary of the worker pool
+    :param task_name: string of the kind of task
+    :param task_count: integer of the number of tasks to be sent
+    :return: integer of the chunk size
+    """
+    task_seconds = worker_pool["task_seconds"].get(task_name)
+    if task_seconds is None:
+        return 1
+    chunk_size_for_time = int(target_chunk_seconds / max(task_seconds, 1e-6))
+    chunk_size_for_balance = math.ceil(task_count / (worker_pool["processes"] * minimum_chunks_per_worker))
+    return max(1, min(chunk_size_for_time, chunk_size_for_balance))
+
+
+# Function to run a list of tasks on a worker pool
+def run_tasks(worker_pool, task_list, task_name):
+    """
+    Function to run a list of tasks on a worker pool, yielding each outcome in order as it completes. If this kind of
+    task hasn't been timed yet, one task is sent to each worker first to measure it, and the rest are sent in chunks
+    sized from that measurement
+    :param worker_pool: dictionary of the worker pool
+    :param task_list: list of tuples of (function, args). Functions must be importable by the workers
+    :param task_name: string of the kind of task, used to size chunks
+    :return: generator of the outcome of instrumentation_lib.run_profiled_task for each task
+    """
+    if worker_pool.get("coordinator") is not None:
+        import cluster_lib
+        yield from cluster_lib.run_cluster_tasks(worker_pool, task_list, task_name)
+        return
+    pool = start_worker_pool(worker_pool)
+    position = 0
+    while position < len(task_list):
+        if task_name in worker_pool["task_seconds"]:
+            tasks = task_list[position:]
+        else:
+            tasks = task_list[position:position + worker_pool["processes"]]
+        chunk_size = get_chunk_size(worker_pool, task_name, len(tasks))
+        for outcome, duration in pool.imap(run_timed_task, tasks, chunksize=chunk_size):
+            record_task_duration(worker_pool, task_name, duration)
+            yield outcome
+        position += len(tasks)